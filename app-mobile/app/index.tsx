@@ -71,38 +71,87 @@ const FONT_STYLE_MAP: Record<string, { fontFamily?: string; fontWeight?: any; fo
 const FONT_SIZE_MAP: Record<string, number> = { pequeno: 22, medio: 28, grande: 34 };
 
 // --- Horário de funcionamento (configurado em configuracoes/bot no GestorChef) ---
-// Mesma lógica do backend-bot/app.py (verificar_horario_funcionamento), pra
-// app e bot do WhatsApp sempre concordarem se a loja está aberta ou não.
+// Mesmas regras do backend-bot/horario.py, pra app e bot do WhatsApp sempre
+// concordarem se a loja está aberta ou não: até dois turnos por dia
+// (abre/fecha e abre2/fecha2), fechar antes de abrir = fechar no dia
+// seguinte, datas especiais (excecoes) no lugar do dia da semana e o
+// relógio no fuso de Brasília (-3), não no do aparelho.
 const NOMES_DIAS_SEMANA: Record<string, string> = { seg: 'Segunda', ter: 'Terça', qua: 'Quarta', qui: 'Quinta', sex: 'Sexta', sab: 'Sábado', dom: 'Domingo' };
-const ORDEM_DIAS_SEMANA_JS = ['dom', 'seg', 'ter', 'qua', 'qui', 'sex', 'sab']; // Date.getDay(): 0 = domingo
+const ORDEM_DIAS_SEMANA = ['seg', 'ter', 'qua', 'qui', 'sex', 'sab', 'dom'];
+const ORDEM_DIAS_SEMANA_JS = ['dom', 'seg', 'ter', 'qua', 'qui', 'sex', 'sab']; // Date.getUTCDay(): 0 = domingo
+const DIAS_AVISO_EXCECAO = 7;
+
+function turnosDoDia(d: any): [string, string][] {
+  const turnos: [string, string][] = [];
+  if (d && d.abre && d.fecha) turnos.push([d.abre, d.fecha]);
+  if (d && d.abre2 && d.fecha2) turnos.push([d.abre2, d.fecha2]);
+  return turnos;
+}
+
+function minutosHorario(t: string): number {
+  const [h, m] = String(t).split(':').map(Number);
+  if (!(h >= 0 && h <= 24 && m >= 0 && m < 60)) throw new Error(t);
+  return h * 60 + m;
+}
+
+// [início, fim] em minutos desde a meia-noite; fim passa de 1440 quando
+// fecha no dia seguinte. Aberto sem horário válido = aberto o dia todo.
+function intervalosDoDia(d: any): [number, number][] {
+  if (!d || !d.aberto) return [];
+  const turnos = turnosDoDia(d);
+  if (!turnos.length) return [[0, 1440]];
+  try {
+    return turnos.map(([abre, fecha]) => {
+      const inicio = minutosHorario(abre);
+      let fim = minutosHorario(fecha);
+      if (fim <= inicio) fim += 1440;
+      return [inicio, fim] as [number, number];
+    });
+  } catch {
+    return [[0, 1440]];
+  }
+}
+
+function textoTurnos(d: any): string {
+  return turnosDoDia(d).map(([abre, fecha]) => `${abre}-${fecha}`).join(' e ');
+}
 
 function calcularHorarioFuncionamento(horarioCfg: any): { aberto: boolean; texto: string } {
   const dias = (horarioCfg && horarioCfg.dias) || {};
+  const excecoes: Record<string, any> = {};
+  ((horarioCfg && horarioCfg.excecoes) || []).forEach((e: any) => {
+    if (e && e.data) excecoes[String(e.data).slice(0, 10)] = e;
+  });
+
+  // "Agora" em Brasília: desloca 3h e lê os campos em UTC.
+  const agora = new Date(Date.now() - 3 * 3600 * 1000);
+  const dataDe = (desloc: number) => new Date(agora.getTime() + desloc * 86400 * 1000);
+  const chaveData = (d: Date) => d.toISOString().slice(0, 10);
+  const cfgDoDia = (d: Date) => excecoes[chaveData(d)] || dias[ORDEM_DIAS_SEMANA_JS[d.getUTCDay()]];
+
   const partes: string[] = [];
-  ['seg', 'ter', 'qua', 'qui', 'sex', 'sab', 'dom'].forEach(chave => {
+  ORDEM_DIAS_SEMANA.forEach(chave => {
     const d = dias[chave];
-    if (d && d.aberto && d.abre && d.fecha) partes.push(`${NOMES_DIAS_SEMANA[chave]} ${d.abre}-${d.fecha}`);
+    if (d && d.aberto && turnosDoDia(d).length) partes.push(`${NOMES_DIAS_SEMANA[chave]} ${textoTurnos(d)}`);
   });
-  const texto = partes.length ? partes.join('; ') : 'horário a confirmar';
+  let texto = partes.length ? partes.join('; ') : 'horário a confirmar';
+  const avisos: string[] = [];
+  for (let desloc = 0; desloc <= DIAS_AVISO_EXCECAO; desloc++) {
+    const e = excecoes[chaveData(dataDe(desloc))];
+    if (!e) continue;
+    const [, mes, dia] = chaveData(dataDe(desloc)).split('-');
+    const horas = e.aberto ? textoTurnos(e) : '';
+    avisos.push(`${dia}/${mes}` + (e.descricao ? ` (${String(e.descricao).trim()})` : '') + (horas ? `: ${horas}` : ': fechado'));
+  }
+  if (partes.length && avisos.length) texto += `. Datas especiais: ${avisos.join('; ')}`;
 
   if (!horarioCfg || !horarioCfg.ativo) return { aberto: true, texto };
 
-  const agora = new Date();
-  const diaCfg = dias[ORDEM_DIAS_SEMANA_JS[agora.getDay()]];
-  if (!diaCfg || !diaCfg.aberto) return { aberto: false, texto };
-
-  const abre = diaCfg.abre, fecha = diaCfg.fecha;
-  if (!abre || !fecha) return { aberto: true, texto };
-
-  const [h1, m1] = abre.split(':').map(Number);
-  const [h2, m2] = fecha.split(':').map(Number);
-  const minutosAgora = agora.getHours() * 60 + agora.getMinutes();
-  const minutosAbre = h1 * 60 + m1;
-  const minutosFecha = h2 * 60 + m2;
-  const dentro = minutosFecha <= minutosAbre
-    ? (minutosAgora >= minutosAbre || minutosAgora < minutosFecha) // fecha depois da meia-noite
-    : (minutosAgora >= minutosAbre && minutosAgora < minutosFecha);
-  return { aberto: dentro, texto };
+  const minutosAgora = agora.getUTCHours() * 60 + agora.getUTCMinutes();
+  // O dia anterior conta pelo pedaço que passa da meia-noite.
+  const aberto = intervalosDoDia(cfgDoDia(dataDe(-1))).some(([ini, fim]) => ini <= minutosAgora + 1440 && minutosAgora + 1440 < fim)
+    || intervalosDoDia(cfgDoDia(agora)).some(([ini, fim]) => ini <= minutosAgora && minutosAgora < fim);
+  return { aberto, texto };
 }
 
 export default function App() {
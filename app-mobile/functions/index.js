@@ -1,6 +1,7 @@
 import axios from "axios";
 import { randomBytes } from "crypto";
 import { onRequest } from "firebase-functions/v2/https";
+import { onDocumentWritten } from "firebase-functions/v2/firestore";
 import { defineSecret } from "firebase-functions/params";
 import { initializeApp } from "firebase-admin/app";
 import { getAuth } from "firebase-admin/auth";
@@ -492,3 +493,104 @@ export const mercadoPagoWebhook = onRequest(
         return res.status(500).send('erro');
     }
 });
+
+// ============================================================
+//  Totais de vendas pro BI (vendas_agregadas/{AAAA-MM-DD}_{n}).
+//  Mesmas regras do backend-bot/vendas_agregadas.py: o bot soma os
+//  pedidos dele no mesmo commit do pedido (agregado=true); aqui entram
+//  os do app/PDV/mesa e toda alteração que muda a soma (cancelamento,
+//  pedido apagado ou editado). Soma = parcela(depois) - parcela(antes),
+//  num fragmento sorteado do dia. Entrega dupla da função soma duas
+//  vezes — a varredura noturna do bot recalcula o dia a partir dos pedidos.
+//  Dia ainda não reprocessado o bi.js lê dos pedidos: aqui os fragmentos
+//  dele guardam só a diferença, não o total.
+// ============================================================
+const FRAGMENTOS_VENDAS = 8;
+const FUSO_BR_MS = -3 * 3600 * 1000;
+
+function chaveVenda(texto, padrao) {
+    let t = String(texto == null ? '' : texto).trim().slice(0, 80);
+    if (t.startsWith('__') && t.endsWith('__')) t = t.replace(/^_+|_+$/g, '');
+    return t || padrao;
+}
+
+function canalVenda(p) {
+    const o = String(p.origem || '').toUpperCase();
+    if (o === 'BALCAO' || o === 'MESA' || o === 'APP') return o;
+    if (o === 'BOT' || o === 'WHATSAPP') return 'WHATSAPP';
+    if (p.usuario_id && String(p.usuario_id).startsWith('cliente_')) return 'APP';
+    return 'APP_BOT';
+}
+
+function parcelaVenda(p) {
+    if (!p || !p.hora_pedido || typeof p.hora_pedido.toDate !== 'function') return null;
+    const local = new Date(p.hora_pedido.toDate().getTime() + FUSO_BR_MS);
+    const dia = local.toISOString().slice(0, 10);
+    if (p.status === 'CANCELADO') return { dia, numeros: { cancelados: 1 } };
+    const valor = Number(p.valor_total) || 0;
+    const venda = () => ({ pedidos: 1, receita: valor });
+    const porItem = {};
+    let itens = 0;
+    (p.itens || []).forEach(i => {
+        const obj = typeof i === 'object' && i !== null;
+        const nome = (obj ? (i.nome_exibicao || i.nome || '') : String(i)).replace(/^\d+x\s/, '').trim();
+        const qtd = (obj && Number(i.quantidade)) || 1;
+        itens += qtd;
+        if (!nome) return;
+        const k = chaveVenda(nome, 'Item');
+        porItem[k] = porItem[k] || { qtd: 0, receita: 0 };
+        porItem[k].qtd += qtd;
+        porItem[k].receita += (obj ? Number(i.preco) || 0 : 0) * qtd;
+    });
+    return {
+        dia,
+        numeros: {
+            pedidos: 1, receita: valor, itens,
+            por_hora: { [String(local.getUTCHours()).padStart(2, '0')]: venda() },
+            por_canal: { [canalVenda(p)]: venda() },
+            por_pagamento: { [chaveVenda(p.forma_pagamento, 'N/I')]: venda() },
+            por_item: porItem,
+            por_cliente: { [chaveVenda(p.nome_cliente, 'Cliente')]: venda() },
+        },
+    };
+}
+
+function somarVenda(alvo, numeros, sinal) {
+    Object.entries(numeros).forEach(([k, v]) => {
+        if (typeof v === 'object') somarVenda(alvo[k] = alvo[k] || {}, v, sinal);
+        else alvo[k] = (alvo[k] || 0) + sinal * v;
+    });
+    return alvo;
+}
+
+// Só o que mudou vira increment; devolve null se a diferença é zero.
+function incrementosVenda(numeros) {
+    const saida = {};
+    Object.entries(numeros).forEach(([k, v]) => {
+        const sub = typeof v === 'object' ? incrementosVenda(v) : (Math.abs(v) > 1e-9 ? FieldValue.increment(v) : null);
+        if (sub) saida[k] = sub;
+    });
+    return Object.keys(saida).length ? saida : null;
+}
+
+export const agregarVendas = onDocumentWritten("pedidos/{pedidoId}", async (event) => {
+    const antes = event.data?.before?.exists ? event.data.before.data() : null;
+    const depois = event.data?.after?.exists ? event.data.after.data() : null;
+    const porDia = {};
+    // Pedido do bot: a criação já foi somada no commit do próprio pedido.
+    const parcelaAntes = antes ? parcelaVenda(antes) : (depois?.agregado ? parcelaVenda(depois) : null);
+    const parcelaDepois = parcelaVenda(depois);
+    if (parcelaAntes) somarVenda(porDia[parcelaAntes.dia] = porDia[parcelaAntes.dia] || {}, parcelaAntes.numeros, -1);
+    if (parcelaDepois) somarVenda(porDia[parcelaDepois.dia] = porDia[parcelaDepois.dia] || {}, parcelaDepois.numeros, 1);
+
+    const batch = db.batch();
+    let pendentes = 0;
+    Object.entries(porDia).forEach(([dia, numeros]) => {
+        const incrementos = incrementosVenda(numeros);
+        if (!incrementos) return;
+        const fragmento = Math.floor(Math.random() * FRAGMENTOS_VENDAS);
+        batch.set(db.collection('vendas_agregadas').doc(`${dia}_${fragmento}`), { dia, ...incrementos }, { merge: true });
+        pendentes++;
+    });
+    if (pendentes) await batch.commit();
+});
@@ -0,0 +1,295 @@
+"""Controle de admissão dos turnos: limite por cliente e vagas pra IA.
+
+Nada limitava quantas vezes um mesmo número disparava o
+get_openai_response. Um cliente mandando rajada, ou um bot do outro lado
+respondendo o nosso em laço, gastava capacidade do gpt-4o e deixava o
+fechamento de pedido de todo mundo mais lento. No pico, todos os turnos
+disputavam a OpenAI igualmente, inclusive quem só estava olhando o
+cardápio.
+
+Três camadas, do /webhook e do /chat_app (e das versões do app_async.py):
+
+- Por cliente: cada wa_id tem um balde de 'admissao_rajada' fichas que
+  reenche 'admissao_por_minuto' por minuto; cada mensagem gasta uma. Balde
+  vazio: a mensagem é descartada e o cliente recebe a
+  'mensagem_limite_cliente' uma vez só — as seguintes ficam sem resposta
+  até o balde reencher, senão um bot do outro lado entra em laço com a
+  própria mensagem de limite. Os baldes moram numa tabela em arquivo
+  mapeado (ADMISSAO_DIR/baldes.v1.bin), compartilhada pelos workers da
+  máquina sob flock: a mensagem que cai em outro worker gasta do mesmo
+  balde. Conjuntos de VIAS posições por hash do wa_id; cheio, sai o balde
+  parado há mais tempo (que já teria reenchido).
+- Vagas: no máximo 'admissao_concorrencia' turnos chamando a OpenAI ao
+  mesmo tempo na máquina (0 = sem limite). Cada vaga é um arquivo
+  ADMISSAO_DIR/vaga.<n>.lock segurado com flock enquanto o turno fala com
+  a IA — se o worker morre, o sistema solta a vaga sozinho. Só as
+  chamadas à OpenAI ficam dentro da vaga; saudação, horário e respostas
+  rápidas passam direto.
+- Prioridade: 'admissao_reserva_checkout' das vagas são só de conversas
+  no fechamento (com 'ultimo_calculo'). Sem vaga livre, o turno espera —
+  até 'admissao_espera_checkout_s' no fechamento, 'admissao_espera_s' no
+  resto, sempre dentro do prazo do turno (prazo.py) — e, no WhatsApp, o
+  cliente recebe a 'mensagem_espera' ao entrar na fila. Esgotada a
+  espera, desiste com a 'mensagem_sobrecarga'.
+
+Tudo é por máquina: com várias instâncias, o limite efetivo é o de cada
+uma vezes o número de instâncias. Com várias lojas no deploy (lojas.py),
+cada loja tem os próprios baldes e as vagas são divididas entre todas — a
+capacidade da OpenAI é do deploy; vale o 'admissao_concorrencia' da loja
+do turno. Sem fcntl (Windows, desenvolvimento)
+baldes e vagas valem só dentro do processo.
+
+Métricas: bot_admissao_limite_cliente_total{aviso},
+bot_admissao_vagas_total{prioridade, resultado} (imediata, adiada,
+recusada) e bot_admissao_espera_segundos{prioridade}.
+"""
+import asyncio
+import hashlib
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+
+import lojas
+import metricas
+import prazo
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+VIAS = 4
+CONJUNTOS = 4096
+# hash do wa_id, fichas, instante da última conta (time.time(), o mesmo
+# relógio pra todos os processos), 1 se o aviso de limite já foi.
+_BALDE = struct.Struct("<QddI4x")
+INTERVALO_ESPERA = 0.05
+
+
+def pasta_padrao():
+    return os.environ.get("ADMISSAO_DIR") or os.path.join(tempfile.gettempdir(), "bot_admissao")
+
+
+def _hash(chave):
+    valor = int.from_bytes(hashlib.blake2b(str(chave).encode("utf-8"), digest_size=8).digest(), "little")
+    return valor or 1
+
+
+def _numero(bot_cfg, chave, padrao):
+    try:
+        return float(bot_cfg.get(chave) if bot_cfg.get(chave) is not None else padrao)
+    except (TypeError, ValueError):
+        return float(padrao)
+
+
+class Vaga:
+    """Uma vaga de turno com IA; liberar() (ou o fim do 'with') devolve."""
+
+    def __init__(self, admissao, indice):
+        self._admissao = admissao
+        self._indice = indice
+
+    def liberar(self):
+        if self._indice is not None:
+            self._admissao._liberar(self._indice)
+            self._indice = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.liberar()
+
+
+class _SemLimite(Vaga):
+    def __init__(self):
+        super().__init__(None, None)
+
+
+class Admissao:
+    def __init__(self, pasta=None):
+        self._pasta = pasta or pasta_padrao()
+        self._pid = None
+        self._lock = threading.Lock()
+        os.register_at_fork(after_in_child=self._depois_do_fork)
+        self._zerar()
+
+    def _zerar(self):
+        self._arquivo = None
+        self._mapa = None
+        self._vagas = {}
+        self._ocupadas = set()
+
+    def _depois_do_fork(self):
+        # Vagas que o pai segura continuam dele: fecha a cópia sem soltar.
+        self._lock = threading.Lock()
+        self._pid = None
+        for fd in list(self._vagas.values()) + ([self._arquivo] if self._arquivo is not None else []):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+        self._zerar()
+
+    def _cfg(self, bot_cfg, chave):
+        return _numero(bot_cfg, chave, 0)
+
+    def _garantir_mapa(self):
+        pid = os.getpid()
+        if self._pid == pid and self._mapa is not None:
+            return self._mapa
+        os.makedirs(self._pasta, exist_ok=True)
+        tamanho = VIAS * CONJUNTOS * _BALDE.size
+        fd = os.open(os.path.join(self._pasta, "baldes.v1.bin"), os.O_RDWR | os.O_CREAT, 0o600)
+        if os.fstat(fd).st_size < tamanho:
+            os.ftruncate(fd, tamanho)
+        self._arquivo, self._mapa, self._pid = fd, mmap.mmap(fd, tamanho), pid
+        return self._mapa
+
+    # --- por cliente ---
+
+    def permitir(self, chave, bot_cfg):
+        """(permitida, avisar): avisar é True só na primeira mensagem
+        barrada desde que o balde esvaziou."""
+        por_minuto = self._cfg(bot_cfg, "admissao_por_minuto")
+        rajada = max(1.0, self._cfg(bot_cfg, "admissao_rajada"))
+        if por_minuto <= 0 or not chave:
+            return True, False
+        # Mesmo número em duas lojas (lojas.py) são dois clientes.
+        chave = f"{lojas.atual().id}:{chave}"
+        permitida, avisar = self._consumir(_hash(chave), rajada, por_minuto / 60.0, time.time())
+        if not permitida:
+            metricas.ADMISSAO_LIMITE_CLIENTE.labels(aviso="enviado" if avisar else "silencio").inc()
+        return permitida, avisar
+
+    def _consumir(self, valor, capacidade, por_segundo, agora):
+        with self._lock:
+            mapa = self._garantir_mapa()
+            if fcntl is not None:
+                fcntl.flock(self._arquivo, fcntl.LOCK_EX)
+            try:
+                base = (valor % CONJUNTOS) * VIAS
+                posicao, registro = None, None
+                livre, mais_velha = None, None
+                for via in range(VIAS):
+                    deslocamento = (base + via) * _BALDE.size
+                    lido = _BALDE.unpack_from(mapa, deslocamento)
+                    if lido[0] == valor:
+                        posicao, registro = deslocamento, lido
+                        break
+                    if lido[0] == 0:
+                        livre = livre if livre is not None else deslocamento
+                    elif mais_velha is None or lido[2] < mais_velha[1]:
+                        mais_velha = (deslocamento, lido[2])
+                if posicao is None:
+                    posicao = livre if livre is not None else mais_velha[0]
+                    fichas, avisado = capacidade, 0
+                else:
+                    _, fichas, em, avisado = registro
+                    fichas = min(capacidade, fichas + max(0.0, agora - em) * por_segundo)
+                if fichas >= 1:
+                    permitida, avisar = True, False
+                    fichas, avisado = fichas - 1, 0
+                else:
+                    permitida, avisar = False, not avisado
+                    avisado = 1
+                _BALDE.pack_into(mapa, posicao, valor, fichas, agora, avisado)
+                return permitida, avisar
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(self._arquivo, fcntl.LOCK_UN)
+
+    # --- vagas ---
+
+    def _limites(self, bot_cfg, prioritario):
+        total = int(self._cfg(bot_cfg, "admissao_concorrencia"))
+        reserva = max(0, min(total - 1, int(self._cfg(bot_cfg, "admissao_reserva_checkout"))))
+        if prioritario:
+            # Reservadas primeiro: deixa as comuns pra quem não tem carrinho.
+            return total, range(total - 1, -1, -1)
+        return total, range(total - reserva)
+
+    def tentar_vaga(self, bot_cfg, prioritario):
+        """Vaga livre agora ou None (sem esperar)."""
+        total, ordem = self._limites(bot_cfg, prioritario)
+        if total <= 0:
+            return _SemLimite()
+        with self._lock:
+            for indice in ordem:
+                if indice in self._ocupadas:
+                    continue
+                if fcntl is not None:
+                    fd = self._vagas.get(indice)
+                    if fd is None:
+                        os.makedirs(self._pasta, exist_ok=True)
+                        fd = os.open(os.path.join(self._pasta, f"vaga.{indice}.lock"), os.O_RDWR | os.O_CREAT, 0o600)
+                        self._vagas[indice] = fd
+                    try:
+                        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except BlockingIOError:
+                        continue
+                self._ocupadas.add(indice)
+                return Vaga(self, indice)
+        return None
+
+    def _liberar(self, indice):
+        with self._lock:
+            if indice not in self._ocupadas:
+                return
+            self._ocupadas.discard(indice)
+            fd = self._vagas.get(indice)
+            if fcntl is not None and fd is not None:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+
+    def _espera(self, bot_cfg, prioritario):
+        chave = "admissao_espera_checkout_s" if prioritario else "admissao_espera_s"
+        return prazo.timeout(max(0.0, self._cfg(bot_cfg, chave)), minimo=0)
+
+    def _registrar(self, prioritario, resultado, inicio=None):
+        rotulo = "checkout" if prioritario else "navegacao"
+        metricas.ADMISSAO_VAGAS.labels(prioridade=rotulo, resultado=resultado).inc()
+        if inicio is not None:
+            metricas.ADMISSAO_ESPERA.labels(prioridade=rotulo).observe(time.perf_counter() - inicio)
+
+    def vaga(self, bot_cfg, prioritario, ao_adiar=None):
+        """Vaga pra um turno com IA, esperando se preciso; None = desistiu
+        (sobrecarga). 'ao_adiar' é chamado uma vez, se o turno entra na
+        fila."""
+        vaga = self.tentar_vaga(bot_cfg, prioritario)
+        if vaga is not None:
+            self._registrar(prioritario, "imediata")
+            return vaga
+        inicio = time.perf_counter()
+        limite = inicio + self._espera(bot_cfg, prioritario)
+        if ao_adiar is not None and limite > inicio:
+            ao_adiar()
+        while time.perf_counter() < limite:
+            time.sleep(INTERVALO_ESPERA)
+            vaga = self.tentar_vaga(bot_cfg, prioritario)
+            if vaga is not None:
+                self._registrar(prioritario, "adiada", inicio)
+                return vaga
+        self._registrar(prioritario, "recusada", inicio)
+        return None
+
+    async def vaga_async(self, bot_cfg, prioritario, ao_adiar=None):
+        """vaga() pro app_async.py: espera sem bloquear o loop."""
+        vaga = self.tentar_vaga(bot_cfg, prioritario)
+        if vaga is not None:
+            self._registrar(prioritario, "imediata")
+            return vaga
+        inicio = time.perf_counter()
+        limite = inicio + self._espera(bot_cfg, prioritario)
+        if ao_adiar is not None and limite > inicio:
+            await ao_adiar()
+        while time.perf_counter() < limite:
+            await asyncio.sleep(INTERVALO_ESPERA)
+            vaga = self.tentar_vaga(bot_cfg, prioritario)
+            if vaga is not None:
+                self._registrar(prioritario, "adiada", inicio)
+                return vaga
+        self._registrar(prioritario, "recusada", inicio)
+        return None
@@ -1,31 +1,136 @@
 import re
 import unicodedata
-from flask import Flask, request, jsonify
-import requests
+import hashlib
+import hmac
+from flask import Flask, request, jsonify, Response, g
 import os
 import json
-import openai
-import firebase_admin
-from thefuzz import process, fuzz
-from firebase_admin import credentials, firestore, storage, messaging
 from dotenv import load_dotenv 
 from flask_cors import CORS
 from datetime import datetime, timedelta, timezone
+import time
+import threading
+import metricas
+import perfil
+from metricas import medir_etapa
+import prazo
+from prazo import PrazoEsgotado
+from firestore_contagem import ClienteContado, iniciar_contagem, encerrar_contagem
+from partida import importar_quando_usar, PorProcesso
+import lojas
+from lojas import PorLoja
+from instantaneo import Instantaneo, pasta_padrao as pasta_instantaneo
+from fila_historico import FilaHistorico, pasta_padrao as pasta_fila_historico
+from varredor import Varredor, PASTA_ARQUIVO
+from admissao import Admissao
+from roteador_modelos import RoteadorModelos
+import respostas_rapidas
+import caixa_entrada
+import disparos
+import notificacoes
+import logs
+import vendas_agregadas
+import paginas_historico
+import horario
+from uso_ia import RegistroUsoIA, versao_prompt
+
+# Importados só no primeiro uso (ver partida.py) — o '/' responde sem eles.
+requests = importar_quando_usar("requests")
+openai = importar_quando_usar("openai")
+firebase_admin = importar_quando_usar("firebase_admin")
+credentials = importar_quando_usar("firebase_admin.credentials")
+firestore = importar_quando_usar("firebase_admin.firestore")
+storage = importar_quando_usar("firebase_admin.storage")
+process = importar_quando_usar("thefuzz.process")
+google_exceptions = importar_quando_usar("google.api_core.exceptions")
 processed_message_ids = set()
 
 load_dotenv()
 
+# Log em JSON, fora do thread da requisição, com o id do turno — ver logs.py.
+logs.configurar()
+log = logs.obter("app")
+# Pontuação de cada busca aproximada (item, sabor, bairro): DEBUG amostrado.
+log_busca = logs.obter("busca")
+
 # --- CONFIGURAÇÃO FIREBASE ---
 FIREBASE_CREDENCIAL_PATH = os.environ.get("FIREBASE_CREDENCIAL_PATH")
 FIREBASE_STORAGE_BUCKET = os.environ.get("FIREBASE_STORAGE_BUCKET")
 
-if not firebase_admin._apps:
-    cred = credentials.Certificate(FIREBASE_CREDENCIAL_PATH)
-    firebase_admin.initialize_app(cred, {'storageBucket': FIREBASE_STORAGE_BUCKET})
-db = firestore.client()
+def iniciar_firebase(loja=None):
+    """Chamado no primeiro uso do Firestore/Storage em cada processo, nunca
+    no import: com 'gunicorn --preload' o import roda no processo mestre.
 
+    Devolve o app do firebase_admin da loja com projeto próprio (lojas.py);
+    None pras que usam o app padrão (a principal e as de prefixo)."""
+    if loja is not None and loja.projeto_proprio:
+        if loja.id not in firebase_admin._apps:
+            try:
+                firebase_admin.initialize_app(credentials.Certificate(loja.firebase_credencial),
+                                              {'storageBucket': loja.storage_bucket}, name=loja.id)
+            except ValueError:
+                pass  # outro thread criou no meio
+        return firebase_admin.get_app(loja.id)
+    if firebase_admin._DEFAULT_APP_NAME in firebase_admin._apps:
+        return None
+    if os.environ.get("FIRESTORE_EMULATOR_HOST") and not FIREBASE_CREDENCIAL_PATH:
+        # Emulador local (teste de carga em carga/, test-env): não tem
+        # credencial de verdade, o cliente só precisa saber o projeto.
+        from google.auth.credentials import AnonymousCredentials
+        firebase_admin.initialize_app(AnonymousCredentials(), {
+            'projectId': os.environ.get("GOOGLE_CLOUD_PROJECT") or "pizzain-40973",
+            'storageBucket': FIREBASE_STORAGE_BUCKET
+        })
+    else:
+        cred = credentials.Certificate(FIREBASE_CREDENCIAL_PATH)
+        firebase_admin.initialize_app(cred, {'storageBucket': FIREBASE_STORAGE_BUCKET})
+    return None
+
+def _criar_cliente_firestore(loja):
+    app_firebase = iniciar_firebase(loja)
+    # Cliente embrulhado só pra contar leituras/escritas (é isso que o Firestore
+    # cobra) — mesma interface do firestore.client(), ver firestore_contagem.py.
+    # Loja sem projeto próprio usa o cliente da principal com o prefixo dela.
+    cliente = firestore.client(app=app_firebase) if app_firebase is not None else firestore.client()
+    return ClienteContado(cliente, prefixo=loja.prefixo)
+
+# Tudo abaixo é um por loja (lojas.py): o objeto da loja do contexto, criado
+# no primeiro uso dela dentro de cada worker (canal gRPC não sobrevive a fork).
+db = PorLoja(_criar_cliente_firestore)
+registro_uso_ia = PorLoja(lambda loja: RegistroUsoIA(db))
+# Config, cardápio e apelidos (itens/bairros aprendidos) vêm da cópia local
+# mantida por listener — ver instantaneo.py.
+instantaneo = PorLoja(lambda loja: Instantaneo(db, pasta=loja.pasta(pasta_instantaneo()),
+                                               memoria_max_bytes=loja.memoria_max_bytes))
+# Histórico das conversas gravado por trás da resposta — ver fila_historico.py.
+fila_historico = PorLoja(lambda loja: FilaHistorico(db, pasta=loja.pasta(pasta_fila_historico())))
+# Push do app em lote, com limpeza de tokens mortos — ver notificacoes.py.
+fila_push = PorLoja(lambda loja: notificacoes.FilaPush(db, lambda: iniciar_firebase(loja)))
+# Disparos de promoção pelo WhatsApp e pelo app — ver disparos.py.
+disparador = PorLoja(lambda loja: disparos.Disparador(db, lambda telefone, campos, nome: enviar_whatsapp_disparo(telefone, campos, nome),
+                                                      lambda mensagens: enviar_app_disparo(mensagens)))
+# Atenção esquecida e conversas paradas, em segundo plano — ver varredor.py.
+varredor = PorLoja(lambda loja: Varredor(db, lambda: obter_config_bot(), lambda: obter_bucket_storage(),
+                                         lambda para, texto: send_message(para, texto),
+                                         pasta_arquivo=loja.prefixo_storage + PASTA_ARQUIVO,
+                                         retomar_disparos=lambda: disparador.retomar()))
+
+def iniciar_varredores():
+    """Varredura de todas as lojas desde a partida do worker (post_fork do
+    gunicorn, lifespan do app_async)."""
+    for loja in lojas.todas():
+        varredor.obter(loja).iniciar()
+# Limite por cliente e vagas de turno com IA, entre os workers da máquina —
+# ver admissao.py.
+admissao = Admissao()
+
+# A biblioteca da OpenAI lê OPENAI_API_KEY do ambiente sozinha quando cria o
+# cliente (já com o .env carregado acima).
 OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY") 
-openai.api_key = OPENAI_API_KEY
+# Sem retentativa da biblioteca: timeout e modelo reserva são do roteador
+# (ver roteador_modelos.py).
+cliente_openai = PorProcesso(lambda: openai.OpenAI(max_retries=0))
+roteador_modelos = RoteadorModelos()
 
 BOT_CONFIG_DEFAULTS = {
     "ativo": True,
@@ -33,6 +138,10 @@ BOT_CONFIG_DEFAULTS = {
     "nome_empresa": "Lileamar Salgados",
     "chave_pix": "abc1231234567",
     "modelo": "gpt-4o",
+    # Turno curto e a 2ª chamada (depois das ferramentas) vão pro modelo
+    # rápido; carrinho/fechamento fica no 'modelo' — ver roteador_modelos.py.
+    "modelo_rapido": "gpt-4o-mini",
+    "roteamento_modelos": True,
     # Fechar um pedido hoje passa por bem mais etapas do que antes (confirmar
     # bairro, pedir endereço completo, forma de pagamento, resumo antes de
     # fechar) — uma conversa real já passou de 17 mensagens antes do cliente
@@ -43,24 +152,68 @@ BOT_CONFIG_DEFAULTS = {
     "max_historico_salvar": 30,
     "mensagem_inicial": "Ola! Como posso ajudar?",
     "mensagem_erro": "Desculpe, tive um probleminha aqui. Pode repetir?",
+    # Tempo máximo de um turno, da chegada da mensagem até a resposta (ver
+    # prazo.py); passou dele, o cliente recebe a 'mensagem_prazo'. Precisa
+    # ficar abaixo do '--timeout 120' do gunicorn.
+    "prazo_turno_s": 40,
+    "mensagem_prazo": "Desculpe a demora, estou com uma lentidão aqui agora. Pode mandar sua mensagem de novo?",
     "mensagem_inativo": "No momento o atendimento automatico esta pausado. Em breve nossa equipe responde por aqui.",
     "mensagem_pronto": "Oi {nome_cliente}! Seu pedido esta pronto!",
     "mensagem_retirada": "Boa noticia, {nome_cliente}! Seu pedido ja pode ser retirado!",
     "instrucoes_extras": "",
     "bairros_entrega": [],
     "taxa_entrega": 0,
-    "cidade_atendida": ""
+    "cidade_atendida": "",
+    # Janela em que um 'registrar_pedido' repetido (mesmo cliente, mesmos
+    # itens, mesma entrega/endereço) devolve o pedido já criado em vez de
+    # criar outro — ver _impressao_digital_pedido.
+    "janela_pedido_repetido_min": 30,
+    # Horário, bairro, cardápio e PIX respondidos sem chamar a IA quando a
+    # mensagem é só essa pergunta — ver respostas_rapidas.py.
+    "respostas_rapidas": True,
+    # Dúvida marcada pra equipe (marcar_atencao) sem resposta: depois de
+    # 'atencao_escalar_min' o bot para de prometer e a varredura avisa a
+    # equipe (WhatsApp pro telefone_alerta_equipe, se houver); depois de
+    # 'atencao_expirar_h' a marcação some. Conversas sem interação há mais de
+    # 'retencao_conversas_dias' vão pro arquivo no Storage (0 = nunca) — ver
+    # varredor.py.
+    "atencao_escalar_min": 10,
+    "atencao_expirar_h": 12,
+    "telefone_alerta_equipe": "",
+    "retencao_conversas_dias": 180,
+    # Controle de admissão (admissao.py): cada cliente manda até
+    # 'admissao_rajada' mensagens seguidas e depois 'admissao_por_minuto'
+    # por minuto (0 = sem limite); no máximo 'admissao_concorrencia' turnos
+    # falando com a OpenAI ao mesmo tempo na máquina (0 = sem limite),
+    # 'admissao_reserva_checkout' deles só pra quem já tem carrinho
+    # calculado. Sem vaga, o turno espera até 'admissao_espera_s'
+    # ('admissao_espera_checkout_s' no fechamento) e desiste com a
+    # 'mensagem_sobrecarga'.
+    "admissao_por_minuto": 8,
+    "admissao_rajada": 6,
+    "admissao_concorrencia": 16,
+    "admissao_reserva_checkout": 4,
+    "admissao_espera_s": 4,
+    "admissao_espera_checkout_s": 15,
+    "mensagem_limite_cliente": "Recebi várias mensagens seguidas suas! Me dá um minutinho e manda de novo, que eu já te respondo.",
+    "mensagem_espera": "Só um instante, já te respondo!",
+    "mensagem_sobrecarga": "Estamos com muito movimento agora. Pode mandar sua mensagem de novo daqui a pouquinho?"
 }
 
 def obter_config_bot():
-    cfg = dict(BOT_CONFIG_DEFAULTS)
+    dados = None
     try:
-        doc = db.collection("configuracoes").document("bot").get()
-        if doc.exists:
-            dados = doc.to_dict() or {}
-            cfg.update({k: v for k, v in dados.items() if v is not None})
-    except Exception as e:
-        print(f"Erro ao ler configuracao do bot: {e}")
+        dados = instantaneo.documento("config", "bot")
+    except Exception:
+        log.error("erro ao ler a configuração do bot", exc_info=True)
+    return montar_config_bot(dados)
+
+def montar_config_bot(dados):
+    """Defaults + o que está gravado em configuracoes/bot, com os limites de
+    histórico já validados. Separado da leitura pra ser reaproveitado pelo
+    modo assíncrono (app_async.py), que lê o documento com outro cliente."""
+    cfg = dict(BOT_CONFIG_DEFAULTS)
+    cfg.update({k: v for k, v in (dados or {}).items() if v is not None})
 
     try:
         cfg["max_historico_contexto"] = max(2, min(50, int(cfg.get("max_historico_contexto") or 24)))
@@ -77,6 +230,8 @@ def obter_config_bot():
 # salvar_historico_firestore. O antigo armazenamento em arquivo local
 # (chat_history.json) foi removido por ser efêmero no deploy (Render)
 # e não funcionar com múltiplos workers do gunicorn.
+# O painel de Atendimento lista as conversas pelo resumo em
+# "caixa_entrada" (caixa_entrada.py), gravado junto com o histórico.
 
 def primeiro_nome(nome):
     """Pra falar com o cliente de forma mais natural (ex.: 'Oi Murilo!' em
@@ -92,36 +247,29 @@ def _disponivel_online(item):
     # dessa opção existir).
     return item.get('disponivel_online') is not False
 
+def cardapio_por_categoria():
+    """{categoria: [(nome, preço)]} dos itens disponíveis online, sem as
+    bebidas. Base do listar_cardapio (texto cru pra IA) e da resposta
+    rápida do cardápio (texto pronto pro cliente)."""
+    categorias = {}
+    for item in instantaneo.documentos('cardapio').values():
+        if item.get('disponivel') is not True or not _disponivel_online(item):
+            continue
+        cat = item.get('categoria', 'Outros').title()
+        # Bebida é acompanhamento, não faz parte do cardápio principal —
+        # fica só na função listar_bebidas, quando o cliente pedir.
+        if 'bebida' in cat.lower():
+            continue
+        # Sem ingredientes aqui de propósito: essa é a lista geral do
+        # cardápio. Detalhe de ingrediente só quando o cliente pergunta
+        # de um item específico (aí a IA usa 'consultar_sabor').
+        categorias.setdefault(cat, []).append((item.get('nome_exibicao') or item.get('nome'), item.get('preco')))
+    return categorias
+
 def listar_cardapio():
     if db is None: return "Erro no banco de dados."
     try:
-        docs = db.collection('cardapio').where('disponivel', '==', True).get()
-
-        if not docs:
-            return "No momento, não temos itens disponíveis no cardápio."
-
-        categorias = {}
-
-        for doc in docs:
-            item = doc.to_dict()
-            if not _disponivel_online(item):
-                continue
-            cat = item.get('categoria', 'Outros').title()
-            # Bebida é acompanhamento, não faz parte do cardápio principal —
-            # fica só na função listar_bebidas, quando o cliente pedir.
-            if 'bebida' in cat.lower():
-                continue
-
-            nome = item.get('nome_exibicao') or item.get('nome')
-            preco = item.get('preco')
-
-            if cat not in categorias:
-                categorias[cat] = []
-
-            # Sem ingredientes aqui de propósito: essa é a lista geral do
-            # cardápio. Detalhe de ingrediente só quando o cliente pergunta
-            # de um item específico (aí a IA usa 'consultar_sabor').
-            categorias[cat].append(f"{nome}: R$ {preco:.2f}")
+        categorias = cardapio_por_categoria()
 
         if not categorias:
             return "No momento, não temos itens disponíveis no cardápio."
@@ -131,13 +279,13 @@ def listar_cardapio():
         # não colar este texto quase igual na resposta pro cliente.
         cardapio_texto = ""
         for cat, itens in categorias.items():
-            cardapio_texto += f"{cat}: " + "; ".join(itens) + "\n"
+            cardapio_texto += f"{cat}: " + "; ".join(f"{nome}: R$ {preco:.2f}" for nome, preco in itens) + "\n"
 
-        print(f"DEBUG: listar_cardapio() retornou categorias: {list(categorias.keys())}")
+        log.debug("cardápio listado", extra={"categorias": list(categorias)})
         return cardapio_texto
 
-    except Exception as e:
-        print(f"Erro ao listar cardápio: {e}")
+    except Exception:
+        log.error("erro ao listar o cardápio", exc_info=True)
         return "Desculpe, tive um problema ao consultar o cardápio."
     
 def listar_bebidas():
@@ -147,9 +295,9 @@ def listar_bebidas():
         # Filtra por "categoria contém bebida" em vez de comparar com um valor
         # fixo — a categoria é texto livre cadastrado no Cardápio (ex.: "Bebidas",
         # "bebida gelada" etc.), não um valor fixo garantido pelo sistema.
-        docs = db.collection('cardapio').where('disponivel', '==', True).get()
-        itens = [doc.to_dict() for doc in docs
-                 if 'bebida' in str(doc.to_dict().get('categoria', '')).lower() and _disponivel_online(doc.to_dict())]
+        itens = [item for item in instantaneo.documentos('cardapio').values()
+                 if item.get('disponivel') is True
+                 and 'bebida' in str(item.get('categoria', '')).lower() and _disponivel_online(item)]
 
         if not itens:
             return "No momento, não temos bebidas disponíveis."
@@ -161,39 +309,36 @@ def listar_bebidas():
 
         return texto_bebidas
 
-    except Exception as e:
-        print(f"ERRO AO LISTAR BEBIDAS: {e}")
+    except Exception:
+        log.error("erro ao listar as bebidas", exc_info=True)
         return "Erro ao carregar a lista de bebidas."
 
+def obter_bucket_storage():
+    loja = lojas.atual()
+    return storage.bucket(loja.storage_bucket, app=iniciar_firebase(loja))
+
 def upload_comprovante_firebase(caminho_local, nome_arquivo):
     """
     Envia o arquivo baixado para o Firebase Storage e retorna a URL pública.
     """
     try:
-        bucket = storage.bucket()
-        blob = bucket.blob(f"comprovantes/{nome_arquivo}")
+        bucket = obter_bucket_storage()
+        blob = bucket.blob(f"{lojas.atual().prefixo_storage}comprovantes/{nome_arquivo}")
         
         # Faz o upload do arquivo
-        blob.upload_from_filename(caminho_local)
+        blob.upload_from_filename(caminho_local, timeout=prazo.timeout(60))
         
         # Torna o arquivo público para visualização (opcional) ou gera URL assinada
-        blob.make_public()
+        blob.make_public(timeout=prazo.timeout(15))
         
-        print(f"DEBUG: Arquivo {nome_arquivo} enviado para o Storage.")
+        log.debug("arquivo enviado pro Storage", extra={"arquivo": nome_arquivo})
         return blob.public_url
-    except Exception as e:
-        print(f"ERRO no Upload Storage: {e}")
+    except Exception:
+        log.error("erro no upload pro Storage", exc_info=True)
         return None
 
 # --- FUNÇÕES DE AUXÍLIO ---
 
-import re
-
-# No topo do seu código, adicione/verifique as importações:
-from thefuzz import process, fuzz # <--- Adicione 'fuzz' aqui
-
-# ... (restante do código) ...
-
 def _montar_itens_pedido(itens, tipo_entrega):
     """Casa cada item pedido (nome + quantidade) contra o cardápio via busca
     aproximada e calcula o total — usada tanto por 'calcular_pedido' (só
@@ -218,13 +363,11 @@ def _montar_itens_pedido(itens, tipo_entrega):
     automaticamente por falta de estoque (baixa-estoque.js) não pode ser
     aceito aqui, mesmo que o cliente peça pelo nome de cor.
     """
-    docs_cardapio = list(db.collection('cardapio').get())
     cardapio_por_nome = {}
     cardapio_por_id = {}
-    for doc in docs_cardapio:
-        dados = doc.to_dict()
-        item_com_id = {**dados, "id": doc.id}
-        cardapio_por_id[doc.id] = item_com_id
+    for doc_id, dados in instantaneo.documentos('cardapio').items():
+        item_com_id = {**dados, "id": doc_id}
+        cardapio_por_id[doc_id] = item_com_id
         nome_chave = str(dados.get('nome', '')).strip().lower()
         if nome_chave:
             cardapio_por_nome[nome_chave] = item_com_id
@@ -249,12 +392,12 @@ def _montar_itens_pedido(itens, tipo_entrega):
         # nome exato — pula a busca aproximada e vai direto no item certo.
         dados = None
         try:
-            aprendido = db.collection("itens_aprendizado").document(_normalizar_termo(nome_pedido)).get()
-            if aprendido.exists:
-                item_id_aprendido = aprendido.to_dict().get("item_id")
+            aprendido = instantaneo.documento("itens_aprendizado", _normalizar_termo(nome_pedido))
+            if aprendido:
+                item_id_aprendido = aprendido.get("item_id")
                 dados = cardapio_por_id.get(item_id_aprendido)
         except Exception as e:
-            print(f"Erro ao checar item aprendido: {e}")
+            log.warning("erro ao checar item aprendido", extra={"erro": str(e)})
 
         if not dados:
             if not nomes_cardapio:
@@ -267,7 +410,7 @@ def _montar_itens_pedido(itens, tipo_entrega):
             nomes_normalizados = [_normalizar_termo(n) for n in nomes_cardapio]
             melhor_match_norm, pontuacao = process.extractOne(_normalizar_termo(nome_pedido), nomes_normalizados)
             melhor_match = nomes_cardapio[nomes_normalizados.index(melhor_match_norm)]
-            print(f"DEBUG: item do pedido '{nome_pedido}' comparado com '{melhor_match}'. Pontuação: {pontuacao}")
+            log_busca.debug("item do pedido", extra={"termo": nome_pedido, "melhor": melhor_match, "pontuacao": pontuacao})
 
             if pontuacao < 70:
                 itens_nao_reconhecidos.append(nome_pedido)
@@ -353,7 +496,7 @@ def calcular_pedido(id_usuario, itens, tipo_entrega=None):
                     }
                 }, merge=True)
             except Exception as e:
-                print(f"Erro ao cachear ultimo_calculo: {e}")
+                log.warning("erro ao guardar ultimo_calculo", extra={"erro": str(e)})
 
         return json.dumps({
             "status": "ok",
@@ -364,27 +507,45 @@ def calcular_pedido(id_usuario, itens, tipo_entrega=None):
             "taxa_entrega": montado["taxa_entrega"],
             "valor_total": montado["valor_total"]
         })
-    except Exception as e:
-        print(f"ERRO ao calcular pedido: {e}")
+    except Exception:
+        log.error("erro ao calcular o pedido", exc_info=True)
         return json.dumps({"status": "erro", "motivo": "Erro interno."})
 
+def _impressao_digital_pedido(wa_id, lista_itens_tsx, tipo_entrega, endereco_completo):
+    """Chave que identifica "o mesmo pedido" pra 'registrar_pedido': cliente,
+    itens JÁ resolvidos (id do cardápio + quantidade, não o texto cru que a
+    IA mandou) e entrega/endereço. Mesmo com o prompt avisando várias vezes,
+    a IA às vezes chama 'registrar_pedido' duas vezes pro mesmo carrinho —
+    cada chamada virava um pedido novo (KDS, pontos de fidelidade e limpeza
+    manual em dobro). Com essa chave, a segunda chamada cai no mesmo
+    documento de 'pedidos_idempotencia' e devolve o pedido já criado."""
+    partes = {
+        "cliente": re.sub(r'\D', '', str(wa_id or '')),
+        "itens": sorted([str(i.get("id")), int(i.get("quantidade") or 1)] for i in lista_itens_tsx),
+        "tipo_entrega": tipo_entrega,
+        "endereco": _normalizar_termo(endereco_completo) if tipo_entrega == "ENTREGA" else ""
+    }
+    return hashlib.sha256(json.dumps(partes, sort_keys=True).encode("utf-8")).hexdigest()
+
 def registrar_pedido(wa_id: str, nome_cliente: str, itens, valor_total: float, observacao: str, endereco_completo: str, forma_pagamento: str, tipo_entrega=None, telefone=None, id_usuario_cache=None, bairro=None):
     if db is None: return json.dumps({"status": "erro", "motivo": "Erro de conexão."})
 
     # Segunda checagem de horário: cobre o caso raro de a conversa ter
     # começado antes de fechar e só terminar (chamar essa função) depois.
-    aberto, texto_horario = verificar_horario_funcionamento(obter_config_bot())
-    if not aberto:
+    bot_cfg = obter_config_bot()
+    estado_horario = horario.consultar(bot_cfg)
+    if not estado_horario.aberto:
         return json.dumps({
             "status": "erro",
             "motivo": "Loja fechada no momento.",
-            "horario_funcionamento": texto_horario
+            "horario_funcionamento": estado_horario.texto,
+            "proxima_abertura": estado_horario.texto_proxima or None
         })
 
     fuso_br = timezone(timedelta(hours=-3))
     agora_br = datetime.now(fuso_br)
 
-    print(f"\n--- [REGISTRO: {agora_br.strftime('%H:%M:%S')}] ---")
+    log.info("registrando pedido", extra={"wa_id": wa_id})
 
     try:
         user_query = db.collection('usuarios_app').where('telefone', '==', wa_id).limit(1).get()
@@ -416,7 +577,7 @@ def registrar_pedido(wa_id: str, nome_cliente: str, itens, valor_total: float, o
                     }
                     hist_ref.update({"ultimo_calculo": firestore.DELETE_FIELD})
             except Exception as e:
-                print(f"Erro ao reaproveitar ultimo_calculo: {e}")
+                log.warning("erro ao reaproveitar ultimo_calculo", extra={"erro": str(e)})
 
         if montado is None:
             montado = _montar_itens_pedido(itens, tipo_entrega)
@@ -436,7 +597,6 @@ def registrar_pedido(wa_id: str, nome_cliente: str, itens, valor_total: float, o
                 "itens_indisponiveis": itens_indisponiveis
             })
 
-        batch = db.batch()
         pedido_ref = db.collection('pedidos').document()
         dados_pedido = {
             "origem": "WHATSAPP",
@@ -454,15 +614,13 @@ def registrar_pedido(wa_id: str, nome_cliente: str, itens, valor_total: float, o
             "telefone_cliente": str(wa_id),
             "usuario_id": usuario_id,
             "valor_total": valor_total_final,
-            "taxa_entrega": taxa_entrega
+            "taxa_entrega": taxa_entrega,
+            # Já somado em vendas_agregadas neste commit — a Cloud Function
+            # agregarVendas não soma a criação de novo.
+            "agregado": True
         }
-        batch.set(pedido_ref, dados_pedido)
 
-        if user_doc and total_pontos > 0:
-            batch.update(user_doc.reference, {"pontos": firestore.Increment(total_pontos)})
-
-        batch.commit()
-        return json.dumps({
+        resposta = {
             "status": "ok",
             "pedido_id": pedido_ref.id,
             "itens_confirmados": [i["nome"] for i in lista_itens_tsx],
@@ -471,10 +629,61 @@ def registrar_pedido(wa_id: str, nome_cliente: str, itens, valor_total: float, o
             "valor_itens": montado["valor_itens"],
             "taxa_entrega": taxa_entrega,
             "valor_total": valor_total_final
-        })
+        }
 
-    except Exception as e:
-        print(f"ERRO: {str(e)}")
+        # Trava contra pedido repetido: o documento da impressão digital é
+        # criado NO MESMO commit do pedido (create = só se não existir). Se
+        # outra chamada (inclusive de outro worker do gunicorn) já registrou
+        # esse carrinho, o commit inteiro falha sem gravar nada — nem pedido,
+        # nem pontos — e devolvemos o pedido que já existe.
+        try:
+            janela = timedelta(minutes=float(bot_cfg.get("janela_pedido_repetido_min") or 30))
+        except (TypeError, ValueError):
+            janela = timedelta(minutes=30)
+        idem_ref = db.collection('pedidos_idempotencia').document(
+            _impressao_digital_pedido(wa_id, lista_itens_tsx, tipo_entrega, endereco_completo)
+        )
+        dados_idem = {
+            "pedido_id": pedido_ref.id,
+            "telefone_cliente": str(wa_id),
+            "criado_em": datetime.now(timezone.utc)
+        }
+        idem_anterior = None
+        for _tentativa in range(3):
+            batch = db.batch()
+            if idem_anterior is None:
+                batch.create(idem_ref, dados_idem)
+            else:
+                # Impressão vencida (fora da janela = pedido novo de verdade,
+                # ex.: mesmo lanche pedido de novo no dia seguinte): reaproveita
+                # o documento só se ninguém mexeu nele desde a leitura — se
+                # outro worker chegou junto, o commit falha e relemos.
+                batch.update(idem_ref, dados_idem, option=db.write_option(last_update_time=idem_anterior.update_time))
+            batch.set(pedido_ref, dados_pedido)
+            # Totais do BI (vendas_agregadas.py) no mesmo commit do pedido.
+            vendas_agregadas.somar_no_lote(batch, db, dados_pedido)
+
+            if user_doc and total_pontos > 0:
+                batch.update(user_doc.reference, {"pontos": firestore.Increment(total_pontos)})
+
+            try:
+                batch.commit()
+                return json.dumps(resposta)
+            except (google_exceptions.AlreadyExists, google_exceptions.FailedPrecondition, google_exceptions.NotFound):
+                idem_anterior = idem_ref.get()
+                if not idem_anterior.exists:
+                    idem_anterior = None
+                    continue
+                existente = idem_anterior.to_dict() or {}
+                criado_em = existente.get("criado_em")
+                if existente.get("pedido_id") and criado_em and datetime.now(timezone.utc) - criado_em < janela:
+                    log.info("pedido repetido bloqueado", extra={"pedido_id": existente["pedido_id"], "wa_id": wa_id})
+                    return json.dumps({**resposta, "pedido_id": existente["pedido_id"], "pedido_ja_registrado": True})
+
+        return json.dumps({"status": "erro", "motivo": "Erro interno."})
+
+    except Exception:
+        log.error("erro ao registrar o pedido", exc_info=True)
         return json.dumps({"status": "erro", "motivo": "Erro interno."})
 
 def consultar_meu_pedido(wa_id: str):
@@ -502,8 +711,8 @@ def consultar_meu_pedido(wa_id: str):
             "forma_pagamento": pedido.get("forma_pagamento"),
             "status_pedido": pedido.get("status")
         })
-    except Exception as e:
-        print(f"ERRO ao consultar pedido: {e}")
+    except Exception:
+        log.error("erro ao consultar o pedido", exc_info=True)
         return json.dumps({"status": "erro", "motivo": "Erro interno."})
 
 def registrar_comprovante(wa_id: str, imagem_url: str):
@@ -533,33 +742,33 @@ def registrar_comprovante(wa_id: str, imagem_url: str):
                 'status': "PENDENTE_VALIDACAO"
             })
             
-            print(f"DEBUG: Comprovante vinculado ao pedido {doc.id}")
+            log.info("comprovante vinculado", extra={"pedido_id": doc.id})
             return f"Obrigado! Recebi o comprovante do seu pedido. 🎉 Nossa equipe já está validando o pagamento para iniciar o preparo."
 
         return "Não encontrei um pedido aberto para este número. Por favor, finalize o pedido antes de enviar o comprovante."
 
-    except Exception as e:
-        print(f"ERRO: {e}")
+    except Exception:
+        log.error("erro ao registrar o comprovante", exc_info=True)
         return "Tive um problema ao processar a imagem."
     
 def baixar_imagem_whatsapp(media_id, tipo):
     """
     Obtém a URL da mídia e baixa o arquivo para o servidor local.
     """
-    url_info = f"https://graph.facebook.com/v21.0/{media_id}"
-    headers = {"Authorization": f"Bearer {ACCESS_TOKEN}"}
+    url_info = f"{GRAPH_API_URL}/{media_id}"
+    headers = {"Authorization": f"Bearer {lojas.atual().access_token}"}
     
     try:
         # 1. Busca a URL de download
-        response_info = requests.get(url_info, headers=headers)
+        response_info = requests.get(url_info, headers=headers, timeout=prazo.timeout(15))
         if response_info.status_code != 200:
-            print(f"Erro ao obter info da mídia: {response_info.text}")
+            log.warning("erro ao obter a mídia", extra={"status": response_info.status_code, "detalhes": response_info.text})
             return None
             
         url_download = response_info.json().get("url")
         
         # 2. Faz o download do arquivo real
-        media_res = requests.get(url_download, headers=headers)
+        media_res = requests.get(url_download, headers=headers, timeout=prazo.timeout(30))
         if media_res.status_code == 200:
             # Define a extensão do arquivo
             ext = "jpg" if tipo == 'image' else "pdf"
@@ -569,67 +778,50 @@ def baixar_imagem_whatsapp(media_id, tipo):
             with open(nome_arquivo, "wb") as f:
                 f.write(media_res.content)
             
-            print(f"DEBUG: Arquivo baixado com sucesso: {nome_arquivo}")
+            log.debug("mídia baixada", extra={"arquivo": nome_arquivo})
             return nome_arquivo # Retorna o caminho do arquivo para o próximo passo
             
-    except Exception as e:
-        print(f"ERRO AO BAIXAR MÍDIA: {e}")
+    except Exception:
+        log.error("erro ao baixar a mídia", exc_info=True)
         return None
        
 def obter_historico_firestore(wa_id, limite=None):
+    # Ler o que o próprio bot acabou de escrever: espera a gravação de
+    # outro worker sair e junta o que ainda está na fila deste.
+    fila_historico.aguardar_outros(wa_id)
     try:
         doc = db.collection("historico_conversas").document(wa_id).get()
-        if doc.exists:
-            historico_bruto = doc.to_dict().get("mensagens", [])
-            
-            # Limpeza: remove campos que a OpenAI não entende (como o objeto de data)
-            historico_limpo = []
-            for msg in historico_bruto:
-                historico_limpo.append({
-                    "role": msg["role"],
-                    "content": msg["content"]
-                })
-            
-            limite = limite or 12
-            return historico_limpo[-limite:]
-        return []
-    except Exception as e:
-        print(f"Erro ao ler histórico: {e}")
+        mensagens = doc.to_dict().get("mensagens", []) if doc.exists else []
+        return historico_para_contexto(fila_historico.mesclar(wa_id, mensagens), limite)
+    except Exception:
+        log.error("erro ao ler o histórico", exc_info=True)
         return []
 
+def historico_para_contexto(historico_bruto, limite=None):
+    # Limpeza: remove campos que a OpenAI não entende (como o objeto de data)
+    historico_limpo = []
+    for msg in historico_bruto:
+        historico_limpo.append({
+            "role": msg["role"],
+            "content": msg["content"]
+        })
+
+    limite = limite or 12
+    return historico_limpo[-limite:]
+
 def salvar_historico_firestore(wa_id, role, content, limite=None):
-    """Salva a mensagem e mantém apenas as últimas 15 para economizar espaço"""
+    """Salva a mensagem e mantém apenas as últimas 15 para economizar espaço.
+    Não grava na hora: entra na fila do histórico (fila_historico.py), que
+    grava em segundo plano — quem lê logo depois já vê a mensagem."""
+    salvar_mensagens_historico(wa_id, [(role, content)], limite)
+
+def salvar_mensagens_historico(wa_id, mensagens, limite=None):
+    """Várias mensagens [(role, content), ...] de uma vez (pergunta e
+    resposta do turno), numa gravação só."""
     try:
-        doc_ref = db.collection("historico_conversas").document(wa_id)
-        
-        # 1. Cria o objeto da nova mensagem
-        nova_msg = {
-            "role": role, 
-            "content": content, 
-            "timestamp": datetime.now(timezone.utc)
-        }
-        
-        doc = doc_ref.get()
-        if doc.exists:
-            historico_atual = doc.to_dict().get("mensagens", [])
-            historico_atual.append(nova_msg)
-            
-            # 2. LOGICA DE CORTE: Mantém apenas as últimas 15 mensagens
-            # Isso garante que o documento nunca cresça demais
-            limite = limite or 15
-            historico_reduzido = historico_atual[-limite:]
-            
-            doc_ref.update({
-                "mensagens": historico_reduzido,
-                "ultima_interacao": datetime.now(timezone.utc) # Útil para limpeza automática
-            })
-        else:
-            doc_ref.set({
-                "mensagens": [nova_msg],
-                "ultima_interacao": datetime.now(timezone.utc)
-            })
-    except Exception as e:
-        print(f"Erro ao salvar histórico: {e}")
+        fila_historico.enfileirar(wa_id, mensagens, limite)
+    except Exception:
+        log.error("erro ao salvar o histórico", exc_info=True)
 
 def _normalizar_termo(s):
     """Chave de comparação exata pra aprendizado (bairro/item): minúsculo,
@@ -647,57 +839,68 @@ def marcar_atencao(wa_id, motivo, tipo=None, dados=None):
     ambíguo, item do pedido não reconhecido, etc. — e precisa de um humano
     olhando. 'tipo'/'dados' alimentam a caixa de resposta rápida do painel
     (ex.: tipo='bairro', dados={'bairro_cliente': 'Passos'})."""
+    agora = datetime.now(timezone.utc)
     try:
-        db.collection("historico_conversas").document(wa_id).set({
+        caixa_entrada.atualizar_conversa(db, wa_id, {
             "precisa_atencao": True,
             "motivo_atencao": motivo,
             "tipo_atencao": tipo,
             "atencao_dados": dados or {},
-            "atencao_marcada_em": datetime.now(timezone.utc)
-        }, merge=True)
+            "atencao_marcada_em": agora,
+            "atencao_escalada_em": None
+        })
+        varredor.registrar_atencao(wa_id, motivo, agora)
+    except Exception:
+        log.error("erro ao marcar atenção", exc_info=True)
+
+def ler_dados_conversa(wa_id):
+    """O documento da conversa em historico_conversas ({} se não existe ou
+    se a leitura falhar)."""
+    try:
+        doc = db.collection("historico_conversas").document(wa_id).get()
+        return (doc.to_dict() or {}) if doc.exists else {}
     except Exception as e:
-        print(f"Erro ao marcar atenção: {e}")
+        log.warning("erro ao ler a conversa", extra={"erro": str(e)})
+    return {}
 
 def texto_atencao_pendente_antiga(wa_id, minutos_limite=10):
     """Se essa conversa tem uma dúvida marcada pra equipe há mais tempo que
     o limite e ninguém respondeu ainda, devolve um aviso pro prompt — sem
     isso o bot ficaria prometendo "vou confirmar com a equipe" de novo a
-    cada mensagem, numa espera que nunca chega no fim. Não há timer/cron
-    rodando o tempo todo; a checagem acontece na próxima mensagem que o
-    cliente mandar (verificado aqui, no início de cada resposta)."""
-    try:
-        doc = db.collection("historico_conversas").document(wa_id).get()
-        if not doc.exists:
-            return ""
-        dados = doc.to_dict()
-        if not dados.get("precisa_atencao"):
-            return ""
-        marcado_em = dados.get("atencao_marcada_em")
-        if not marcado_em:
-            return ""
-        agora = datetime.now(timezone.utc)
-        if agora - marcado_em > timedelta(minutes=minutos_limite):
-            return (
-                f'AVISO: você marcou uma dúvida pra equipe há mais de {minutos_limite} '
-                f'minutos ("{dados.get("motivo_atencao", "")}") e ninguém respondeu ainda. '
-                f'NÃO prometa verificar com a equipe de novo sobre isso — resolva com o '
-                f'cliente agora mesmo (ofereça retirada como alternativa, ou siga sem esse '
-                f'dado se ele preferir esperar por conta própria).'
-            )
-    except Exception as e:
-        print(f"Erro ao checar atenção pendente: {e}")
+    cada mensagem, numa espera que nunca chega no fim. Consulta o índice em
+    memória do varredor (varredor.py), sem ler o Firestore no turno; é o
+    varredor que avisa a equipe e limpa as marcações velhas."""
+    pendente = varredor.atencao_pendente(wa_id)
+    if not pendente:
+        return ""
+    marcado_em, motivo = pendente
+    if datetime.now(timezone.utc) - marcado_em > timedelta(minutes=minutos_limite):
+        return (
+            f'AVISO: você marcou uma dúvida pra equipe há mais de {minutos_limite} '
+            f'minutos ("{motivo}") e ninguém respondeu ainda. '
+            f'NÃO prometa verificar com a equipe de novo sobre isso — resolva com o '
+            f'cliente agora mesmo (ofereça retirada como alternativa, ou siga sem esse '
+            f'dado se ele preferir esperar por conta própria).'
+        )
     return ""
 
+def minutos_atencao(bot_cfg):
+    try:
+        return float(bot_cfg.get("atencao_escalar_min") or BOT_CONFIG_DEFAULTS["atencao_escalar_min"])
+    except (TypeError, ValueError):
+        return BOT_CONFIG_DEFAULTS["atencao_escalar_min"]
+
 def consultar_sabor(sabor_cliente):
     if db is None: return {"status": "erro"}
     
     try:
         # 1. Buscamos TODOS os itens disponíveis do cardápio uma única vez
-        cardapio_ref = db.collection('cardapio').where('disponivel', '==', True).get()
+        cardapio = instantaneo.documentos('cardapio').values()
 
         # Criamos um dicionário para mapear o 'nome' (ou nome_exibicao) aos dados do item
         # Usamos o campo 'nome' do banco para a comparação
-        itens_banco = {doc.to_dict().get('nome'): doc.to_dict() for doc in cardapio_ref if _disponivel_online(doc.to_dict())}
+        itens_banco = {item.get('nome'): item for item in cardapio
+                       if item.get('disponivel') is True and _disponivel_online(item)}
         nomes_no_banco = list(itens_banco.keys())
 
         if not nomes_no_banco:
@@ -714,7 +917,7 @@ def consultar_sabor(sabor_cliente):
         melhor_match_norm, pontuacao = process.extractOne(_normalizar_termo(termo_usuario), nomes_normalizados)
         melhor_match = nomes_no_banco[nomes_normalizados.index(melhor_match_norm)]
 
-        print(f"DEBUG: Sofia comparou '{termo_usuario}' com '{melhor_match}'. Pontuação: {pontuacao}")
+        log_busca.debug("sabor", extra={"termo": termo_usuario, "melhor": melhor_match, "pontuacao": pontuacao})
 
         # Se a semelhança for maior que 65%, consideramos que encontrou
         if pontuacao > 65:
@@ -727,10 +930,10 @@ def consultar_sabor(sabor_cliente):
                 "pontos": item.get('pontos_fidelidade', 0),
                 "ingredientes": item.get('ingredientes')
             }
-    except Exception as e:
-        print(f"ERRO AO CONSULTAR FIRESTORE: {e}")
+    except Exception:
+        log.error("erro ao consultar o sabor", exc_info=True)
         
-    print(f"DEBUG: Nenhuma pizza parecida com '{sabor_cliente}' foi encontrada.")
+    log_busca.debug("sabor sem parecido", extra={"termo": sabor_cliente})
     return {"status": "indisponivel"}
 
 def verificar_bairro_entrega(bairro_cliente):
@@ -746,9 +949,8 @@ def verificar_bairro_entrega(bairro_cliente):
         return {"status": "nao_encontrado"}
 
     try:
-        aprendido = db.collection("bairros_aprendizado").document(_normalizar_termo(termo)).get()
-        if aprendido.exists:
-            dados_aprendido = aprendido.to_dict()
+        dados_aprendido = instantaneo.documento("bairros_aprendizado", _normalizar_termo(termo))
+        if dados_aprendido:
             bot_cfg_taxa = obter_config_bot().get("taxa_entrega") or 0
             if dados_aprendido.get("atende"):
                 return {
@@ -758,7 +960,7 @@ def verificar_bairro_entrega(bairro_cliente):
                 }
             return {"status": "nao_atende_confirmado", "bairro": dados_aprendido.get("bairro_original") or termo}
     except Exception as e:
-        print(f"Erro ao checar bairro aprendido: {e}")
+        log.warning("erro ao checar bairro aprendido", extra={"erro": str(e)})
 
     bot_cfg = obter_config_bot()
     bairros = [str(b).strip() for b in (bot_cfg.get("bairros_entrega") or []) if str(b).strip()]
@@ -775,7 +977,7 @@ def verificar_bairro_entrega(bairro_cliente):
     # sobe pra 90 e o falso positivo cai pra 86, com folga de verdade.
     bairros_normalizados = [_normalizar_termo(b) for b in bairros]
     melhor_match, pontuacao = process.extractOne(_normalizar_termo(termo), bairros_normalizados)
-    print(f"DEBUG: bairro '{termo}' comparado com '{melhor_match}'. Pontuação: {pontuacao}")
+    log_busca.debug("bairro", extra={"termo": termo, "melhor": melhor_match, "pontuacao": pontuacao})
 
     if pontuacao > 75:
         return {
@@ -786,221 +988,253 @@ def verificar_bairro_entrega(bairro_cliente):
 
     return {"status": "nao_encontrado"}
 
-NOMES_DIAS_SEMANA = {"seg": "Segunda", "ter": "Terça", "qua": "Quarta", "qui": "Quinta", "sex": "Sexta", "sab": "Sábado", "dom": "Domingo"}
-ORDEM_DIAS_SEMANA = ["seg", "ter", "qua", "qui", "sex", "sab", "dom"]
-
 def verificar_horario_funcionamento(bot_cfg):
     """Confere se agora (fuso BR) está dentro do horário de funcionamento
     configurado em configuracoes/bot -> horario_funcionamento. Se a chave
     'ativo' estiver desligada, não há restrição (funciona o tempo todo).
-    Retorna (aberto: bool, texto_horario: str com os dias/horários configurados)."""
-    horario_cfg = bot_cfg.get("horario_funcionamento") or {}
-    dias = horario_cfg.get("dias") or {}
-    texto_horario = "; ".join(
-        f"{NOMES_DIAS_SEMANA[chave]} {dias[chave]['abre']}-{dias[chave]['fecha']}"
-        for chave in ORDEM_DIAS_SEMANA
-        if dias.get(chave, {}).get("aberto") and dias[chave].get("abre") and dias[chave].get("fecha")
-    ) or "horário a confirmar"
-
-    if not horario_cfg.get("ativo"):
-        return True, texto_horario
-
-    fuso_br = timezone(timedelta(hours=-3))
-    agora = datetime.now(fuso_br)
-    dia_cfg = dias.get(ORDEM_DIAS_SEMANA[agora.weekday()]) or {}
-
-    if not dia_cfg.get("aberto"):
-        return False, texto_horario
-
-    abre, fecha = dia_cfg.get("abre"), dia_cfg.get("fecha")
-    if not abre or not fecha:
-        return True, texto_horario
-
-    try:
-        h1, m1 = (int(x) for x in abre.split(":"))
-        h2, m2 = (int(x) for x in fecha.split(":"))
-    except Exception:
-        return True, texto_horario
-
-    minutos_agora = agora.hour * 60 + agora.minute
-    minutos_abre, minutos_fecha = h1 * 60 + m1, h2 * 60 + m2
-    if minutos_fecha <= minutos_abre:
-        # Fecha depois da meia-noite (ex.: 18:00 às 00:30).
-        dentro = minutos_agora >= minutos_abre or minutos_agora < minutos_fecha
-    else:
-        dentro = minutos_abre <= minutos_agora < minutos_fecha
-    return dentro, texto_horario
-
-def is_modo_manual(wa_id):
-    """Conversa assumida manualmente por um atendente no painel: bot não responde."""
-    try:
-        doc = db.collection("historico_conversas").document(wa_id).get()
-        return doc.exists and doc.to_dict().get("modo_manual") is True
-    except Exception as e:
-        print(f"Erro ao checar modo manual: {e}")
-        return False
-
-# --- LÓGICA AGENTE OPENAI ---
-def get_openai_response(prompt: str, wa_id: str, origem: str = "WPP"):
-    import re
-    import json
-
-    # 1. Limpeza do ID
-    id_usuario = str(wa_id).split('@')[0]
-    id_usuario = re.sub(r'\D', '', id_usuario)
-
-    bot_cfg = obter_config_bot()
-
-    # Conversa assumida manualmente pelo atendente: só registra a mensagem
-    # do cliente no histórico (pro painel exibir) e não responde.
-    if is_modo_manual(id_usuario):
-        salvar_historico_firestore(id_usuario, "user", prompt, bot_cfg.get("max_historico_salvar"))
+    Retorna (aberto: bool, texto_horario: str com os dias/horários configurados).
+    A conta mora em horario.py (compilada e em cache até a próxima virada);
+    horario.consultar devolve também a próxima abertura."""
+    estado = horario.consultar(bot_cfg)
+    return estado.aberto, estado.texto
+
+def resposta_rapida(prompt, bot_cfg, texto_horario):
+    """Resposta pronta, sem IA, pra mensagem que é só uma pergunta de
+    horário, bairro, cardápio ou PIX (classificador em respostas_rapidas.py).
+    None = segue pro fluxo normal com a IA — inclusive quando a pergunta foi
+    reconhecida mas falta o dado (bairro não encontrado, horário não
+    cadastrado): aí a IA faz o que já fazia (marca atenção, pergunta de novo)."""
+    if bot_cfg.get("respostas_rapidas") is False:
         return None
+    with medir_etapa("resposta_rapida"):
+        intencao, argumento, confiante = respostas_rapidas.classificar(prompt)
+        if intencao is None:
+            metricas.RESPOSTAS_RAPIDAS.labels(intencao="nenhuma", resultado="ia").inc()
+            return None
+        if not confiante:
+            metricas.RESPOSTAS_RAPIDAS.labels(intencao=intencao, resultado="ambigua").inc()
+            return None
 
-    if not bot_cfg.get("ativo", True):
-        return bot_cfg.get("mensagem_inativo") or BOT_CONFIG_DEFAULTS["mensagem_inativo"]
-
-    aberto, texto_horario = verificar_horario_funcionamento(bot_cfg)
-    if not aberto:
-        horario_cfg = bot_cfg.get("horario_funcionamento") or {}
-        msg_fechado = horario_cfg.get("mensagem_fechado") or "No momento estamos fechados. Nosso horário de funcionamento: {horario}"
-        return msg_fechado.replace("{horario}", texto_horario)
-
-    aviso_atencao_antiga = texto_atencao_pendente_antiga(id_usuario)
-
-    # Primeiro contato deste cliente (sem histórico ainda): manda a saudação
-    # configurada em vez de chamar a IA. Se ele já tiver perguntado algo
-    # junto com o "oi", essa pergunta fica salva no histórico e é respondida
-    # normalmente na mensagem seguinte dele.
-    if not obter_historico_firestore(id_usuario, limite=1):
-        saudacao = bot_cfg.get("mensagem_inicial") or BOT_CONFIG_DEFAULTS["mensagem_inicial"]
-        salvar_historico_firestore(id_usuario, "user", prompt, bot_cfg.get("max_historico_salvar"))
-        salvar_historico_firestore(id_usuario, "assistant", saudacao, bot_cfg.get("max_historico_salvar"))
-        return saudacao
-
-    nome_cliente = None
-    
-    # 2. Busca no Firestore
-    try:
-        usuarios_ref = db.collection("usuarios_app")
-        query = usuarios_ref.where("telefone", "==", id_usuario).limit(1).stream()
-        for doc in query:
-            dados = doc.to_dict()
-            nome_cliente = dados.get('nome')
-    except Exception as e:
-        print(f"❌ Erro na busca: {e}")
+        texto = None
+        try:
+            if intencao == "horario":
+                if texto_horario != horario.SEM_HORARIO:
+                    texto = respostas_rapidas.montar_texto(bot_cfg, "horario", horario=texto_horario)
+            elif intencao == "pix":
+                # Sem chave da loja o bot_cfg traz o exemplo do BOT_CONFIG_DEFAULTS:
+                # não é uma chave de verdade, então a IA (e a equipe) resolvem.
+                if bot_cfg.get("chave_pix") and bot_cfg["chave_pix"] != BOT_CONFIG_DEFAULTS["chave_pix"]:
+                    texto = respostas_rapidas.montar_texto(bot_cfg, "pix", chave_pix=bot_cfg["chave_pix"])
+            elif intencao == "cardapio":
+                categorias = cardapio_por_categoria()
+                if categorias:
+                    cardapio = "\n\n".join(
+                        f"*{cat}*\n" + "\n".join(f"- {nome}: R$ {preco:.2f}" for nome, preco in itens)
+                        for cat, itens in categorias.items()
+                    )
+                    texto = respostas_rapidas.montar_texto(bot_cfg, "cardapio", cardapio=cardapio)
+            elif intencao == "bairro":
+                resultado = verificar_bairro_entrega(argumento)
+                if resultado["status"] == "atende":
+                    taxa = float(resultado.get("taxa_entrega") or 0)
+                    chave = "bairro_atende" if taxa > 0 else "bairro_atende_sem_taxa"
+                    texto = respostas_rapidas.montar_texto(bot_cfg, chave, bairro=resultado["bairro"], taxa=f"{taxa:.2f}")
+                elif resultado["status"] == "nao_atende_confirmado":
+                    texto = respostas_rapidas.montar_texto(bot_cfg, "bairro_nao_atende", bairro=resultado["bairro"])
+        except Exception as e:
+            log.warning("erro na resposta rápida", extra={"intencao": intencao, "erro": str(e)})
+            metricas.ERROS.labels(tipo="resposta_rapida").inc()
+            texto = None
+
+        metricas.RESPOSTAS_RAPIDAS.labels(intencao=intencao, resultado="respondida" if texto else "sem_dado").inc()
+        return texto
+
+def executar_ferramenta(function_name, args, wa_id, id_usuario):
+    """Executa a ferramenta que a IA pediu e devolve o texto que volta pra
+    ela como resposta da chamada ('content' da mensagem role=tool)."""
+    content = ""
+    if function_name == "calcular_pedido":
+        content = calcular_pedido(id_usuario, args.get("itens"), args.get("tipo_entrega"))
+    elif function_name == "consultar_sabor":
+        content = json.dumps(consultar_sabor(args.get("sabor_cliente")))
+    elif function_name == "listar_cardapio":
+        content = listar_cardapio()
+    elif function_name == "listar_bebidas":
+        content = listar_bebidas()
+    elif function_name == "verificar_bairro_entrega":
+        content = json.dumps(verificar_bairro_entrega(args.get("bairro_cliente")))
+    elif function_name == "consultar_meu_pedido":
+        content = consultar_meu_pedido(wa_id)
+    elif function_name == "registrar_pedido":
+        content = registrar_pedido(
+            wa_id=wa_id,
+            nome_cliente=args.get("nome_cliente"),
+            itens=args.get("itens"),
+            valor_total=args.get("valor_total"),
+            observacao=args.get("observacao", "Nenhuma"),
+            endereco_completo=args.get("endereco_completo"),
+            bairro=args.get("bairro"),
+            forma_pagamento=args.get("forma_pagamento"),
+            tipo_entrega=args.get("tipo_entrega"),
+            telefone=wa_id,
+            id_usuario_cache=id_usuario
+        )
 
-    # 3. Definição do Contexto (Separado das Instruções)
-    if nome_cliente:
-        contexto_identificacao = f"CLIENTE IDENTIFICADO: Sim. Nome: {nome_cliente}."
-        instrucao_nome = f"Chame o cliente só pelo primeiro nome, '{primeiro_nome(nome_cliente)}' (nunca o nome completo, soa mais natural). NÃO pergunte o nome dele novamente."
-    else:
-        contexto_identificacao = "CLIENTE NOVO: Nome desconhecido."
-        instrucao_nome = "Descubra o nome do cliente antes de finalizar o pedido."
+    # Sinaliza no painel de Atendimento quando o bot bate numa
+    # situação que não consegue resolver sozinho — dá pra ver
+    # o texto exato que o cliente digitou em 'args', então usa
+    # ele na mensagem em vez do que a função devolveu. 'tipo' e
+    # 'dados' alimentam a caixa de resposta rápida do painel.
+    if function_name == "verificar_bairro_entrega":
+        try:
+            resultado_bairro = json.loads(content)
+            if resultado_bairro.get("status") in ("nao_encontrado", "sem_lista_cadastrada"):
+                bairro_cliente = args.get("bairro_cliente")
+                marcar_atencao(
+                    id_usuario,
+                    f"Bairro não reconhecido: \"{bairro_cliente}\"",
+                    tipo="bairro",
+                    dados={"bairro_cliente": bairro_cliente}
+                )
+        except (ValueError, TypeError):
+            pass
+    elif function_name in ("registrar_pedido", "calcular_pedido"):
+        try:
+            resultado_pedido = json.loads(content)
+            nao_reconhecidos = resultado_pedido.get("itens_nao_reconhecidos") or []
+            if nao_reconhecidos:
+                marcar_atencao(
+                    id_usuario,
+                    f"Item(ns) não reconhecido(s) no pedido: {', '.join(nao_reconhecidos)}",
+                    tipo="item",
+                    dados={"nome_produto": nao_reconhecidos[0], "todos": nao_reconhecidos}
+                )
+        except (ValueError, TypeError):
+            pass
+    return content
 
-    # 4. Ferramentas (Tools) - Mantive igual
-    tools = [
-        {
-            "type": "function",
-            "function": {
-                "name": "calcular_pedido",
-                "description": "Calcula uma PRÉVIA do pedido (itens reconhecidos, taxa de entrega, total) SEM registrar nada. Use pra mostrar o resumo e pedir confirmação do cliente antes de chamar 'registrar_pedido' de vez.",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "itens": {
-                            "type": "array",
-                            "description": "Um item por entrada — nunca junte vários itens numa frase só.",
-                            "items": {
-                                "type": "object",
-                                "properties": {
-                                    "nome_produto": {"type": "string", "description": "Nome do item exatamente como veio de 'consultar_sabor' ou 'listar_cardapio'."},
-                                    "quantidade": {"type": "integer"}
-                                },
-                                "required": ["nome_produto", "quantidade"]
-                            }
-                        },
-                        "tipo_entrega": {
-                            "type": "string",
-                            "enum": ["ENTREGA", "RETIRADA"],
-                            "description": "OBRIGATÓRIO e explícito — nunca deduza pelo texto do endereço. Se ainda não sabe se é entrega ou retirada, não chame esta função ainda."
+# --- LÓGICA AGENTE OPENAI ---
+# Versão do texto fixo do prompt de sistema (abaixo). Troque quando mudar as
+# regras — o consumo de tokens é separado por versão em uso_ia_diario, pra
+# comparar a versão nova com a anterior no tráfego real.
+PROMPT_VERSAO = "2026-10a"
+
+# Ferramentas (tools) que a IA pode chamar — as mesmas no modo síncrono
+# (get_openai_response) e no assíncrono (app_async.py).
+FERRAMENTAS_OPENAI = [
+    {
+        "type": "function",
+        "function": {
+            "name": "calcular_pedido",
+            "description": "Calcula uma PRÉVIA do pedido (itens reconhecidos, taxa de entrega, total) SEM registrar nada. Use pra mostrar o resumo e pedir confirmação do cliente antes de chamar 'registrar_pedido' de vez.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "itens": {
+                        "type": "array",
+                        "description": "Um item por entrada — nunca junte vários itens numa frase só.",
+                        "items": {
+                            "type": "object",
+                            "properties": {
+                                "nome_produto": {"type": "string", "description": "Nome do item exatamente como veio de 'consultar_sabor' ou 'listar_cardapio'."},
+                                "quantidade": {"type": "integer"}
+                            },
+                            "required": ["nome_produto", "quantidade"]
                         }
                     },
-                    "required": ["itens", "tipo_entrega"]
-                }
+                    "tipo_entrega": {
+                        "type": "string",
+                        "enum": ["ENTREGA", "RETIRADA"],
+                        "description": "OBRIGATÓRIO e explícito — nunca deduza pelo texto do endereço. Se ainda não sabe se é entrega ou retirada, não chame esta função ainda."
+                    }
+                },
+                "required": ["itens", "tipo_entrega"]
             }
-        },
-        {
-            "type": "function",
-            "function": {
-                "name": "registrar_pedido",
-                "description": "Registra o pedido final após coletar todos os dados. O valor total (incluindo taxa de entrega) é calculado pelo sistema, não pela IA.",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "nome_cliente": {"type": "string"},
-                        "itens": {
-                            "type": "array",
-                            "description": "Um item por entrada — nunca junte vários itens numa frase só.",
-                            "items": {
-                                "type": "object",
-                                "properties": {
-                                    "nome_produto": {"type": "string", "description": "Nome do item exatamente como veio de 'consultar_sabor' ou 'listar_cardapio'."},
-                                    "quantidade": {"type": "integer"}
-                                },
-                                "required": ["nome_produto", "quantidade"]
-                            }
-                        },
-                        "valor_total": {"type": "number", "description": "Sua estimativa do total (só os itens, sem taxa) — o sistema recalcula e pode corrigir."},
-                        "telefone": {"type": "string"},
-                        "tipo_entrega": {
-                            "type": "string",
-                            "enum": ["ENTREGA", "RETIRADA"],
-                            "description": "OBRIGATÓRIO e explícito — nunca deduza pelo texto do endereço, mesmo que pareça óbvio."
-                        },
-                        "endereco_completo": {"type": "string", "description": "Se for ENTREGA: rua e número de verdade (não só o bairro). Se for RETIRADA, pode deixar vazio ou escrever 'Retirada no balcão'."},
-                        "bairro": {"type": "string", "description": "Se for ENTREGA: o nome do bairro exatamente como 'verificar_bairro_entrega' confirmou (campo \"bairro\" do retorno) — fica separado do endereço pro painel/impressão mostrarem sozinho. Deixe vazio se for RETIRADA."},
-                        "forma_pagamento": {"type": "string"},
-                        "observacao": {"type": "string"}
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "registrar_pedido",
+            "description": "Registra o pedido final após coletar todos os dados. O valor total (incluindo taxa de entrega) é calculado pelo sistema, não pela IA.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "nome_cliente": {"type": "string"},
+                    "itens": {
+                        "type": "array",
+                        "description": "Um item por entrada — nunca junte vários itens numa frase só.",
+                        "items": {
+                            "type": "object",
+                            "properties": {
+                                "nome_produto": {"type": "string", "description": "Nome do item exatamente como veio de 'consultar_sabor' ou 'listar_cardapio'."},
+                                "quantidade": {"type": "integer"}
+                            },
+                            "required": ["nome_produto", "quantidade"]
+                        }
                     },
-                    "required": ["nome_cliente", "itens", "valor_total", "tipo_entrega", "endereco_completo", "forma_pagamento"]
-                }
-            }
-        },
-        {"type": "function", "function": {"name": "listar_cardapio", "description": "Lista todos os itens de comida do cardápio (sem bebidas), organizados por categoria, com preços."}},
-        {"type": "function", "function": {"name": "listar_bebidas", "description": "Lista só as bebidas disponíveis, com preços."}},
-        {
-            "type": "function",
-            "function": {
-                "name": "consultar_sabor",
-                "description": "Consulta disponibilidade, preço e ingredientes de um item específico do cardápio pelo nome.",
-                "parameters": {
-                    "type": "object",
-                    "properties": {"sabor_cliente": {"type": "string"}},
-                    "required": ["sabor_cliente"]
-                }
+                    "valor_total": {"type": "number", "description": "Sua estimativa do total (só os itens, sem taxa) — o sistema recalcula e pode corrigir."},
+                    "telefone": {"type": "string"},
+                    "tipo_entrega": {
+                        "type": "string",
+                        "enum": ["ENTREGA", "RETIRADA"],
+                        "description": "OBRIGATÓRIO e explícito — nunca deduza pelo texto do endereço, mesmo que pareça óbvio."
+                    },
+                    "endereco_completo": {"type": "string", "description": "Se for ENTREGA: rua e número de verdade (não só o bairro). Se for RETIRADA, pode deixar vazio ou escrever 'Retirada no balcão'."},
+                    "bairro": {"type": "string", "description": "Se for ENTREGA: o nome do bairro exatamente como 'verificar_bairro_entrega' confirmou (campo \"bairro\" do retorno) — fica separado do endereço pro painel/impressão mostrarem sozinho. Deixe vazio se for RETIRADA."},
+                    "forma_pagamento": {"type": "string"},
+                    "observacao": {"type": "string"}
+                },
+                "required": ["nome_cliente", "itens", "valor_total", "tipo_entrega", "endereco_completo", "forma_pagamento"]
             }
-        },
-        {
-            "type": "function",
-            "function": {
-                "name": "verificar_bairro_entrega",
-                "description": "Verifica se a loja entrega em um bairro/região que o cliente mencionou.",
-                "parameters": {
-                    "type": "object",
-                    "properties": {"bairro_cliente": {"type": "string"}},
-                    "required": ["bairro_cliente"]
-                }
+        }
+    },
+    {"type": "function", "function": {"name": "listar_cardapio", "description": "Lista todos os itens de comida do cardápio (sem bebidas), organizados por categoria, com preços."}},
+    {"type": "function", "function": {"name": "listar_bebidas", "description": "Lista só as bebidas disponíveis, com preços."}},
+    {
+        "type": "function",
+        "function": {
+            "name": "consultar_sabor",
+            "description": "Consulta disponibilidade, preço e ingredientes de um item específico do cardápio pelo nome.",
+            "parameters": {
+                "type": "object",
+                "properties": {"sabor_cliente": {"type": "string"}},
+                "required": ["sabor_cliente"]
             }
-        },
-        {
-            "type": "function",
-            "function": {
-                "name": "consultar_meu_pedido",
-                "description": "Busca o pedido mais recente que este cliente já fez (itens, valor total, forma de pagamento, status). Use quando ele perguntar sobre um pedido já realizado — NUNCA use 'registrar_pedido' pra responder esse tipo de pergunta."
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "verificar_bairro_entrega",
+            "description": "Verifica se a loja entrega em um bairro/região que o cliente mencionou.",
+            "parameters": {
+                "type": "object",
+                "properties": {"bairro_cliente": {"type": "string"}},
+                "required": ["bairro_cliente"]
             }
         }
-    ]
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "consultar_meu_pedido",
+            "description": "Busca o pedido mais recente que este cliente já fez (itens, valor total, forma de pagamento, status). Use quando ele perguntar sobre um pedido já realizado — NUNCA use 'registrar_pedido' pra responder esse tipo de pergunta."
+        }
+    }
+]
+
+def montar_system_prompt(bot_cfg, id_usuario, nome_cliente=None, aviso_atencao_antiga=""):
+    """Monta o prompt de sistema do turno a partir da configuração do bot e
+    do que já se sabe do cliente. Separado do get_openai_response pra poder
+    ser medido sozinho (bench/bench_funcoes.py) — roda em toda mensagem."""
+    # 3. Definição do Contexto (Separado das Instruções)
+    if nome_cliente:
+        contexto_identificacao = f"CLIENTE IDENTIFICADO: Sim. Nome: {nome_cliente}."
+        instrucao_nome = f"Chame o cliente só pelo primeiro nome, '{primeiro_nome(nome_cliente)}' (nunca o nome completo, soa mais natural). NÃO pergunte o nome dele novamente."
+    else:
+        contexto_identificacao = "CLIENTE NOVO: Nome desconhecido."
+        instrucao_nome = "Descubra o nome do cliente antes de finalizar o pedido."
 
     nome_atendente = bot_cfg.get("nome_atendente") or BOT_CONFIG_DEFAULTS["nome_atendente"]
     nome_empresa = bot_cfg.get("nome_empresa") or BOT_CONFIG_DEFAULTS["nome_empresa"]
@@ -1251,6 +1485,10 @@ def get_openai_response(prompt: str, wa_id: str, origem: str = "WPP"):
          adicional, deixe isso explícito pro cliente (ex.: "Registrei como
          um novo pedido, esse aqui fica R$ {{valor}}") em vez de dar a
          entender que é o mesmo total de antes.
+       - Se 'registrar_pedido' devolver "pedido_ja_registrado": true, esse
+         MESMO pedido (mesmos itens, mesma entrega) já tinha sido registrado
+         há pouco — nada novo foi criado. Diga ao cliente que o pedido dele
+         já está registrado (não fale em "novo pedido").
        - Se a função devolver "itens_nao_reconhecidos" com algo dentro,
          avise o cliente que esses itens específicos não foram reconhecidos
          e pergunte de novo sobre eles (pode ser um apelido diferente do
@@ -1264,7 +1502,8 @@ def get_openai_response(prompt: str, wa_id: str, origem: str = "WPP"):
          finja que foi incluído no pedido.
        - Se a função devolver status "erro" com motivo "Loja fechada no
          momento.", avise o cliente educadamente que a loja está fechada
-         agora e informe o "horario_funcionamento" devolvido — não insista
+         agora e informe o "horario_funcionamento" devolvido (e, se vier
+         "proxima_abertura", quando a loja abre de novo) — não insista
          em registrar o pedido.
 
     5. COMPORTAMENTO:
@@ -1280,129 +1519,367 @@ def get_openai_response(prompt: str, wa_id: str, origem: str = "WPP"):
     6. INSTRUCOES EXTRAS DA LOJA:
        {instrucoes_extras}
     """
+    return system_prompt
+
+
+def limite_cliente(chave, bot_cfg):
+    """Limite de mensagens por cliente (admissao.py), antes de qualquer
+    coisa do turno. None = segue; senão o texto pra responder no lugar —
+    "" quando o aviso já foi dado e a mensagem é só descartada."""
+    permitida, avisar = admissao.permitir(chave, bot_cfg)
+    if permitida:
+        return None
+    if not avisar:
+        return ""
+    return bot_cfg.get("mensagem_limite_cliente") or BOT_CONFIG_DEFAULTS["mensagem_limite_cliente"]
+
+def get_openai_response(prompt: str, wa_id: str, origem: str = "WPP"):
+    import re
+    import json
+
+    # 1. Limpeza do ID
+    id_usuario = str(wa_id).split('@')[0]
+    id_usuario = re.sub(r'\D', '', id_usuario)
+
+    with medir_etapa("config"):
+        bot_cfg = obter_config_bot()
+    prazo.ajustar(bot_cfg.get("prazo_turno_s"))
+
+    # Uma leitura só da conversa: modo manual e o carrinho aberto
+    # (ultimo_calculo), que o roteador usa pra escolher o modelo. A atenção
+    # pendente vem do índice em memória do varredor.
+    dados_conversa = ler_dados_conversa(id_usuario)
+
+    # Conversa assumida manualmente pelo atendente: só registra a mensagem
+    # do cliente no histórico (pro painel exibir) e não responde.
+    if dados_conversa.get("modo_manual") is True:
+        salvar_historico_firestore(id_usuario, "user", prompt, bot_cfg.get("max_historico_salvar"))
+        return None
+
+    if not bot_cfg.get("ativo", True):
+        metricas.FALLBACKS.labels(motivo="bot_inativo").inc()
+        return bot_cfg.get("mensagem_inativo") or BOT_CONFIG_DEFAULTS["mensagem_inativo"]
+
+    estado_horario = horario.consultar(bot_cfg)
+    texto_horario = estado_horario.texto
+    if not estado_horario.aberto:
+        return horario.mensagem_fechado(bot_cfg, estado_horario)
+
+    aviso_atencao = texto_atencao_pendente_antiga(id_usuario, minutos_atencao(bot_cfg))
+    tem_carrinho = bool(dados_conversa.get("ultimo_calculo"))
+
+    # Primeiro contato deste cliente (sem histórico ainda): manda a saudação
+    # configurada em vez de chamar a IA. Se ele já tiver perguntado algo
+    # junto com o "oi", essa pergunta fica salva no histórico e é respondida
+    # normalmente na mensagem seguinte dele.
+    with medir_etapa("historico"):
+        historico_existe = bool(obter_historico_firestore(id_usuario, limite=1))
+    if not historico_existe:
+        saudacao = bot_cfg.get("mensagem_inicial") or BOT_CONFIG_DEFAULTS["mensagem_inicial"]
+        salvar_mensagens_historico(id_usuario, [("user", prompt), ("assistant", saudacao)], bot_cfg.get("max_historico_salvar"))
+        return saudacao
+
+    # Pergunta que o servidor responde sozinho (horário, bairro, cardápio,
+    # PIX): resposta pronta, sem as chamadas à OpenAI.
+    resposta = resposta_rapida(prompt, bot_cfg, texto_horario)
+    if resposta:
+        with medir_etapa("salvar_historico"):
+            salvar_mensagens_historico(wa_id, [("user", prompt), ("assistant", resposta)], bot_cfg.get("max_historico_salvar"))
+        return resposta
+
+    nome_cliente = None
+    
+    # 2. Busca no Firestore
+    try:
+        with medir_etapa("usuario"):
+            usuarios_ref = db.collection("usuarios_app")
+            query = usuarios_ref.where("telefone", "==", id_usuario).limit(1).stream()
+            for doc in query:
+                dados = doc.to_dict()
+                nome_cliente = dados.get('nome')
+    except Exception:
+        metricas.ERROS.labels(tipo="busca_usuario").inc()
+        log.error("erro na busca do usuário", exc_info=True)
+
+    instrucoes_extras = bot_cfg.get("instrucoes_extras") or ""
+
+    # 5. Prompt Otimizado (Limpo e Direto) — ver montar_system_prompt
+    system_prompt = montar_system_prompt(bot_cfg, id_usuario, nome_cliente, aviso_atencao)
 
     # 6. Carregar Histórico
-    historico_msgs = obter_historico_firestore(wa_id, bot_cfg.get("max_historico_contexto"))
+    with medir_etapa("historico"):
+        historico_msgs = obter_historico_firestore(wa_id, bot_cfg.get("max_historico_contexto"))
 
     # Montagem
     messages = [{"role": "system", "content": system_prompt}]
     messages.extend(historico_msgs)
     messages.append({"role": "user", "content": prompt})
 
+    # Só as chamadas à OpenAI disputam vaga (admissao.py); no fechamento
+    # (carrinho calculado) o turno tem vagas reservadas e espera mais.
+    mensagem_espera = bot_cfg.get("mensagem_espera")
+    with medir_etapa("admissao"):
+        vaga = admissao.vaga(bot_cfg, tem_carrinho,
+                             ao_adiar=(lambda: send_message(wa_id, mensagem_espera)) if origem == "WPP" and mensagem_espera else None)
+    if vaga is None:
+        metricas.FALLBACKS.labels(motivo="sobrecarga").inc()
+        return bot_cfg.get("mensagem_sobrecarga") or BOT_CONFIG_DEFAULTS["mensagem_sobrecarga"]
+
+    modelo, motivo = roteador_modelos.escolher(bot_cfg, "completion_1", prompt, tem_carrinho)
+    respostas_openai = []
+    chamadas_openai = []
+    segundos_openai = 0.0
     try:
-        response = openai.chat.completions.create(
-            model=bot_cfg.get("modelo") or BOT_CONFIG_DEFAULTS["modelo"],
-            messages=messages,
-            tools=tools,
-            tool_choice="auto"
-        )
+        inicio_openai = time.perf_counter()
+        with medir_etapa("completion_1"):
+            modelo, response = roteador_modelos.executar(
+                bot_cfg, "completion_1", modelo, motivo,
+                lambda modelo_chamada, timeout: cliente_openai.chat.completions.create(
+                    model=modelo_chamada,
+                    messages=messages,
+                    tools=FERRAMENTAS_OPENAI,
+                    tool_choice="auto",
+                    timeout=timeout
+                )
+            )
         
+        segundos = time.perf_counter() - inicio_openai
+        segundos_openai += segundos
+        respostas_openai.append(response)
+        chamadas_openai.append((modelo, segundos))
         response_message = response.choices[0].message
         
         if response_message.tool_calls:
             messages.append(response_message)
+            ferramentas_chamadas = []
             for tool_call in response_message.tool_calls:
                 function_name = tool_call.function.name
                 args = json.loads(tool_call.function.arguments)
+                ferramentas_chamadas.append(function_name)
+                prazo.verificar()
                 
-                content = ""
-                if function_name == "calcular_pedido":
-                    content = calcular_pedido(id_usuario, args.get("itens"), args.get("tipo_entrega"))
-                elif function_name == "consultar_sabor":
-                    content = json.dumps(consultar_sabor(args.get("sabor_cliente")))
-                elif function_name == "listar_cardapio":
-                    content = listar_cardapio()
-                elif function_name == "listar_bebidas":
-                    content = listar_bebidas()
-                elif function_name == "verificar_bairro_entrega":
-                    content = json.dumps(verificar_bairro_entrega(args.get("bairro_cliente")))
-                elif function_name == "consultar_meu_pedido":
-                    content = consultar_meu_pedido(wa_id)
-                elif function_name == "registrar_pedido":
-                    content = registrar_pedido(
-                        wa_id=wa_id,
-                        nome_cliente=args.get("nome_cliente"),
-                        itens=args.get("itens"),
-                        valor_total=args.get("valor_total"),
-                        observacao=args.get("observacao", "Nenhuma"),
-                        endereco_completo=args.get("endereco_completo"),
-                        bairro=args.get("bairro"),
-                        forma_pagamento=args.get("forma_pagamento"),
-                        tipo_entrega=args.get("tipo_entrega"),
-                        telefone=wa_id,
-                        id_usuario_cache=id_usuario
-                    )
-
-                # Sinaliza no painel de Atendimento quando o bot bate numa
-                # situação que não consegue resolver sozinho — dá pra ver
-                # o texto exato que o cliente digitou em 'args', então usa
-                # ele na mensagem em vez do que a função devolveu. 'tipo' e
-                # 'dados' alimentam a caixa de resposta rápida do painel.
-                if function_name == "verificar_bairro_entrega":
-                    try:
-                        resultado_bairro = json.loads(content)
-                        if resultado_bairro.get("status") in ("nao_encontrado", "sem_lista_cadastrada"):
-                            bairro_cliente = args.get("bairro_cliente")
-                            marcar_atencao(
-                                id_usuario,
-                                f"Bairro não reconhecido: \"{bairro_cliente}\"",
-                                tipo="bairro",
-                                dados={"bairro_cliente": bairro_cliente}
-                            )
-                    except (ValueError, TypeError):
-                        pass
-                elif function_name in ("registrar_pedido", "calcular_pedido"):
-                    try:
-                        resultado_pedido = json.loads(content)
-                        nao_reconhecidos = resultado_pedido.get("itens_nao_reconhecidos") or []
-                        if nao_reconhecidos:
-                            marcar_atencao(
-                                id_usuario,
-                                f"Item(ns) não reconhecido(s) no pedido: {', '.join(nao_reconhecidos)}",
-                                tipo="item",
-                                dados={"nome_produto": nao_reconhecidos[0], "todos": nao_reconhecidos}
-                            )
-                    except (ValueError, TypeError):
-                        pass
+                metricas.CHAMADAS_FERRAMENTA.labels(ferramenta=function_name).inc()
+                with medir_etapa(f"ferramenta:{function_name}"):
+                    content = executar_ferramenta(function_name, args, wa_id, id_usuario)
 
                 messages.append({"tool_call_id": tool_call.id, "role": "tool", "name": function_name, "content": content})
             
-            second_res = openai.chat.completions.create(model=bot_cfg.get("modelo") or BOT_CONFIG_DEFAULTS["modelo"], messages=messages)
+            modelo, motivo = roteador_modelos.escolher(bot_cfg, "completion_2", ferramentas=ferramentas_chamadas)
+            inicio_openai = time.perf_counter()
+            with medir_etapa("completion_2"):
+                modelo, second_res = roteador_modelos.executar(
+                    bot_cfg, "completion_2", modelo, motivo,
+                    lambda modelo_chamada, timeout: cliente_openai.chat.completions.create(
+                        model=modelo_chamada, messages=messages, timeout=timeout
+                    )
+                )
+            segundos = time.perf_counter() - inicio_openai
+            segundos_openai += segundos
+            respostas_openai.append(second_res)
+            chamadas_openai.append((modelo, segundos))
             final_text = second_res.choices[0].message.content
         else:
             final_text = response_message.content
 
-        salvar_historico_firestore(wa_id, "user", prompt, bot_cfg.get("max_historico_salvar"))
-        salvar_historico_firestore(wa_id, "assistant", final_text, bot_cfg.get("max_historico_salvar"))
+        with medir_etapa("salvar_historico"):
+            salvar_mensagens_historico(wa_id, [("user", prompt), ("assistant", final_text)], bot_cfg.get("max_historico_salvar"))
         return final_text
     
     except Exception as e:
-        print(f"Erro OpenAI: {e}")
+        if isinstance(e, PrazoEsgotado) or prazo.esgotado():
+            log.warning("turno passou do prazo", extra={"prazo_s": bot_cfg.get("prazo_turno_s"), "erro": repr(e)})
+            metricas.FALLBACKS.labels(motivo="prazo").inc()
+            return bot_cfg.get("mensagem_prazo") or BOT_CONFIG_DEFAULTS["mensagem_prazo"]
+        log.error("erro na OpenAI", exc_info=True)
+        metricas.ERROS.labels(tipo="openai").inc()
+        metricas.FALLBACKS.labels(motivo="mensagem_erro").inc()
         return bot_cfg.get("mensagem_erro") or BOT_CONFIG_DEFAULTS["mensagem_erro"]
+    finally:
+        vaga.liberar()
+        # Conta mesmo quando a 2ª chamada falha: os tokens da 1ª já foram cobrados.
+        registro_uso_ia.registrar_turno(
+            id_usuario, modelo, respostas_openai,
+            versao_prompt(PROMPT_VERSAO, instrucoes_extras),
+            segundos_openai, bot_cfg.get("precos_modelos"), chamadas_openai
+        )
 
 # --- FLASK ---
 app = Flask(__name__)
 CORS(app)
 
+@app.before_request
+def _iniciar_turno_log():
+    # X-Request-Id, se quem chamou mandou um (painel, balanceador).
+    g.token_turno_log = logs.iniciar_turno(request.headers.get("X-Request-Id"))
+
+@app.before_request
+def _iniciar_contagem_firestore():
+    g.contagem_firestore, g.token_contagem_firestore = iniciar_contagem()
+
+@app.before_request
+def _escolher_loja():
+    """Loja da requisição (lojas.py): 'loja' na query ou no JSON, ou o
+    cabeçalho X-Loja; sem nada, a principal. O webhook escolhe por
+    mensagem, pelo número que a recebeu."""
+    if request.endpoint in ("webhook", "home", "metrics"):
+        return None
+    pedida = request.args.get("loja") or request.headers.get("X-Loja")
+    if not pedida and request.is_json:
+        pedida = (request.get_json(silent=True) or {}).get("loja")
+    loja = lojas.da_requisicao(pedida)
+    if loja is None:
+        return jsonify({"erro": "loja_desconhecida"}), 404
+    g.token_loja = lojas.entrar(loja)
+    return None
+
+@app.teardown_request
+def _encerrar_turno_log(exc=None):
+    # O Flask roda os teardown na ordem inversa do registro: este, o
+    # primeiro, roda por último — a linha do Firestore ainda sai com o turno.
+    token = g.pop("token_turno_log", None)
+    if token is not None:
+        logs.encerrar_turno(token)
+
+@app.teardown_request
+def _sair_da_loja(exc=None):
+    token = g.pop("token_loja", None)
+    if token is not None:
+        lojas.sair(token)
+
+@app.teardown_request
+def _encerrar_contagem_firestore(exc=None):
+    token = g.pop("token_contagem_firestore", None)
+    if token is None:
+        return
+    encerrar_contagem(token)
+    rota = request.url_rule.rule if request.url_rule else "desconhecida"
+    registrar_contagem_requisicao(request.method, rota, g.pop("contagem_firestore"))
+
+def registrar_contagem_requisicao(metodo, rota, contagem):
+    """Fecha a contagem de uma requisição (Flask aqui, ASGI em app_async.py):
+    histograma por rota e a linha de log do turno."""
+    if contagem.leituras or contagem.escritas:
+        metricas.FIRESTORE_POR_REQUISICAO.labels(rota=rota, tipo="leitura").observe(contagem.leituras)
+        metricas.FIRESTORE_POR_REQUISICAO.labels(rota=rota, tipo="escrita").observe(contagem.escritas)
+        log.info("firestore da requisição", extra={
+            "metodo": metodo, "rota": rota, "leituras": contagem.leituras, "consultas": contagem.consultas,
+            "docs_consulta": contagem.docs_consulta, "escritas": contagem.escritas})
+
 VERIFY_TOKEN = os.environ.get("VERIFY_TOKEN")
-ACCESS_TOKEN = os.environ.get("ACCESS_TOKEN")
-PHONE_NUMBER_ID = os.environ.get("PHONE_NUMBER_ID")
+# Número e token da Graph API são de cada loja (lojas.py): os da principal
+# continuam em PHONE_NUMBER_ID e ACCESS_TOKEN.
+# Trocável só pra apontar pro stub local do teste de carga (carga/stubs.py).
+GRAPH_API_URL = os.environ.get("GRAPH_API_URL") or "https://graph.facebook.com/v21.0"
+# Token das rotas /admin/* (ferramentas de operação, não do painel). Sem
+# ele definido no ambiente essas rotas ficam desligadas.
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN")
+
+def _admin_autorizado():
+    cabecalho = request.headers.get("Authorization", "")
+    return bool(ADMIN_TOKEN) and hmac.compare_digest(cabecalho, f"Bearer {ADMIN_TOKEN}")
 
 @app.route('/', methods=['GET'])
 def home():
     return "Bot Fila/Agendamento Online", 200
 
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Latência por etapa e contadores do bot (formato texto do Prometheus),
+    somados entre todos os workers do gunicorn — ver metricas.py."""
+    corpo, content_type = metricas.gerar_metricas()
+    return Response(corpo, content_type=content_type)
+
+@app.route('/admin/perfil', methods=['GET', 'POST', 'DELETE'])
+def admin_perfil():
+    """Liga/desliga o profiler por amostragem em todos os workers da máquina
+    (ver perfil.py). POST {"fracao": 0.05, "minutos": 15}."""
+    if not _admin_autorizado():
+        return jsonify({"erro": "nao_autorizado"}), 403
+    if request.method == 'POST':
+        data = request.json or {}
+        try:
+            perfil.ligar(data.get("fracao", 0.05), data.get("minutos", 15))
+        except (TypeError, ValueError):
+            return jsonify({"erro": "fracao/minutos inválidos"}), 400
+    elif request.method == 'DELETE':
+        perfil.desligar()
+    return jsonify(perfil.status()), 200
+
+@app.route('/admin/caixa_entrada', methods=['POST'])
+def admin_caixa_entrada():
+    """Reconstrói o resumo de todas as conversas (caixa_entrada.py) a partir
+    de historico_conversas — pra conversas de antes do resumo existir."""
+    if not _admin_autorizado():
+        return jsonify({"erro": "nao_autorizado"}), 403
+    return jsonify({"conversas": caixa_entrada.reconstruir(db)}), 200
+
+@app.route('/admin/vendas_agregadas', methods=['GET', 'POST'])
+def admin_vendas_agregadas():
+    """Refaz os totais do BI (vendas_agregadas.py) de um período a partir dos
+    pedidos — pro histórico de antes dos totais existirem. POST {"de":
+    "2025-01-01", "ate": "2026-10-18"} ('ate' padrão: ontem) roda em segundo
+    plano; GET mostra o andamento."""
+    if not _admin_autorizado():
+        return jsonify({"erro": "nao_autorizado"}), 403
+    if request.method == 'GET':
+        return jsonify((vendas_agregadas.tarefa(db).get().to_dict() or {}).get("backfill") or {}), 200
+    data = request.json or {}
+    de, ate = data.get("de"), data.get("ate") or vendas_agregadas.ontem()
+    try:
+        if datetime.strptime(de, "%Y-%m-%d") > datetime.strptime(ate, "%Y-%m-%d"):
+            raise ValueError
+    except (TypeError, ValueError):
+        return jsonify({"erro": "de/ate inválidos (AAAA-MM-DD, de <= ate)"}), 400
+    threading.Thread(target=lojas.fixar(vendas_agregadas.reprocessar_periodo), args=(db, de, ate),
+                     name="vendas_agregadas", daemon=True).start()
+    return jsonify({"de": de, "ate": ate}), 202
+
+@app.route('/admin/disparos', methods=['POST'])
+def admin_disparos():
+    """Cria e já começa um disparo de promoção (campos em disparos.py). O
+    painel cria pelo Firestore; quem pega é o líder da varredura."""
+    if not _admin_autorizado():
+        return jsonify({"erro": "nao_autorizado"}), 403
+    try:
+        disparo_id = disparos.criar(db, request.json or {})
+    except disparos.DisparoInvalido as e:
+        return jsonify({"erro": str(e)}), 400
+    disparador.iniciar(disparo_id)
+    return jsonify({"id": disparo_id}), 201
+
+@app.route('/admin/disparos/<disparo_id>', methods=['GET', 'POST'])
+def admin_disparo(disparo_id):
+    """GET: andamento do disparo. POST {"acao": "pausar" | "retomar" |
+    "cancelar"} — pausar e cancelar valem na próxima página."""
+    if not _admin_autorizado():
+        return jsonify({"erro": "nao_autorizado"}), 403
+    ref = db.collection(disparos.COLECAO).document(disparo_id)
+    snap = ref.get()
+    if not snap.exists:
+        return jsonify({"erro": "disparo não encontrado"}), 404
+    if request.method == 'POST':
+        acao = (request.json or {}).get("acao")
+        status = {"pausar": "pausado", "retomar": "pendente", "cancelar": "cancelado"}.get(acao)
+        if status is None:
+            return jsonify({"erro": "acao: pausar, retomar ou cancelar"}), 400
+        ref.update({"status": status, "mandato_expira_em": None} if status == "pendente" else {"status": status})
+        if status == "pendente":
+            disparador.iniciar(disparo_id)
+        snap = ref.get()
+    dados = snap.to_dict() or {}
+    return jsonify({campo: dados.get(campo) for campo in
+                     ("status", "contagem", "taxa_por_minuto", "expansao_concluida", "erro")} | {"id": disparo_id}), 200
+
 @app.route('/salvar_token', methods=['POST'])
 def salvar_token():
     data = request.json
-    print(f"Dados recebidos no servidor: {data}") 
     
     # O App envia 'wa_id' e 'fcm_token'
     usuario_id = data.get('wa_id') 
     fcm_token = data.get('fcm_token')
 
     if not usuario_id or not fcm_token:
-        print("Erro: Dados incompletos vindos do App")
+        log.warning("token sem wa_id ou fcm_token")
         return jsonify({"status": "erro", "mensagem": "Dados incompletos"}), 400
 
     # Grava no Firestore
@@ -1411,42 +1888,77 @@ def salvar_token():
             "fcm_token": fcm_token,
             "ultima_atualizacao": firestore.SERVER_TIMESTAMP
         }, merge=True)
-        print(f"Token salvo com sucesso para o usuário: {usuario_id}")
+        log.info("token salvo", extra={"usuario_id": usuario_id})
         return jsonify({"status": "sucesso"}), 200
-    except Exception as e:
-        print(f"Erro ao gravar no Firestore: {e}")
+    except Exception:
+        log.error("erro ao salvar o token", exc_info=True)
         return jsonify({"status": "erro"}), 500
     
-#Envia o aviso via whatsapp
+def montar_mensagem_pronto(bot_cfg, nome_cliente, tipo_servico):
+    """Montagem da mensagem a partir do template configurado."""
+    template = bot_cfg.get("mensagem_pronto") if tipo_servico != 'RETIRADA' else bot_cfg.get("mensagem_retirada")
+    template = template or (BOT_CONFIG_DEFAULTS["mensagem_pronto"] if tipo_servico != 'RETIRADA' else BOT_CONFIG_DEFAULTS["mensagem_retirada"])
+    return template.format(
+        nome_cliente=primeiro_nome(nome_cliente),
+        nome=primeiro_nome(nome_cliente),
+        empresa=bot_cfg.get("nome_empresa") or BOT_CONFIG_DEFAULTS["nome_empresa"]
+    )
+
+def destino_aviso(data):
+    """(usuario_id, telefone) de quem recebe o aviso. Pedido do app às
+    vezes traz o usuario_id ('cliente_...') no lugar do wa_id."""
+    telefone = str(data.get('wa_id') or data.get('telefone') or '')
+    usuario_id = data.get('usuario_id')
+    if telefone.startswith('cliente_'):
+        usuario_id, telefone = usuario_id or telefone, ''
+    return usuario_id, re.sub(r'\D', '', telefone)
+
+def notificar_pelo_app(usuario_id, telefone, bot_cfg, mensagem, dados):
+    """Aviso por push pra quem tem o app (notificacoes.py). Devolve o
+    (resultado, erro) do push, ou None se o cliente não tem token — em
+    qualquer caso que não 'enviado' o aviso vai pelo WhatsApp."""
+    try:
+        usuario_id, token = notificacoes.token_do_cliente(db, usuario_id, telefone)
+    except Exception as e:
+        metricas.ERROS.labels(tipo="push").inc()
+        return "retido", f"token: {e}"
+    if not token:
+        return None
+    titulo = bot_cfg.get("nome_empresa") or BOT_CONFIG_DEFAULTS["nome_empresa"]
+    return fila_push.enviar([(token, titulo, mensagem, dados)])[0]
+
+#Envia o aviso: push pra quem tem o app, senão WhatsApp
 @app.route('/notificar_pronto', methods=['POST'])
 def notificar_pronto():
     try:
         data = request.json
         # O sistema deve enviar o número do WhatsApp no campo wa_id ou telefone
-        telefone = data.get('wa_id') or data.get('telefone')
+        # (e o usuario_id, nos pedidos do app)
+        usuario_id, telefone_limpo = destino_aviso(data)
         nome_cliente = data.get('nome', 'Cliente')
         tipo_servico = data.get('tipo_servico')
         
-        if not telefone:
+        if not telefone_limpo and not usuario_id:
             return jsonify({"erro": "Número de telefone (wa_id) não fornecido"}), 400
 
-        # Montagem da mensagem a partir do template configurado
         bot_cfg = obter_config_bot()
-        template = bot_cfg.get("mensagem_pronto") if tipo_servico != 'RETIRADA' else bot_cfg.get("mensagem_retirada")
-        template = template or (BOT_CONFIG_DEFAULTS["mensagem_pronto"] if tipo_servico != 'RETIRADA' else BOT_CONFIG_DEFAULTS["mensagem_retirada"])
-        mensagem = template.format(
-            nome_cliente=primeiro_nome(nome_cliente),
-            nome=primeiro_nome(nome_cliente),
-            empresa=bot_cfg.get("nome_empresa") or BOT_CONFIG_DEFAULTS["nome_empresa"]
-        )
-
-        import re
-        telefone_limpo = re.sub(r'\D', '', str(telefone))
-
-        # Configuração da API da Meta (WhatsApp)
-        url = f"https://graph.facebook.com/v21.0/{PHONE_NUMBER_ID}/messages"
+        mensagem = montar_mensagem_pronto(bot_cfg, nome_cliente, tipo_servico)
+
+        push = notificar_pelo_app(usuario_id, telefone_limpo, bot_cfg, mensagem,
+                                  {"tipo": "pedido_pronto", "pedido_id": data.get('pedido_id') or ""})
+        if push is not None and push[0] == "enviado":
+            log.info("aviso enviado", extra={"canal": "app", "destino": usuario_id or telefone_limpo})
+            return jsonify({"status": "sucesso", "canal": "app"}), 200
+        if not telefone_limpo:
+            return jsonify({"erro": "falha_push", "detalhes": push[1] if push else "cliente sem app nem telefone"}), 502
+        if push is not None:
+            log.warning("push não saiu, indo pelo WhatsApp", extra={"erro": push[1]})
+
+        # Configuração da API da Meta (WhatsApp), com o número da loja
+        loja = lojas.atual()
+        url = f"{GRAPH_API_URL}/{loja.phone_number_id}/messages"
         headers = {
-            "Authorization": f"Bearer {ACCESS_TOKEN}",
+            "Authorization": f"Bearer {loja.access_token}",
             "Content-Type": "application/json"
         }
         
@@ -1458,17 +1970,20 @@ def notificar_pronto():
         }
         
         # Envio da mensagem
-        response_wa = requests.post(url, headers=headers, json=payload)
+        with metricas.NOTIFICACAO_SEGUNDOS.labels(canal="whatsapp").time():
+            response_wa = requests.post(url, headers=headers, json=payload, timeout=15)
         
         if response_wa.status_code in [200, 201]:
-            print(f"✅ WhatsApp enviado para {telefone_limpo}")
+            metricas.NOTIFICACOES.labels(canal="whatsapp", resultado="enviado").inc()
+            log.info("aviso enviado", extra={"canal": "whatsapp", "destino": telefone_limpo})
             return jsonify({"status": "sucesso", "canal": "whatsapp"}), 200
         else:
-            print(f"❌ Erro Meta: {response_wa.text}")
+            metricas.NOTIFICACOES.labels(canal="whatsapp", resultado="falhou").inc()
+            log.warning("aviso recusado pela Meta", extra={"status": response_wa.status_code, "detalhes": response_wa.text})
             return jsonify({"erro": "falha_meta", "detalhes": response_wa.json()}), response_wa.status_code
 
     except Exception as e:
-        print(f"❌ Erro geral na notificação: {e}")
+        log.error("erro no aviso de pedido pronto", exc_info=True)
         return jsonify({"erro": str(e)}), 500
 
 @app.route('/webhook', methods=['GET', 'POST'])
@@ -1481,6 +1996,9 @@ def webhook():
         return 'Token inválido', 403
 
     if request.method == 'POST':
+        # Marca a chegada antes de qualquer processamento: bot_turno_segundos
+        # mede até a resposta sair pro WhatsApp, não só o tempo da IA.
+        inicio_turno = time.perf_counter()
         data = request.json
         
         if data and 'entry' in data:
@@ -1488,62 +2006,138 @@ def webhook():
                 for change in entry.get('changes', []):
                     value = change.get('value', {})
                     if 'messages' in value:
-                        for message in value['messages']:
+                        # Cada 'value' vem do número que recebeu a mensagem: é ele
+                        # que diz de qual loja é o turno (lojas.py).
+                        numero = (value.get('metadata') or {}).get('phone_number_id')
+                        loja = lojas.por_numero(numero)
+                        if loja is None:
+                            metricas.ERROS.labels(tipo="loja_desconhecida").inc()
+                            log.warning("mensagem pra número sem loja", extra={"phone_number_id": numero})
+                            continue
+                        with lojas.usar(loja):
+                            for message in value['messages']:
                             
-                            # --- BLOQUEIO DE DUPLICIDADE ---
-                            msg_id = message.get('id')
-                            if msg_id in processed_message_ids:
-                                print(f"🚫 Mensagem repetida bloqueada: {msg_id}")
-                                return "EVENT_RECEIVED", 200 # Responde OK para o WhatsApp parar de tentar
+                                # --- BLOQUEIO DE DUPLICIDADE ---
+                                msg_id = message.get('id')
+                                if msg_id in processed_message_ids:
+                                    log.info("mensagem repetida bloqueada", extra={"msg_id": msg_id})
+                                    return "EVENT_RECEIVED", 200 # Responde OK para o WhatsApp parar de tentar
                             
-                            processed_message_ids.add(msg_id)
-                            # Limpeza simples para a memória não estourar (mantém últimos 1000 IDs)
-                            if len(processed_message_ids) > 1000:
-                                processed_message_ids.pop()
-                            # -------------------------------
+                                processed_message_ids.add(msg_id)
+                                # Limpeza simples para a memória não estourar (mantém últimos 1000 IDs)
+                                if len(processed_message_ids) > 1000:
+                                    processed_message_ids.pop()
+                                # -------------------------------
 
-                            from_number = message['from']
+                                from_number = message['from']
                             
-                            if 'text' in message:
-                                text = message['text']['body']
-                                ai_response = get_openai_response(text, from_number, "WPP")
-                                if ai_response:
-                                    send_message(from_number, ai_response)
-                                return "EVENT_RECEIVED", 200
-
-                            elif 'image' in message or 'document' in message:
-                                # ... (seu código de imagem continua igual) ...
-                                tipo = 'image' if 'image' in message else 'document'
-                                media_id = message[tipo]['id']
-                                # (mantenha sua lógica de imagem aqui)
-                                caminho_arquivo = baixar_imagem_whatsapp(media_id, tipo)
-                                if caminho_arquivo:
-                                    nome_arquivo = os.path.basename(caminho_arquivo)
-                                    url_publica = upload_comprovante_firebase(caminho_arquivo, nome_arquivo)
-                                    if url_publica:
-                                        msg = f"Recebi seu comprovante! Vou registrar aqui."
-                                        send_message(from_number, msg)
-                                        registrar_comprovante(from_number, url_publica) # Chamei a função que faltava no seu código original
-                                        os.remove(caminho_arquivo)
-                                return "EVENT_RECEIVED", 200
+                                if 'text' in message:
+                                    text = message['text']['body']
+                                    if disparos.pedido_de_saida(text):
+                                        disparos.descadastrar(db, from_number)
+                                        send_message(from_number, MENSAGEM_DESCADASTRO)
+                                        return "EVENT_RECEIVED", 200
+                                    recusa = limite_cliente(from_number, obter_config_bot())
+                                    if recusa is not None:
+                                        if recusa:
+                                            send_message(from_number, recusa)
+                                        return "EVENT_RECEIVED", 200
+                                    metricas.TURNOS.labels(canal="whatsapp").inc()
+                                    with perfil.perfilar_turno("whatsapp"), prazo.prazo_turno():
+                                        ai_response = get_openai_response(text, from_number, "WPP")
+                                        if ai_response:
+                                            send_message(from_number, ai_response)
+                                    metricas.TURNO_SEGUNDOS.labels(canal="whatsapp").observe(time.perf_counter() - inicio_turno)
+                                    return "EVENT_RECEIVED", 200
+
+                                elif 'image' in message or 'document' in message:
+                                    # ... (seu código de imagem continua igual) ...
+                                    tipo = 'image' if 'image' in message else 'document'
+                                    media_id = message[tipo]['id']
+                                    # (mantenha sua lógica de imagem aqui)
+                                    with prazo.prazo_turno():
+                                        caminho_arquivo = baixar_imagem_whatsapp(media_id, tipo)
+                                        if caminho_arquivo:
+                                            nome_arquivo = os.path.basename(caminho_arquivo)
+                                            url_publica = upload_comprovante_firebase(caminho_arquivo, nome_arquivo)
+                                            if url_publica:
+                                                msg = "Recebi seu comprovante! Vou registrar aqui."
+                                                send_message(from_number, msg)
+                                                registrar_comprovante(from_number, url_publica) # Chamei a função que faltava no seu código original
+                                                os.remove(caminho_arquivo)
+                                    return "EVENT_RECEIVED", 200
 
         return "OK", 200
                                     
 def send_message(to, message):
-    url = f"https://graph.facebook.com/v21.0/{PHONE_NUMBER_ID}/messages"
-    headers = {"Authorization": f"Bearer {ACCESS_TOKEN}", "Content-Type": "application/json"}
+    loja = lojas.atual()
+    url = f"{GRAPH_API_URL}/{loja.phone_number_id}/messages"
+    headers = {"Authorization": f"Bearer {loja.access_token}", "Content-Type": "application/json"}
     payload = {"messaging_product": "whatsapp", "to": to, "type": "text", "text": {"body": message}}
     try:
-        resp = requests.post(url, headers=headers, json=payload, timeout=15)
+        with medir_etapa("send_message"):
+            # Sai mesmo com o prazo do turno esgotado: é o envio que leva a
+            # resposta (ou o aviso de demora) até o cliente.
+            resp = requests.post(url, headers=headers, json=payload, timeout=prazo.timeout_envio(15))
         if not resp.ok:
             # Antes esse erro era engolido em silêncio: a mensagem ficava
             # salva no histórico (Firestore) como se tivesse sido enviada,
             # mas nunca chegava de verdade no WhatsApp do cliente.
-            print(f"❌ Falha ao enviar WhatsApp pra {to}: HTTP {resp.status_code} — {resp.text}")
+            metricas.ERROS.labels(tipo="send_message").inc()
+            log.error("WhatsApp recusado", extra={"para": to, "status": resp.status_code, "detalhes": resp.text})
     except Exception as e:
-        print(f"❌ Erro de rede ao enviar WhatsApp pra {to}: {e}")
+        metricas.ERROS.labels(tipo="send_message").inc()
+        log.error("erro de rede no WhatsApp", extra={"para": to, "erro": str(e)})
     return 'EVENT_RECEIVED', 200
 
+# Respostas da Graph API que são limite de envio (tentar de novo mais
+# tarde), não erro do destinatário.
+CODIGOS_LIMITE_META = {130429, 131056, 80007}
+# Uma página de disparo pelo app é um send_each de até 500.
+DISPARO_ESPERA_PUSH_S = 60
+MENSAGEM_DESCADASTRO = ("Pronto, você não vai mais receber promoções por aqui. "
+                        "Pra fazer um pedido é só mandar uma mensagem!")
+
+def enviar_whatsapp_disparo(telefone, campos, nome):
+    """Um envio de disparo (disparos.py): template, se o disparo tiver um
+    (fora da janela de 24 h só template passa), ou texto. Devolve
+    (resultado, erro)."""
+    loja = lojas.atual()
+    url = f"{GRAPH_API_URL}/{loja.phone_number_id}/messages"
+    headers = {"Authorization": f"Bearer {loja.access_token}", "Content-Type": "application/json"}
+    template = campos.get("template")
+    if template:
+        nome_cliente = primeiro_nome(nome) if nome else "cliente"
+        parametros = [{"type": "text", "text": str(p).replace("{nome}", nome_cliente)}
+                      for p in template.get("parametros") or []]
+        payload = {"messaging_product": "whatsapp", "to": telefone, "type": "template", "template": {
+            "name": template["nome"], "language": {"code": template.get("idioma") or "pt_BR"},
+            **({"components": [{"type": "body", "parameters": parametros}]} if parametros else {})}}
+    else:
+        payload = {"messaging_product": "whatsapp", "to": telefone, "type": "text",
+                   "text": {"body": disparos.texto_para(campos["mensagem"], nome)}}
+    try:
+        resp = requests.post(url, headers=headers, json=payload, timeout=15)
+    except Exception as e:
+        # Pode ter chegado: não tenta de novo (disparos.py prefere uma a menos).
+        return "falhou", f"rede: {e}"
+    if resp.ok:
+        return "enviado", None
+    try:
+        codigo = (resp.json().get("error") or {}).get("code")
+    except ValueError:
+        codigo = None
+    erro = f"HTTP {resp.status_code}: {resp.text[:200]}"
+    if resp.status_code == 429 or codigo in CODIGOS_LIMITE_META:
+        return "retido", erro
+    return "falhou", erro
+
+def enviar_app_disparo(mensagens):
+    """Notificações de um disparo, pela mesma fila do push (notificacoes.py):
+    lotes do send_each e limpeza dos tokens mortos. mensagens: [(token,
+    titulo, corpo, dados)]."""
+    return fila_push.enviar(mensagens, espera_s=DISPARO_ESPERA_PUSH_S)
+
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 5000)) 
     app.run(host='0.0.0.0', port=port)
@@ -1552,22 +2146,50 @@ if __name__ == "__main__":
 @app.route('/chat_app', methods=['GET', 'POST'])
 def gerenciar_chat_app():
     if request.method == 'GET':
-        # Lê o histórico direto do Firestore (coleção historico_conversas)
+        # Histórico em páginas, com cursor, ETag/304 e gzip (paginas_historico.py).
         usuario_id = request.args.get('usuario_id') or request.args.get('wa_id')
         if not usuario_id:
             return jsonify({"historico": []}), 200
 
-        historico = obter_historico_firestore(usuario_id)
-        if not historico:
+        desde, antes, limite = paginas_historico.ler_parametros(request.args)
+        fila_historico.aguardar_outros(usuario_id)
+        pendentes = fila_historico.mesclar(usuario_id, [])
+        try:
+            resumo = caixa_entrada.referencia(db, usuario_id).get()
+            resumo = resumo.to_dict() if resumo.exists else None
+        except Exception as e:
+            log.warning("erro ao ler o resumo da conversa", extra={"erro": str(e)})
+            resumo = None
+        etag = paginas_historico.etag(usuario_id, paginas_historico.versao(resumo, pendentes), desde, antes, limite)
+        nao_mudou = paginas_historico.sem_mudanca(etag, request.headers.get('If-None-Match'))
+        if nao_mudou:
+            status, corpo, cabecalhos = nao_mudou
+            return Response(corpo, status=status, headers=cabecalhos)
+
+        doc_ref = db.collection("historico_conversas").document(usuario_id)
+        try:
+            gravadas = [d.to_dict() for d in paginas_historico.consulta(doc_ref, desde, antes, limite).stream()]
+            legado = []
+            if paginas_historico.precisa_legado(desde, gravadas, limite):
+                doc = doc_ref.get()
+                legado = doc.to_dict().get("mensagens", []) if doc.exists else []
+        except Exception:
+            log.error("erro ao ler o histórico", exc_info=True)
+            gravadas, legado = [], []
+        pagina = paginas_historico.montar_pagina(gravadas, legado, pendentes, desde, antes, limite)
+        if not desde and not antes and not pagina["historico"]:
             # Primeira interação: registra e devolve a saudação inicial
-            saudacao = "Olá! Como posso ajudar? 🍕"
             bot_cfg = obter_config_bot()
             saudacao = bot_cfg.get("mensagem_inicial") or BOT_CONFIG_DEFAULTS["mensagem_inicial"]
             salvar_historico_firestore(usuario_id, "assistant", saudacao, bot_cfg.get("max_historico_salvar"))
-            historico = [{"role": "assistant", "content": saudacao}]
-        return jsonify({"historico": historico}), 200
+            pagina = paginas_historico.montar_pagina([], [], fila_historico.mesclar(usuario_id, []), None, None, limite)
+            etag = None
+        status, corpo, cabecalhos = paginas_historico.resposta(
+            pagina, etag, request.headers.get('If-None-Match'), request.headers.get('Accept-Encoding'))
+        return Response(corpo, status=status, headers=cabecalhos)
 
     if request.method == 'POST':
+        inicio_turno = time.perf_counter()
         data = request.json
         usuario_id = data.get('usuario_id') or data.get('wa_id')
         mensagem = data.get('mensagem') or data.get('prompt') or ""
@@ -1578,11 +2200,18 @@ def gerenciar_chat_app():
         # 1. PRIMEIRO define a origem
         origem = "APP" if usuario_id and usuario_id.startswith("cliente_") else "WHATSAPP"
         
-        # 2. DEPOIS faz o print de debug
-        print(f"DEBUG APP: ID={usuario_id} | ORIGEM={origem} | MSG={mensagem}")
+        # 2. DEPOIS o log (o texto sai só com o tamanho, ver logs.py)
+        log.debug("mensagem do app", extra={"usuario_id": usuario_id, "origem": origem, "mensagem": mensagem})
         
+        recusa = limite_cliente(usuario_id, obter_config_bot())
+        if recusa is not None:
+            return jsonify({"resposta": recusa or None}), 200
+
         # 3. POR FIM chama a função
-        ai_response = get_openai_response(mensagem, usuario_id, origem)
+        metricas.TURNOS.labels(canal="app").inc()
+        with perfil.perfilar_turno("app"), prazo.prazo_turno():
+            ai_response = get_openai_response(mensagem, usuario_id, origem)
+        metricas.TURNO_SEGUNDOS.labels(canal="app").observe(time.perf_counter() - inicio_turno)
         return jsonify({"resposta": ai_response}), 200
 
 
@@ -1604,6 +2233,6 @@ def painel_enviar_mensagem():
     send_message(wa_id, mensagem)
     salvar_historico_firestore(wa_id, "assistant", mensagem)
     if assumir_manual:
-        db.collection("historico_conversas").document(wa_id).set({"modo_manual": True}, merge=True)
+        caixa_entrada.atualizar_conversa(db, wa_id, {"modo_manual": True})
     return jsonify({"ok": True}), 200
 
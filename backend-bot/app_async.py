@@ -0,0 +1,564 @@
+"""Modo assíncrono (ASGI) do bot.
+
+No modo normal (app.py, Flask + gunicorn sync) cada conversa em andamento
+segura um processo inteiro pelos 3 a 15 s que a OpenAI leva pra responder:
+a concorrência é o número de workers e a memória cresce junto com ela.
+Aqui as rotas que passam a maior parte do tempo esperando rede — /webhook,
+/chat_app e /notificar_pronto — são corrotinas, com o cliente assíncrono
+da OpenAI, o do Firestore (firebase_admin.firestore_async) e o httpx pra
+Graph API. Enquanto um turno espera a OpenAI o processo atende os outros,
+e um processo só segura centenas de turnos ao mesmo tempo.
+
+O resto (painel, /metrics, /admin/perfil, /salvar_token...) continua sendo
+o Flask do app.py, montado embaixo via a2wsgi. As regras do turno — prompt,
+ferramentas, config, histórico — são as do app.py; só a espera mudou. As
+ferramentas que a IA chama (cardápio, pedido, bairro) continuam síncronas
+e rodam numa thread à parte (asyncio.to_thread): são leituras rápidas do
+Firestore, o tempo longo do turno é a OpenAI. O profiler sob demanda
+(perfil.py) amostra por thread e não funciona neste modo.
+
+O app.py continua sendo a entrada padrão (Procfile). Pra rodar este modo:
+
+    uvicorn app_async:app --host 0.0.0.0 --port $PORT --workers 2
+
+ASYNC_THREADS (padrão 32) é o tamanho do pool que roda as ferramentas.
+"""
+import asyncio
+import contextlib
+import json
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+from a2wsgi import WSGIMiddleware
+from firebase_admin import firestore_async
+from openai import AsyncOpenAI
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, PlainTextResponse, Response
+from starlette.routing import Mount, Route
+
+import app as bot
+import caixa_entrada
+import disparos
+import horario
+import logs
+import lojas
+import metricas
+import paginas_historico
+import prazo
+from firestore_contagem import ClienteContadoAsync, iniciar_contagem, encerrar_contagem
+from uso_ia import versao_prompt
+
+ASYNC_THREADS = int(os.environ.get("ASYNC_THREADS") or 32)
+log = logs.obter("app_async")
+
+
+class _Clientes:
+    """Criados dentro do loop (lifespan): o canal gRPC do Firestore e o pool
+    do httpx ficam presos ao loop em que nasceram. 'db' é um cliente por
+    loja (lojas.py) — use _db()."""
+    db = {}
+    openai = None
+    graph = None
+
+
+def _db():
+    """Cliente assíncrono do Firestore da loja do contexto, criado no
+    primeiro uso dela (já dentro do loop)."""
+    loja = lojas.atual()
+    cliente = _Clientes.db.get(loja.id)
+    if cliente is None:
+        app_firebase = bot.iniciar_firebase(loja)
+        original = firestore_async.client(app=app_firebase) if app_firebase is not None else firestore_async.client()
+        cliente = _Clientes.db[loja.id] = ClienteContadoAsync(original, prefixo=loja.prefixo)
+    return cliente
+
+
+@contextlib.asynccontextmanager
+async def _ciclo_de_vida(app):
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=ASYNC_THREADS, thread_name_prefix="ferramenta"))
+    bot.iniciar_firebase()
+    _Clientes.db = {}
+    # Sem retentativa da biblioteca: timeout e reserva são do roteador.
+    _Clientes.openai = AsyncOpenAI(api_key=bot.OPENAI_API_KEY, max_retries=0)
+    _Clientes.graph = httpx.AsyncClient(timeout=15, limits=httpx.Limits(max_connections=200))
+    # Varredura de fundo (varredor.py): um thread por loja, com o cliente síncrono.
+    bot.iniciar_varredores()
+    try:
+        yield
+    finally:
+        await _Clientes.graph.aclose()
+        await _Clientes.openai.close()
+
+
+def _etapa(nome):
+    # medir_etapa (metricas.py) também guarda a etapa por thread pro
+    # profiler; aqui várias corrotinas dividem a thread, então só o
+    # histograma (e o registro da etapa pro prazo do turno).
+    return metricas.cronometrar_etapa(nome)
+
+
+def _com_contagem(rota):
+    """Contagem de leituras/escritas do Firestore e id do turno no log
+    (logs.py) por requisição, igual ao before/teardown_request do Flask.
+    Cada requisição roda na sua própria task, então os contextvars não
+    misturam turnos."""
+    def decorador(funcao):
+        async def rota_contada(request):
+            token_turno = logs.iniciar_turno(request.headers.get("x-request-id"))
+            contagem, token = iniciar_contagem()
+            try:
+                return await funcao(request)
+            finally:
+                encerrar_contagem(token)
+                bot.registrar_contagem_requisicao(request.method, rota, contagem)
+                logs.encerrar_turno(token_turno)
+        return rota_contada
+    return decorador
+
+
+def _na_loja(funcao):
+    """Loja da requisição, como o _escolher_loja do app.py: 'loja' na query
+    ou no JSON, ou o cabeçalho X-Loja; sem nada, a principal."""
+    async def rota_na_loja(request):
+        pedida = request.query_params.get("loja") or request.headers.get("x-loja")
+        if not pedida and request.method == "POST":
+            corpo = await _corpo_json(request)
+            pedida = corpo.get("loja") if isinstance(corpo, dict) else None
+        loja = lojas.da_requisicao(pedida)
+        if loja is None:
+            return JSONResponse({"erro": "loja_desconhecida"}, status_code=404)
+        with lojas.usar(loja):
+            return await funcao(request)
+    return rota_na_loja
+
+
+async def _corpo_json(request):
+    try:
+        return await request.json()
+    except ValueError:
+        return None
+
+
+# --- FIRESTORE ---
+
+async def obter_config_bot():
+    dados = None
+    try:
+        # Cópia local em dia (instantaneo.py): nem sai do processo. Velha
+        # demais, lê com o cliente assíncrono em vez de bloquear o loop.
+        if bot.instantaneo.fresco("config"):
+            return bot.montar_config_bot(bot.instantaneo.documento("config", "bot"))
+        doc = await _db().collection("configuracoes").document("bot").get()
+        if doc.exists:
+            dados = doc.to_dict()
+    except Exception:
+        log.error("erro ao ler a configuração do bot", exc_info=True)
+    return bot.montar_config_bot(dados)
+
+
+async def ler_conversa(wa_id):
+    """Documento de historico_conversas inteiro (ou {}). O turno síncrono lê
+    esse documento quatro vezes (modo manual, atenção, existe histórico,
+    histórico); aqui é uma leitura só. As mensagens incluem o que ainda
+    está na fila de gravação (fila_historico.py)."""
+    if bot.fila_historico.outros_gravando(wa_id):
+        await asyncio.to_thread(bot.fila_historico.aguardar_outros, wa_id)
+    try:
+        doc = await _db().collection("historico_conversas").document(wa_id).get()
+        conversa = doc.to_dict() if doc.exists else {}
+    except Exception:
+        log.error("erro ao ler o histórico", exc_info=True)
+        conversa = {}
+    conversa["mensagens"] = bot.fila_historico.mesclar(wa_id, conversa.get("mensagens", []))
+    return conversa
+
+
+async def salvar_historico(wa_id, mensagens, limite=None):
+    """Mesmo corte do salvar_historico_firestore: as mensagens do turno
+    (pergunta e resposta) entram juntas na fila de gravação — não espera o
+    Firestore. A fila escreve no diário em disco: fora do loop."""
+    await asyncio.to_thread(bot.salvar_mensagens_historico, wa_id, mensagens, limite)
+
+
+async def buscar_nome_cliente(id_usuario):
+    try:
+        with _etapa("usuario"):
+            consulta = _db().collection("usuarios_app").where("telefone", "==", id_usuario).limit(1)
+            async for doc in consulta.stream():
+                return doc.to_dict().get("nome")
+    except Exception:
+        metricas.ERROS.labels(tipo="busca_usuario").inc()
+        log.error("erro na busca do usuário", exc_info=True)
+    return None
+
+
+# --- TURNO ---
+
+async def get_openai_response(prompt: str, wa_id: str, origem: str = "WPP"):
+    """Versão assíncrona do app.get_openai_response — mesmas regras e
+    mesmas respostas, na mesma ordem."""
+    id_usuario = re.sub(r'\D', '', str(wa_id).split('@')[0])
+
+    with _etapa("config"):
+        bot_cfg = await obter_config_bot()
+    prazo.ajustar(bot_cfg.get("prazo_turno_s"))
+    limite_salvar = bot_cfg.get("max_historico_salvar")
+    with _etapa("historico"):
+        conversa = await ler_conversa(id_usuario)
+
+    if conversa.get("modo_manual") is True:
+        await salvar_historico(id_usuario, [("user", prompt)], limite_salvar)
+        return None
+
+    if not bot_cfg.get("ativo", True):
+        metricas.FALLBACKS.labels(motivo="bot_inativo").inc()
+        return bot_cfg.get("mensagem_inativo") or bot.BOT_CONFIG_DEFAULTS["mensagem_inativo"]
+
+    estado_horario = horario.consultar(bot_cfg)
+    texto_horario = estado_horario.texto
+    if not estado_horario.aberto:
+        return horario.mensagem_fechado(bot_cfg, estado_horario)
+
+    aviso_atencao_antiga = await asyncio.to_thread(
+        bot.texto_atencao_pendente_antiga, id_usuario, bot.minutos_atencao(bot_cfg))
+    tem_carrinho = bool(conversa.get("ultimo_calculo"))
+
+    if not conversa.get("mensagens"):
+        saudacao = bot_cfg.get("mensagem_inicial") or bot.BOT_CONFIG_DEFAULTS["mensagem_inicial"]
+        await salvar_historico(id_usuario, [("user", prompt), ("assistant", saudacao)], limite_salvar)
+        return saudacao
+
+    # Sai da thread do loop: a resposta do bairro/cardápio lê o instantâneo
+    # (e, se ele estiver velho, o Firestore síncrono).
+    resposta = await asyncio.to_thread(bot.resposta_rapida, prompt, bot_cfg, texto_horario)
+    if resposta:
+        with _etapa("salvar_historico"):
+            await salvar_historico(wa_id, [("user", prompt), ("assistant", resposta)], limite_salvar)
+        return resposta
+
+    nome_cliente = await buscar_nome_cliente(id_usuario)
+    instrucoes_extras = bot_cfg.get("instrucoes_extras") or ""
+    system_prompt = bot.montar_system_prompt(bot_cfg, id_usuario, nome_cliente, aviso_atencao_antiga)
+
+    # O histórico de contexto é o do wa_id como chegou (igual ao modo
+    # síncrono) — só relê se for outro documento.
+    if wa_id != id_usuario:
+        with _etapa("historico"):
+            conversa = await ler_conversa(wa_id)
+    historico_msgs = bot.historico_para_contexto(conversa.get("mensagens", []), bot_cfg.get("max_historico_contexto"))
+
+    messages = [{"role": "system", "content": system_prompt}]
+    messages.extend(historico_msgs)
+    messages.append({"role": "user", "content": prompt})
+
+    mensagem_espera = bot_cfg.get("mensagem_espera")
+    with _etapa("admissao"):
+        vaga = await bot.admissao.vaga_async(
+            bot_cfg, tem_carrinho,
+            ao_adiar=(lambda: send_message(wa_id, mensagem_espera)) if origem == "WPP" and mensagem_espera else None)
+    if vaga is None:
+        metricas.FALLBACKS.labels(motivo="sobrecarga").inc()
+        return bot_cfg.get("mensagem_sobrecarga") or bot.BOT_CONFIG_DEFAULTS["mensagem_sobrecarga"]
+
+    modelo, motivo = bot.roteador_modelos.escolher(bot_cfg, "completion_1", prompt, tem_carrinho)
+    respostas_openai = []
+    chamadas_openai = []
+    segundos_openai = 0.0
+    try:
+        inicio_openai = time.perf_counter()
+        with _etapa("completion_1"):
+            modelo, response = await bot.roteador_modelos.executar_async(
+                bot_cfg, "completion_1", modelo, motivo,
+                lambda modelo_chamada, timeout: _Clientes.openai.chat.completions.create(
+                    model=modelo_chamada,
+                    messages=messages,
+                    tools=bot.FERRAMENTAS_OPENAI,
+                    tool_choice="auto",
+                    timeout=timeout
+                )
+            )
+        segundos = time.perf_counter() - inicio_openai
+        segundos_openai += segundos
+        respostas_openai.append(response)
+        chamadas_openai.append((modelo, segundos))
+        response_message = response.choices[0].message
+
+        if response_message.tool_calls:
+            messages.append(response_message)
+            ferramentas_chamadas = []
+            for tool_call in response_message.tool_calls:
+                function_name = tool_call.function.name
+                args = json.loads(tool_call.function.arguments)
+                ferramentas_chamadas.append(function_name)
+                prazo.verificar()
+
+                metricas.CHAMADAS_FERRAMENTA.labels(ferramenta=function_name).inc()
+                with _etapa(f"ferramenta:{function_name}"):
+                    content = await asyncio.to_thread(bot.executar_ferramenta, function_name, args, wa_id, id_usuario)
+                messages.append({"tool_call_id": tool_call.id, "role": "tool", "name": function_name, "content": content})
+
+            modelo, motivo = bot.roteador_modelos.escolher(bot_cfg, "completion_2", ferramentas=ferramentas_chamadas)
+            inicio_openai = time.perf_counter()
+            with _etapa("completion_2"):
+                modelo, second_res = await bot.roteador_modelos.executar_async(
+                    bot_cfg, "completion_2", modelo, motivo,
+                    lambda modelo_chamada, timeout: _Clientes.openai.chat.completions.create(
+                        model=modelo_chamada, messages=messages, timeout=timeout
+                    )
+                )
+            segundos = time.perf_counter() - inicio_openai
+            segundos_openai += segundos
+            respostas_openai.append(second_res)
+            chamadas_openai.append((modelo, segundos))
+            final_text = second_res.choices[0].message.content
+        else:
+            final_text = response_message.content
+
+        with _etapa("salvar_historico"):
+            await salvar_historico(wa_id, [("user", prompt), ("assistant", final_text)], limite_salvar)
+        return final_text
+
+    except Exception as e:
+        if isinstance(e, prazo.PrazoEsgotado) or prazo.esgotado():
+            log.warning("turno passou do prazo", extra={"prazo_s": bot_cfg.get("prazo_turno_s"), "erro": repr(e)})
+            metricas.FALLBACKS.labels(motivo="prazo").inc()
+            return bot_cfg.get("mensagem_prazo") or bot.BOT_CONFIG_DEFAULTS["mensagem_prazo"]
+        log.error("erro na OpenAI", exc_info=True)
+        metricas.ERROS.labels(tipo="openai").inc()
+        metricas.FALLBACKS.labels(motivo="mensagem_erro").inc()
+        return bot_cfg.get("mensagem_erro") or bot.BOT_CONFIG_DEFAULTS["mensagem_erro"]
+    finally:
+        vaga.liberar()
+        # Numa thread: a cada MAX_PENDENTES turnos o registro grava no
+        # Firestore ali mesmo, e isso não pode parar o loop.
+        await asyncio.to_thread(
+            bot.registro_uso_ia.registrar_turno,
+            id_usuario, modelo, respostas_openai,
+            versao_prompt(bot.PROMPT_VERSAO, instrucoes_extras),
+            segundos_openai, bot_cfg.get("precos_modelos"), chamadas_openai
+        )
+
+
+# --- GRAPH API ---
+
+async def enviar_whatsapp(to, message):
+    """Devolve a resposta da Graph API (ou None se nem chegou lá)."""
+    loja = lojas.atual()
+    url = f"{bot.GRAPH_API_URL}/{loja.phone_number_id}/messages"
+    headers = {"Authorization": f"Bearer {loja.access_token}", "Content-Type": "application/json"}
+    payload = {"messaging_product": "whatsapp", "to": to, "type": "text", "text": {"body": message}}
+    # Folga de prazo.RESERVA_ENVIO além do prazo do turno: o envio é o que
+    # leva a resposta (ou o aviso de demora) até o cliente.
+    return await _Clientes.graph.post(url, headers=headers, json=payload, timeout=prazo.timeout_envio(15))
+
+
+async def send_message(to, message):
+    try:
+        with _etapa("send_message"):
+            resp = await enviar_whatsapp(to, message)
+        if resp.is_error:
+            metricas.ERROS.labels(tipo="send_message").inc()
+            log.error("WhatsApp recusado", extra={"para": to, "status": resp.status_code, "detalhes": resp.text})
+    except httpx.HTTPError as e:
+        metricas.ERROS.labels(tipo="send_message").inc()
+        log.error("erro de rede no WhatsApp", extra={"para": to, "erro": str(e)})
+
+
+async def _receber_comprovante(from_number, tipo, media_id):
+    caminho_arquivo = await asyncio.to_thread(bot.baixar_imagem_whatsapp, media_id, tipo)
+    if not caminho_arquivo:
+        return
+    url_publica = await asyncio.to_thread(bot.upload_comprovante_firebase, caminho_arquivo, os.path.basename(caminho_arquivo))
+    if url_publica:
+        await send_message(from_number, "Recebi seu comprovante! Vou registrar aqui.")
+        await asyncio.to_thread(bot.registrar_comprovante, from_number, url_publica)
+        os.remove(caminho_arquivo)
+
+
+# --- ROTAS ---
+
+@_com_contagem("/webhook")
+async def webhook(request):
+    if request.method == "GET":
+        if request.query_params.get("hub.verify_token") == bot.VERIFY_TOKEN:
+            return PlainTextResponse(request.query_params.get("hub.challenge") or "")
+        return PlainTextResponse("Token inválido", status_code=403)
+
+    inicio_turno = time.perf_counter()
+    data = await _corpo_json(request)
+    for entry in (data or {}).get("entry", []):
+        for change in entry.get("changes", []):
+            value = change.get("value", {})
+            # O número que recebeu diz de qual loja é o turno (lojas.py).
+            numero = (value.get("metadata") or {}).get("phone_number_id")
+            loja = lojas.por_numero(numero)
+            if loja is None:
+                if value.get("messages"):
+                    metricas.ERROS.labels(tipo="loja_desconhecida").inc()
+                    log.warning("mensagem pra número sem loja", extra={"phone_number_id": numero})
+                continue
+            with lojas.usar(loja):
+                for message in value.get("messages", []):
+                    msg_id = message.get("id")
+                    if msg_id in bot.processed_message_ids:
+                        log.info("mensagem repetida bloqueada", extra={"msg_id": msg_id})
+                        return PlainTextResponse("EVENT_RECEIVED")
+                    bot.processed_message_ids.add(msg_id)
+                    if len(bot.processed_message_ids) > 1000:
+                        bot.processed_message_ids.pop()
+
+                    from_number = message["from"]
+                    if "text" in message:
+                        if disparos.pedido_de_saida(message["text"]["body"]):
+                            await asyncio.to_thread(disparos.descadastrar, bot.db, from_number)
+                            await send_message(from_number, bot.MENSAGEM_DESCADASTRO)
+                            return PlainTextResponse("EVENT_RECEIVED")
+                        # A admissão trava (flock) o mapa compartilhado entre os workers.
+                        recusa = await asyncio.to_thread(bot.limite_cliente, from_number, await obter_config_bot())
+                        if recusa is not None:
+                            if recusa:
+                                await send_message(from_number, recusa)
+                            return PlainTextResponse("EVENT_RECEIVED")
+                        metricas.TURNOS.labels(canal="whatsapp").inc()
+                        with prazo.prazo_turno():
+                            ai_response = await get_openai_response(message["text"]["body"], from_number, "WPP")
+                            if ai_response:
+                                await send_message(from_number, ai_response)
+                        metricas.TURNO_SEGUNDOS.labels(canal="whatsapp").observe(time.perf_counter() - inicio_turno)
+                        return PlainTextResponse("EVENT_RECEIVED")
+
+                    if "image" in message or "document" in message:
+                        tipo = "image" if "image" in message else "document"
+                        with prazo.prazo_turno():
+                            await _receber_comprovante(from_number, tipo, message[tipo]["id"])
+                        return PlainTextResponse("EVENT_RECEIVED")
+
+    return PlainTextResponse("OK")
+
+
+async def _pagina_historico(request, usuario_id):
+    """GET /chat_app em páginas, com cursor, ETag/304 e gzip — o mesmo do
+    app.py (paginas_historico.py), lendo com o cliente assíncrono."""
+    desde, antes, limite = paginas_historico.ler_parametros(request.query_params)
+    if bot.fila_historico.outros_gravando(usuario_id):
+        await asyncio.to_thread(bot.fila_historico.aguardar_outros, usuario_id)
+    pendentes = bot.fila_historico.mesclar(usuario_id, [])
+    try:
+        resumo = await _db().collection(caixa_entrada.COLECAO).document(usuario_id).get()
+        resumo = resumo.to_dict() if resumo.exists else None
+    except Exception as e:
+        log.warning("erro ao ler o resumo da conversa", extra={"erro": str(e)})
+        resumo = None
+    etag = paginas_historico.etag(usuario_id, paginas_historico.versao(resumo, pendentes), desde, antes, limite)
+    nao_mudou = paginas_historico.sem_mudanca(etag, request.headers.get("if-none-match"))
+    if nao_mudou:
+        status, corpo, cabecalhos = nao_mudou
+        return Response(corpo, status_code=status, headers=cabecalhos)
+
+    doc_ref = _db().collection("historico_conversas").document(usuario_id)
+    try:
+        gravadas = [d.to_dict() async for d in paginas_historico.consulta(doc_ref, desde, antes, limite).stream()]
+        legado = []
+        if paginas_historico.precisa_legado(desde, gravadas, limite):
+            doc = await doc_ref.get()
+            legado = doc.to_dict().get("mensagens", []) if doc.exists else []
+    except Exception:
+        log.error("erro ao ler o histórico", exc_info=True)
+        gravadas, legado = [], []
+    pagina = paginas_historico.montar_pagina(gravadas, legado, pendentes, desde, antes, limite)
+    if not desde and not antes and not pagina["historico"]:
+        bot_cfg = await obter_config_bot()
+        saudacao = bot_cfg.get("mensagem_inicial") or bot.BOT_CONFIG_DEFAULTS["mensagem_inicial"]
+        await salvar_historico(usuario_id, [("assistant", saudacao)], bot_cfg.get("max_historico_salvar"))
+        pagina = paginas_historico.montar_pagina([], [], bot.fila_historico.mesclar(usuario_id, []), None, None, limite)
+        etag = None
+    status, corpo, cabecalhos = paginas_historico.resposta(
+        pagina, etag, request.headers.get("if-none-match"), request.headers.get("accept-encoding"))
+    return Response(corpo, status_code=status, headers=cabecalhos)
+
+
+@_com_contagem("/chat_app")
+@_na_loja
+async def chat_app(request):
+    if request.method == "GET":
+        usuario_id = request.query_params.get("usuario_id") or request.query_params.get("wa_id")
+        if not usuario_id:
+            return JSONResponse({"historico": []})
+        return await _pagina_historico(request, usuario_id)
+
+    inicio_turno = time.perf_counter()
+    data = await _corpo_json(request) or {}
+    usuario_id = data.get("usuario_id") or data.get("wa_id")
+    mensagem = data.get("mensagem") or data.get("prompt") or ""
+    if not mensagem.strip():
+        return JSONResponse({"error": "Mensagem vazia ignorada para evitar disparos falsos"})
+
+    origem = "APP" if usuario_id and usuario_id.startswith("cliente_") else "WHATSAPP"
+    log.debug("mensagem do app", extra={"usuario_id": usuario_id, "origem": origem, "mensagem": mensagem})
+    recusa = await asyncio.to_thread(bot.limite_cliente, usuario_id, await obter_config_bot())
+    if recusa is not None:
+        return JSONResponse({"resposta": recusa or None})
+    metricas.TURNOS.labels(canal="app").inc()
+    with prazo.prazo_turno():
+        ai_response = await get_openai_response(mensagem, usuario_id, origem)
+    metricas.TURNO_SEGUNDOS.labels(canal="app").observe(time.perf_counter() - inicio_turno)
+    return JSONResponse({"resposta": ai_response})
+
+
+@_com_contagem("/notificar_pronto")
+@_na_loja
+async def notificar_pronto(request):
+    try:
+        data = await _corpo_json(request) or {}
+        usuario_id, telefone_limpo = bot.destino_aviso(data)
+        if not telefone_limpo and not usuario_id:
+            return JSONResponse({"erro": "Número de telefone (wa_id) não fornecido"}, status_code=400)
+
+        bot_cfg = await obter_config_bot()
+        mensagem = bot.montar_mensagem_pronto(bot_cfg, data.get("nome", "Cliente"), data.get("tipo_servico"))
+        # Push pelo app (fila em lote do notificacoes.py, síncrona): numa thread.
+        push = await asyncio.to_thread(bot.notificar_pelo_app, usuario_id, telefone_limpo, bot_cfg, mensagem,
+                                       {"tipo": "pedido_pronto", "pedido_id": data.get("pedido_id") or ""})
+        if push is not None and push[0] == "enviado":
+            log.info("aviso enviado", extra={"canal": "app", "destino": usuario_id or telefone_limpo})
+            return JSONResponse({"status": "sucesso", "canal": "app"})
+        if not telefone_limpo:
+            return JSONResponse({"erro": "falha_push", "detalhes": push[1] if push else "cliente sem app nem telefone"},
+                                status_code=502)
+
+        inicio = time.perf_counter()
+        response_wa = await enviar_whatsapp(telefone_limpo, mensagem)
+        metricas.NOTIFICACAO_SEGUNDOS.labels(canal="whatsapp").observe(time.perf_counter() - inicio)
+
+        if response_wa.status_code in [200, 201]:
+            metricas.NOTIFICACOES.labels(canal="whatsapp", resultado="enviado").inc()
+            log.info("aviso enviado", extra={"canal": "whatsapp", "destino": telefone_limpo})
+            return JSONResponse({"status": "sucesso", "canal": "whatsapp"})
+        metricas.NOTIFICACOES.labels(canal="whatsapp", resultado="falhou").inc()
+        log.warning("aviso recusado pela Meta", extra={"status": response_wa.status_code, "detalhes": response_wa.text})
+        return JSONResponse({"erro": "falha_meta", "detalhes": response_wa.json()}, status_code=response_wa.status_code)
+    except Exception as e:
+        log.error("erro no aviso de pedido pronto", exc_info=True)
+        return JSONResponse({"erro": str(e)}, status_code=500)
+
+
+# CORS liberado como o CORS(app) do Flask — o painel chama /notificar_pronto
+# do navegador. Só nas rotas daqui: as do Flask já recebem do flask_cors.
+_CORS = [Middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"])]
+
+app = Starlette(
+    routes=[
+        Route("/webhook", webhook, methods=["GET", "POST", "OPTIONS"], middleware=_CORS),
+        Route("/chat_app", chat_app, methods=["GET", "POST", "OPTIONS"], middleware=_CORS),
+        Route("/notificar_pronto", notificar_pronto, methods=["POST", "OPTIONS"], middleware=_CORS),
+        # Todo o resto continua no Flask do app.py (painel, /metrics, /admin...).
+        Mount("/", app=WSGIMiddleware(bot.app, workers=4)),
+    ],
+    lifespan=_ciclo_de_vida,
+)
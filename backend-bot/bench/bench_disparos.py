@@ -0,0 +1,262 @@
+"""Disparos de promoção (disparos.py) de ponta a ponta, sem rede.
+
+Sobe o app.py com o Firestore em memória (firestore_memoria.py) e um
+público sintético: PEDIDOS pedidos de CLIENTES clientes nos últimos dias
+(cada cliente com vários pedidos), mais pedidos antigos que ficam fora,
+parte dos clientes com o app (token FCM), alguns descadastrados (SAIR) e
+alguns com aceita_promocoes desligado. Os envios vão pra funções falsas que
+anotam a hora de cada um; a primeira resposta de alguns números é o limite
+da Meta (volta pra fila).
+
+No meio do disparo o envio quebra (queda do processo), o mandato vence e o
+disparo é retomado como o líder da varredura faria. Confere:
+
+- cada cliente recebeu no máximo uma vez, pelo canal certo, e ninguém de
+  fora do público (antigo, descadastrado, aceita_promocoes=false);
+- os presos na queda (a página que estava saindo) viraram 'incerto' e
+  não foram reenviados;
+- a contagem do documento bate com os destinatários;
+- nenhum segundo teve mais envios de WhatsApp que o por_segundo (mais a
+  rajada de um segundo do balde);
+- "SAIR" no webhook descadastra e responde;
+- com uma página mais longa que o mandato e outro processo retomando, o
+  dono renova no meio da página; se não renovar, o outro pega e a página
+  que estava saindo não é contada duas vezes (enviado e incerto).
+
+    python bench/bench_disparos.py
+    python bench/bench_disparos.py --clientes 2000 --por-segundo 200
+
+Sai com código 1 se alguma conferência falhar.
+"""
+import argparse
+import contextlib
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+PASTA = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, PASTA)
+sys.path.insert(0, os.path.dirname(PASTA))
+
+import firestore_memoria  # noqa: E402
+from bench_funcoes import _carregar_app  # noqa: E402
+
+
+class Queda(Exception):
+    pass
+
+
+def semear(cliente, args):
+    """Devolve (telefones no público, telefones fora, usuários com app)."""
+    agora = datetime.now(timezone.utc)
+    dentro, fora, com_app = set(), set(), set()
+    for n in range(args.clientes):
+        telefone = f"5535999{n:06d}"
+        usuario_id = f"cliente_{n:06d}" if n % 3 == 0 else None
+        if usuario_id:
+            usuario = {"nome": f"Cliente {n}", "fcm_token": f"token-{n}"}
+            if n % 30 == 0:
+                usuario["aceita_promocoes"] = False
+            cliente.collection("usuarios_app").document(usuario_id).set(usuario)
+        for k in range(args.pedidos_por_cliente):
+            cliente.collection("pedidos").add({
+                "telefone_cliente": telefone, "usuario_id": usuario_id, "nome_cliente": f"cliente {n}",
+                "hora_pedido": agora - timedelta(days=(n + k) % 20, minutes=k),
+            })
+        if n % 25 == 0:
+            cliente.collection("promocoes_descadastros").document(telefone).set({"em": agora})
+        if n % 25 == 0 or (usuario_id and n % 30 == 0):
+            fora.add(telefone)
+        else:
+            dentro.add(telefone)
+            if usuario_id:
+                com_app.add(usuario_id)
+    for n in range(args.clientes // 10):
+        cliente.collection("pedidos").add({"telefone_cliente": f"5535888{n:06d}", "nome_cliente": "antigo",
+                                           "hora_pedido": agora - timedelta(days=90)})
+        fora.add(f"5535888{n:06d}")
+    return dentro, fora, com_app
+
+
+def esperar(disparador, disparo_id, limite_s=120):
+    fim = time.monotonic() + limite_s
+    while time.monotonic() < fim:
+        with disparador._lock:
+            if disparo_id not in disparador._rodando:
+                return True
+        time.sleep(0.05)
+    return False
+
+
+def rodar(args):
+    os.environ["INSTANTANEO_DIR"] = tempfile.mkdtemp(prefix="bench_disparos_inst_")
+    os.environ["FILA_HISTORICO_DIR"] = tempfile.mkdtemp(prefix="bench_disparos_fila_")
+    os.environ["ADMISSAO_DIR"] = tempfile.mkdtemp(prefix="bench_disparos_adm_")
+    os.environ["ADMIN_TOKEN"] = "bench"
+    cliente = firestore_memoria.Cliente()
+    dentro, fora, com_app = semear(cliente, args)
+    with open(os.devnull, "w") as nulo, contextlib.redirect_stdout(nulo):
+        app = _carregar_app(cliente)
+    import disparos
+
+    falhas = []
+
+    def conferir(condicao, texto):
+        if not condicao:
+            falhas.append(texto)
+
+    lock = threading.Lock()
+    whatsapp, pelo_app, retidos = [], [], set()
+    quebrar_em = {"n": args.queda_em}
+
+    def enviar_whatsapp(telefone, campos, nome):
+        with lock:
+            if quebrar_em["n"] is not None:
+                quebrar_em["n"] -= 1
+                if quebrar_em["n"] < 0:
+                    raise Queda("queda simulada")
+            if int(telefone[-2:]) % 7 == 0 and telefone not in retidos:
+                retidos.add(telefone)
+                return "retido", "HTTP 429"
+            whatsapp.append((time.monotonic(), telefone, nome))
+        return "enviado", None
+
+    def enviar_app(mensagens):
+        with lock:
+            pelo_app.extend(token for token, _titulo, _corpo, _dados in mensagens)
+        return [("enviado", None)] * len(mensagens)
+
+    app.enviar_whatsapp_disparo = enviar_whatsapp
+    app.enviar_app_disparo = enviar_app
+    # Sem isso o freio do limite da Meta (FREIO_S) domina o tempo do bench.
+    disparos.FREIO_S = 0.2
+    cabecalho = {"Authorization": "Bearer bench"}
+    corpo_disparo = {"mensagem": "Oi {nome}! Pizza grande pela metade do preço hoje.", "titulo": "Promoção",
+                     "canais": ["app", "whatsapp"], "publico": {"tipo": "pedido_recente", "dias": 30},
+                     "por_segundo": args.por_segundo}
+    cliente_http = app.app.test_client()
+
+    inicio = time.monotonic()
+    with open(os.devnull, "w") as nulo, contextlib.redirect_stdout(nulo):
+        resposta = cliente_http.post("/admin/disparos", json=corpo_disparo, headers=cabecalho)
+        disparo_id = resposta.get_json()["id"]
+        conferir(resposta.status_code == 201, f"POST /admin/disparos: {resposta.status_code}")
+        disparador = app.disparador.obter()
+        conferir(esperar(disparador, disparo_id), "o disparo não parou na queda")
+        ref = cliente.collection(disparos.COLECAO).document(disparo_id)
+        conferir(ref.get().to_dict()["status"] == "rodando", "a queda não deixou o disparo rodando")
+        enviados_antes = len(whatsapp)
+        # Mandato vencido: o líder da varredura pega de novo.
+        quebrar_em["n"] = None
+        ref.update({"mandato_expira_em": datetime.now(timezone.utc) - timedelta(seconds=1)})
+        disparador.retomar()
+        conferir(esperar(disparador, disparo_id), "o disparo retomado não terminou")
+    segundos = time.monotonic() - inicio
+
+    dados = ref.get().to_dict()
+    destinatarios = {s.id: s.to_dict() for s in ref.collection(disparos.SUBCOLECAO).stream()}
+    por_status = Counter(d["status"] for d in destinatarios.values())
+    contados = Counter(telefone for _t, telefone, _n in whatsapp)
+    print(f"{len(dentro)} clientes no público, {len(fora)} fora; {len(destinatarios)} destinatários "
+          f"({dict(por_status)}) em {segundos:.1f}s")
+    print(f"WhatsApp: {len(whatsapp)} ({enviados_antes} antes da queda), app: {len(pelo_app)}, "
+          f"retidos uma vez: {len(retidos)}; contagem {dados['contagem']}, {dados.get('taxa_por_minuto')}/min")
+
+    conferir(dados["status"] == "concluido", f"status final {dados['status']}")
+    conferir(max(contados.values(), default=0) <= 1, "telefone recebeu mais de uma vez")
+    conferir(len(set(pelo_app)) == len(pelo_app), "token recebeu mais de uma vez")
+    conferir(not (set(contados) & fora), "mensagem pra quem está fora do público")
+    conferir(set(pelo_app) == {f"token-{int(u.split('_')[1])}" for u in com_app},
+             "clientes com app não receberam pelo app")
+    conferir(por_status["incerto"] > 0 and por_status["incerto"] == dados["contagem"]["incertos"],
+             "os presos na queda não viraram incerto")
+    incertos = {d["telefone"] for d in destinatarios.values() if d["status"] == "incerto"}
+    conferir(not any(t in incertos for _t, t, _n in whatsapp[enviados_antes:]), "incerto foi reenviado")
+    conferir(set(destinatarios) == dentro, "destinatários diferentes do público")
+    conferir(dados["contagem"]["total"] == len(destinatarios), "contagem.total diferente dos destinatários")
+    conferir(dados["contagem"]["enviados"] == por_status["enviado"], "contagem.enviados diferente dos destinatários")
+    conferir({d["telefone"] for d in destinatarios.values() if d["status"] == "enviado" and d["canal"] == "whatsapp"}
+             <= set(contados), "destinatário 'enviado' que não recebeu")
+    conferir(por_status["pendente"] == 0 and por_status["enviando"] == 0, "sobrou destinatário pendente")
+
+    # Janela de um segundo: por_segundo fichas mais a rajada inicial do balde.
+    horas = sorted(t for t, _telefone, _n in whatsapp)
+    pico, j = 0, 0
+    for i, t in enumerate(horas):
+        while horas[j] < t - 1:
+            j += 1
+        pico = max(pico, i - j + 1)
+    print(f"pico de WhatsApp num segundo: {pico} (por_segundo {args.por_segundo})")
+    conferir(pico <= 2 * args.por_segundo + 1, f"{pico} envios num segundo, acima de {args.por_segundo}")
+
+    respostas = []
+    app.send_message = lambda para, texto: respostas.append((para, texto))
+    corpo = {"entry": [{"changes": [{"value": {"metadata": {"phone_number_id": "PN"},
+                                               "messages": [{"id": "wamid.sair", "from": "5535999000001",
+                                                             "text": {"body": "SAIR"}}]}}]}]}
+    with open(os.devnull, "w") as nulo, contextlib.redirect_stdout(nulo):
+        cliente_http.post("/webhook", json=corpo)
+    conferir(cliente.collection("promocoes_descadastros").document("5535999000001").get().exists,
+             "SAIR não descadastrou")
+    conferir(respostas == [("5535999000001", app.MENSAGEM_DESCADASTRO)], f"SAIR respondeu {respostas}")
+
+    # Página mais longa que o mandato, com outro processo tentando retomar o
+    # tempo todo. Renovando, o disparo não troca de dono; sem renovar, o
+    # outro pega no meio da página e o primeiro não pode gravar o fechamento
+    # dela por cima dos 'incerto' (contaria o cliente duas vezes).
+    disparos.MANDATO_S = 0.6
+    outro = disparos.Disparador(cliente, enviar_whatsapp, enviar_app)
+    outro._dono = "outra-maquina:1"
+    for renovando in (True, False):
+        if not renovando:
+            disparador._renovar = lambda ref: True
+        del whatsapp[:]
+        with open(os.devnull, "w") as nulo, contextlib.redirect_stdout(nulo):
+            resposta = cliente_http.post("/admin/disparos", json={**corpo_disparo, "por_segundo": 100},
+                                         headers=cabecalho)
+            ref = cliente.collection(disparos.COLECAO).document(resposta.get_json()["id"])
+            while ref.get().to_dict()["status"] == "pendente":
+                time.sleep(0.01)
+            while ref.get().to_dict()["status"] != "concluido" and time.monotonic() - inicio < 300:
+                outro.retomar()
+                time.sleep(0.05)
+            conferir(esperar(disparador, ref.id) and esperar(outro, ref.id), "disparo com mandato curto não terminou")
+        dados = ref.get().to_dict()
+        por_status = Counter(s.to_dict()["status"] for s in ref.collection(disparos.SUBCOLECAO).stream())
+        caso = "renovando" if renovando else "sem renovar"
+        print(f"mandato curto, {caso}: dono {dados.get('dono')}, {dict(por_status)}")
+        conferir(dados["status"] == "concluido", f"{caso}: status final {dados['status']}")
+        conferir(max(Counter(t for _t, t, _n in whatsapp).values(), default=0) <= 1,
+                 f"{caso}: telefone recebeu mais de uma vez")
+        conferir(dados["contagem"]["enviados"] == por_status["enviado"],
+                 f"{caso}: contagem.enviados {dados['contagem']['enviados']} com {por_status['enviado']} enviados")
+        conferir(dados["contagem"]["incertos"] == por_status["incerto"], f"{caso}: contagem.incertos diferente")
+        if renovando:
+            conferir(dados.get("dono") == disparador._dono and not por_status["incerto"],
+                     "renovando: outro processo pegou o disparo")
+        else:
+            conferir(dados.get("dono") == outro._dono and por_status["incerto"] > 0,
+                     "sem renovar: o outro processo não retomou no meio da página")
+    del disparador._renovar
+    return falhas
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--clientes", type=int, default=600)
+    parser.add_argument("--pedidos-por-cliente", type=int, default=3)
+    parser.add_argument("--por-segundo", type=float, default=60)
+    parser.add_argument("--queda-em", type=int, default=150, help="envios de WhatsApp antes da queda simulada")
+    falhas = rodar(parser.parse_args())
+    if falhas:
+        print("\nFALHOU:\n- " + "\n- ".join(falhas))
+        sys.exit(1)
+    print("\nDisparo retomado sem repetir ninguém, dentro do limite.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+"""Micro-benchmarks das funções quentes do bot, sem rede.
+
+Mede o custo de CPU do que roda em quase todo turno — normalização de
+termos, busca aproximada de item/sabor/bairro, checagem de horário,
+texto do cardápio, montagem do prompt de sistema e o corte do histórico —
+com o Firestore trocado por um em memória (firestore_memoria.py) e
+cardápios/listas de bairros sintéticos de vários tamanhos. Assim dá pra
+ver como cada função escala com o tamanho da loja, e pegar regressão
+antes do deploy:
+
+    python bench/bench_funcoes.py --salvar bench/baseline.json   # nova linha de base
+    python bench/bench_funcoes.py --comparar bench/baseline.json # falha se piorar
+
+No modo --comparar o script sai com código 1 se alguma medição ficar mais
+de --limite (padrão 25%) acima da linha de base. A linha de base é da
+máquina onde foi gravada — compare sempre na mesma máquina (ou grave uma
+nova antes de mexer no código).
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+PASTA = os.path.dirname(os.path.abspath(__file__))
+PASTA_BOT = os.path.dirname(PASTA)
+sys.path.insert(0, PASTA)
+sys.path.insert(0, PASTA_BOT)
+
+import firestore_memoria  # noqa: E402
+
+TAMANHOS_CARDAPIO = [50, 500, 5000]
+TAMANHOS_BAIRROS = [10, 100, 1000]
+
+_CATEGORIAS = ["Pizzas", "Esfihas", "Pastéis", "Salgados Fritos", "Salgados Assados", "Doces", "Lanches", "Porções"]
+_SABORES = ["calabresa", "frango com catupiry", "quatro queijos", "portuguesa", "marguerita", "carne seca",
+            "palmito", "brócolis", "atum", "bacon", "chocolate", "banana com canela", "escarola", "milho"]
+_BAIRROS = ["Centro", "Vila Formosa", "Jardim Paraíso", "San Genaro", "São Judas Tadeu", "Jardim São José",
+            "Vila Mariana", "Jardim América", "Parque das Nações", "Santa Luzia"]
+
+
+def _carregar_app(cliente):
+    """Importa o app.py com o Firestore em memória no lugar do de verdade
+    (nada de credencial nem rede) e devolve o módulo."""
+    import firebase_admin
+    from firebase_admin import credentials, firestore
+
+    os.environ.setdefault("OPENAI_API_KEY", "bench")
+    # Linha de log por requisição atrapalha a medida; WARNING pra cima ainda sai.
+    os.environ.setdefault("LOG_NIVEL", "WARNING")
+    os.environ.setdefault("INSTANTANEO_DIR", os.path.join(tempfile.gettempdir(), "bench_instantaneo"))
+    os.environ.setdefault("FILA_HISTORICO_DIR", os.path.join(tempfile.gettempdir(), "bench_fila_historico"))
+    credentials.Certificate = lambda *args, **kwargs: None
+    firebase_admin.initialize_app = lambda *args, **kwargs: firebase_admin._apps.setdefault("[DEFAULT]", object())
+    firestore.client = lambda *args, **kwargs: cliente
+    import app
+    return app
+
+
+def cardapio_sintetico(n):
+    itens = []
+    for i in range(n):
+        categoria = _CATEGORIAS[i % len(_CATEGORIAS)]
+        sabor = _SABORES[i % len(_SABORES)]
+        nome = f"{categoria.lower().rstrip('s')} {sabor} {i // len(_SABORES)}"
+        itens.append({
+            "nome": nome, "nome_exibicao": nome.title(), "categoria": categoria,
+            "preco": 5 + (i % 60) * 0.75, "ingredientes": f"{sabor}, mussarela",
+            "pontos_fidelidade": i % 10, "disponivel": i % 17 != 0,
+        })
+    return itens
+
+
+def bairros_sinteticos(n):
+    return [_BAIRROS[i % len(_BAIRROS)] + ("" if i < len(_BAIRROS) else f" {i // len(_BAIRROS)}") for i in range(n)]
+
+
+def config_bot(bairros):
+    dias = {dia: {"aberto": True, "abre": "18:00", "fecha": "00:30"} for dia in ["seg", "ter", "qua", "qui", "sex", "sab", "dom"]}
+    return {
+        "ativo": True, "bairros_entrega": bairros, "taxa_entrega": 6,
+        "cidade_atendida": "São Sebastião do Paraíso",
+        "instrucoes_extras": "Aos domingos a borda recheada sai pela metade do preço.",
+        "horario_funcionamento": {"ativo": True, "dias": dias},
+    }
+
+
+def semear(cliente, itens, bairros, mensagens_historico=30):
+    cliente.limpar()
+    cliente.collection("configuracoes").document("bot").set(config_bot(bairros))
+    for i, item in enumerate(itens):
+        cliente.collection("cardapio").document(f"item_{i:05d}").set(item)
+    agora = datetime.now(timezone.utc)
+    cliente.collection("historico_conversas").document("5535999990000").set({
+        "mensagens": [{"role": "user" if i % 2 == 0 else "assistant", "content": f"mensagem {i} " + "x" * 80,
+                       "timestamp": agora - timedelta(minutes=mensagens_historico - i)}
+                      for i in range(mensagens_historico)],
+        "ultima_interacao": agora,
+    })
+
+
+def medir(funcao, repeticoes=5, alvo_s=0.2):
+    """Microssegundos por chamada: calibra quantas chamadas cabem em ~alvo_s,
+    repete e devolve mediana e mínimo (o mínimo é o menos ruidoso)."""
+    numero = 1
+    while True:
+        inicio = time.perf_counter()
+        for _ in range(numero):
+            funcao()
+        gasto = time.perf_counter() - inicio
+        if gasto >= alvo_s / 4 or numero >= 1 << 20:
+            break
+        numero *= 4
+    numero = max(1, int(numero * (alvo_s / max(gasto, 1e-9))))
+    amostras = []
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        for _ in range(numero):
+            funcao()
+        amostras.append((time.perf_counter() - inicio) / numero * 1e6)
+    return {"mediana_us": round(statistics.median(amostras), 3), "min_us": round(min(amostras), 3), "chamadas": numero}
+
+
+def casos(app, cliente):
+    """(nome, preparação, função) de cada medição. A preparação popula o
+    Firestore em memória do tamanho certo antes de medir."""
+    lista = []
+
+    termos = ["  São Judas Tadeu ", "PASTÉIS de Carne", "coração", "Jardim  Paraíso", "açaí 500ml"] * 40
+    lista.append(("normalizar_termo[x200]", lambda: None, lambda: [app._normalizar_termo(t) for t in termos]))
+
+    cfg_horario = config_bot([])
+    lista.append(("verificar_horario_funcionamento", lambda: None,
+                  lambda: app.verificar_horario_funcionamento(cfg_horario)))
+
+    cfg_prompt = {**app.BOT_CONFIG_DEFAULTS, **config_bot(_BAIRROS)}
+    lista.append(("montar_system_prompt", lambda: None,
+                  lambda: app.montar_system_prompt(cfg_prompt, "5535999990000", "Murilo Amorim", "")))
+
+    for n in TAMANHOS_CARDAPIO:
+        itens = cardapio_sintetico(n)
+        preparar = (lambda itens=itens: semear(cliente, itens, _BAIRROS))
+        pedido = [{"nome_produto": itens[1]["nome"], "quantidade": 2},
+                  {"nome_produto": itens[n // 2 + 1]["nome"].replace(" ", "  ").upper()},
+                  {"nome_produto": "pastel de salsixa"}]
+        lista.append((f"listar_cardapio[{n}]", preparar, app.listar_cardapio))
+        lista.append((f"consultar_sabor[{n}]", preparar, lambda: app.consultar_sabor("pizza de calabreza")))
+        lista.append((f"montar_itens_pedido[{n}]", preparar,
+                      lambda pedido=pedido: app._montar_itens_pedido(pedido, "ENTREGA")))
+
+    for n in TAMANHOS_BAIRROS:
+        bairros = bairros_sinteticos(n)
+        lista.append((f"verificar_bairro_entrega[{n}]", (lambda bairros=bairros: semear(cliente, [], bairros)),
+                      lambda: app.verificar_bairro_entrega("sao genaro")))
+
+    # Enfileirar + a gravação que o thread da fila faria (fila_historico.py):
+    # o custo total, não só o que fica no caminho do turno.
+    lista.append(("salvar_historico_firestore[30]", lambda: semear(cliente, [], _BAIRROS),
+                  lambda: (app.salvar_historico_firestore("5535999990000", "user", "quero uma calabresa", 30),
+                           app.fila_historico.gravar())))
+    return lista
+
+
+def rodar(filtro=None, repeticoes=5, alvo_s=0.2):
+    cliente = firestore_memoria.Cliente()
+    with open(os.devnull, "w") as nulo, contextlib.redirect_stdout(nulo):
+        app = _carregar_app(cliente)
+    resultados = {}
+    for nome, preparar, funcao in casos(app, cliente):
+        if filtro and filtro not in nome:
+            continue
+        preparar()
+        # O app lê cardápio/config da cópia local (instantaneo.py), que o
+        # listener do Firestore em memória atualiza num thread: espera a
+        # entrega e publica na hora, pra nada disso rodar durante a medida.
+        cliente.aguardar_ouvintes()
+        app.instantaneo.recarregar()
+        # O que ainda sair de log no stdout (WARNING pra cima) é descartado;
+        # o custo de pôr o registro na fila continua medido.
+        with open(os.devnull, "w") as nulo, contextlib.redirect_stdout(nulo):
+            resultados[nome] = medir(funcao, repeticoes, alvo_s)
+        print(f"{nome:<40}{resultados[nome]['mediana_us']:>14.1f} µs  (mín {resultados[nome]['min_us']:.1f})", flush=True)
+    return resultados
+
+
+def comparar(resultados, linha_base, limite):
+    piores = []
+    print(f"\n{'medição':<40}{'base µs':>12}{'agora µs':>12}{'variação':>10}")
+    for nome, atual in resultados.items():
+        base = (linha_base.get("resultados") or {}).get(nome)
+        if not base:
+            print(f"{nome:<40}{'-':>12}{atual['mediana_us']:>12.1f}{'nova':>10}")
+            continue
+        variacao = atual["mediana_us"] / base["mediana_us"] - 1
+        marca = "  <-- REGRESSÃO" if variacao > limite else ""
+        print(f"{nome:<40}{base['mediana_us']:>12.1f}{atual['mediana_us']:>12.1f}{variacao:>+10.0%}{marca}")
+        if variacao > limite:
+            piores.append(nome)
+    return piores
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--salvar", help="grava os resultados como linha de base nesse arquivo")
+    parser.add_argument("--comparar", help="compara com a linha de base desse arquivo")
+    parser.add_argument("--limite", type=float, default=0.25, help="piora máxima aceita no --comparar (0.25 = 25%%)")
+    parser.add_argument("--filtro", help="só as medições cujo nome contém esse texto")
+    parser.add_argument("--repeticoes", type=int, default=5)
+    parser.add_argument("--alvo-ms", type=float, default=200, help="tempo de cada repetição")
+    args = parser.parse_args()
+
+    resultados = rodar(args.filtro, args.repeticoes, args.alvo_ms / 1000)
+
+    if args.salvar:
+        with open(args.salvar, "w", encoding="utf-8") as f:
+            json.dump({
+                "gravado_em": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                "python": platform.python_version(),
+                "maquina": platform.machine(),
+                "resultados": resultados,
+            }, f, indent=2, ensure_ascii=False)
+            f.write("\n")
+        print(f"\nLinha de base gravada em {args.salvar}")
+
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as f:
+            linha_base = json.load(f)
+        piores = comparar(resultados, linha_base, args.limite)
+        if piores:
+            print(f"\n{len(piores)} medição(ões) pioraram mais de {args.limite:.0%}: {', '.join(piores)}")
+            sys.exit(1)
+        print(f"\nNenhuma regressão acima de {args.limite:.0%}.")
+
+
+if __name__ == "__main__":
+    main()
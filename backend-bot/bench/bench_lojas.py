@@ -0,0 +1,203 @@
+"""Várias lojas num processo só (lojas.py): isolamento e memória.
+
+Sobe o app.py com o Firestore em memória (firestore_memoria.py) e N lojas
+(padrão 20: a principal e mais 19 no prefixo lojas/<id>), cada uma com a
+sua config, cardápio e apelidos. Uma delas tem um cardápio maior que o
+limite de memória da loja. Pra cada loja, em sequência:
+
+- config, cardápio, sabor, bairro aprendido e horário lidos dentro dela —
+  e nada da vizinha aparece;
+- um webhook com o phone_number_id dela responde com a saudação dela e
+  grava o histórico embaixo do prefixo dela;
+- o heap (tracemalloc) depois de cada loja nova.
+
+Depois faz mais VOLTAS voltas por todas as lojas e confere que o heap
+parou de crescer: cada loja custa o que cabe no limite dela, uma vez.
+
+    python bench/bench_lojas.py
+    python bench/bench_lojas.py --lojas 50 --itens 500 --limite-mb 0.5
+
+Sai com código 1 se alguma conferência falhar.
+"""
+import argparse
+import contextlib
+import gc
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+PASTA = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, PASTA)
+sys.path.insert(0, os.path.dirname(PASTA))
+
+import firestore_memoria  # noqa: E402
+from bench_funcoes import _carregar_app, cardapio_sintetico  # noqa: E402
+
+VOLTAS = 3
+# Folga por loja além do limite do instantâneo: clientes, filas, agenda,
+# séries das métricas.
+FOLGA_POR_LOJA = 256 * 1024
+# O limite conta bytes serializados; em objetos Python o mesmo conjunto
+# ocupa algumas vezes isso.
+FATOR_OBJETOS = 6
+
+
+def _rss_kib():
+    try:
+        with open("/proc/self/status") as f:
+            for linha in f:
+                if linha.startswith("VmRSS:"):
+                    return int(linha.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+def _heap():
+    """Heap do processo sem o Firestore em memória — os documentos gravados
+    ali são o banco, não o bot."""
+    gc.collect()
+    foto = tracemalloc.take_snapshot().filter_traces([
+        tracemalloc.Filter(False, firestore_memoria.__file__),
+        tracemalloc.Filter(False, tracemalloc.__file__),
+    ])
+    return sum(estat.size for estat in foto.statistics("filename"))
+
+
+def semear_loja(cliente, loja, itens):
+    base = f"{loja.prefixo}/" if loja.prefixo else ""
+    dias = {dia: {"aberto": True, "abre": "00:00", "fecha": "23:59"} for dia in ["seg", "ter", "qua", "qui", "sex", "sab", "dom"]}
+    cliente.collection(f"{base}configuracoes").document("bot").set({
+        "nome_empresa": f"Empresa {loja.id}",
+        "mensagem_inicial": f"Olá! Aqui é a {loja.id}.",
+        "bairros_entrega": [f"Bairro {loja.id}"],
+        "admissao_por_minuto": 0, "admissao_concorrencia": 0,
+        "horario_funcionamento": {"ativo": True, "dias": dias},
+    })
+    for i, item in enumerate(itens):
+        cliente.collection(f"{base}cardapio").document(f"item_{i:05d}").set(item)
+    cliente.collection(f"{base}cardapio").document("especial").set({
+        "nome": f"especial {loja.id}", "nome_exibicao": f"Especial {loja.id}", "categoria": "Pizzas",
+        "preco": 40, "disponivel": True,
+    })
+    cliente.collection(f"{base}bairros_aprendizado").document("vizinhanca").set({"bairro_oficial": f"Bairro {loja.id}"})
+
+
+def rodar(args):
+    os.environ["INSTANTANEO_DIR"] = tempfile.mkdtemp(prefix="bench_lojas_inst_")
+    os.environ["FILA_HISTORICO_DIR"] = tempfile.mkdtemp(prefix="bench_lojas_fila_")
+    os.environ["ADMISSAO_DIR"] = tempfile.mkdtemp(prefix="bench_lojas_adm_")
+    cliente = firestore_memoria.Cliente()
+    with open(os.devnull, "w") as nulo, contextlib.redirect_stdout(nulo):
+        app = _carregar_app(cliente)
+    import lojas
+
+    configuracao = {"principal": {"memoria_max_mb": args.limite_mb}}
+    for n in range(1, args.lojas):
+        configuracao[f"loja{n:02d}"] = {"phone_number_id": f"PN{n:02d}", "access_token": f"token{n:02d}",
+                                        "memoria_max_mb": args.limite_mb}
+    os.environ["PHONE_NUMBER_ID"] = "PN00"
+    todas = lojas.configurar(configuracao)
+    grande = todas[min(args.grande, len(todas) - 1)]
+    for loja in todas:
+        semear_loja(cliente, loja, cardapio_sintetico(args.itens_grande if loja is grande else args.itens))
+
+    enviadas = []
+    app.send_message = lambda para, texto: enviadas.append((lojas.atual().id, para, texto))
+    falhas = []
+
+    def conferir(condicao, texto):
+        if not condicao:
+            falhas.append(texto)
+
+    def usar_loja(loja, turno):
+        outra = todas[(todas.index(loja) + 1) % len(todas)]
+        with lojas.usar(loja):
+            cfg = app.obter_config_bot()
+            conferir(cfg.get("nome_empresa") == f"Empresa {loja.id}", f"{loja.id}: config de outra loja")
+            texto = app.listar_cardapio()
+            conferir(f"Especial {loja.id}" in texto and f"Especial {outra.id}" not in texto,
+                     f"{loja.id}: cardápio de outra loja")
+            app.consultar_sabor("calabresa")
+            conferir(f"Bairro {outra.id}" not in str(app.verificar_bairro_entrega("vizinhança")),
+                     f"{loja.id}: apelido de bairro de outra loja")
+            app.verificar_horario_funcionamento(cfg)
+        numero = lojas.obter(loja.id).phone_number_id
+        wa_id = f"55359{turno:04d}{todas.index(loja):04d}"
+        corpo = {"entry": [{"changes": [{"value": {
+            "metadata": {"phone_number_id": numero},
+            "messages": [{"id": f"wamid.{loja.id}.{turno}", "from": wa_id, "text": {"body": "oi"}}],
+        }}]}]}
+        antes = len(enviadas)
+        app.app.test_client().post("/webhook", json=corpo)
+        conferir(enviadas[antes:] == [(loja.id, wa_id, f"Olá! Aqui é a {loja.id}.")],
+                 f"{loja.id}: webhook respondeu {enviadas[antes:]}")
+
+    tracemalloc.start()
+    with open(os.devnull, "w") as nulo, contextlib.redirect_stdout(nulo):
+        # Carrega o que é de todo processo (módulos preguiçosos, Flask) antes
+        # da primeira medição.
+        app.app.test_client().get("/")
+    base = _heap()
+    rss_base = _rss_kib()
+    print(f"{'loja':<12}{'itens':>7}{'heap total KiB':>16}{'esta loja KiB':>15}{'limite KiB':>12}")
+    anterior = base
+    for loja in todas:
+        with open(os.devnull, "w") as nulo, contextlib.redirect_stdout(nulo):
+            usar_loja(loja, 0)
+        agora = _heap()
+        itens = args.itens_grande if loja is grande else args.itens
+        print(f"{loja.id:<12}{itens:>7}{(agora - base) // 1024:>16}{(agora - anterior) // 1024:>15}"
+              f"{loja.memoria_max_bytes // 1024:>12}")
+        teto = FATOR_OBJETOS * loja.memoria_max_bytes + FOLGA_POR_LOJA
+        conferir(agora - anterior <= teto, f"{loja.id}: {agora - anterior} bytes, acima de {teto}")
+        anterior = agora
+
+    depois_primeira = _heap()
+    for volta in range(1, VOLTAS + 1):
+        with open(os.devnull, "w") as nulo, contextlib.redirect_stdout(nulo):
+            for loja in todas:
+                usar_loja(loja, volta)
+    time.sleep(0.5)  # a fila do histórico grava por trás
+    final = _heap()
+    crescimento = final - depois_primeira
+    print(f"\n{len(todas)} lojas: heap {(depois_primeira - base) // 1024} KiB depois da primeira volta, "
+          f"{crescimento // 1024:+} KiB depois de mais {VOLTAS}; RSS {(_rss_kib() - rss_base) // 1024:+} MiB")
+    conferir(crescimento <= FOLGA_POR_LOJA, f"heap cresceu {crescimento} bytes depois da primeira volta")
+
+    with lojas.usar(grande):
+        excedidos = set(app.instantaneo.obter()._excedidos)
+    conferir("cardapio" in excedidos, f"{grande.id}: cardápio acima do limite continuou na cópia local")
+    print(f"{grande.id}: fora da cópia local por limite de memória: {sorted(excedidos) or 'nada'}")
+
+    for loja in todas:
+        caminho = (f"{loja.prefixo}/" if loja.prefixo else "") + f"historico_conversas/55359{0:04d}{todas.index(loja):04d}"
+        conferir(cliente.document(caminho).get().exists, f"{loja.id}: histórico fora do prefixo da loja")
+
+    corpo = {"entry": [{"changes": [{"value": {"metadata": {"phone_number_id": "PN-DESCONHECIDO"},
+                                               "messages": [{"id": "wamid.x", "from": "1", "text": {"body": "oi"}}]}}]}]}
+    antes = len(enviadas)
+    with open(os.devnull, "w") as nulo, contextlib.redirect_stdout(nulo):
+        app.app.test_client().post("/webhook", json=corpo)
+    conferir(len(enviadas) == antes, "número desconhecido foi respondido")
+    return falhas
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--lojas", type=int, default=20)
+    parser.add_argument("--itens", type=int, default=300, help="itens no cardápio de cada loja")
+    parser.add_argument("--itens-grande", type=int, default=6000, help="itens no cardápio da loja grande")
+    parser.add_argument("--grande", type=int, default=5, help="posição da loja com o cardápio grande")
+    parser.add_argument("--limite-mb", type=float, default=1.0, help="memoria_max_mb de cada loja")
+    falhas = rodar(parser.parse_args())
+    if falhas:
+        print("\nFALHOU:\n- " + "\n- ".join(falhas))
+        sys.exit(1)
+    print("\nLojas isoladas e memória limitada.")
+
+
+if __name__ == "__main__":
+    main()
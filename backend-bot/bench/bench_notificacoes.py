@@ -0,0 +1,211 @@
+"""Aviso de pedido pronto (/notificar_pronto): push do app em lote e
+WhatsApp de reserva, contra um FCM e uma Graph API falsos.
+
+Sobe o app.py com o Firestore em memória (firestore_memoria.py) e troca o
+firebase_admin.messaging do notificacoes.py por um stub que guarda cada
+send_each (quantas mensagens, pra quem) e responde com a latência de
+LATENCIA_FCM_S; a Graph API do WhatsApp por um stub que só anota. Tokens
+"morto-..." o FCM diz que não existem mais; "quebrado-..." são malformados.
+Confere:
+
+- AVISOS clientes do app avisados ao mesmo tempo (o KDS fechando vários
+  pedidos) saem pelo push em poucos send_each, não um por aviso;
+- cliente só do WhatsApp (sem app, ou com o telefone no cadastro do app
+  mas sem token) recebe pelo WhatsApp;
+- token morto ou malformado: o aviso vai pelo WhatsApp e o token sai do
+  usuarios_app — o do vizinho, não; o próximo aviso já vai direto;
+- FCM fora do ar: o aviso vai pelo WhatsApp;
+- bot_notificacoes_total conta cada canal e resultado.
+
+    python bench/bench_notificacoes.py
+    python bench/bench_notificacoes.py --avisos 500
+
+Sai com código 1 se alguma conferência falhar.
+"""
+import argparse
+import contextlib
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+PASTA = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, PASTA)
+sys.path.insert(0, os.path.dirname(PASTA))
+
+import firestore_memoria  # noqa: E402
+from bench_funcoes import _carregar_app  # noqa: E402
+
+LATENCIA_FCM_S = 0.03
+
+
+class UnregisteredError(Exception):
+    pass
+
+
+class InvalidArgumentError(Exception):
+    pass
+
+
+class _Resposta:
+    def __init__(self, exception=None):
+        self.success = exception is None
+        self.exception = exception
+
+
+class MessagingFalso:
+    """O pedaço do firebase_admin.messaging que o notificacoes.py usa."""
+
+    def __init__(self):
+        self.chamadas = []
+        self.fora_do_ar = False
+        self._lock = threading.Lock()
+
+    class Notification:
+        def __init__(self, title=None, body=None):
+            self.title, self.body = title, body
+
+    class Message:
+        def __init__(self, token=None, notification=None, data=None):
+            self.token, self.notification, self.data = token, notification, data
+
+    class BatchResponse:
+        def __init__(self, responses):
+            self.responses = responses
+
+    def send_each(self, mensagens, app=None):
+        time.sleep(LATENCIA_FCM_S)
+        if self.fora_do_ar:
+            raise ConnectionError("FCM fora do ar")
+        with self._lock:
+            self.chamadas.append([m.token for m in mensagens])
+        respostas = []
+        for m in mensagens:
+            if m.token.startswith("morto-"):
+                respostas.append(_Resposta(UnregisteredError("Requested entity was not found.")))
+            elif m.token.startswith("quebrado-"):
+                respostas.append(_Resposta(InvalidArgumentError("The registration token is not a valid FCM registration token")))
+            else:
+                respostas.append(_Resposta())
+        return self.BatchResponse(respostas)
+
+
+class GraphFalsa:
+    def __init__(self):
+        self.enviadas = []
+        self._lock = threading.Lock()
+
+    def post(self, url, headers=None, json=None, timeout=None):
+        with self._lock:
+            self.enviadas.append(json["to"])
+        return type("RespostaGraph", (), {"status_code": 200, "ok": True, "text": "{}", "json": lambda self: {}})()
+
+
+def _contagem_metricas():
+    from prometheus_client import REGISTRY
+    contagem = Counter()
+    for familia in REGISTRY.collect():
+        if familia.name == "bot_notificacoes":
+            for amostra in familia.samples:
+                if amostra.name.endswith("_total"):
+                    contagem[(amostra.labels["canal"], amostra.labels["resultado"])] += amostra.value
+    return contagem
+
+
+def rodar(args):
+    os.environ["INSTANTANEO_DIR"] = tempfile.mkdtemp(prefix="bench_notif_inst_")
+    os.environ["FILA_HISTORICO_DIR"] = tempfile.mkdtemp(prefix="bench_notif_fila_")
+    os.environ["ADMISSAO_DIR"] = tempfile.mkdtemp(prefix="bench_notif_adm_")
+    cliente = firestore_memoria.Cliente()
+    usuarios = cliente.collection("usuarios_app")
+    for n in range(args.avisos):
+        usuarios.document(f"cliente_{n:05d}").set({"nome": f"Cliente {n}", "fcm_token": f"token-{n}",
+                                                   "telefone": f"5535997{n:06d}"})
+    usuarios.document("cliente_morto").set({"fcm_token": "morto-1", "telefone": "5535990000001"})
+    usuarios.document("cliente_quebrado").set({"fcm_token": "quebrado-1", "telefone": "5535990000002"})
+    usuarios.document("cliente_sem_token").set({"telefone": "5535990000003"})
+    with open(os.devnull, "w") as nulo, contextlib.redirect_stdout(nulo):
+        app = _carregar_app(cliente)
+    import notificacoes
+
+    fcm, graph = MessagingFalso(), GraphFalsa()
+    notificacoes.messaging = fcm
+    app.requests = graph
+    http = app.app.test_client()
+    falhas = []
+
+    def conferir(condicao, texto):
+        if not condicao:
+            falhas.append(texto)
+
+    def avisar(corpo):
+        resposta = http.post("/notificar_pronto", json={"nome": "Cliente", "tipo_servico": "ENTREGA", **corpo})
+        return resposta.status_code, resposta.get_json()
+
+    antes = _contagem_metricas()
+    inicio = time.perf_counter()
+    with open(os.devnull, "w") as nulo, contextlib.redirect_stdout(nulo), ThreadPoolExecutor(args.concorrencia) as pool:
+        # Metade pelo usuario_id do pedido do app, metade pelo telefone do cadastro.
+        corpos = [{"wa_id": f"cliente_{n:05d}"} if n % 2 else {"wa_id": f"5535997{n:06d}"} for n in range(args.avisos)]
+        respostas = list(pool.map(avisar, corpos))
+    segundos = time.perf_counter() - inicio
+    canais = Counter(corpo.get("canal") for _status, corpo in respostas)
+    tamanhos = [len(chamada) for chamada in fcm.chamadas]
+    print(f"{args.avisos} avisos com {args.concorrencia} ao mesmo tempo em {segundos:.2f}s: {dict(canais)}; "
+          f"{len(tamanhos)} send_each (média {sum(tamanhos) / max(len(tamanhos), 1):.1f}, máx {max(tamanhos, default=0)})")
+    conferir(canais == {"app": args.avisos}, f"avisos do app fora do push: {dict(canais)}")
+    conferir(not graph.enviadas, "cliente do app recebeu WhatsApp")
+    conferir(len(tamanhos) <= args.avisos / 2, f"{len(tamanhos)} send_each pra {args.avisos} avisos: não juntou")
+
+    with open(os.devnull, "w") as nulo, contextlib.redirect_stdout(nulo):
+        casos = {
+            "só WhatsApp": avisar({"wa_id": "5535912345678"}),
+            "cadastro sem token": avisar({"wa_id": "5535990000003"}),
+            "token morto": avisar({"wa_id": "5535990000001", "usuario_id": "cliente_morto"}),
+            "token malformado": avisar({"wa_id": "5535990000002"}),
+            "token morto, de novo": avisar({"wa_id": "5535990000001", "usuario_id": "cliente_morto"}),
+        }
+        fcm.fora_do_ar = True
+        casos["FCM fora do ar"] = avisar({"wa_id": "5535997000004"})
+        casos["app sem telefone, FCM fora"] = avisar({"wa_id": "cliente_00006"})
+        fcm.fora_do_ar = False
+    for caso, (status, corpo) in casos.items():
+        print(f"  {caso:<28} HTTP {status} {corpo}")
+    for caso in ("só WhatsApp", "cadastro sem token", "token morto", "token malformado", "token morto, de novo",
+                 "FCM fora do ar"):
+        conferir(casos[caso] == (200, {"status": "sucesso", "canal": "whatsapp"}), f"{caso}: {casos[caso]}")
+    conferir(casos["app sem telefone, FCM fora"][0] == 502, "sem telefone e sem push devia dar 502")
+    conferir(graph.enviadas == ["5535912345678", "5535990000003", "5535990000001", "5535990000002",
+                                "5535990000001", "5535997000004"], f"WhatsApp pra {graph.enviadas}")
+    conferir("fcm_token" not in usuarios.document("cliente_morto").get().to_dict(), "token morto continuou")
+    conferir("fcm_token" not in usuarios.document("cliente_quebrado").get().to_dict(), "token malformado continuou")
+    conferir(usuarios.document("cliente_00001").get().to_dict().get("fcm_token") == "token-1", "token bom foi apagado")
+    conferir(sum(1 for chamada in fcm.chamadas for token in chamada if token == "morto-1") == 1,
+             "token morto tentado de novo depois de limpo")
+
+    depois = _contagem_metricas()
+    diferenca = {chave: depois[chave] - antes[chave] for chave in depois if depois[chave] != antes[chave]}
+    print(f"bot_notificacoes_total: {diferenca}")
+    conferir(diferenca.get(("app", "enviado")) == args.avisos, "métrica de push enviado")
+    conferir(diferenca.get(("app", "token_invalido")) == 2, "métrica de token inválido")
+    conferir(diferenca.get(("app", "retido")) == 2, "métrica de push retido")
+    conferir(diferenca.get(("whatsapp", "enviado")) == 6, "métrica de WhatsApp")
+    return falhas
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--avisos", type=int, default=200)
+    parser.add_argument("--concorrencia", type=int, default=32, help="requisições ao mesmo tempo")
+    falhas = rodar(parser.parse_args())
+    if falhas:
+        print("\nFALHOU:\n- " + "\n- ".join(falhas))
+        sys.exit(1)
+    print("\nPush em lote, tokens mortos limpos e WhatsApp de reserva.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""Orçamento de leituras/escritas do Firestore por turno, sem rede.
+
+Sobe o app.py com o Firestore em memória (firestore_memoria.py), um
+cardápio sintético e uma conversa gravada pela fila do histórico (com
+resumo e páginas, como em produção), e roda cada caso dentro de
+firestore_contagem.orcamento_firestore com o máximo da tabela ORCAMENTOS.
+A contagem é a mesma do /metrics e da linha de log do turno (get = 1
+leitura, consulta = 1 por documento, escrita = 1 por documento).
+
+Quem mexer num caminho desses e passar a ler mais — o cardápio de volta
+ao Firestore no calcular_pedido, o /chat_app relendo a conversa inteira
+em vez da página — quebra aqui antes do deploy. Se o aumento for de
+propósito, sobe o número na tabela no mesmo commit.
+
+    python bench/bench_orcamento.py
+
+Sai com código 1 se algum caso passar do orçamento.
+"""
+import argparse
+import contextlib
+import os
+import sys
+import tempfile
+
+PASTA = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, PASTA)
+sys.path.insert(0, os.path.dirname(PASTA))
+
+import firestore_memoria  # noqa: E402
+from bench_funcoes import _BAIRROS, _carregar_app, cardapio_sintetico, semear  # noqa: E402
+
+CONVERSA = "cliente_orcamento"
+TURNOS_CONVERSA = 15
+
+# caso -> (máximo de leituras, máximo de escritas)
+ORCAMENTOS = {
+    # Cardápio e config vêm do instantâneo; só o ultimo_calculo é gravado.
+    "calcular_pedido": (0, 1),
+    # Resumo da conversa + uma página (30 mensagens) + o documento antigo
+    # quando a página vem cheia.
+    "GET /chat_app": (32, 0),
+    # ETag igual: só o resumo.
+    "GET /chat_app (304)": (1, 0),
+    # Consulta largada no primeiro documento paga um, na hora.
+    "stream parcial": (1, 0),
+}
+
+
+def rodar(args):
+    os.environ["INSTANTANEO_DIR"] = tempfile.mkdtemp(prefix="bench_orcamento_inst_")
+    os.environ["FILA_HISTORICO_DIR"] = tempfile.mkdtemp(prefix="bench_orcamento_fila_")
+    os.environ["ADMISSAO_DIR"] = tempfile.mkdtemp(prefix="bench_orcamento_adm_")
+    cliente = firestore_memoria.Cliente()
+    itens = cardapio_sintetico(args.itens)
+    semear(cliente, itens, _BAIRROS)
+    with open(os.devnull, "w") as nulo, contextlib.redirect_stdout(nulo):
+        app = _carregar_app(cliente)
+    from firestore_contagem import OrcamentoFirestoreExcedido, orcamento_firestore
+
+    app.instantaneo.recarregar()
+    for i in range(TURNOS_CONVERSA):
+        app.salvar_mensagens_historico(CONVERSA, [("user", f"pergunta {i}"), ("assistant", f"resposta {i}")])
+    app.fila_historico.gravar()
+    http = app.app.test_client()
+    pedido = [{"nome_produto": itens[1]["nome"], "quantidade": 2},
+              {"nome_produto": itens[len(itens) // 2 + 1]["nome"].upper()}]
+    etag = http.get(f"/chat_app?usuario_id={CONVERSA}").headers.get("ETag")
+
+    def primeiro_do_cardapio():
+        next(iter(app.db.collection("cardapio").stream()))
+
+    casos = {
+        "calcular_pedido": lambda: app.calcular_pedido(CONVERSA, pedido, "ENTREGA"),
+        "GET /chat_app": lambda: http.get(f"/chat_app?usuario_id={CONVERSA}"),
+        "GET /chat_app (304)": lambda: http.get(f"/chat_app?usuario_id={CONVERSA}", headers={"If-None-Match": etag}),
+        "stream parcial": primeiro_do_cardapio,
+    }
+    falhas = []
+    print(f"{'caso':<24}{'leituras':>10}{'escritas':>10}{'orçamento':>12}")
+    for nome, caso in casos.items():
+        max_leituras, max_escritas = ORCAMENTOS[nome]
+        try:
+            with orcamento_firestore(max_leituras=max_leituras, max_escritas=max_escritas) as contagem:
+                caso()
+        except OrcamentoFirestoreExcedido as e:
+            falhas.append(f"{nome}: {e}")
+        print(f"{nome:<24}{contagem.leituras:>10}{contagem.escritas:>10}{f'{max_leituras}/{max_escritas}':>12}")
+    return falhas
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--itens", type=int, default=50, help="itens no cardápio")
+    falhas = rodar(parser.parse_args())
+    if falhas:
+        print("\nFALHOU:\n- " + "\n- ".join(falhas))
+        sys.exit(1)
+    print("\nTodos os turnos dentro do orçamento.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""Mede a partida a frio do bot: tempo de 'import app' e tempo até o
+primeiro 200 no '/'.
+
+É o que o Render paga a cada deploy ou scale-up. Três medições, cada uma
+num processo Python novo (sem cache de import quente no processo):
+
+- import: 'import app' sozinho (mediana de N rodadas) e os módulos que
+  mais pesam nele, via 'python -X importtime';
+- primeiro 200: do Popen do gunicorn (1 worker sync) até o '/' responder
+  200, com e sem --preload.
+
+Roda sem credencial nem rede: aponta o Firestore pra um emulador que não
+existe (a partida não pode depender de falar com ele).
+
+Uso: python bench/bench_partida.py [--rodadas 5] [--json partida.json]
+"""
+import argparse
+import json
+import os
+import re
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+PASTA_BOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+AMBIENTE = {
+    **os.environ,
+    "FIRESTORE_EMULATOR_HOST": "127.0.0.1:9",
+    "FIREBASE_CREDENCIAL_PATH": "",
+    "OPENAI_API_KEY": "partida",
+}
+
+_CODIGO_IMPORT = "import time; t = time.perf_counter(); import app; print(time.perf_counter() - t)"
+
+
+def tempo_import(rodadas):
+    tempos = []
+    for _ in range(rodadas):
+        saida = subprocess.run([sys.executable, "-c", _CODIGO_IMPORT], cwd=PASTA_BOT, env=AMBIENTE,
+                               capture_output=True, text=True, check=True)
+        tempos.append(float(saida.stdout.strip().splitlines()[-1]))
+    return tempos
+
+
+def modulos_mais_pesados(quantos=10):
+    """Imports diretos do app.py (e dos módulos do bot) por tempo acumulado."""
+    saida = subprocess.run([sys.executable, "-X", "importtime", "-c", "import app"], cwd=PASTA_BOT, env=AMBIENTE,
+                           capture_output=True, text=True, check=True)
+    linhas = []
+    for linha in saida.stderr.splitlines():
+        m = re.match(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)", linha)
+        if m and len(m.group(3)) <= 3:
+            linhas.append((int(m.group(2)) / 1e6, m.group(4).strip()))
+    return sorted(linhas, reverse=True)[:quantos]
+
+
+def _porta_livre():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def primeiro_200(preload, limite_s=60):
+    porta = _porta_livre()
+    comando = [sys.executable, "-m", "gunicorn", "app:app", "--bind", f"127.0.0.1:{porta}",
+               "--workers", "1", "--worker-class", "sync", "--log-level", "warning"]
+    if preload:
+        comando.append("--preload")
+    inicio = time.perf_counter()
+    processo = subprocess.Popen(comando, cwd=PASTA_BOT, env=AMBIENTE,
+                                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while time.perf_counter() - inicio < limite_s:
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{porta}/", timeout=1) as resposta:
+                    if resposta.status == 200:
+                        return time.perf_counter() - inicio
+            except (urllib.error.URLError, ConnectionError, OSError):
+                time.sleep(0.01)
+        return None
+    finally:
+        processo.terminate()
+        try:
+            processo.wait(10)
+        except subprocess.TimeoutExpired:
+            processo.kill()
+
+
+def _resumo(tempos):
+    validos = [t for t in tempos if t is not None]
+    if not validos:
+        return {"mediana_s": None, "min_s": None, "falhas": len(tempos)}
+    return {"mediana_s": round(statistics.median(validos), 3), "min_s": round(min(validos), 3),
+            "falhas": len(tempos) - len(validos)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--rodadas", type=int, default=5)
+    parser.add_argument("--json", help="grava o relatório também nesse arquivo")
+    args = parser.parse_args()
+
+    relatorio = {
+        "import_app": _resumo(tempo_import(args.rodadas)),
+        "primeiro_200": _resumo([primeiro_200(False) for _ in range(args.rodadas)]),
+        "primeiro_200_preload": _resumo([primeiro_200(True) for _ in range(args.rodadas)]),
+        "modulos_mais_pesados": [{"modulo": nome, "segundos": round(s, 3)} for s, nome in modulos_mais_pesados()],
+    }
+
+    print(f"{'medição':<28}{'mediana s':>11}{'mín s':>9}")
+    for nome in ("import_app", "primeiro_200", "primeiro_200_preload"):
+        d = relatorio[nome]
+        falhas = f"  ({d['falhas']} sem resposta)" if d["falhas"] else ""
+        print(f"{nome:<28}{d['mediana_s'] or '-':>11}{d['min_s'] or '-':>9}{falhas}")
+    print("\nimports que mais pesam no 'import app' (acumulado):")
+    for item in relatorio["modulos_mais_pesados"]:
+        print(f"  {item['segundos']:>7.3f}s  {item['modulo']}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(relatorio, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
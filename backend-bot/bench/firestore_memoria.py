@@ -0,0 +1,384 @@
+"""Firestore em memória pros micro-benchmarks (bench_funcoes.py).
+
+Implementa só o pedaço da API do google-cloud-firestore que o app.py usa:
+collection/document, get/set/create/update/delete, get_all, where/order_by/
+limit/start_after/stream, batch com commit atômico,
+write_option(last_update_time=...), on_snapshot de documento e de coleção
+e os sentinelas (Increment, ArrayUnion, DELETE_FIELD, SERVER_TIMESTAMP).
+
+Não é um emulador: não tem índice nem transação — a ideia é tirar a rede
+da conta e medir só o custo de CPU das funções do bot em cima dos
+documentos que elas leem. Os listeners recebem num thread do cliente, como
+no de verdade, e escritas seguidas viram uma entrega só.
+
+Documento guardado nunca é alterado no lugar (cada escrita monta outro):
+o snapshot aponta pra ele e só copia no to_dict(), como o cliente de
+verdade decodifica uma vez por leitura.
+"""
+import copy
+import itertools
+import queue
+import threading
+from datetime import datetime, timezone
+
+from google.api_core import exceptions as google_exceptions
+from google.cloud.firestore_v1 import transforms
+
+_versoes = itertools.count(1)
+_lock = threading.RLock()
+
+_OPERADORES = {
+    "==": lambda a, b: a == b,
+    "!=": lambda a, b: a != b,
+    "<": lambda a, b: a is not None and a < b,
+    "<=": lambda a, b: a is not None and a <= b,
+    ">": lambda a, b: a is not None and a > b,
+    ">=": lambda a, b: a is not None and a >= b,
+    "in": lambda a, b: a in b,
+    "array_contains": lambda a, b: b in (a or []),
+}
+
+
+_IMUTAVEIS = (str, int, float, bool, bytes, datetime, type(None))
+
+
+def _copiar(valor):
+    """deepcopy só do que muda (dict e list): o resto é imutável e volta
+    como está — o deepcopy reconstrói cada datetime, e o histórico tem um
+    por mensagem."""
+    if isinstance(valor, dict):
+        return {k: _copiar(v) for k, v in valor.items()}
+    if isinstance(valor, list):
+        return [_copiar(v) for v in valor]
+    if isinstance(valor, _IMUTAVEIS):
+        return valor
+    return copy.deepcopy(valor)
+
+
+class Snapshot:
+    def __init__(self, ref, dados, update_time=None):
+        self.reference = ref
+        self.id = ref.id
+        self._dados = dados
+        self.exists = dados is not None
+        self.update_time = update_time
+
+    def to_dict(self):
+        return _copiar(self._dados) if self._dados is not None else None
+
+    def get(self, campo):
+        return _copiar((self._dados or {}).get(campo))
+
+
+def _aplicar(atual, novos, merge):
+    base = dict(atual or {}) if merge else {}
+    for chave, valor in novos.items():
+        if "." in chave:
+            *caminho, ultima = chave.split(".")
+            alvo = base
+            for parte in caminho:
+                # Cópia: o mapa de dentro ainda é o da versão anterior.
+                alvo[parte] = dict(alvo.get(parte) or {})
+                alvo = alvo[parte]
+            _atribuir(alvo, ultima, valor)
+        elif merge and isinstance(valor, dict) and isinstance(base.get(chave), dict):
+            base[chave] = _aplicar(base[chave], valor, True)
+        else:
+            _atribuir(base, chave, valor)
+    return base
+
+
+def _atribuir(alvo, chave, valor):
+    if valor is transforms.DELETE_FIELD:
+        alvo.pop(chave, None)
+    elif valor is transforms.SERVER_TIMESTAMP:
+        alvo[chave] = datetime.now(timezone.utc)
+    elif isinstance(valor, transforms.Increment):
+        alvo[chave] = (alvo.get(chave) or 0) + valor.value
+    elif isinstance(valor, transforms.ArrayUnion):
+        lista = list(alvo.get(chave) or [])
+        lista.extend(v for v in valor.values if v not in lista)
+        alvo[chave] = lista
+    elif isinstance(valor, dict):
+        sub = {}
+        for k, v in valor.items():
+            _atribuir(sub, k, v)
+        alvo[chave] = sub
+    else:
+        alvo[chave] = _copiar(valor)
+
+
+class Documento:
+    def __init__(self, cliente, caminho):
+        self._cliente = cliente
+        self.path = caminho
+        self.id = caminho.rsplit("/", 1)[-1]
+
+    def collection(self, nome):
+        return Colecao(self._cliente, f"{self.path}/{nome}")
+
+    def get(self, *args, **kwargs):
+        with _lock:
+            atual = self._cliente._docs.get(self.path)
+        if atual is None:
+            return Snapshot(self, None)
+        return Snapshot(self, atual[0], atual[1])
+
+    def on_snapshot(self, callback):
+        return self._cliente._ouvir(self.path, None, callback)
+
+    def _gravar(self, dados, merge=False, exigir=None, versao=None):
+        with _lock:
+            atual = self._cliente._docs.get(self.path)
+            if exigir == "ausente" and atual is not None:
+                raise google_exceptions.AlreadyExists(self.path)
+            if exigir == "existe" and atual is None:
+                raise google_exceptions.NotFound(self.path)
+            if versao is not None and (atual is None or atual[1] != versao):
+                raise google_exceptions.FailedPrecondition(self.path)
+            novo = _aplicar(atual[0] if atual else None, dados, merge)
+            self._cliente._docs[self.path] = (novo, next(_versoes))
+            self._cliente._mudou(self.path)
+
+    def set(self, dados, merge=False, **kwargs):
+        self._gravar(dados, merge)
+
+    def create(self, dados, **kwargs):
+        self._gravar(dados, exigir="ausente")
+
+    def update(self, dados, option=None, **kwargs):
+        self._gravar(dados, merge=True, exigir="existe", versao=getattr(option, "last_update_time", None))
+
+    def delete(self, **kwargs):
+        with _lock:
+            if self._cliente._docs.pop(self.path, None) is not None:
+                self._cliente._mudou(self.path)
+
+
+class _OpcaoEscrita:
+    def __init__(self, last_update_time):
+        self.last_update_time = last_update_time
+
+
+def _valor(snap, campo):
+    return snap.id if campo == "__name__" else (snap._dados or {}).get(campo)
+
+
+class Consulta:
+    def __init__(self, cliente, caminho, filtros=(), ordem=(), limite=None, depois_de=None):
+        self._cliente = cliente
+        self._caminho = caminho
+        self._filtros = list(filtros)
+        self._ordem = list(ordem)
+        self._limite = limite
+        self._depois_de = depois_de
+
+    def _com(self, **mudancas):
+        campos = {"filtros": self._filtros, "ordem": self._ordem, "limite": self._limite, "depois_de": self._depois_de}
+        campos.update(mudancas)
+        return Consulta(self._cliente, self._caminho, **campos)
+
+    def where(self, campo=None, op=None, valor=None, filter=None):
+        if filter is not None:
+            campo, op, valor = filter.field_path, filter.op_string, filter.value
+        return self._com(filtros=self._filtros + [(campo, op, valor)])
+
+    def order_by(self, campo, direction="ASCENDING"):
+        return self._com(ordem=self._ordem + [(campo, direction)])
+
+    def limit(self, n):
+        return self._com(limite=n)
+
+    def start_after(self, snapshot):
+        """Só com snapshot (o que o app usa), na ordem do order_by."""
+        return self._com(depois_de=snapshot)
+
+    def stream(self, *args, **kwargs):
+        prefixo = self._caminho + "/"
+        with _lock:
+            itens = [
+                (caminho, dados, versao) for caminho, (dados, versao) in self._cliente._docs.items()
+                if caminho.startswith(prefixo) and "/" not in caminho[len(prefixo):]
+            ]
+        resultado = [
+            Snapshot(Documento(self._cliente, caminho), dados, versao)
+            for caminho, dados, versao in itens
+            if all(_OPERADORES[op](dados.get(campo), valor) for campo, op, valor in self._filtros)
+        ]
+        resultado.sort(key=lambda s: s.id)
+        for campo, direcao in reversed(self._ordem):
+            resultado.sort(key=lambda s: (_valor(s, campo) is None, _valor(s, campo)), reverse=direcao == "DESCENDING")
+        if self._depois_de is not None:
+            ids = [s.id for s in resultado]
+            if self._depois_de.id in ids:
+                resultado = resultado[ids.index(self._depois_de.id) + 1:]
+        if self._limite is not None:
+            resultado = resultado[:self._limite]
+        return iter(resultado)
+
+    def get(self, *args, **kwargs):
+        return list(self.stream())
+
+
+class Colecao(Consulta):
+    def __init__(self, cliente, caminho):
+        super().__init__(cliente, caminho)
+        self.id = caminho.rsplit("/", 1)[-1]
+
+    def document(self, doc_id=None):
+        return Documento(self._cliente, f"{self._caminho}/{doc_id or 'auto%08d' % next(_versoes)}")
+
+    def on_snapshot(self, callback):
+        return self._cliente._ouvir(self._caminho, self, callback)
+
+    def add(self, dados):
+        ref = self.document()
+        ref.set(dados)
+        return None, ref
+
+
+class Lote:
+    """batch()/bulk_writer(): junta as escritas e aplica tudo de uma vez
+    no commit — ou nenhuma, se uma precondição falhar."""
+
+    def __init__(self, cliente):
+        self._cliente = cliente
+        self._operacoes = []
+
+    def set(self, ref, dados, merge=False):
+        self._operacoes.append(lambda: ref.set(dados, merge=merge))
+
+    def create(self, ref, dados):
+        self._operacoes.append(lambda: ref.create(dados))
+
+    def update(self, ref, dados, option=None):
+        self._operacoes.append(lambda: ref.update(dados, option=option))
+
+    def delete(self, ref, **kwargs):
+        self._operacoes.append(ref.delete)
+
+    def commit(self, *args, **kwargs):
+        with _lock:
+            copia = dict(self._cliente._docs)
+            self._cliente._adiados = set()
+            try:
+                for operacao in self._operacoes:
+                    operacao()
+            except Exception:
+                self._cliente._docs.clear()
+                self._cliente._docs.update(copia)
+                raise
+            finally:
+                mudados, self._cliente._adiados = self._cliente._adiados, None
+            for caminho in mudados:
+                self._cliente._mudou(caminho)
+        self._operacoes = []
+        return []
+
+    flush = close = commit
+
+
+class _Ouvinte:
+    def __init__(self, cliente, caminho, consulta, callback):
+        self._cliente = cliente
+        self.caminho = caminho
+        self.consulta = consulta
+        self.callback = callback
+        self.mudados = set()
+        self.ativo = True
+
+    def abrange(self, caminho):
+        if self.consulta is None:
+            return caminho == self.caminho
+        resto = caminho[len(self.caminho) + 1:]
+        return caminho.startswith(self.caminho + "/") and resto and "/" not in resto
+
+    def unsubscribe(self):
+        with _lock:
+            self.ativo = False
+            self._cliente._ouvintes.remove(self)
+
+
+class Cliente:
+    def __init__(self):
+        self._docs = {}
+        self._ouvintes = []
+        self._adiados = None
+        self._entregas = None
+
+    # --- listeners ---
+
+    def _ouvir(self, caminho, consulta, callback):
+        ouvinte = _Ouvinte(self, caminho, consulta, callback)
+        with _lock:
+            if self._entregas is None:
+                self._entregas = queue.Queue()
+                threading.Thread(target=self._entregar, name="firestore-memoria-ouvintes", daemon=True).start()
+            self._ouvintes.append(ouvinte)
+            ouvinte.mudados.add(None)  # primeira entrega: tudo
+        self._entregas.put(ouvinte)
+        return ouvinte
+
+    def _mudou(self, caminho):
+        # Chamado com _lock seguro. Dentro de um lote, só depois do commit.
+        if self._adiados is not None:
+            self._adiados.add(caminho)
+            return
+        for ouvinte in self._ouvintes:
+            if ouvinte.abrange(caminho):
+                if not ouvinte.mudados:
+                    self._entregas.put(ouvinte)
+                ouvinte.mudados.add(caminho)
+
+    def _entregar(self):
+        while True:
+            ouvinte = self._entregas.get()
+            try:
+                self._entregar_um(ouvinte)
+            finally:
+                self._entregas.task_done()
+
+    def _entregar_um(self, ouvinte):
+        with _lock:
+            mudados, ouvinte.mudados = ouvinte.mudados, set()
+            if not ouvinte.ativo or not mudados:
+                return
+            if ouvinte.consulta is None:
+                atual = self._docs.get(ouvinte.caminho)
+                snaps = [Snapshot(Documento(self, ouvinte.caminho), *atual) if atual
+                         else Snapshot(Documento(self, ouvinte.caminho), None)]
+            else:
+                snaps = list(ouvinte.consulta.stream())
+        mudancas = snaps if None in mudados else [s for s in snaps if s.reference.path in mudados]
+        ouvinte.callback(snaps, mudancas, datetime.now(timezone.utc))
+
+    def aguardar_ouvintes(self):
+        """Espera os listeners receberem tudo o que já foi escrito — o
+        bench semeia, espera e só então mede, sem entrega no meio."""
+        if self._entregas is not None:
+            self._entregas.join()
+
+    def collection(self, nome):
+        return Colecao(self, nome)
+
+    def document(self, caminho):
+        return Documento(self, caminho)
+
+    def get_all(self, refs):
+        return [ref.get() for ref in refs]
+
+    def batch(self):
+        return Lote(self)
+
+    def bulk_writer(self):
+        return Lote(self)
+
+    def write_option(self, last_update_time=None, **kwargs):
+        return _OpcaoEscrita(last_update_time)
+
+    def limpar(self):
+        with _lock:
+            caminhos = list(self._docs)
+            self._docs.clear()
+            for caminho in caminhos:
+                self._mudou(caminho)
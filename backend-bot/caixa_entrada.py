@@ -0,0 +1,90 @@
+"""Resumo de cada conversa pro painel de Atendimento (coleção caixa_entrada).
+
+O bot-chat.js montava a lista da esquerda com
+historico_conversas.orderBy('ultima_interacao').limit(50).get(): até 50
+documentos inteiros, cada um com até 60 mensagens, só pra mostrar a última
+frase de cada conversa — e de novo a cada 20 s. Agora cada conversa tem
+também um documento pequeno em caixa_entrada/{wa_id}:
+
+- previa / previa_role: começo da última mensagem e quem mandou;
+- ultima_interacao e ultima_do_cliente_em;
+- precisa_atencao, motivo_atencao, tipo_atencao, atencao_marcada_em,
+  atencao_escalada_em (varredor.py) e modo_manual (cópia dos campos do
+  documento da conversa);
+- nao_lidas: mensagens do cliente desde que alguém abriu a conversa no
+  painel (o painel zera ao abrir).
+
+Quem grava o histórico (fila_historico.py) grava o resumo no mesmo lote
+que o documento da conversa — os dois mudam juntos ou nenhum muda. Quem
+mexe em atenção/modo_manual fora dali (marcar_atencao, a rota
+/painel/enviar_mensagem e o próprio bot-chat.js) também grava nos dois no
+mesmo lote. O painel assina a caixa_entrada (onSnapshot) e só lê
+historico_conversas/{id} ao abrir uma conversa — os detalhes da atenção
+(atencao_dados) e as mensagens continuam só lá.
+
+Conversas que não recebem mensagem desde antes do resumo existir ficam
+fora da lista até a próxima mensagem; POST /admin/caixa_entrada
+reconstrói todos os resumos a partir de historico_conversas.
+"""
+from partida import importar_quando_usar
+
+firestore = importar_quando_usar("firebase_admin.firestore")
+
+COLECAO = "caixa_entrada"
+TAMANHO_PREVIA = 120
+CAMPOS_ESPELHADOS = ("precisa_atencao", "motivo_atencao", "tipo_atencao", "atencao_marcada_em", "atencao_escalada_em",
+                     "modo_manual")
+LOTE_RECONSTRUIR = 400
+
+
+def referencia(db, wa_id):
+    return db.collection(COLECAO).document(wa_id)
+
+
+def resumo(conversa, novas=None):
+    """Campos do resumo a partir do documento da conversa (já com as
+    mensagens novas). Com 'novas', nao_lidas soma as do cliente entre elas."""
+    campos = {campo: conversa[campo] for campo in CAMPOS_ESPELHADOS if campo in conversa}
+    mensagens = conversa.get("mensagens") or []
+    if mensagens:
+        ultima = mensagens[-1]
+        campos["previa"] = str(ultima.get("content") or "")[:TAMANHO_PREVIA]
+        campos["previa_role"] = ultima.get("role")
+        campos["ultima_interacao"] = conversa.get("ultima_interacao") or ultima.get("timestamp")
+        do_cliente = next((m for m in reversed(mensagens) if m.get("role") == "user"), None)
+        if do_cliente:
+            campos["ultima_do_cliente_em"] = do_cliente.get("timestamp")
+    if novas is not None:
+        do_cliente = sum(1 for m in novas if m.get("role") == "user")
+        if do_cliente:
+            campos["nao_lidas"] = firestore.Increment(do_cliente)
+    return campos
+
+
+def atualizar_conversa(db, wa_id, campos):
+    """Grava campos de atenção/modo_manual (merge) na conversa e no resumo,
+    num lote só."""
+    lote = db.batch()
+    lote.set(db.collection("historico_conversas").document(wa_id), campos, merge=True)
+    lote.set(referencia(db, wa_id), {c: v for c, v in campos.items() if c in CAMPOS_ESPELHADOS}, merge=True)
+    lote.commit()
+
+
+def reconstruir(db):
+    """Regrava o resumo de todas as conversas (zerando nao_lidas). Devolve
+    quantas foram."""
+    lote, pendentes, total = db.batch(), 0, 0
+    for doc in db.collection("historico_conversas").stream():
+        campos = resumo(doc.to_dict() or {})
+        if "ultima_interacao" not in campos:
+            continue
+        campos["nao_lidas"] = 0
+        lote.set(referencia(db, doc.id), campos)
+        pendentes += 1
+        total += 1
+        if pendentes == LOTE_RECONSTRUIR:
+            lote.commit()
+            lote, pendentes = db.batch(), 0
+    if pendentes:
+        lote.commit()
+    return total
@@ -0,0 +1,164 @@
+"""Sobe o ambiente de carga inteiro numa máquina só (sem rede) e compara
+tipos de worker do gunicorn.
+
+Pra cada configuração pedida (ex.: sync com 4 workers, gthread com 4x8
+threads, gevent, ou asgi:1 — um processo só do modo assíncrono,
+app_async.py, no uvicorn) o script: sobe o bot apontando pra OpenAI e
+Graph API falsas (stubs.py) e pro emulador do Firestore, espera o "/"
+responder, roda a mesma carga do rodar_carga.py, derruba o servidor e no
+fim imprime uma tabela comparando vazão e latência.
+
+Pré-requisito: emulador do Firestore rodando (ou --subir-emulador, que usa
+o firebase-tools do test-env/). Ex.:
+
+    python carga/comparar_workers.py --configs sync:4 asgi:1 --concorrencia 200 --duracao 60
+"""
+import importlib.util
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+
+PASTA = os.path.dirname(os.path.abspath(__file__))
+PASTA_BOT = os.path.dirname(PASTA)
+sys.path.insert(0, PASTA)
+
+import rodar_carga  # noqa: E402
+import stubs  # noqa: E402
+
+
+def _esperar(url, segundos):
+    limite = time.monotonic() + segundos
+    while time.monotonic() < limite:
+        try:
+            if requests.get(url, timeout=2).status_code == 200:
+                return True
+        except requests.RequestException:
+            pass
+        time.sleep(0.3)
+    return False
+
+
+def _comando_servidor(config, porta):
+    """'sync:4' | 'gthread:4x8' | 'gevent:4' -> gunicorn com o app.py;
+    'asgi:1' -> uvicorn com o app_async.py (modo assíncrono)."""
+    classe, _, tamanho = config.partition(":")
+    workers, _, threads = (tamanho or "4").partition("x")
+    if classe == "asgi":
+        return [sys.executable, "-m", "uvicorn", "app_async:app", "--host", "127.0.0.1", "--port", str(porta),
+                "--workers", workers, "--log-level", "warning"]
+    comando = [sys.executable, "-m", "gunicorn", "app:app", "--bind", f"127.0.0.1:{porta}",
+               "--timeout", "120", "--log-level", "warning", "--worker-class", classe, "--workers", workers]
+    if threads:
+        comando += ["--threads", threads]
+    if classe == "gevent":
+        comando += ["--worker-connections", "1000"]
+    return comando
+
+
+def _subir_emulador(porta):
+    comando = ["npx", "firebase", "--project", "pizzain-40973", "--config", "../dashboard/firebase.json",
+               "emulators:start", "--only", "firestore"]
+    processo = subprocess.Popen(comando, cwd=os.path.join(PASTA_BOT, "..", "test-env"),
+                                stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT)
+    if not _esperar(f"http://127.0.0.1:{porta}/", 90):
+        processo.terminate()
+        sys.exit("O emulador do Firestore não subiu em 90s.")
+    return processo
+
+
+def rodar_config(config, args, ambiente_base):
+    if config.startswith("gevent") and importlib.util.find_spec("gevent") is None:
+        print(f"[{config}] pulado: gevent não está instalado (pip install gevent).")
+        return None
+    pasta_metricas = tempfile.mkdtemp(prefix="carga_metricas_")
+    ambiente = {**ambiente_base, "PROMETHEUS_MULTIPROC_DIR": pasta_metricas}
+    comando = _comando_servidor(config, args.porta_bot)
+    # Fora da pasta de métricas: o on_starting do gunicorn.conf.py apaga ela.
+    saida = tempfile.NamedTemporaryFile("w", prefix="carga_gunicorn_", suffix=".log", delete=False)
+    manter_log = False
+    processo = subprocess.Popen(comando, cwd=PASTA_BOT, env=ambiente, stdout=saida, stderr=subprocess.STDOUT)
+    try:
+        if not _esperar(f"http://127.0.0.1:{args.porta_bot}/", 60):
+            manter_log = True
+            print(f"[{config}] o bot não subiu — veja {saida.name}")
+            return None
+        args.alvo = f"http://127.0.0.1:{args.porta_bot}"
+        relatorio = rodar_carga.executar(args)
+        rodar_carga.imprimir(relatorio, titulo=config)
+        return relatorio
+    finally:
+        processo.send_signal(signal.SIGTERM)
+        try:
+            processo.wait(30)
+        except subprocess.TimeoutExpired:
+            processo.kill()
+        saida.close()
+        if not manter_log:
+            os.unlink(saida.name)
+        shutil.rmtree(pasta_metricas, ignore_errors=True)
+
+
+def main():
+    parser = rodar_carga.parser_argumentos()
+    parser.description = __doc__.split("\n")[0]
+    parser.add_argument("--configs", nargs="+", default=["sync:4", "gthread:4x8", "gevent:4", "asgi:1"])
+    parser.add_argument("--porta-bot", type=int, default=5055)
+    parser.add_argument("--porta-openai", type=int, default=8901)
+    parser.add_argument("--porta-graph", type=int, default=8902)
+    parser.add_argument("--latencia-openai-ms", type=float, default=1500)
+    parser.add_argument("--variacao-openai-ms", type=float, default=500)
+    parser.add_argument("--latencia-graph-ms", type=float, default=120)
+    parser.add_argument("--emulador", default=os.environ.get("FIRESTORE_EMULATOR_HOST") or "127.0.0.1:8080")
+    parser.add_argument("--subir-emulador", action="store_true", help="sobe o emulador do Firestore via firebase-tools")
+    parser.add_argument("--itens-extras", type=int, default=0, help="itens sintéticos a mais no cardápio semeado")
+    args = parser.parse_args()
+
+    emulador = None
+    if args.subir_emulador:
+        emulador = _subir_emulador(args.emulador.rsplit(":", 1)[-1])
+
+    stubs.iniciar(stubs.StubOpenAI, args.porta_openai, args.latencia_openai_ms, args.variacao_openai_ms,
+                  roteiros=stubs.carregar_roteiros())
+    stubs.iniciar(stubs.StubGraph, args.porta_graph, args.latencia_graph_ms, args.latencia_graph_ms / 4, enviadas=0)
+
+    ambiente = {
+        **os.environ,
+        "FIRESTORE_EMULATOR_HOST": args.emulador,
+        "FIREBASE_CREDENCIAL_PATH": "",
+        "OPENAI_API_KEY": "carga",
+        "OPENAI_BASE_URL": f"http://127.0.0.1:{args.porta_openai}/v1",
+        "GRAPH_API_URL": f"http://127.0.0.1:{args.porta_graph}",
+        "PHONE_NUMBER_ID": "PHONE_CARGA",
+        "ACCESS_TOKEN": "carga",
+        "VERIFY_TOKEN": "carga",
+    }
+    subprocess.run([sys.executable, os.path.join(PASTA, "semear.py"), "--itens-extras", str(args.itens_extras)],
+                   env=ambiente, check=True)
+
+    resultados = {}
+    try:
+        for config in args.configs:
+            relatorio = rodar_config(config, args, ambiente)
+            if relatorio:
+                resultados[config] = relatorio
+    finally:
+        if emulador:
+            emulador.terminate()
+
+    print(f"\n=== Comparação (concorrência {args.concorrencia}, OpenAI falsa ~{args.latencia_openai_ms:.0f} ms) ===")
+    print(f"{'config':<16}{'req/s':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'erros':>7}")
+    for config, relatorio in resultados.items():
+        texto = relatorio["tipos"].get("texto") or {}
+        erros = sum(t["erros"] for t in relatorio["tipos"].values())
+        print(f"{config:<16}{relatorio['vazao_rps']:>8}{rodar_carga._ms(texto.get('p50'))} "
+              f"{rodar_carga._ms(texto.get('p95'))} {rodar_carga._ms(texto.get('p99'))}{erros:>7}")
+
+
+if __name__ == "__main__":
+    main()
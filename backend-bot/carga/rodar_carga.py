@@ -0,0 +1,278 @@
+"""Gera tráfego realista contra o bot (/webhook e /chat_app) e mede.
+
+Cada thread de carga faz o papel de alguns clientes conversando em
+sequência (oi → cardápio → sabor → bairro → total → fechar), do jeito que
+chega da Meta: payload de webhook com 'entry/changes/value/messages'. Além
+do texto normal, o mix inclui:
+
+- imagem: comprovante de PIX (baixa a mídia pela Graph API falsa);
+- rajada: o cliente manda 3 mensagens seguidas sem esperar resposta;
+- reenvio: a Meta reentrega o mesmo message id (teste da trava de duplicidade).
+
+No fim imprime vazão e p50/p95/p99 da latência vista pelo cliente e, lendo
+o /metrics do bot antes e depois, p50/p95/p99 de cada etapa do turno.
+
+Uso: python carga/rodar_carga.py --alvo http://127.0.0.1:5000 --concorrencia 20 --duracao 60
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+ROTEIRO_CONVERSA = [
+    "oi, boa noite",
+    "me manda o cardápio",
+    "tem pizza calabresa?",
+    "tem refri?",
+    "entrega no centro?",
+    "Rua das Flores, 120",
+    "vai ser pix",
+    "quanto fica o total?",
+    "pode fechar",
+    "cadê meu pedido?",
+]
+
+MIX_PADRAO = "texto=75,imagem=5,rajada=10,reenvio=10"
+
+
+def payload_webhook(numero, mensagem):
+    return {
+        "object": "whatsapp_business_account",
+        "entry": [{
+            "id": "WABA_CARGA",
+            "changes": [{
+                "field": "messages",
+                "value": {
+                    "messaging_product": "whatsapp",
+                    "metadata": {"display_phone_number": "553599999999", "phone_number_id": "PHONE_CARGA"},
+                    "contacts": [{"profile": {"name": "Cliente Carga"}, "wa_id": numero}],
+                    "messages": [mensagem],
+                },
+            }],
+        }],
+    }
+
+
+def mensagem_texto(numero, texto, msg_id=None):
+    return {"from": numero, "id": msg_id or f"wamid.carga.{uuid.uuid4().hex}",
+            "timestamp": str(int(time.time())), "type": "text", "text": {"body": texto}}
+
+
+def mensagem_imagem(numero):
+    return {"from": numero, "id": f"wamid.carga.{uuid.uuid4().hex}", "timestamp": str(int(time.time())),
+            "type": "image", "image": {"id": f"midia{uuid.uuid4().hex[:10]}", "mime_type": "image/jpeg"}}
+
+
+def _ler_mix(texto):
+    mix = {}
+    for parte in texto.split(","):
+        nome, _, peso = parte.partition("=")
+        mix[nome.strip()] = float(peso or 0)
+    return mix
+
+
+class Resultados:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencias = defaultdict(list)
+        self.erros = defaultdict(int)
+
+    def registrar(self, tipo, segundos, ok):
+        with self.lock:
+            self.latencias[tipo].append(segundos)
+            if not ok:
+                self.erros[tipo] += 1
+
+
+def _enviar(sessao, alvo, canal, numero, mensagem, resultados, tipo):
+    inicio = time.perf_counter()
+    ok = False
+    try:
+        if canal == "chat_app":
+            resp = sessao.post(f"{alvo}/chat_app", json={"usuario_id": numero, "mensagem": mensagem["text"]["body"]}, timeout=180)
+        else:
+            resp = sessao.post(f"{alvo}/webhook", json=payload_webhook(numero, mensagem), timeout=180)
+        ok = resp.status_code == 200
+    except requests.RequestException:
+        pass
+    resultados.registrar(tipo, time.perf_counter() - inicio, ok)
+
+
+def _cliente(args, indice, prazo, resultados, contador):
+    sessao = requests.Session()
+    mix = _ler_mix(args.mix)
+    tipos, pesos = list(mix.keys()), list(mix.values())
+    numero_base = 5535990000000
+    clientes_da_thread = [str(numero_base + indice + k * args.concorrencia) for k in range(max(1, args.clientes // args.concorrencia))]
+    passo = defaultdict(int)
+
+    while time.monotonic() < prazo:
+        with contador["lock"]:
+            if args.turnos and contador["n"] >= args.turnos:
+                return
+            contador["n"] += 1
+        numero = random.choice(clientes_da_thread)
+        canal = args.canal if args.canal != "ambos" else random.choice(["webhook", "chat_app"])
+        texto = ROTEIRO_CONVERSA[passo[numero] % len(ROTEIRO_CONVERSA)]
+        passo[numero] += 1
+        tipo = random.choices(tipos, pesos)[0]
+
+        if tipo == "imagem" and canal == "webhook":
+            _enviar(sessao, args.alvo, canal, numero, mensagem_imagem(numero), resultados, "imagem")
+        elif tipo == "rajada":
+            mensagens = [mensagem_texto(numero, t) for t in (texto, "e mais uma coisa", "?")]
+            threads = [threading.Thread(target=_enviar, args=(requests.Session(), args.alvo, canal, numero, m, resultados, "rajada"))
+                       for m in mensagens]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        elif tipo == "reenvio" and canal == "webhook":
+            mensagem = mensagem_texto(numero, texto)
+            threads = [threading.Thread(target=_enviar, args=(requests.Session(), args.alvo, canal, numero, mensagem, resultados, "reenvio"))
+                       for _ in range(2)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        else:
+            _enviar(sessao, args.alvo, canal, numero, mensagem_texto(numero, texto), resultados, "texto")
+
+
+# --- leitura do /metrics ---
+
+_LINHA_BUCKET = re.compile(r'^(\w+)_bucket\{(.*)\} ([0-9.e+-]+)$')
+
+
+def ler_histogramas(alvo):
+    """{(metrica, rótulo): {le: contagem acumulada}} de todos os histogramas
+    bot_* do /metrics (rótulo = etapa/canal, sem o 'le')."""
+    try:
+        texto = requests.get(f"{alvo}/metrics", timeout=10).text
+    except requests.RequestException:
+        return {}
+    histogramas = defaultdict(dict)
+    for linha in texto.splitlines():
+        m = _LINHA_BUCKET.match(linha)
+        if not m or not m.group(1).startswith("bot_"):
+            continue
+        rotulos = dict(re.findall(r'(\w+)="([^"]*)"', m.group(2)))
+        le = rotulos.pop("le")
+        chave = (m.group(1), ",".join(f"{k}={v}" for k, v in sorted(rotulos.items()) if k != "pid"))
+        limite = float("inf") if le == "+Inf" else float(le)
+        histogramas[chave][limite] = histogramas[chave].get(limite, 0) + float(m.group(3))
+    return histogramas
+
+
+def quantil_histograma(buckets, q):
+    itens = sorted(buckets.items())
+    total = itens[-1][1] if itens else 0
+    if not total:
+        return None
+    alvo = q * total
+    limite_anterior, acumulado_anterior = 0.0, 0.0
+    for limite, acumulado in itens:
+        if acumulado >= alvo:
+            if limite == float("inf"):
+                return limite_anterior
+            fracao = (alvo - acumulado_anterior) / max(acumulado - acumulado_anterior, 1e-9)
+            return limite_anterior + (limite - limite_anterior) * fracao
+        limite_anterior, acumulado_anterior = limite, acumulado
+    return limite_anterior
+
+
+def diferenca(depois, antes):
+    resultado = {}
+    for chave, buckets in depois.items():
+        anteriores = antes.get(chave, {})
+        delta = {le: n - anteriores.get(le, 0) for le, n in buckets.items()}
+        if max(delta.values(), default=0) > 0:
+            resultado[chave] = delta
+    return resultado
+
+
+def percentil(valores, q):
+    if not valores:
+        return None
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(q * len(ordenados)))]
+
+
+def _ms(valor):
+    return "-" if valor is None else f"{valor * 1000:8.0f}"
+
+
+def executar(args):
+    antes = ler_histogramas(args.alvo)
+    resultados = Resultados()
+    contador = {"n": 0, "lock": threading.Lock()}
+    inicio = time.monotonic()
+    prazo = inicio + args.duracao
+    with ThreadPoolExecutor(max_workers=args.concorrencia) as executor:
+        for i in range(args.concorrencia):
+            executor.submit(_cliente, args, i, prazo, resultados, contador)
+    duracao = time.monotonic() - inicio
+    depois = ler_histogramas(args.alvo)
+
+    relatorio = {"duracao_s": round(duracao, 1), "concorrencia": args.concorrencia, "tipos": {}, "etapas": {}}
+    total = 0
+    for tipo, valores in sorted(resultados.latencias.items()):
+        total += len(valores)
+        relatorio["tipos"][tipo] = {
+            "requisicoes": len(valores), "erros": resultados.erros.get(tipo, 0),
+            "p50": percentil(valores, 0.5), "p95": percentil(valores, 0.95), "p99": percentil(valores, 0.99),
+        }
+    relatorio["vazao_rps"] = round(total / duracao, 2) if duracao else 0
+    for (metrica, rotulo), buckets in sorted(diferenca(depois, antes).items()):
+        relatorio["etapas"][f"{metrica}{{{rotulo}}}"] = {
+            "n": int(max(buckets.values())),
+            "p50": quantil_histograma(buckets, 0.5), "p95": quantil_histograma(buckets, 0.95), "p99": quantil_histograma(buckets, 0.99),
+        }
+    return relatorio
+
+
+def imprimir(relatorio, titulo=""):
+    print(f"\n=== {titulo or 'Resultado'}: {relatorio['vazao_rps']} req/s em {relatorio['duracao_s']}s, "
+          f"concorrência {relatorio['concorrencia']} ===")
+    print(f"{'tipo (cliente)':<56}{'n':>7}{'erros':>7}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+    for tipo, d in relatorio["tipos"].items():
+        print(f"{tipo:<56}{d['requisicoes']:>7}{d['erros']:>7}{_ms(d['p50'])} {_ms(d['p95'])} {_ms(d['p99'])}")
+    if relatorio["etapas"]:
+        print(f"{'etapa (servidor, /metrics)':<56}{'n':>7}{'':>7}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+        for etapa, d in relatorio["etapas"].items():
+            if "por_requisicao" in etapa:
+                continue
+            print(f"{etapa:<56}{d['n']:>7}{'':>7}{_ms(d['p50'])} {_ms(d['p95'])} {_ms(d['p99'])}")
+
+
+def parser_argumentos():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--alvo", default="http://127.0.0.1:5000")
+    parser.add_argument("--concorrencia", type=int, default=10)
+    parser.add_argument("--duracao", type=float, default=60, help="segundos de carga")
+    parser.add_argument("--turnos", type=int, default=0, help="para depois de N turnos (0 = só pela duração)")
+    parser.add_argument("--clientes", type=int, default=200)
+    parser.add_argument("--canal", choices=["webhook", "chat_app", "ambos"], default="webhook")
+    parser.add_argument("--mix", default=MIX_PADRAO, help="pesos dos tipos de evento (texto, imagem, rajada, reenvio)")
+    parser.add_argument("--json", help="grava o relatório também nesse arquivo")
+    return parser
+
+
+def main():
+    args = parser_argumentos().parse_args()
+    relatorio = executar(args)
+    imprimir(relatorio)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(relatorio, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
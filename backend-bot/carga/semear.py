@@ -0,0 +1,84 @@
+"""Popula o emulador do Firestore com o mínimo que o bot precisa pro teste
+de carga: configuracoes/bot (horário desligado, bairros, taxa), cardápio
+e alguns clientes do app.
+
+Só roda contra o emulador (FIRESTORE_EMULATOR_HOST definido) — nunca
+contra o projeto de produção.
+
+Uso: FIRESTORE_EMULATOR_HOST=127.0.0.1:8080 python carga/semear.py [--itens-extras 200]
+"""
+import argparse
+import os
+import sys
+
+import firebase_admin
+from firebase_admin import firestore
+from google.auth.credentials import AnonymousCredentials
+
+CARDAPIO = [
+    {"nome": "pizza calabresa", "nome_exibicao": "Pizza de Calabresa", "categoria": "Pizzas", "preco": 45.9, "ingredientes": "Calabresa, cebola, mussarela", "pontos_fidelidade": 45},
+    {"nome": "pizza frango catupiry", "nome_exibicao": "Pizza de Frango c/ Catupiry", "categoria": "Pizzas", "preco": 45.9, "ingredientes": "Frango, catupiry, mussarela", "pontos_fidelidade": 45},
+    {"nome": "pizza margherita", "nome_exibicao": "Pizza Margherita", "categoria": "Pizzas", "preco": 42.0, "ingredientes": "Mussarela, tomate, manjericão", "pontos_fidelidade": 42},
+    {"nome": "esfiha carne", "nome_exibicao": "Esfiha de Carne", "categoria": "Esfihas", "preco": 6.0, "ingredientes": "Carne temperada", "pontos_fidelidade": 6},
+    {"nome": "esfiha escarola", "nome_exibicao": "Esfiha de Escarola", "categoria": "Esfihas", "preco": 6.5, "ingredientes": "Escarola", "pontos_fidelidade": 6},
+    {"nome": "coca cola 2l", "nome_exibicao": "Coca-Cola 2L", "categoria": "Bebidas", "preco": 9.0, "ingredientes": "Refrigerante", "pontos_fidelidade": 0},
+    {"nome": "guarana lata", "nome_exibicao": "Guaraná Lata", "categoria": "Bebidas", "preco": 5.0, "ingredientes": "Refrigerante", "pontos_fidelidade": 0},
+]
+
+BAIRROS = ["Centro", "Vila Formosa", "Jardim Paraíso", "San Genaro", "São Judas Tadeu", "Jardim São José"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--itens-extras", type=int, default=0, help="itens sintéticos a mais no cardápio")
+    parser.add_argument("--clientes", type=int, default=50, help="clientes cadastrados no app (usuarios_app)")
+    args = parser.parse_args()
+
+    if not os.environ.get("FIRESTORE_EMULATOR_HOST"):
+        sys.exit("Defina FIRESTORE_EMULATOR_HOST — este script só roda contra o emulador.")
+
+    firebase_admin.initialize_app(AnonymousCredentials(), {
+        "projectId": os.environ.get("GOOGLE_CLOUD_PROJECT") or "pizzain-40973"
+    })
+    db = firestore.client()
+
+    db.collection("configuracoes").document("bot").set({
+        "ativo": True,
+        "modelo": "gpt-4o",
+        "bairros_entrega": BAIRROS,
+        "taxa_entrega": 5,
+        "cidade_atendida": "São Sebastião do Paraíso",
+        "horario_funcionamento": {"ativo": False},
+        # O teste manda rajadas do mesmo número e satura o servidor de
+        # propósito: sem controle de admissão (admissao.py), mede o caminho
+        # inteiro do turno em vez do descarte.
+        "admissao_por_minuto": 0,
+        "admissao_concorrencia": 0,
+    })
+
+    batch, pendentes = db.batch(), 0
+    itens = [dict(item) for item in CARDAPIO]
+    for i in range(args.itens_extras):
+        itens.append({"nome": f"salgado sintetico {i}", "nome_exibicao": f"Salgado Sintético {i}",
+                      "categoria": f"Categoria {i % 12}", "preco": 5 + (i % 40), "pontos_fidelidade": 1})
+    for i, item in enumerate(itens):
+        batch.set(db.collection("cardapio").document(f"carga_{i:05d}"), {**item, "disponivel": True})
+        pendentes += 1
+        if pendentes == 400:
+            batch.commit()
+            batch, pendentes = db.batch(), 0
+    for i in range(args.clientes):
+        batch.set(db.collection("usuarios_app").document(f"cliente_carga_{i}"), {
+            "nome": f"Cliente Carga {i}", "telefone": f"5535990{i:06d}", "pontos": 0
+        })
+        pendentes += 1
+        if pendentes == 400:
+            batch.commit()
+            batch, pendentes = db.batch(), 0
+    if pendentes:
+        batch.commit()
+    print(f"Emulador populado: {len(itens)} itens no cardápio, {args.clientes} clientes, {len(BAIRROS)} bairros.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+"""Servidores falsos da OpenAI e da Graph API (WhatsApp) pro teste de carga.
+
+Tudo local, sem rede: o bot aponta pra cá via OPENAI_BASE_URL e
+GRAPH_API_URL (ver rodar_carga.py / comparar_workers.py).
+
+- OpenAI (/v1/chat/completions): reproduz as transcrições gravadas em
+  transcricoes.json. A primeira chamada do turno escolhe o roteiro pelas
+  palavras-chave da última mensagem do cliente e devolve as tool_calls
+  gravadas (ou um texto direto); a segunda chamada (a que já traz as
+  mensagens role=tool) devolve o texto final do roteiro. A latência é
+  configurável (média + variação), pra imitar a OpenAI lenta do horário
+  de pico.
+- Graph API: POST /{phone_number_id}/messages responde como a Meta,
+  GET /{media_id} devolve uma URL de download e GET /midia/{id} devolve
+  bytes de uma "foto" de comprovante.
+
+Uso: python carga/stubs.py --porta-openai 8901 --porta-graph 8902 --latencia-ms 1500 --variacao-ms 500
+"""
+import argparse
+import json
+import os
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+PASTA = os.path.dirname(os.path.abspath(__file__))
+
+
+class _Base(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _json(self, status, dados):
+        corpo = json.dumps(dados).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(corpo)))
+        self.end_headers()
+        self.wfile.write(corpo)
+
+    def _ler_json(self):
+        tamanho = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(tamanho) or b"{}")
+
+    def _esperar(self):
+        cfg = self.server.cfg
+        atraso = max(0.0, random.gauss(cfg["latencia_ms"], cfg["variacao_ms"])) / 1000
+        time.sleep(atraso)
+
+
+def _escolher_roteiro(roteiros, texto):
+    texto = (texto or "").lower()
+    for roteiro in roteiros:
+        if any(palavra in texto for palavra in roteiro.get("gatilhos", [])):
+            return roteiro
+    return roteiros[-1]
+
+
+def _resposta_openai(modelo, mensagem, prompt_tokens):
+    completion_tokens = len(json.dumps(mensagem)) // 4
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": modelo,
+        "choices": [{"index": 0, "message": mensagem,
+                     "finish_reason": "tool_calls" if mensagem.get("tool_calls") else "stop"}],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "prompt_tokens_details": {"cached_tokens": prompt_tokens // 2},
+        },
+    }
+
+
+class StubOpenAI(_Base):
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            return self._json(404, {"error": {"message": "rota desconhecida"}})
+        pedido = self._ler_json()
+        mensagens = pedido.get("messages") or []
+        ultima_do_cliente = next((m.get("content") for m in reversed(mensagens) if m.get("role") == "user"), "")
+        roteiro = _escolher_roteiro(self.server.roteiros, ultima_do_cliente)
+        prompt_tokens = sum(len(str(m.get("content") or "")) for m in mensagens) // 4
+
+        self._esperar()
+        if mensagens and mensagens[-1].get("role") == "tool":
+            mensagem = {"role": "assistant", "content": roteiro["final"]}
+        elif roteiro.get("ferramentas") and pedido.get("tools"):
+            mensagem = {"role": "assistant", "content": None, "tool_calls": [
+                {"id": f"call_{uuid.uuid4().hex[:10]}", "type": "function",
+                 "function": {"name": f["nome"], "arguments": json.dumps(f.get("argumentos") or {}, ensure_ascii=False)}}
+                for f in roteiro["ferramentas"]
+            ]}
+        else:
+            mensagem = {"role": "assistant", "content": roteiro["final"]}
+        self._json(200, _resposta_openai(pedido.get("model"), mensagem, prompt_tokens))
+
+
+class StubGraph(_Base):
+    def do_POST(self):
+        # Lê o corpo mesmo sem usar: com keep-alive (httpx do app_async.py)
+        # o que sobrar no socket vira o começo da próxima requisição.
+        self._ler_json()
+        self._esperar()
+        if self.path.endswith("/messages"):
+            self.server.enviadas += 1
+            return self._json(200, {"messaging_product": "whatsapp",
+                                    "messages": [{"id": f"wamid.{uuid.uuid4().hex}"}]})
+        self._json(404, {"error": {"message": "rota desconhecida"}})
+
+    def do_GET(self):
+        self._esperar()
+        if self.path.startswith("/midia/"):
+            corpo = b"\xff\xd8\xff\xe0" + os.urandom(2048)
+            self.send_response(200)
+            self.send_header("Content-Type", "image/jpeg")
+            self.send_header("Content-Length", str(len(corpo)))
+            self.end_headers()
+            self.wfile.write(corpo)
+            return
+        media_id = self.path.strip("/").split("/")[-1]
+        host = self.headers.get("Host")
+        self._json(200, {"url": f"http://{host}/midia/{media_id}", "mime_type": "image/jpeg"})
+
+
+def iniciar(classe, porta, latencia_ms, variacao_ms, **extras):
+    servidor = ThreadingHTTPServer(("127.0.0.1", porta), classe)
+    servidor.daemon_threads = True
+    servidor.cfg = {"latencia_ms": latencia_ms, "variacao_ms": variacao_ms}
+    for chave, valor in extras.items():
+        setattr(servidor, chave, valor)
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return servidor
+
+
+def carregar_roteiros(caminho=None):
+    with open(caminho or os.path.join(PASTA, "transcricoes.json"), encoding="utf-8") as f:
+        return json.load(f)["roteiros"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--porta-openai", type=int, default=8901)
+    parser.add_argument("--porta-graph", type=int, default=8902)
+    parser.add_argument("--latencia-ms", type=float, default=1500, help="latência média da OpenAI falsa")
+    parser.add_argument("--variacao-ms", type=float, default=500)
+    parser.add_argument("--latencia-graph-ms", type=float, default=120)
+    parser.add_argument("--transcricoes", default=None)
+    args = parser.parse_args()
+
+    iniciar(StubOpenAI, args.porta_openai, args.latencia_ms, args.variacao_ms,
+            roteiros=carregar_roteiros(args.transcricoes))
+    graph = iniciar(StubGraph, args.porta_graph, args.latencia_graph_ms, args.latencia_graph_ms / 4, enviadas=0)
+    print(f"OpenAI falsa em http://127.0.0.1:{args.porta_openai}/v1 | Graph falsa em http://127.0.0.1:{args.porta_graph}", flush=True)
+    try:
+        while True:
+            time.sleep(10)
+            print(f"  mensagens WhatsApp recebidas: {graph.enviadas}", flush=True)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
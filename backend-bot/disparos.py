@@ -0,0 +1,516 @@
+"""Disparos de promoção pros clientes, pelo WhatsApp e pela notificação do app.
+
+O marketing.js cadastra cupons e promoções, mas só quem abre o app vê — não
+havia como avisar os clientes. E um laço mandando uma mensagem atrás da
+outra pela Graph API bate no limite da Meta (e no de spam) em segundos.
+
+Um disparo é o documento disparos/{id}, criado pelo painel (aba Disparos do
+marketing) ou por POST /admin/disparos:
+
+- mensagem (texto, {nome} vira o primeiro nome), titulo (da notificação)
+  e, pro WhatsApp fora da janela de 24 h, template {nome, idioma,
+  parametros} — aprovado antes no Gerenciador do WhatsApp;
+- canais em ordem de preferência ("app", "whatsapp"): cada cliente recebe
+  por um só, o primeiro que ele tiver (token do app, telefone);
+- publico: {"tipo": "pedido_recente", "dias": 30} (quem pediu nos últimos
+  N dias) ou {"tipo": "clientes_app"} (todos os cadastrados no app), e
+  "somente_optin" pra só quem marcou aceita_promocoes no app;
+- por_segundo: envios por segundo (padrão POR_SEGUNDO_PADRAO, no máximo
+  POR_SEGUNDO_MAX).
+
+Quem roda é um Disparador por loja, num thread por disparo, no processo que
+segurar o mandato do disparo (dono/mandato_expira_em, renovado a cada
+página e, enquanto ela sai, a cada MANDATO_S/3). Cada volta do laço faz uma página:
+
+1. Expansão: lê PAGINA documentos do público (pedidos ou usuarios_app, em
+   ordem, a partir de cursor_publico) e grava um destinatário por cliente
+   em disparos/{id}/destinatarios/{telefone}, no mesmo batch que avança o
+   cursor — retomar nunca pula nem repete página. O id pelo telefone é o
+   dedupe: cliente com dez pedidos no mês recebe uma vez. Quem respondeu
+   SAIR (promocoes_descadastros/{telefone}) ou desmarcou aceita_promocoes
+   fica de fora.
+2. Envio: pega PAGINA destinatários pendentes, marca todos 'enviando' num
+   batch, manda — WhatsApp por TRABALHADORES threads atrás de um balde de
+   por_segundo fichas, app num send_each só — e grava os resultados e os
+   contadores do disparo num batch só — condicionado ao documento do
+   disparo (last_update_time) e a este processo ainda ser o dono. Quem
+   ficou 'enviando' numa queda do processo não é reenviado (vira
+   'incerto'): promoção repetida é pior que uma a menos. Se outro processo
+   pegou o disparo no meio da página, o resto dela não sai e o resultado
+   não é gravado — o novo dono já marcou a página como incerta. Limite da Meta (HTTP 429, 130429, 131056) devolve o
+   destinatário pra fila e freia o balde.
+
+Pausar/cancelar é mudar o status no documento: vale na próxima página. Um
+processo que morre larga o mandato; o líder da varredura (varredor.py)
+retoma os disparos sem dono a cada volta. O andamento fica no próprio
+documento (contagem, taxa_por_minuto, atualizado_em — o painel assina) e em
+bot_disparos_envios_total{canal, resultado}.
+"""
+import os
+import re
+import socket
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+import logs
+import lojas
+import metricas
+from partida import importar_quando_usar
+
+firestore = importar_quando_usar("firebase_admin.firestore")
+google_exceptions = importar_quando_usar("google.api_core.exceptions")
+
+log = logs.obter("disparos")
+
+COLECAO = "disparos"
+SUBCOLECAO = "destinatarios"
+COLECAO_DESCADASTROS = "promocoes_descadastros"
+PAGINA = 200
+TRABALHADORES = 8
+POR_SEGUNDO_PADRAO = 10
+POR_SEGUNDO_MAX = 60
+MANDATO_S = 120
+MAX_TENTATIVAS = 3
+FREIO_S = 10
+CANAIS = ("app", "whatsapp")
+PUBLICOS = ("pedido_recente", "clientes_app")
+PALAVRAS_SAIDA = {"sair", "parar", "pare", "stop", "descadastrar", "cancelar promocoes", "cancelar promoções"}
+ATIVOS = ("pendente", "rodando")
+
+
+class DisparoInvalido(ValueError):
+    pass
+
+
+def _agora():
+    return datetime.now(timezone.utc)
+
+
+def _telefone(valor):
+    return re.sub(r"\D", "", str(valor or ""))
+
+
+def _primeiro_nome(nome):
+    partes = str(nome or "").split()
+    return partes[0].title() if partes else ""
+
+
+def validar(dados):
+    """Campos do disparo normalizados; DisparoInvalido com o motivo."""
+    mensagem = str(dados.get("mensagem") or "").strip()
+    template = dados.get("template") or None
+    if template is not None and not (isinstance(template, dict) and str(template.get("nome") or "").strip()):
+        raise DisparoInvalido("template precisa de 'nome'")
+    if not mensagem and not template:
+        raise DisparoInvalido("mensagem ou template obrigatório")
+    canais = [c for c in (dados.get("canais") or CANAIS) if c in CANAIS]
+    if not canais:
+        raise DisparoInvalido(f"canais: {', '.join(CANAIS)}")
+    publico = dict(dados.get("publico") or {})
+    publico.setdefault("tipo", "pedido_recente")
+    if publico["tipo"] not in PUBLICOS:
+        raise DisparoInvalido(f"publico.tipo: {', '.join(PUBLICOS)}")
+    if publico["tipo"] == "pedido_recente":
+        try:
+            publico["dias"] = max(1, int(publico.get("dias") or 30))
+        except (TypeError, ValueError):
+            raise DisparoInvalido("publico.dias inválido")
+    publico["somente_optin"] = bool(publico.get("somente_optin"))
+    try:
+        por_segundo = float(dados.get("por_segundo") or POR_SEGUNDO_PADRAO)
+    except (TypeError, ValueError):
+        raise DisparoInvalido("por_segundo inválido")
+    return {
+        "mensagem": mensagem,
+        "titulo": str(dados.get("titulo") or "").strip(),
+        "template": template,
+        "canais": canais,
+        "publico": publico,
+        "por_segundo": min(max(por_segundo, 0.1), POR_SEGUNDO_MAX),
+    }
+
+
+def criar(db, dados):
+    """Grava um disparo novo (pendente) e devolve o id."""
+    campos = validar(dados)
+    ref = db.collection(COLECAO).document()
+    ref.set({
+        **campos,
+        "status": "pendente",
+        "criado_em": _agora(),
+        "expansao_concluida": False,
+        "cursor_publico": None,
+        "contagem": {"total": 0, "enviados": 0, "falhas": 0, "incertos": 0, "fora_do_publico": 0},
+    })
+    return ref.id
+
+
+def pedido_de_saida(texto):
+    """A mensagem do cliente é um pedido pra não receber mais promoções?"""
+    return re.sub(r"[^\w\s]", "", str(texto or "")).strip().lower() in PALAVRAS_SAIDA
+
+
+def descadastrar(db, wa_id):
+    db.collection(COLECAO_DESCADASTROS).document(_telefone(wa_id)).set({"em": _agora()})
+
+
+def texto_para(mensagem, nome):
+    nome = _primeiro_nome(nome)
+    texto = mensagem.replace("{nome}", nome)
+    # Sem nome, "Oi {nome}!" não pode sair "Oi !".
+    return re.sub(r"\s+([!?,.])", r"\1", texto) if not nome else texto
+
+
+class Balde:
+    """Balde de fichas dividido pelos threads de envio: 'por_segundo'
+    envios por segundo, rajada de até um segundo. frear() segura todo mundo
+    (limite da Meta)."""
+
+    def __init__(self, por_segundo):
+        self._por_segundo = por_segundo
+        self._fichas = 1.0
+        self._ultimo = time.monotonic()
+        self._freado_ate = 0.0
+        self._lock = threading.Lock()
+
+    def esperar(self):
+        while True:
+            with self._lock:
+                agora = time.monotonic()
+                if agora >= self._freado_ate:
+                    capacidade = max(1.0, self._por_segundo)
+                    self._fichas = min(capacidade, self._fichas + (agora - self._ultimo) * self._por_segundo)
+                    self._ultimo = agora
+                    if self._fichas >= 1:
+                        self._fichas -= 1
+                        return
+                    espera = (1 - self._fichas) / self._por_segundo
+                else:
+                    espera = self._freado_ate - agora
+            time.sleep(espera)
+
+    def frear(self, segundos):
+        with self._lock:
+            self._freado_ate = max(self._freado_ate, time.monotonic() + segundos)
+            self._fichas = 0.0
+            self._ultimo = self._freado_ate
+
+
+class Disparador:
+    """enviar_whatsapp(telefone, disparo, nome) -> (resultado, erro) e
+    enviar_app([(token, titulo, corpo, dados)]) -> [(resultado, erro)], com
+    resultado 'enviado', 'falhou' ou 'retido' (limite do canal: tentar de
+    novo depois)."""
+
+    def __init__(self, db, enviar_whatsapp, enviar_app):
+        self._db = db
+        self._enviar_whatsapp = enviar_whatsapp
+        self._enviar_app = enviar_app
+        self._dono = f"{socket.gethostname()}:{os.getpid()}"
+        self._rodando = set()
+        self._lock = threading.Lock()
+        self._pool = None
+
+    def _ref(self, disparo_id):
+        return self._db.collection(COLECAO).document(disparo_id)
+
+    # --- quem roda ---
+
+    def iniciar(self, disparo_id):
+        """Sobe o thread do disparo neste processo, se ninguém estiver
+        rodando ele."""
+        with self._lock:
+            if disparo_id in self._rodando:
+                return False
+            self._rodando.add(disparo_id)
+        threading.Thread(target=lojas.fixar(self._rodar), args=(disparo_id,), name=f"disparo-{disparo_id}",
+                         daemon=True).start()
+        return True
+
+    def retomar(self):
+        """Líder da varredura: pega os disparos pendentes ou largados."""
+        agora = _agora()
+        for doc in self._db.collection(COLECAO).where("status", "in", list(ATIVOS)).stream():
+            dados = doc.to_dict() or {}
+            expira_em = dados.get("mandato_expira_em")
+            if dados.get("status") == "pendente" or expira_em is None or expira_em <= agora:
+                self.iniciar(doc.id)
+
+    def _mandato(self, ref, snap):
+        """Pega ou renova o mandato do disparo (otimista, como o do
+        varredor)."""
+        dados = snap.to_dict() or {}
+        agora = _agora()
+        expira_em = dados.get("mandato_expira_em")
+        if dados.get("dono") not in (None, self._dono) and expira_em is not None and expira_em > agora:
+            return False
+        campos = {"dono": self._dono, "mandato_expira_em": agora + timedelta(seconds=MANDATO_S)}
+        if dados.get("status") == "pendente":
+            campos["status"] = "rodando"
+            campos.setdefault("iniciado_em", dados.get("iniciado_em") or agora)
+        try:
+            ref.update(campos, option=self._db.write_option(last_update_time=snap.update_time))
+            return True
+        except (google_exceptions.FailedPrecondition, google_exceptions.NotFound):
+            return False
+
+    def _renovar(self, ref):
+        """Renova o mandato no meio da página. False se outro processo
+        pegou o disparo."""
+        for _tentativa in range(3):
+            snap = ref.get()
+            if (snap.to_dict() or {}).get("dono") != self._dono:
+                return False
+            if self._mandato(ref, snap):
+                return True
+        # Documento mudando (painel, o próprio fechamento da página), mas
+        # ainda nosso: tenta de novo na próxima volta.
+        return True
+
+    def _manter_mandato(self, ref, fim, perdido):
+        while not fim.wait(MANDATO_S / 3):
+            try:
+                if not self._renovar(ref):
+                    perdido.set()
+                    return
+            except Exception:
+                # Sem Firestore agora; o fechamento da página confere o dono.
+                log.warning("erro ao renovar o mandato do disparo", extra={"disparo": ref.id}, exc_info=True)
+
+    def _rodar(self, disparo_id):
+        ref = self._ref(disparo_id)
+        balde = None
+        try:
+            while True:
+                snap = ref.get()
+                dados = snap.to_dict() or {}
+                if not snap.exists or dados.get("status") not in ATIVOS or not self._mandato(ref, snap):
+                    return
+                try:
+                    campos = validar(dados)
+                except DisparoInvalido as e:
+                    ref.update({"status": "erro", "erro": str(e)})
+                    return
+                if balde is None:
+                    balde = Balde(campos["por_segundo"])
+                    self._marcar_incertos(ref)
+                if not dados.get("expansao_concluida"):
+                    self._expandir(ref, dados, campos)
+                elif not self._enviar_pagina(ref, disparo_id, campos, balde):
+                    ref.update({"status": "concluido", "terminado_em": _agora(), "mandato_expira_em": None})
+                    log.info("disparo concluído", extra={"disparo": disparo_id})
+                    return
+        except Exception as e:
+            # O mandato vence e o líder da varredura tenta de novo.
+            metricas.ERROS.labels(tipo="disparo").inc()
+            log.error("erro no disparo", extra={"disparo": disparo_id}, exc_info=True)
+            try:
+                ref.update({"erro": str(e)})
+            except Exception:
+                pass
+        finally:
+            with self._lock:
+                self._rodando.discard(disparo_id)
+
+    # --- expansão do público ---
+
+    def _consulta_publico(self, publico):
+        if publico["tipo"] == "pedido_recente":
+            corte = _agora() - timedelta(days=publico["dias"])
+            return "pedidos", (self._db.collection("pedidos").where("hora_pedido", ">=", corte)
+                               .order_by("hora_pedido").order_by("__name__"))
+        return "usuarios_app", self._db.collection("usuarios_app").order_by("__name__")
+
+    def _expandir(self, ref, dados, campos):
+        """Uma página do público: destinatários novos e o cursor num batch
+        só."""
+        colecao, consulta = self._consulta_publico(campos["publico"])
+        cursor = dados.get("cursor_publico")
+        if cursor:
+            ultimo = self._db.collection(colecao).document(cursor).get()
+            if ultimo.exists:
+                consulta = consulta.start_after(ultimo)
+        docs = list(consulta.limit(PAGINA).stream())
+
+        # telefone (ou app_<id>) -> destinatário; o primeiro documento ganha.
+        candidatos, usuarios = {}, {}
+        for doc in docs:
+            d = doc.to_dict() or {}
+            if colecao == "pedidos":
+                telefone = _telefone(d.get("telefone_cliente"))
+                usuario_id = d.get("usuario_id")
+                chave = telefone or (f"app_{usuario_id}" if usuario_id else None)
+                if chave and chave not in candidatos:
+                    candidatos[chave] = {"telefone": telefone or None, "nome": d.get("nome_cliente") or "",
+                                         "usuario_id": usuario_id}
+            else:
+                telefone = _telefone(d.get("telefone"))
+                chave = telefone or f"app_{doc.id}"
+                if chave not in candidatos:
+                    candidatos[chave] = {"telefone": telefone or None, "nome": d.get("nome") or "", "usuario_id": doc.id}
+                    usuarios[doc.id] = d
+
+        # Token do app e aceita_promocoes: os pedidos só trazem o usuario_id.
+        faltando = {c["usuario_id"] for c in candidatos.values() if c["usuario_id"] and c["usuario_id"] not in usuarios}
+        if faltando:
+            refs = [self._db.collection("usuarios_app").document(str(u)) for u in faltando]
+            usuarios.update({s.id: s.to_dict() or {} for s in self._db.get_all(refs) if s.exists})
+        refs_saida = [self._db.collection(COLECAO_DESCADASTROS).document(c["telefone"])
+                      for c in candidatos.values() if c["telefone"]]
+        descadastrados = {s.id for s in self._db.get_all(refs_saida) if s.exists} if refs_saida else set()
+        refs_dest = [ref.collection(SUBCOLECAO).document(chave) for chave in candidatos]
+        existentes = {s.id for s in self._db.get_all(refs_dest) if s.exists} if refs_dest else set()
+
+        lote, novos, fora = self._db.batch(), 0, 0
+        for chave, c in candidatos.items():
+            if chave in existentes:
+                continue
+            usuario = usuarios.get(str(c["usuario_id"])) or {}
+            aceita = usuario.get("aceita_promocoes")
+            if c["telefone"] in descadastrados or aceita is False or (campos["publico"]["somente_optin"] and aceita is not True):
+                fora += 1
+                continue
+            token = usuario.get("fcm_token") or None
+            canal = next((canal for canal in campos["canais"]
+                          if (canal == "app" and token) or (canal == "whatsapp" and c["telefone"])), None)
+            if canal is None:
+                fora += 1
+                continue
+            lote.set(ref.collection(SUBCOLECAO).document(chave), {
+                "telefone": c["telefone"], "fcm_token": token, "nome": _primeiro_nome(c["nome"] or usuario.get("nome")),
+                "canal": canal, "status": "pendente", "tentativas": 0,
+            })
+            novos += 1
+        lote.update(ref, {
+            "cursor_publico": docs[-1].id if docs else cursor,
+            "expansao_concluida": len(docs) < PAGINA,
+            "contagem.total": firestore.Increment(novos),
+            "contagem.fora_do_publico": firestore.Increment(fora),
+            "atualizado_em": _agora(),
+        })
+        lote.commit()
+
+    # --- envio ---
+
+    def _marcar_incertos(self, ref):
+        """Destinatários que ficaram 'enviando' numa queda: não reenvia."""
+        presos = list(ref.collection(SUBCOLECAO).where("status", "==", "enviando").stream())
+        if not presos:
+            return
+        lote = self._db.batch()
+        for snap in presos:
+            lote.update(snap.reference, {"status": "incerto"})
+        lote.update(ref, {"contagem.incertos": firestore.Increment(len(presos))})
+        lote.commit()
+
+    def _executor(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=TRABALHADORES, thread_name_prefix="disparo-envio")
+            return self._pool
+
+    def _enviar_pagina(self, ref, disparo_id, campos, balde):
+        """Uma página de envios. False quando não sobrou ninguém pendente."""
+        pendentes = list(ref.collection(SUBCOLECAO).where("status", "==", "pendente").limit(PAGINA).stream())
+        if not pendentes:
+            return False
+        lote = self._db.batch()
+        for snap in pendentes:
+            lote.update(snap.reference, {"status": "enviando"})
+        lote.commit()
+
+        # Uma página a poucos envios por segundo, com freio da Meta ou
+        # esperando o push passa do MANDATO_S: renova enquanto ela sai.
+        fim, perdido = threading.Event(), threading.Event()
+        threading.Thread(target=lojas.fixar(self._manter_mandato), args=(ref, fim, perdido),
+                         name=f"disparo-mandato-{disparo_id}", daemon=True).start()
+        try:
+            resultados, segundos = self._enviar(disparo_id, campos, balde, pendentes, perdido)
+        finally:
+            fim.set()
+        if perdido.is_set():
+            log.warning("outro processo pegou o disparo no meio da página", extra={"disparo": disparo_id})
+            return True
+
+        agora = _agora()
+        escritas, contagem = [], Counter()
+        for snap in pendentes:
+            d = snap.to_dict() or {}
+            resultado, erro = resultados[snap.id]
+            if resultado == "retido":
+                tentativas = int(d.get("tentativas") or 0) + 1
+                if tentativas < MAX_TENTATIVAS:
+                    escritas.append((snap.reference, {"status": "pendente", "tentativas": tentativas}))
+                    continue
+                resultado, erro = "falhou", erro or "limite do canal"
+            status = "enviado" if resultado == "enviado" else "falhou"
+            contagem["enviados" if status == "enviado" else "falhas"] += 1
+            escritas.append((snap.reference, {"status": status, "erro": erro, "em": agora}))
+        for _tentativa in range(3):
+            snap = ref.get()
+            if (snap.to_dict() or {}).get("dono") != self._dono:
+                log.warning("outro processo pegou o disparo no meio da página", extra={"disparo": disparo_id})
+                return True
+            lote = self._db.batch()
+            for destinatario, campos_destinatario in escritas:
+                lote.update(destinatario, campos_destinatario)
+            lote.update(ref, {
+                **{f"contagem.{campo}": firestore.Increment(n) for campo, n in contagem.items()},
+                "taxa_por_minuto": round(sum(contagem.values()) * 60 / segundos, 1),
+                "atualizado_em": agora,
+                "mandato_expira_em": agora + timedelta(seconds=MANDATO_S),
+            }, option=self._db.write_option(last_update_time=snap.update_time))
+            try:
+                lote.commit()
+                break
+            except google_exceptions.FailedPrecondition:
+                continue
+        else:
+            raise RuntimeError("documento do disparo mudou 3 vezes no fechamento da página")
+        for snap in pendentes:
+            resultado = resultados[snap.id][0]
+            metricas.DISPAROS_ENVIOS.labels(canal=(snap.to_dict() or {}).get("canal"), resultado=resultado).inc()
+        return True
+
+    def _enviar(self, disparo_id, campos, balde, pendentes, perdido):
+        """Manda a página: app num send_each só, WhatsApp pelos
+        trabalhadores atrás do balde. Devolve ({id: (resultado, erro)},
+        segundos). Com 'perdido' ligado o que falta não sai."""
+        inicio = time.monotonic()
+        destinatarios = [(snap, snap.to_dict() or {}) for snap in pendentes]
+        pelo_app = [(snap, d) for snap, d in destinatarios if d.get("canal") == "app"]
+        pelo_whatsapp = [(snap, d) for snap, d in destinatarios if d.get("canal") != "app"]
+
+        resultados = {}
+        if pelo_app:
+            corpo = campos["mensagem"] or campos["titulo"]
+            mensagens = [(d["fcm_token"], campos["titulo"], texto_para(corpo, d.get("nome")),
+                          {"tipo": "promocao", "disparo": disparo_id}) for _snap, d in pelo_app]
+            for (snap, _d), resultado in zip(pelo_app, self._enviar_app(mensagens)):
+                resultados[snap.id] = resultado
+
+        interrompido = threading.Event()
+
+        def enviar(item):
+            snap, d = item
+            balde.esperar()
+            if interrompido.is_set() or perdido.is_set():
+                return snap.id, ("falhou", "interrompido")
+            resultado = self._enviar_whatsapp(d["telefone"], campos, d.get("nome"))
+            if resultado[0] == "retido":
+                balde.frear(FREIO_S)
+            return snap.id, resultado
+
+        futuros = [self._executor().submit(enviar, item) for item in pelo_whatsapp]
+        try:
+            resultados.update(futuro.result() for futuro in futuros)
+        except BaseException:
+            # A página fica 'enviando' (vira 'incerto'); o resto dela não sai.
+            interrompido.set()
+            for futuro in futuros:
+                futuro.cancel()
+            raise
+        return resultados, max(time.monotonic() - inicio, 0.001)
@@ -0,0 +1,368 @@
+"""Histórico das conversas gravado por trás da resposta (write-behind).
+
+O turno terminava com dois salvar_historico_firestore seguidos — cada um
+um get + update do documento da conversa — e só depois a resposta saía pro
+WhatsApp: o cliente esperava quatro idas ao Firestore que não mudam nada
+no que ele recebe. Agora o turno só entrega as mensagens pra esta fila
+(microssegundos) e responde; um thread de fundo grava.
+
+- Junta: tudo o que chegou pra mesma conversa desde a última gravação
+  (pergunta e resposta, ou vários turnos com o Firestore lento) vira uma
+  escrita só. A gravação é otimista — update com last_update_time do
+  documento lido (ou create, se ainda não existe) — e relê se outro
+  worker ou o calcular_pedido mexeu no documento no meio. O resumo da
+  conversa pro painel (caixa_entrada.py) e as mensagens na subcoleção
+  paginada (paginas_historico.py) vão no mesmo lote.
+- Diário: cada entrada vai antes pra um arquivo só-acréscimo do processo
+  (FILA_HISTORICO_DIR/historico-<pid>-<início>.jsonl) e cada gravação
+  confirmada acrescenta um {"ok": [...]}. O processo segura uma trava
+  (flock) no próprio diário enquanto vive; na partida, cada worker procura
+  diários sem dono (trava livre = processo morreu), regrava as entradas
+  não confirmadas e apaga o arquivo. Cada mensagem leva um 'id', e a
+  gravação pula as que já estão no documento — entrada gravada cujo "ok"
+  não chegou no diário antes do crash não duplica.
+- Ler o que escreveu: quem lê o histórico (obter_historico_firestore, o
+  ler_conversa do app_async) junta o que ainda está na fila deste processo
+  (mesclar). Se outro worker da máquina tem gravação pendente da mesma
+  conversa — marcada em FILA_HISTORICO_DIR/pendentes/<wa_id>.<pid> —, a
+  leitura espera ela sair (até ESPERA_MAXIMA_LEITURA, dentro do prazo do
+  turno). Entre máquinas diferentes não há essa garantia; o atraso normal
+  é JANELA_JUNTAR mais uma escrita.
+
+O atraso entre o turno e o histórico no Firestore fica em
+bot_historico_atraso_segundos, e quantos turnos cada escrita juntou em
+bot_historico_turnos_por_gravacao. O diário não tem fsync: sobrevive ao
+worker morrer (o que o gunicorn faz no timeout), não à máquina cair. No
+Render o disco some num deploy novo; pendências de um worker vivo são
+gravadas no encerramento (atexit).
+"""
+import atexit
+import json
+import os
+import secrets
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import caixa_entrada
+import logs
+import lojas
+import metricas
+import paginas_historico
+import prazo
+from partida import importar_quando_usar
+
+log = logs.obter("fila_historico")
+
+google_exceptions = importar_quando_usar("google.api_core.exceptions")
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+JANELA_JUNTAR = 0.2
+ESPERA_MAXIMA_LEITURA = 2.0
+TENTATIVAS_CONFLITO = 3
+ESPERA_ERRO_MAX = 30
+TAMANHO_COMPACTAR = 1 << 20
+LIMITE_PADRAO = 15
+
+
+def pasta_padrao():
+    return os.environ.get("FILA_HISTORICO_DIR") or os.path.join(tempfile.gettempdir(), "bot_fila_historico")
+
+
+def _processo_vivo(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _para_diario(seq, wa_id, mensagens, limite):
+    return {
+        "s": seq, "w": wa_id, "l": limite,
+        "m": [{**m, "timestamp": m["timestamp"].isoformat()} for m in mensagens],
+    }
+
+
+def _ler_diario(caminho):
+    """Entradas ainda não confirmadas de um diário, na ordem em que chegaram."""
+    entradas = {}
+    with open(caminho, encoding="utf-8") as arquivo:
+        for linha in arquivo:
+            try:
+                registro = json.loads(linha)
+            except ValueError:
+                continue  # última linha cortada no meio pelo crash
+            if "ok" in registro:
+                for seq in registro["ok"]:
+                    entradas.pop(seq, None)
+            else:
+                entradas[registro["s"]] = registro
+    return [
+        (r["w"], [{**m, "timestamp": datetime.fromisoformat(m["timestamp"])} for m in r["m"]], r.get("l"))
+        for r in entradas.values()
+    ]
+
+
+class FilaHistorico:
+    def __init__(self, db, pasta=None):
+        self._db = db
+        self._pasta = pasta or pasta_padrao()
+        self._pid = None
+        self._lock = threading.Lock()
+        self._gravando = threading.Lock()
+        self._acordar = threading.Event()
+        os.register_at_fork(after_in_child=self._depois_do_fork)
+        self._zerar()
+
+    def _zerar(self):
+        # wa_id -> entradas {seq, mensagens, limite, enfileirado_em}, em ordem.
+        self._pendentes = {}
+        self._seq = 0
+        self._diario = None
+
+    def _depois_do_fork(self):
+        # Fila, diário e thread do processo pai não valem no filho.
+        self._lock = threading.Lock()
+        self._gravando = threading.Lock()
+        self._acordar = threading.Event()
+        self._pid = None
+
+    # --- partida ---
+
+    def _garantir_iniciado(self):
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._lock:
+            if self._pid == pid:
+                return
+            self._zerar()
+            os.makedirs(os.path.join(self._pasta, "pendentes"), exist_ok=True)
+            caminho = os.path.join(self._pasta, f"historico-{pid}-{int(time.time())}.jsonl")
+            self._diario = os.open(caminho, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            if fcntl is not None:
+                fcntl.flock(self._diario, fcntl.LOCK_EX)
+            self._pid = pid
+            recuperadas = self._recuperar_orfaos(caminho)
+            # Uma fila por loja (lojas.py): o thread grava no db da loja.
+            threading.Thread(target=lojas.fixar(self._laco), name="fila-historico", daemon=True).start()
+            atexit.register(lojas.fixar(self.gravar))
+        if recuperadas:
+            log.info("diários sem dono recuperados", extra={"entradas": recuperadas})
+            self._acordar.set()
+
+    def _recuperar_orfaos(self, proprio):
+        """Regrava no próprio diário as entradas pendentes de processos
+        mortos e apaga os diários deles (com o lock da fila já seguro)."""
+        recuperadas = 0
+        for nome in sorted(os.listdir(self._pasta)):
+            caminho = os.path.join(self._pasta, nome)
+            if caminho == proprio or not (nome.startswith("historico-") and nome.endswith(".jsonl")):
+                continue
+            if fcntl is None:
+                continue  # sem trava não dá pra saber se o dono morreu
+            try:
+                fd = os.open(caminho, os.O_RDONLY)
+            except FileNotFoundError:
+                continue
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(fd)
+                continue
+            try:
+                for wa_id, mensagens, limite in _ler_diario(caminho):
+                    self._adicionar(wa_id, mensagens, limite)
+                    recuperadas += 1
+                os.unlink(caminho)
+            except Exception:
+                log.error("erro ao recuperar diário", extra={"diario": nome}, exc_info=True)
+            finally:
+                os.close(fd)
+        pasta_marcas = os.path.join(self._pasta, "pendentes")
+        for nome in os.listdir(pasta_marcas):
+            pid = nome.rpartition(".")[2]
+            if pid.isdigit() and not _processo_vivo(int(pid)):
+                try:
+                    os.unlink(os.path.join(pasta_marcas, nome))
+                except FileNotFoundError:
+                    pass
+        return recuperadas
+
+    # --- entrada (no turno) ---
+
+    def enfileirar(self, wa_id, mensagens, limite=None):
+        """Entrega as mensagens [(role, content), ...] de um turno pra
+        gravação. Volta na hora; limite = quantas mensagens o documento guarda."""
+        self._garantir_iniciado()
+        agora = datetime.now(timezone.utc)
+        # Um microssegundo entre as mensagens do turno: a pergunta fica
+        # sempre antes da resposta na ordem da subcoleção (paginas_historico.py).
+        novas = [{"id": secrets.token_hex(8), "role": role, "content": content,
+                  "timestamp": agora + timedelta(microseconds=i)}
+                 for i, (role, content) in enumerate(mensagens)]
+        with self._lock:
+            self._adicionar(wa_id, novas, limite)
+        self._acordar.set()
+
+    def _adicionar(self, wa_id, mensagens, limite):
+        # Chamado com self._lock seguro.
+        self._seq += 1
+        entrada = {"seq": self._seq, "mensagens": mensagens, "limite": limite, "enfileirado_em": time.monotonic()}
+        self._escrever_diario(_para_diario(self._seq, wa_id, mensagens, limite))
+        if wa_id not in self._pendentes:
+            self._pendentes[wa_id] = []
+            self._marcar(wa_id)
+        self._pendentes[wa_id].append(entrada)
+
+    def _escrever_diario(self, registro):
+        try:
+            os.write(self._diario, (json.dumps(registro, ensure_ascii=False) + "\n").encode("utf-8"))
+        except OSError:
+            # Sem diário a entrada só não sobrevive a um crash; a gravação segue.
+            log.error("erro ao escrever no diário do histórico", exc_info=True)
+
+    def _marca(self, wa_id):
+        return os.path.join(self._pasta, "pendentes", f"{wa_id}.{os.getpid()}")
+
+    def _marcar(self, wa_id):
+        try:
+            os.close(os.open(self._marca(wa_id), os.O_WRONLY | os.O_CREAT, 0o644))
+        except OSError:
+            pass
+
+    def _desmarcar(self, wa_id):
+        try:
+            os.unlink(self._marca(wa_id))
+        except OSError:
+            pass
+
+    # --- leitura (ler o que escreveu) ---
+
+    def mesclar(self, wa_id, mensagens):
+        """As mensagens do documento mais as desta conversa que ainda estão
+        na fila deste processo."""
+        with self._lock:
+            entradas = list(self._pendentes.get(wa_id, ()))
+        if not entradas:
+            return mensagens
+        ids = {m.get("id") for m in mensagens}
+        return list(mensagens) + [m for e in entradas for m in e["mensagens"] if m["id"] not in ids]
+
+    def outros_gravando(self, wa_id):
+        """Outro worker da máquina ainda tem gravação pendente desta conversa?"""
+        prefixo = f"{wa_id}."
+        proprio = str(os.getpid())
+        try:
+            nomes = os.listdir(os.path.join(self._pasta, "pendentes"))
+        except FileNotFoundError:
+            return False
+        for nome in nomes:
+            if nome.startswith(prefixo):
+                pid = nome[len(prefixo):]
+                if pid != proprio and pid.isdigit() and _processo_vivo(int(pid)):
+                    return True
+        return False
+
+    def aguardar_outros(self, wa_id):
+        """Espera (pouco) a gravação de outro worker sair antes de ler."""
+        fim = time.monotonic() + prazo.timeout(ESPERA_MAXIMA_LEITURA, minimo=0.0)
+        while self.outros_gravando(wa_id):
+            if time.monotonic() >= fim:
+                metricas.ERROS.labels(tipo="historico_leitura_atrasada").inc()
+                return False
+            time.sleep(0.02)
+        return True
+
+    # --- gravação (thread de fundo) ---
+
+    def _laco(self):
+        espera = None
+        while True:
+            self._acordar.wait(espera)
+            self._acordar.clear()
+            time.sleep(JANELA_JUNTAR)
+            if self.gravar():
+                espera = min(ESPERA_ERRO_MAX, (espera or 0.5) * 2)
+            else:
+                espera = None
+
+    def gravar(self):
+        """Grava agora tudo o que está na fila, uma escrita por conversa.
+        Devolve True se alguma conversa ficou pendente por erro."""
+        with self._gravando:
+            with self._lock:
+                lote = {wa_id: list(entradas) for wa_id, entradas in self._pendentes.items()}
+            falhou = False
+            for wa_id, entradas in lote.items():
+                try:
+                    self._gravar_conversa(wa_id, entradas)
+                except Exception as e:
+                    falhou = True
+                    metricas.ERROS.labels(tipo="historico").inc()
+                    log.warning("histórico não salvo, fica na fila", extra={"wa_id": wa_id, "erro": str(e)})
+                    continue
+                self._confirmar(wa_id, entradas)
+            return falhou
+
+    def _gravar_conversa(self, wa_id, entradas):
+        doc_ref = self._db.collection("historico_conversas").document(wa_id)
+        novas = [m for e in entradas for m in e["mensagens"]]
+        limite = max(e["limite"] or LIMITE_PADRAO for e in entradas)
+        for _tentativa in range(TENTATIVAS_CONFLITO):
+            doc = doc_ref.get()
+            # O resumo da caixa_entrada e as mensagens da subcoleção vão no
+            # mesmo lote: mudam junto com o documento da conversa, ou nada muda.
+            lote = self._db.batch()
+            if doc.exists:
+                atual = doc.to_dict() or {}
+                atuais = atual.get("mensagens", [])
+                ids = {m.get("id") for m in atuais}
+                ineditas = [m for m in novas if m["id"] not in ids]
+                campos = {"mensagens": (atuais + ineditas)[-limite:], "ultima_interacao": novas[-1]["timestamp"]}
+                lote.update(doc_ref, campos, option=self._db.write_option(last_update_time=doc.update_time))
+                erros = (google_exceptions.FailedPrecondition, google_exceptions.NotFound)
+            else:
+                atual, ineditas = {}, novas
+                campos = {"mensagens": novas[-limite:], "ultima_interacao": novas[-1]["timestamp"]}
+                lote.create(doc_ref, campos)
+                erros = (google_exceptions.AlreadyExists,)
+            lote.set(caixa_entrada.referencia(self._db, wa_id), caixa_entrada.resumo({**atual, **campos}, ineditas), merge=True)
+            for mensagem in ineditas:
+                lote.set(paginas_historico.referencia(doc_ref, mensagem), paginas_historico.documento(mensagem))
+            try:
+                lote.commit()
+                return
+            except erros:
+                continue
+        raise RuntimeError(f"documento mudou {TENTATIVAS_CONFLITO} vezes durante a gravação")
+
+    def _confirmar(self, wa_id, entradas):
+        agora = time.monotonic()
+        for entrada in entradas:
+            metricas.HISTORICO_ATRASO.observe(agora - entrada["enfileirado_em"])
+        metricas.HISTORICO_TURNOS_POR_GRAVACAO.observe(len(entradas))
+        gravadas = {e["seq"] for e in entradas}
+        with self._lock:
+            restantes = [e for e in self._pendentes.get(wa_id, ()) if e["seq"] not in gravadas]
+            if restantes:
+                self._pendentes[wa_id] = restantes
+            else:
+                self._pendentes.pop(wa_id, None)
+                self._desmarcar(wa_id)
+            self._escrever_diario({"ok": sorted(gravadas)})
+            if not self._pendentes:
+                # Tudo confirmado: o diário pode recomeçar do zero.
+                try:
+                    if os.fstat(self._diario).st_size > TAMANHO_COMPACTAR:
+                        os.ftruncate(self._diario, 0)
+                except OSError:
+                    pass
@@ -0,0 +1,451 @@
+"""Contagem de operações do Firestore por requisição/turno.
+
+O Firestore cobra por documento lido, e uma conversa de pedido chegava a
+dezenas de leituras (o 'cardapio' inteiro lido por quatro funções
+diferentes, o documento da conversa relido várias vezes) sem ninguém ver.
+O 'db' do app.py passa a ser um ClienteContado: mesma interface do cliente
+do firebase_admin, mas cada leitura, escrita e documento devolvido por
+consulta é somado:
+
+- nas métricas globais (bot_firestore_operacoes_total, ver metricas.py);
+- na contagem do escopo atual, aberto com 'contar_operacoes()' — o app.py
+  abre um por requisição e põe o total na linha de log do turno.
+
+Pra travar regressão de custo, 'orcamento_firestore' falha (AssertionError)
+se o bloco passar do limite — bench/bench_orcamento.py roda os turnos
+principais assim:
+
+    with orcamento_firestore(max_leituras=0, max_escritas=1):
+        calcular_pedido("5511999999999", itens, "ENTREGA")
+
+Regra de cobrança usada nas contas: get() de documento = 1 leitura (mesmo
+se não existir); consulta = 1 leitura por documento devolvido (mínimo 1,
+consulta vazia também é cobrada); set/update/create/delete = 1 escrita
+cada, inclusive dentro de batch e de transação. collection_group() conta
+como consulta; a transação (transaction()) conta o que lê na hora e as
+escritas no commit — tentativa abortada e repetida lê de novo, e paga.
+
+Dentro de um turno, cada chamada ao servidor também sai com 'timeout=' do
+que resta do prazo do turno (prazo.py), se quem chamou não passou um.
+"""
+import contextvars
+from contextlib import contextmanager
+
+import metricas
+import prazo
+
+_escopo_atual = contextvars.ContextVar("contagem_firestore", default=None)
+
+
+class ContagemFirestore:
+    def __init__(self, pai=None):
+        self.pai = pai
+        self.leituras = 0
+        self.escritas = 0
+        self.docs_consulta = 0
+        self.consultas = 0
+
+    def como_dict(self):
+        return {
+            "leituras": self.leituras,
+            "escritas": self.escritas,
+            "consultas": self.consultas,
+            "docs_consulta": self.docs_consulta,
+        }
+
+
+class OrcamentoFirestoreExcedido(AssertionError):
+    pass
+
+
+def _somar(leituras=0, escritas=0, docs_consulta=0, consultas=0):
+    if leituras:
+        metricas.FIRESTORE_OPERACOES.labels(tipo="leitura").inc(leituras)
+    if escritas:
+        metricas.FIRESTORE_OPERACOES.labels(tipo="escrita").inc(escritas)
+    escopo = _escopo_atual.get()
+    while escopo is not None:
+        escopo.leituras += leituras
+        escopo.escritas += escritas
+        escopo.docs_consulta += docs_consulta
+        escopo.consultas += consultas
+        escopo = escopo.pai
+
+
+def registrar_leituras(quantidade):
+    """Leituras que não passam pelo cliente contado — os listeners
+    (on_snapshot) do instantaneo.py, cobrados por documento alterado."""
+    _somar(leituras=quantidade)
+
+
+@contextmanager
+def contar_operacoes():
+    """Abre um escopo de contagem (aninhável — o escopo de fora também soma
+    o que acontece dentro) e devolve a ContagemFirestore dele."""
+    contagem = ContagemFirestore(pai=_escopo_atual.get())
+    token = _escopo_atual.set(contagem)
+    try:
+        yield contagem
+    finally:
+        _escopo_atual.reset(token)
+
+
+def iniciar_contagem():
+    """Versão sem 'with', pra ganchos before/teardown do Flask: devolve
+    (contagem, token) — o token vai pra 'encerrar_contagem' no fim."""
+    contagem = ContagemFirestore(pai=_escopo_atual.get())
+    return contagem, _escopo_atual.set(contagem)
+
+
+def encerrar_contagem(token):
+    _escopo_atual.reset(token)
+
+
+@contextmanager
+def orcamento_firestore(max_leituras=None, max_escritas=None):
+    with contar_operacoes() as contagem:
+        yield contagem
+    excedido = []
+    if max_leituras is not None and contagem.leituras > max_leituras:
+        excedido.append(f"{contagem.leituras} leituras (máximo {max_leituras})")
+    if max_escritas is not None and contagem.escritas > max_escritas:
+        excedido.append(f"{contagem.escritas} escritas (máximo {max_escritas})")
+    if excedido:
+        raise OrcamentoFirestoreExcedido("Orçamento do Firestore estourado: " + ", ".join(excedido))
+
+
+def _original(ref):
+    return getattr(ref, "_original", ref)
+
+
+def _com_prazo(kwargs):
+    # Nunca menos que MINIMO_FIRESTORE: quem desiste do turno é o próprio
+    # turno (prazo.verificar), não uma gravação cortada no meio.
+    if "transaction" in kwargs:
+        kwargs["transaction"] = _original(kwargs["transaction"])
+    if "timeout" not in kwargs:
+        timeout = prazo.timeout(minimo=prazo.MINIMO_FIRESTORE)
+        if timeout is not None:
+            kwargs["timeout"] = timeout
+    return kwargs
+
+
+def _contar_consulta(snaps):
+    # Conta cada documento ao entregar: quem para no meio (next() no
+    # primeiro, break) paga o que leu, sem esperar o coletor de lixo.
+    _somar(consultas=1)
+    vazia = True
+    for snap in snaps:
+        vazia = False
+        _somar(leituras=1, docs_consulta=1)
+        yield SnapshotContado(snap)
+    if vazia:
+        _somar(leituras=1)
+
+
+async def _contar_consulta_async(snaps):
+    _somar(consultas=1)
+    vazia = True
+    async for snap in snaps:
+        vazia = False
+        _somar(leituras=1, docs_consulta=1)
+        yield SnapshotContado(snap)
+    if vazia:
+        _somar(leituras=1)
+
+
+class _Embrulho:
+    def __init__(self, original):
+        self._original = original
+
+    def __getattr__(self, nome):
+        return getattr(self._original, nome)
+
+
+class SnapshotContado(_Embrulho):
+    @property
+    def reference(self):
+        return DocumentoContado(self._original.reference)
+
+
+class DocumentoContado(_Embrulho):
+    def get(self, *args, **kwargs):
+        _somar(leituras=1)
+        return SnapshotContado(self._original.get(*args, **_com_prazo(kwargs)))
+
+    def set(self, *args, **kwargs):
+        _somar(escritas=1)
+        return self._original.set(*args, **_com_prazo(kwargs))
+
+    def update(self, *args, **kwargs):
+        _somar(escritas=1)
+        return self._original.update(*args, **_com_prazo(kwargs))
+
+    def create(self, *args, **kwargs):
+        _somar(escritas=1)
+        return self._original.create(*args, **_com_prazo(kwargs))
+
+    def delete(self, *args, **kwargs):
+        _somar(escritas=1)
+        return self._original.delete(*args, **_com_prazo(kwargs))
+
+    def collection(self, *args, **kwargs):
+        return ColecaoContada(self._original.collection(*args, **kwargs))
+
+
+class ConsultaContada(_Embrulho):
+    def _encadear(nome):
+        def metodo(self, *args, **kwargs):
+            # start_after(snapshot) e companhia querem o snapshot original.
+            return ConsultaContada(getattr(self._original, nome)(*map(_original, args), **kwargs))
+        metodo.__name__ = nome
+        return metodo
+
+    where = _encadear("where")
+    order_by = _encadear("order_by")
+    limit = _encadear("limit")
+    limit_to_last = _encadear("limit_to_last")
+    offset = _encadear("offset")
+    select = _encadear("select")
+    start_at = _encadear("start_at")
+    start_after = _encadear("start_after")
+    end_at = _encadear("end_at")
+    end_before = _encadear("end_before")
+    del _encadear
+
+    def stream(self, *args, **kwargs):
+        return _contar_consulta(self._original.stream(*args, **_com_prazo(kwargs)))
+
+    def get(self, *args, **kwargs):
+        return list(self.stream(*args, **kwargs))
+
+
+class ColecaoContada(ConsultaContada):
+    def document(self, *args, **kwargs):
+        return DocumentoContado(self._original.document(*args, **kwargs))
+
+    def add(self, *args, **kwargs):
+        _somar(escritas=1)
+        return self._original.add(*args, **_com_prazo(kwargs))
+
+
+class LoteContado(_Embrulho):
+    """Batch/BulkWriter: conta as escritas no commit (se o commit falhar,
+    nada foi gravado nem cobrado)."""
+
+    def __init__(self, original):
+        super().__init__(original)
+        self._pendentes = 0
+
+    def set(self, ref, *args, **kwargs):
+        self._pendentes += 1
+        return self._original.set(_original(ref), *args, **kwargs)
+
+    def update(self, ref, *args, **kwargs):
+        self._pendentes += 1
+        return self._original.update(_original(ref), *args, **kwargs)
+
+    def create(self, ref, *args, **kwargs):
+        self._pendentes += 1
+        return self._original.create(_original(ref), *args, **kwargs)
+
+    def delete(self, ref, *args, **kwargs):
+        self._pendentes += 1
+        return self._original.delete(_original(ref), *args, **kwargs)
+
+    def _confirmar(self, metodo, *args, **kwargs):
+        resultado = getattr(self._original, metodo)(*args, **kwargs)
+        _somar(escritas=self._pendentes)
+        self._pendentes = 0
+        return resultado
+
+    def commit(self, *args, **kwargs):
+        return self._confirmar("commit", *args, **_com_prazo(kwargs))
+
+    def flush(self, *args, **kwargs):
+        return self._confirmar("flush", *args, **kwargs)
+
+    def close(self, *args, **kwargs):
+        return self._confirmar("close", *args, **kwargs)
+
+
+class TransacaoContada(LoteContado):
+    """Transação: as leituras contam na hora (o Firestore cobra mesmo se
+    ela abortar); as escritas, como no batch, só no commit — que quem faz
+    é o firestore.transactional, pelo _commit."""
+
+    def get(self, ref_or_query, *args, **kwargs):
+        resultado = self._original.get(_original(ref_or_query), *args, **_com_prazo(kwargs))
+        if isinstance(ref_or_query, ConsultaContada):
+            return _contar_consulta(resultado)
+        _somar(leituras=1)
+        return (SnapshotContado(snap) for snap in resultado)
+
+    def get_all(self, refs, *args, **kwargs):
+        refs = [_original(ref) for ref in refs]
+        _somar(leituras=len(refs))
+        return (SnapshotContado(snap) for snap in self._original.get_all(refs, *args, **_com_prazo(kwargs)))
+
+    def _clean_up(self):
+        # Começo de cada tentativa: o que a anterior enfileirou não vale.
+        self._pendentes = 0
+        return self._original._clean_up()
+
+    def _commit(self, *args, **kwargs):
+        return self._confirmar("_commit", *args, **kwargs)
+
+
+class ClienteContado(_Embrulho):
+    """'prefixo' põe todas as coleções embaixo de um documento — as lojas
+    que dividem o projeto Firebase da principal (lojas.py) usam
+    lojas/<id>/<coleção> com o mesmo código."""
+
+    def __init__(self, original, prefixo=""):
+        super().__init__(original)
+        self._prefixo = f"{prefixo}/" if prefixo else ""
+
+    def collection(self, caminho, *args, **kwargs):
+        return ColecaoContada(self._original.collection(self._prefixo + caminho, *args, **kwargs))
+
+    def document(self, caminho, *args, **kwargs):
+        return DocumentoContado(self._original.document(self._prefixo + caminho, *args, **kwargs))
+
+    def get_all(self, refs, *args, **kwargs):
+        refs = [_original(ref) for ref in refs]
+        _somar(leituras=len(refs))
+        return [SnapshotContado(snap) for snap in self._original.get_all(refs, *args, **_com_prazo(kwargs))]
+
+    def collection_group(self, *args, **kwargs):
+        # Pega a coleção em todo o projeto, por cima do prefixo da loja.
+        return ConsultaContada(self._original.collection_group(*args, **kwargs))
+
+    def batch(self, *args, **kwargs):
+        return LoteContado(self._original.batch(*args, **kwargs))
+
+    def bulk_writer(self, *args, **kwargs):
+        return LoteContado(self._original.bulk_writer(*args, **kwargs))
+
+    def transaction(self, *args, **kwargs):
+        return TransacaoContada(self._original.transaction(*args, **kwargs))
+
+
+# --- Cliente assíncrono (app_async.py) ---
+# Mesma contagem, pro firestore_async.client(): os métodos que falam com o
+# servidor viram corrotinas e o stream() das consultas é um gerador async.
+
+class DocumentoContadoAsync(_Embrulho):
+    async def get(self, *args, **kwargs):
+        _somar(leituras=1)
+        return SnapshotContado(await self._original.get(*args, **_com_prazo(kwargs)))
+
+    async def set(self, *args, **kwargs):
+        _somar(escritas=1)
+        return await self._original.set(*args, **_com_prazo(kwargs))
+
+    async def update(self, *args, **kwargs):
+        _somar(escritas=1)
+        return await self._original.update(*args, **_com_prazo(kwargs))
+
+    async def create(self, *args, **kwargs):
+        _somar(escritas=1)
+        return await self._original.create(*args, **_com_prazo(kwargs))
+
+    async def delete(self, *args, **kwargs):
+        _somar(escritas=1)
+        return await self._original.delete(*args, **_com_prazo(kwargs))
+
+    def collection(self, *args, **kwargs):
+        return ColecaoContadaAsync(self._original.collection(*args, **kwargs))
+
+
+class ConsultaContadaAsync(_Embrulho):
+    def _encadear(nome):
+        def metodo(self, *args, **kwargs):
+            return ConsultaContadaAsync(getattr(self._original, nome)(*map(_original, args), **kwargs))
+        metodo.__name__ = nome
+        return metodo
+
+    where = _encadear("where")
+    order_by = _encadear("order_by")
+    limit = _encadear("limit")
+    limit_to_last = _encadear("limit_to_last")
+    offset = _encadear("offset")
+    select = _encadear("select")
+    start_at = _encadear("start_at")
+    start_after = _encadear("start_after")
+    end_at = _encadear("end_at")
+    end_before = _encadear("end_before")
+    del _encadear
+
+    def stream(self, *args, **kwargs):
+        return _contar_consulta_async(self._original.stream(*args, **_com_prazo(kwargs)))
+
+    async def get(self, *args, **kwargs):
+        return [snap async for snap in self.stream(*args, **kwargs)]
+
+
+class ColecaoContadaAsync(ConsultaContadaAsync):
+    def document(self, *args, **kwargs):
+        return DocumentoContadoAsync(self._original.document(*args, **kwargs))
+
+    async def add(self, *args, **kwargs):
+        _somar(escritas=1)
+        return await self._original.add(*args, **_com_prazo(kwargs))
+
+
+class LoteContadoAsync(LoteContado):
+    async def commit(self, *args, **kwargs):
+        resultado = await self._original.commit(*args, **_com_prazo(kwargs))
+        _somar(escritas=self._pendentes)
+        self._pendentes = 0
+        return resultado
+
+
+class TransacaoContadaAsync(LoteContado):
+    async def get(self, ref_or_query, *args, **kwargs):
+        resultado = await self._original.get(_original(ref_or_query), *args, **_com_prazo(kwargs))
+        if isinstance(ref_or_query, ConsultaContadaAsync):
+            return _contar_consulta_async(resultado)
+        _somar(leituras=1)
+        return _embrulhar_async(resultado)
+
+    async def get_all(self, refs, *args, **kwargs):
+        refs = [_original(ref) for ref in refs]
+        _somar(leituras=len(refs))
+        return _embrulhar_async(await self._original.get_all(refs, *args, **_com_prazo(kwargs)))
+
+    def _clean_up(self):
+        self._pendentes = 0
+        return self._original._clean_up()
+
+    async def _commit(self, *args, **kwargs):
+        resultado = await self._original._commit(*args, **kwargs)
+        _somar(escritas=self._pendentes)
+        self._pendentes = 0
+        return resultado
+
+
+async def _embrulhar_async(snaps):
+    async for snap in snaps:
+        yield SnapshotContado(snap)
+
+
+class ClienteContadoAsync(_Embrulho):
+    def __init__(self, original, prefixo=""):
+        super().__init__(original)
+        self._prefixo = f"{prefixo}/" if prefixo else ""
+
+    def collection(self, caminho, *args, **kwargs):
+        return ColecaoContadaAsync(self._original.collection(self._prefixo + caminho, *args, **kwargs))
+
+    def document(self, caminho, *args, **kwargs):
+        return DocumentoContadoAsync(self._original.document(self._prefixo + caminho, *args, **kwargs))
+
+    def collection_group(self, *args, **kwargs):
+        return ConsultaContadaAsync(self._original.collection_group(*args, **kwargs))
+
+    def batch(self, *args, **kwargs):
+        return LoteContadoAsync(self._original.batch(*args, **kwargs))
+
+    def transaction(self, *args, **kwargs):
+        return TransacaoContadaAsync(self._original.transaction(*args, **kwargs))
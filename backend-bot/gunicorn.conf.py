@@ -0,0 +1,41 @@
+# Configuração lida automaticamente pelo gunicorn (arquivo ./gunicorn.conf.py)
+# — os parâmetros do Procfile continuam valendo, aqui ficam só os ganchos.
+import os
+import shutil
+import tempfile
+
+# Métricas somadas entre os workers (ver metricas.py): cada worker grava
+# seus números em arquivos nessa pasta e /metrics junta tudo. Precisa estar
+# definido ANTES de qualquer worker importar o prometheus_client.
+os.environ.setdefault(
+    "PROMETHEUS_MULTIPROC_DIR",
+    os.path.join(tempfile.gettempdir(), "bot_metricas_multiproc")
+)
+os.makedirs(os.environ["PROMETHEUS_MULTIPROC_DIR"], exist_ok=True)
+
+# O app é importado uma vez no processo mestre e os workers nascem por fork
+# já com ele carregado: partida mais rápida e o código fica em páginas
+# compartilhadas (copy-on-write) entre os workers. Seguro porque nada no
+# import abre conexão — Firestore, OpenAI e cia. são criados no primeiro uso
+# dentro de cada worker (ver partida.py).
+preload_app = True
+
+
+def on_starting(server):
+    # Arquivos de uma execução anterior somariam números velhos no /metrics.
+    pasta = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+    shutil.rmtree(pasta, ignore_errors=True)
+    os.makedirs(pasta, exist_ok=True)
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
+
+
+def post_fork(server, worker):
+    # Índice de atenção e varredura (varredor.py) desde a partida do worker,
+    # não só a partir do primeiro turno — a equipe é avisada mesmo sem
+    # mensagem nova chegando. Um varredor por loja (lojas.py).
+    import app
+    app.iniciar_varredores()
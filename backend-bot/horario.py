@@ -0,0 +1,259 @@
+"""Horário de funcionamento compilado, com exceções por data e cache do
+aberto/fechado até a próxima virada.
+
+verificar_horario_funcionamento (app.py) relia as strings de
+horario_funcionamento.dias e remontava o texto dos horários a cada chamada
+— duas vezes por turno de pedido (no turno e de novo no
+registrar_pedido) — e só sabia um intervalo por dia da semana: sem
+feriado, sem fechamento especial, sem almoço + jantar.
+
+Agora a config é compilada uma vez por versão (Agenda) numa tabela da
+semana — pra cada dia, os intervalos em minutos desde a meia-noite, já
+validados e juntados — mais as exceções por data. O texto dos horários
+também sai pronto da compilação. A resposta (Estado) fica guardada até o
+próximo instante em que ela muda: a próxima abertura ou fechamento, ou a
+meia-noite (o texto leva as exceções dos próximos dias). Entre uma virada
+e outra, consultar() é uma comparação da config com a compilada e uma do
+relógio com o fim da validade.
+
+Config em configuracoes/bot -> horario_funcionamento:
+- dias.{seg..dom}: aberto, abre, fecha e, opcional, abre2/fecha2 (segundo
+  turno, ex.: 11:00-14:00 e 18:00-23:00);
+- excecoes: lista de {data: "AAAA-MM-DD", aberto, abre, fecha, abre2,
+  fecha2, descricao} — no dia da exceção ela vale no lugar do dia da
+  semana (aberto false = fechado o dia todo).
+
+Fechar no horário igual ou antes de abrir é fechar no dia seguinte (18:00
+às 00:30): os 30 minutos depois da meia-noite são da segunda-feira mesmo
+que a terça esteja fechada, e uma exceção na segunda tira esse pedaço
+também. Dia marcado como aberto sem horário válido vale como aberto o dia
+todo, como já era. Fuso fixo de Brasília (-3, sem horário de verão).
+
+O app (app-mobile/app/index.tsx, calcularHorarioFuncionamento) segue as
+mesmas regras — os dois precisam concordar se a loja está aberta.
+"""
+import copy
+import threading
+import time
+from collections import namedtuple
+from datetime import date, datetime, timedelta, timezone
+
+import lojas
+
+FUSO_BR = timezone(timedelta(hours=-3))
+NOMES_DIAS_SEMANA = {"seg": "Segunda", "ter": "Terça", "qua": "Quarta", "qui": "Quinta", "sex": "Sexta", "sab": "Sábado", "dom": "Domingo"}
+ORDEM_DIAS_SEMANA = ["seg", "ter", "qua", "qui", "sex", "sab", "dom"]
+SEM_HORARIO = "horário a confirmar"
+MENSAGEM_FECHADO_PADRAO = "No momento estamos fechados. Nosso horário de funcionamento: {horario}"
+# Até onde procurar a próxima abertura (férias longas cadastradas como
+# exceção dia a dia) e até onde listar exceções no texto dos horários.
+DIAS_BUSCA_ABERTURA = 370
+DIAS_AVISO_EXCECAO = 7
+
+# aberto; texto com os horários (e as exceções dos próximos dias);
+# proxima_abertura / fecha_em: datetime (fuso BR) ou None; texto_proxima:
+# "hoje às 18:00", "amanhã às 11:00", "sexta às 18:00", "25/12 às 18:00".
+Estado = namedtuple("Estado", "aberto texto proxima_abertura texto_proxima fecha_em")
+
+_DIA_TODO = ((0, 1440),)
+
+
+def _minutos(texto):
+    h, m = (int(x) for x in str(texto).split(":"))
+    if not (0 <= h <= 24 and 0 <= m < 60):
+        raise ValueError(texto)
+    return h * 60 + m
+
+
+def _turnos(dia_cfg):
+    """[(abre, fecha), ...] em texto, na ordem em que foram configurados."""
+    turnos = []
+    for abre, fecha in (("abre", "fecha"), ("abre2", "fecha2")):
+        if dia_cfg.get(abre) and dia_cfg.get(fecha):
+            turnos.append((dia_cfg[abre], dia_cfg[fecha]))
+    return turnos
+
+
+def _compilar_dia(dia_cfg):
+    """Intervalos (início, fim) em minutos desde a meia-noite do dia; o fim
+    passa de 1440 quando fecha no dia seguinte."""
+    if not dia_cfg or not dia_cfg.get("aberto"):
+        return ()
+    turnos = _turnos(dia_cfg)
+    if not turnos:
+        return _DIA_TODO
+    intervalos = []
+    try:
+        for abre, fecha in turnos:
+            inicio, fim = _minutos(abre), _minutos(fecha)
+            if fim <= inicio:
+                fim += 1440
+            intervalos.append((inicio, fim))
+    except (TypeError, ValueError):
+        return _DIA_TODO
+    return _juntar(intervalos)
+
+
+def _juntar(intervalos):
+    juntos = []
+    for inicio, fim in sorted(intervalos):
+        if juntos and inicio <= juntos[-1][1]:
+            juntos[-1] = (juntos[-1][0], max(juntos[-1][1], fim))
+        else:
+            juntos.append((inicio, fim))
+    return tuple(juntos)
+
+
+def _texto_dia(dia_cfg):
+    return " e ".join(f"{abre}-{fecha}" for abre, fecha in _turnos(dia_cfg))
+
+
+def _data(texto):
+    try:
+        return date.fromisoformat(str(texto)[:10])
+    except ValueError:
+        return None
+
+
+class Agenda:
+    """Config de horário compilada. Só é montada quando a config muda."""
+
+    def __init__(self, horario_cfg):
+        self.fonte = copy.deepcopy(horario_cfg)
+        self.ativo = bool(horario_cfg.get("ativo"))
+        dias = horario_cfg.get("dias") or {}
+        self.semana = tuple(_compilar_dia(dias.get(chave) or {}) for chave in ORDEM_DIAS_SEMANA)
+        self.texto_semana = "; ".join(
+            f"{NOMES_DIAS_SEMANA[chave]} {_texto_dia(dias[chave])}"
+            for chave in ORDEM_DIAS_SEMANA
+            if (dias.get(chave) or {}).get("aberto") and _turnos(dias[chave])
+        ) or SEM_HORARIO
+        self.excecoes = {}
+        self._avisos = {}
+        for excecao in horario_cfg.get("excecoes") or []:
+            dia = _data((excecao or {}).get("data"))
+            if dia is None:
+                continue
+            self.excecoes[dia] = _compilar_dia(excecao)
+            horas = _texto_dia(excecao) if excecao.get("aberto") else ""
+            descricao = str(excecao.get("descricao") or "").strip()
+            self._avisos[dia] = (f"{dia:%d/%m}" + (f" ({descricao})" if descricao else "")
+                                 + (f": {horas}" if horas else ": fechado"))
+        # (Estado, válido até em segundos epoch) — uma tupla só, trocada
+        # de uma vez, pra thread nenhuma ver o estado de uma virada com a
+        # validade de outra.
+        self._cache = None
+
+    def intervalos(self, dia):
+        """Intervalos em minutos do dia (a exceção, se houver, senão o dia
+        da semana)."""
+        if dia in self.excecoes:
+            return self.excecoes[dia]
+        return self.semana[dia.weekday()]
+
+    def _absolutos(self, dia):
+        meia_noite = datetime(dia.year, dia.month, dia.day, tzinfo=FUSO_BR)
+        return [(meia_noite + timedelta(minutes=inicio), meia_noite + timedelta(minutes=fim))
+                for inicio, fim in self.intervalos(dia)]
+
+    def texto(self, hoje):
+        avisos = [self._avisos[d] for d in sorted(self._avisos) if 0 <= (d - hoje).days <= DIAS_AVISO_EXCECAO]
+        if not avisos or self.texto_semana == SEM_HORARIO:
+            return self.texto_semana
+        return f"{self.texto_semana}. Datas especiais: {'; '.join(avisos)}"
+
+    def calcular(self, agora):
+        """Estado no instante 'agora' (datetime com fuso) e até quando ele
+        vale."""
+        agora = agora.astimezone(FUSO_BR)
+        hoje = agora.date()
+        amanha = datetime(hoje.year, hoje.month, hoje.day, tzinfo=FUSO_BR) + timedelta(days=1)
+        texto = self.texto(hoje)
+        if not self.ativo:
+            return Estado(True, texto, None, "", None), amanha
+
+        # O dia anterior entra pelo pedaço que passa da meia-noite.
+        fecha_em = None
+        for inicio, fim in self._absolutos(hoje - timedelta(days=1)) + self._absolutos(hoje):
+            if inicio <= agora < fim:
+                fecha_em = max(fecha_em or fim, fim)
+        if fecha_em is not None:
+            # Turno que emenda no do dia seguinte continua aberto.
+            dia = hoje
+            while dia <= fecha_em.date():
+                for inicio, fim in self._absolutos(dia):
+                    if inicio <= fecha_em < fim:
+                        fecha_em = fim
+                dia += timedelta(days=1)
+                if (dia - hoje).days > DIAS_BUSCA_ABERTURA:
+                    break
+            return Estado(True, texto, None, "", fecha_em), min(fecha_em, amanha)
+
+        for desloc in range(DIAS_BUSCA_ABERTURA):
+            dia = hoje + timedelta(days=desloc)
+            proxima = min((inicio for inicio, _ in self._absolutos(dia) if inicio > agora), default=None)
+            if proxima is not None:
+                return Estado(False, texto, proxima, _texto_proxima(proxima, hoje), None), min(proxima, amanha)
+        return Estado(False, texto, None, "", None), amanha
+
+    def consultar(self, agora=None):
+        """Estado de agora, do cache enquanto não passou a próxima virada."""
+        instante = time.time() if agora is None else agora.timestamp()
+        cache = self._cache
+        if cache is not None and instante < cache[1]:
+            return cache[0]
+        estado, valido_ate = self.calcular(agora or datetime.now(FUSO_BR))
+        if agora is None:
+            self._cache = (estado, valido_ate.timestamp())
+        return estado
+
+
+_NOMES_DIA_CURTO = ["segunda", "terça", "quarta", "quinta", "sexta", "sábado", "domingo"]
+
+
+def _texto_proxima(instante, hoje):
+    dias = (instante.date() - hoje).days
+    hora = f"{instante:%H:%M}"
+    if dias == 0:
+        return f"hoje às {hora}"
+    if dias == 1:
+        return f"amanhã às {hora}"
+    if dias < 7:
+        return f"{_NOMES_DIA_CURTO[instante.weekday()]} às {hora}"
+    return f"{instante:%d/%m} às {hora}"
+
+
+# Uma Agenda por loja (lojas.py): cada uma tem a sua config de horário.
+_agendas = {}
+_lock = threading.Lock()
+
+
+def agenda(horario_cfg):
+    """Agenda compilada da config da loja do contexto (recompila só quando
+    ela muda)."""
+    loja_id = lojas.atual().id
+    atual = _agendas.get(loja_id)
+    if atual is not None and atual.fonte == horario_cfg:
+        return atual
+    with _lock:
+        atual = _agendas.get(loja_id)
+        if atual is None or atual.fonte != horario_cfg:
+            atual = _agendas[loja_id] = Agenda(horario_cfg)
+        return atual
+
+
+def consultar(bot_cfg, agora=None):
+    """Estado do horário de funcionamento pela config do bot."""
+    return agenda(bot_cfg.get("horario_funcionamento") or {}).consultar(agora)
+
+
+def mensagem_fechado(bot_cfg, estado):
+    """Resposta pro cliente com a loja fechada: a mensagem configurada com
+    {horario} e {proxima_abertura} trocados. Se ela não usa
+    {proxima_abertura} e há uma abertura marcada, o aviso vai no fim."""
+    horario_cfg = bot_cfg.get("horario_funcionamento") or {}
+    texto = horario_cfg.get("mensagem_fechado") or MENSAGEM_FECHADO_PADRAO
+    if estado.texto_proxima and "{proxima_abertura}" not in texto:
+        texto = texto.rstrip()
+        texto += ("" if texto.endswith((".", "!", "?")) else ".") + " Abrimos de novo {proxima_abertura}."
+    return texto.replace("{horario}", estado.texto).replace("{proxima_abertura}", estado.texto_proxima)
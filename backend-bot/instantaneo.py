@@ -0,0 +1,574 @@
+"""Cópia local dos dados de leitura quase só — config do bot, cardápio e os
+apelidos ensinados pela equipe — publicada uma vez por máquina e lida por
+todos os workers.
+
+Cada turno relia configuracoes/bot várias vezes e o 'cardapio' inteiro a
+cada ferramenta (listar_cardapio, consultar_sabor, calcular/registrar
+pedido), mais um get por item/bairro em itens_aprendizado e
+bairros_aprendizado. São dados que mudam poucas vezes por dia, pelo painel.
+E com o Firestore lento ou fora do ar na subida de um worker, o bot não
+respondia nada até a primeira leitura voltar.
+
+Um processo por máquina é o publicador: o primeiro worker que pega a trava
+(flock) de INSTANTANEO_DIR/publicador.lock. Só ele abre listeners
+(on_snapshot) no Firestore — um por conjunto, não um por worker — e a cada
+mudança grava um instantâneo novo e imutável no disco (arquivo temporário
++ os.replace, versão sempre crescente). Se ele morre, o sistema solta a
+trava e outro worker assume na hora.
+
+Os workers mapeiam o arquivo só-leitura (mmap) e decodificam só o que cada
+chamada pede: documento() acha o registro pelo índice de hash, sem ler o
+resto; documentos() decodifica o conjunto inteiro e não guarda nada. A
+memória por worker não cresce com o tamanho do cardápio (as páginas do
+arquivo ficam no cache do sistema, compartilhadas). O preço é CPU: varrer
+um cardápio de 5000 itens custa ~15 ms por chamada (bench_funcoes.py); um
+de 50, ~0,1 ms. Versão nova no disco (outro inode) é mapeada na próxima
+leitura e trocada de uma vez — o mapa antigo continua válido pra quem
+ainda está lendo dele.
+
+Na partida, o worker já atende com o último instantâneo do disco
+(milissegundos), enquanto o publicador reconcilia com o Firestore em
+segundo plano.
+
+Quanto o dado pode estar velho: cada conjunto leva no cabeçalho o horário
+da última confirmação com o Firestore. Com o listener ativo, o publicador
+renova esse horário a cada INTERVALO_CONFIRMACAO segundos (e as mudanças
+chegam nos workers em 1–2s). Sem listener — Firestore inacessível,
+publicador sem conseguir religar — o instantâneo só é usado até
+INSTANTANEO_IDADE_MAX_MIN minutos (padrão 30) depois da última
+confirmação. Passou disso, a leitura vai direto no Firestore, como era
+antes; se ela falhar, o erro sobe pra quem chamou (cada função já trata o
+seu).
+
+O arquivo fica em INSTANTANEO_DIR (padrão: pasta temporária do sistema).
+No Render o disco não sobrevive a um deploy novo: aí a primeira partida lê
+do Firestore, e as seguintes (restart de worker, scale dentro da mesma
+instância) já partem do disco. Sem fcntl (Windows, desenvolvimento) cada
+processo é o próprio publicador.
+
+Com várias lojas (lojas.py) cada uma tem o seu Instantaneo, na sua pasta
+(INSTANTANEO_DIR/lojas/<id>), com publicador e listeners próprios, e um
+limite de memória ('memoria_max_mb' da loja) medido pelo tamanho
+serializado dos conjuntos que o publicador guarda e publica. Conjunto que
+passaria do limite sai da cópia (e do arquivo), perde o listener e é lido
+direto do Firestore (bot_instantaneo_limite_memoria_total); a cada
+INTERVALO_RELIGAR uma dessas leituras confere se ele voltou a caber.
+"""
+import base64
+import hashlib
+import json
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+import zlib
+from datetime import date, datetime
+
+import logs
+import lojas
+import metricas
+from firestore_contagem import registrar_leituras
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+log = logs.obter("instantaneo")
+
+# conjunto -> (coleção, documento). Documento None = coleção inteira.
+CONJUNTOS = {
+    "config": ("configuracoes", "bot"),
+    "cardapio": ("cardapio", None),
+    "itens_aprendizado": ("itens_aprendizado", None),
+    "bairros_aprendizado": ("bairros_aprendizado", None),
+}
+
+# Formato do arquivo: MAGIA, struct "<HI" (versão do formato e tamanho do
+# cabeçalho), cabeçalho em JSON e o corpo. No corpo, cada conjunto tem os
+# registros — um array JSON de [id, dados], um item por documento — seguidos
+# do índice: entradas "<QII" (hash do id, posição e tamanho do item dentro
+# do array) ordenadas pelo hash. documento() decodifica só o item;
+# documentos(), o array inteiro num json.loads só.
+# Mudou o layout, sobe FORMATO — arquivo de outra versão é ignorado.
+# Registro é só dado (nada de pickle): o arquivo fica numa pasta que outro
+# usuário da máquina pode ter criado antes, e o crc32 só pega corrupção.
+MAGIA = b"BOTINST\0"
+FORMATO = 3
+_ESTRUTURA = struct.Struct("<HI")
+_ENTRADA = struct.Struct("<QII")
+
+IDADE_MAXIMA_S = float(os.environ.get("INSTANTANEO_IDADE_MAX_MIN", "30")) * 60
+INTERVALO_GRAVACAO = 1
+INTERVALO_RELIGAR = 30
+# Com listener ativo e nada mudando, o arquivo ainda é regravado nesse
+# intervalo só pra renovar o horário de confirmação do cabeçalho.
+INTERVALO_CONFIRMACAO = 60
+# De quanto em quanto tempo um worker confere se saiu versão nova.
+INTERVALO_VERIFICACAO = 0.5
+
+
+def pasta_padrao():
+    return os.environ.get("INSTANTANEO_DIR") or os.path.join(tempfile.gettempdir(), "bot_instantaneo")
+
+
+def _hash_id(doc_id):
+    return int.from_bytes(hashlib.blake2b(doc_id.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def _limpar(valor):
+    """Só tipos simples vão pro disco — DocumentReference, GeoPoint e afins
+    viram texto (nenhuma função que lê esses conjuntos usa esses tipos)."""
+    if isinstance(valor, dict):
+        return {str(k): _limpar(v) for k, v in valor.items()}
+    if isinstance(valor, (list, tuple)):
+        return [_limpar(v) for v in valor]
+    if valor is None or isinstance(valor, (str, int, float, bool, bytes)):
+        return valor
+    if isinstance(valor, datetime):
+        # DatetimeWithNanoseconds (timestamp do Firestore) vira datetime puro.
+        return datetime(*valor.timetuple()[:6], valor.microsecond, tzinfo=valor.tzinfo)
+    if isinstance(valor, date):
+        return date(valor.year, valor.month, valor.day)
+    return str(valor)
+
+
+def _codificar_valor(valor):
+    # O que o JSON não tem: datetime, date e bytes vão marcados.
+    if isinstance(valor, datetime):
+        return {"$datetime": valor.isoformat()}
+    if isinstance(valor, date):
+        return {"$date": valor.isoformat()}
+    if isinstance(valor, bytes):
+        return {"$bytes": base64.b64encode(valor).decode("ascii")}
+    raise TypeError(f"{type(valor).__name__} fora do instantâneo")
+
+
+def _decodificar_valor(objeto):
+    if len(objeto) == 1:
+        if "$datetime" in objeto:
+            return datetime.fromisoformat(objeto["$datetime"])
+        if "$date" in objeto:
+            return date.fromisoformat(objeto["$date"])
+        if "$bytes" in objeto:
+            return base64.b64decode(objeto["$bytes"])
+    return objeto
+
+
+def _codificar(doc_id, doc, marcados):
+    """Item de um documento no array. Anota em 'marcados' se precisou
+    marcar algum valor: conjunto sem marca (o comum) é lido sem o
+    object_hook, que deixa o json.loads várias vezes mais lento."""
+    def marcar(valor):
+        marcados.append(True)
+        return _codificar_valor(valor)
+
+    return json.dumps([doc_id, _limpar(doc)], ensure_ascii=False, separators=(",", ":"),
+                      default=marcar).encode("utf-8")
+
+
+def _decodificar(registro, marcado):
+    texto = registro.decode("utf-8")
+    if marcado:
+        return json.loads(texto, object_hook=_decodificar_valor)
+    return json.loads(texto)
+
+
+def gravar_arquivo(caminho, dados, sincronizado_em, versao):
+    """Grava o instantâneo de forma atômica. 'dados' é {conjunto: {id: doc}}."""
+    corpo = bytearray()
+    secoes = {}
+    for conjunto, docs in dados.items():
+        entradas, marcados = [], []
+        registros = len(corpo)
+        corpo += b"["
+        for doc_id, doc in docs.items():
+            if entradas:
+                corpo += b","
+            registro = _codificar(doc_id, doc, marcados)
+            entradas.append((_hash_id(doc_id), len(corpo), len(registro)))
+            corpo += registro
+        corpo += b"]"
+        entradas.sort()
+        secoes[conjunto] = {"registros": registros, "indice": len(corpo), "documentos": len(entradas),
+                            "marcado": bool(marcados)}
+        for entrada in entradas:
+            corpo += _ENTRADA.pack(*entrada)
+    cabecalho = json.dumps({
+        "versao": versao,
+        "gravado_em": time.time(),
+        "sincronizado_em": sincronizado_em,
+        "conjuntos": secoes,
+        "crc32": zlib.crc32(corpo),
+    }).encode("utf-8")
+    os.makedirs(os.path.dirname(caminho), mode=0o700, exist_ok=True)
+    descritor, temporario = tempfile.mkstemp(prefix=".inst-", dir=os.path.dirname(caminho))
+    try:
+        with os.fdopen(descritor, "wb") as f:
+            f.write(MAGIA)
+            f.write(_ESTRUTURA.pack(FORMATO, len(cabecalho)))
+            f.write(cabecalho)
+            f.write(corpo)
+        os.replace(temporario, caminho)
+    except BaseException:
+        try:
+            os.unlink(temporario)
+        except OSError:
+            pass
+        raise
+
+
+def _tamanho(docs):
+    """Bytes do conjunto no arquivo (o que o limite de memória da loja conta)."""
+    return sum(len(_codificar(doc_id, doc, [])) for doc_id, doc in docs.items())
+
+
+class InstantaneoMapeado:
+    """Um instantâneo publicado, mapeado só-leitura. Imutável: versão nova
+    é outro objeto."""
+
+    def __init__(self, caminho):
+        with open(caminho, "rb") as f:
+            estado = os.fstat(f.fileno())
+            self._mapa = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.identidade = (estado.st_ino, estado.st_mtime_ns, estado.st_size)
+        if self._mapa[:len(MAGIA)] != MAGIA:
+            raise ValueError("arquivo não é um instantâneo")
+        inicio = len(MAGIA)
+        formato, tamanho = _ESTRUTURA.unpack_from(self._mapa, inicio)
+        if formato != FORMATO:
+            raise ValueError(f"formato {formato}, esperado {FORMATO}")
+        inicio += _ESTRUTURA.size
+        self.cabecalho = json.loads(self._mapa[inicio:inicio + tamanho])
+        self._corpo = inicio + tamanho
+        with memoryview(self._mapa)[self._corpo:] as corpo:
+            if zlib.crc32(corpo) != self.cabecalho.get("crc32"):
+                raise ValueError("crc32 não confere")
+        self.versao = int(self.cabecalho.get("versao") or 0)
+
+    def tem(self, conjunto):
+        return conjunto in self.cabecalho["conjuntos"]
+
+    def idade(self, conjunto):
+        return time.time() - float((self.cabecalho.get("sincronizado_em") or {}).get(conjunto, 0))
+
+
+    def _entrada(self, secao, i):
+        return _ENTRADA.unpack_from(self._mapa, self._corpo + secao["indice"] + i * _ENTRADA.size)
+
+    def documento(self, conjunto, doc_id):
+        secao = self.cabecalho["conjuntos"][conjunto]
+        alvo = _hash_id(doc_id)
+        baixo, alto = 0, secao["documentos"]
+        while baixo < alto:
+            meio = (baixo + alto) // 2
+            if self._entrada(secao, meio)[0] < alvo:
+                baixo = meio + 1
+            else:
+                alto = meio
+        # Colisão de hash (improvável com 64 bits): confere o id gravado.
+        while baixo < secao["documentos"]:
+            valor, posicao, tamanho = self._entrada(secao, baixo)
+            if valor != alvo:
+                break
+            inicio = self._corpo + posicao
+            registro_id, dados = _decodificar(self._mapa[inicio:inicio + tamanho], secao["marcado"])
+            if registro_id == doc_id:
+                return dados
+            baixo += 1
+        return None
+
+    def documentos(self, conjunto):
+        secao = self.cabecalho["conjuntos"][conjunto]
+        # O array está na ordem em que o Firestore devolveu (por id).
+        inicio, fim = self._corpo + secao["registros"], self._corpo + secao["indice"]
+        return dict(_decodificar(self._mapa[inicio:fim], secao["marcado"]))
+
+
+def mapear(caminho):
+    """InstantaneoMapeado ou None se o arquivo não existe, é de outro
+    formato ou está corrompido."""
+    try:
+        return InstantaneoMapeado(caminho)
+    except (OSError, ValueError, KeyError, struct.error):
+        return None
+
+
+class Instantaneo:
+    def __init__(self, db, pasta=None, idade_maxima_s=IDADE_MAXIMA_S, memoria_max_bytes=None):
+        self._db = db
+        self._pasta = pasta or pasta_padrao()
+        self._caminho = os.path.join(self._pasta, f"dados.v{FORMATO}.bin")
+        self.idade_maxima_s = idade_maxima_s
+        self.memoria_max_bytes = memoria_max_bytes
+        self._pid = None
+        self._lock = threading.Lock()
+        os.register_at_fork(after_in_child=self._depois_do_fork)
+        self._zerar()
+
+    def _zerar(self):
+        self._mapa = None
+        self._verificado_em = 0.0
+        self._trava = None
+        self._publicador = False
+        # Daqui pra baixo, só o publicador usa.
+        self._dados = {}
+        self._sincronizado_em = {}
+        self._ouvintes = {}
+        self._ao_vivo = set()
+        self._avisados = set()
+        self._religado_em = 0.0
+        self._versao = 0
+        self._sujo = False
+        self._gravado_em = 0.0
+        # conjunto -> bytes serializados; fora do limite -> última conferida.
+        self._tamanhos = {}
+        self._excedidos = {}
+
+    def _depois_do_fork(self):
+        # Listener, thread e trava do processo pai não valem no filho.
+        self._lock = threading.Lock()
+        self._pid = None
+        if self._trava is not None:
+            os.close(self._trava)
+        self._zerar()
+
+    @property
+    def publicador(self):
+        return self._publicador
+
+    # --- leitura (todos os workers) ---
+
+    def documentos(self, conjunto):
+        """{id: dados} do conjunto, decodificado na hora."""
+        mapa = self._mapa_em_dia(conjunto)
+        if mapa is not None:
+            metricas.INSTANTANEO_LEITURAS.labels(conjunto=conjunto, origem="instantaneo").inc()
+            return mapa.documentos(conjunto)
+        metricas.INSTANTANEO_LEITURAS.labels(conjunto=conjunto, origem="firestore").inc()
+        return self._ler_direto(conjunto)
+
+    def documento(self, conjunto, doc_id):
+        mapa = self._mapa_em_dia(conjunto)
+        if mapa is not None:
+            metricas.INSTANTANEO_LEITURAS.labels(conjunto=conjunto, origem="instantaneo").inc()
+            return mapa.documento(conjunto, doc_id)
+        metricas.INSTANTANEO_LEITURAS.labels(conjunto=conjunto, origem="firestore").inc()
+        if self._publicador:
+            return self._ler_direto(conjunto).get(doc_id)
+        colecao, _ = CONJUNTOS[conjunto]
+        snap = self._db.collection(colecao).document(doc_id).get()
+        return snap.to_dict() if snap.exists else None
+
+    def fresco(self, conjunto):
+        """True se a leitura sairia do instantâneo, sem ir ao Firestore (o
+        modo assíncrono usa isso pra não bloquear o loop numa leitura
+        direta)."""
+        return self._mapa_em_dia(conjunto) is not None
+
+    def recarregar(self, conjunto=None):
+        """Lê de novo direto do Firestore (um conjunto ou todos) e, no
+        publicador, publica na hora."""
+        self._garantir_iniciado()
+        for nome in ([conjunto] if conjunto else CONJUNTOS):
+            self._ler_direto(nome)
+
+    def _mapa_em_dia(self, conjunto):
+        self._garantir_iniciado()
+        agora = time.monotonic()
+        if agora - self._verificado_em >= INTERVALO_VERIFICACAO:
+            self._verificado_em = agora
+            self._remapear()
+        mapa = self._mapa
+        if mapa is None or not mapa.tem(conjunto) or mapa.idade(conjunto) > self.idade_maxima_s:
+            return None
+        return mapa
+
+    def _remapear(self):
+        try:
+            estado = os.stat(self._caminho)
+        except OSError:
+            return
+        atual = self._mapa
+        if atual is not None and atual.identidade == (estado.st_ino, estado.st_mtime_ns, estado.st_size):
+            return
+        novo = mapear(self._caminho)
+        if novo is not None and (atual is None or novo.versao >= atual.versao):
+            # Troca de uma referência só: quem pegou o mapa antigo termina
+            # de ler nele (o arquivo antigo some do diretório, não da memória).
+            self._mapa = novo
+
+    def _ler_direto(self, conjunto):
+        colecao, doc_id = CONJUNTOS[conjunto]
+        ref = self._db.collection(colecao)
+        if doc_id:
+            snap = ref.document(doc_id).get()
+            docs = {doc_id: snap.to_dict()} if snap.exists else {}
+        else:
+            docs = {snap.id: snap.to_dict() for snap in ref.stream()}
+        if self._publicador:
+            conferido_em = self._excedidos.get(conjunto)
+            if conferido_em is None or time.time() - conferido_em >= INTERVALO_RELIGAR:
+                self._trocar(conjunto, docs)
+                self.gravar()
+        return docs
+
+    # --- partida e eleição do publicador ---
+
+    def _garantir_iniciado(self):
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._lock:
+            if self._pid == pid:
+                return
+            self._zerar()
+            self._mapa = mapear(self._caminho)
+            if self._mapa is not None:
+                contagens = {c: s["documentos"] for c, s in self._mapa.cabecalho["conjuntos"].items()}
+                log.info("instantâneo mapeado", extra={"versao": self._mapa.versao, "caminho": self._caminho,
+                                                       "documentos": contagens})
+            self._verificado_em = time.monotonic()
+            # Thread e listeners nascem aqui, dentro do worker (depois do fork).
+            if self._tentar_trava(bloquear=False):
+                self._assumir()
+            threading.Thread(target=lojas.fixar(self._laco), name="instantaneo", daemon=True).start()
+            self._pid = pid
+
+    def _tentar_trava(self, bloquear):
+        if fcntl is None:
+            return True
+        if self._trava is None:
+            os.makedirs(self._pasta, mode=0o700, exist_ok=True)
+            self._trava = os.open(os.path.join(self._pasta, "publicador.lock"), os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(self._trava, fcntl.LOCK_EX | (0 if bloquear else fcntl.LOCK_NB))
+            return True
+        except BlockingIOError:
+            return False
+
+    def _assumir(self):
+        # Parte do que já está publicado: o listener reconcilia em seguida.
+        mapa = self._mapa
+        if mapa is not None:
+            self._dados = {c: mapa.documentos(c) for c in CONJUNTOS if mapa.tem(c)}
+            if self.memoria_max_bytes:
+                self._tamanhos = {c: _tamanho(docs) for c, docs in self._dados.items()}
+            self._sincronizado_em = {c: float(t) for c, t in (mapa.cabecalho.get("sincronizado_em") or {}).items()}
+            self._versao = mapa.versao
+        self._publicador = True
+        log.info("publicador do instantâneo desta máquina", extra={"pid": os.getpid()})
+
+    def _laco(self):
+        if not self._publicador:
+            # Bloqueia até o publicador atual morrer e o sistema soltar a trava.
+            self._tentar_trava(bloquear=True)
+            self._remapear()
+            self._assumir()
+        self._religar_ouvintes()
+        while True:
+            time.sleep(INTERVALO_GRAVACAO)
+            if time.time() - self._religado_em >= INTERVALO_RELIGAR:
+                self._religar_ouvintes()
+            self.gravar()
+
+    # --- publicador: listeners e gravação ---
+
+    def _trocar(self, conjunto, docs, ao_vivo=False):
+        tamanho = _tamanho(docs) if self.memoria_max_bytes else 0
+        with self._lock:
+            outros = sum(t for c, t in self._tamanhos.items() if c != conjunto)
+            if self.memoria_max_bytes and outros + tamanho > self.memoria_max_bytes:
+                excedeu = conjunto not in self._excedidos
+                self._excedidos[conjunto] = time.time()
+                self._dados.pop(conjunto, None)
+                self._sincronizado_em.pop(conjunto, None)
+                self._tamanhos.pop(conjunto, None)
+                self._ao_vivo.discard(conjunto)
+                self._sujo = True
+                ouvinte = self._ouvintes.pop(conjunto, None)
+            else:
+                excedeu, ouvinte = False, None
+                self._excedidos.pop(conjunto, None)
+                self._tamanhos[conjunto] = tamanho
+                self._dados[conjunto] = docs
+                self._sincronizado_em[conjunto] = time.time()
+                if ao_vivo:
+                    self._ao_vivo.add(conjunto)
+                self._sujo = True
+        if ouvinte is not None:
+            try:
+                ouvinte.unsubscribe()
+            except Exception:
+                pass
+        if excedeu:
+            metricas.INSTANTANEO_LIMITE.labels(conjunto=conjunto).inc()
+            log.warning("conjunto acima do limite de memória; lido direto do Firestore", extra={
+                "conjunto": conjunto, "kib": tamanho // 1024, "limite_kib": self.memoria_max_bytes // 1024,
+                "pasta": self._pasta})
+
+    def _ouvinte_ativo(self, conjunto):
+        ouvinte = self._ouvintes.get(conjunto)
+        return ouvinte is not None and getattr(ouvinte, "is_active", True)
+
+    def _ouvir(self, conjunto):
+        colecao, doc_id = CONJUNTOS[conjunto]
+        ref = self._db.collection(colecao)
+        if doc_id:
+            ref = ref.document(doc_id)
+        with self._lock:
+            self._ao_vivo.discard(conjunto)
+        antigo = self._ouvintes.pop(conjunto, None)
+        if antigo is not None:
+            try:
+                antigo.unsubscribe()
+            except Exception:
+                pass
+        # O callback roda numa thread do cliente, fora do contexto da loja.
+        self._ouvintes[conjunto] = ref.on_snapshot(
+            lojas.fixar(lambda snaps, mudancas, lido_em: self._ao_mudar(conjunto, snaps, mudancas)))
+
+    def _ao_mudar(self, conjunto, snaps, mudancas):
+        # A cada retorno o listener entrega o resultado inteiro da consulta;
+        # só os documentos em 'mudancas' foram lidos (e cobrados) agora.
+        registrar_leituras(len(mudancas))
+        self._trocar(conjunto, {snap.id: snap.to_dict() for snap in snaps if snap.exists}, ao_vivo=True)
+
+    def _religar_ouvintes(self):
+        self._religado_em = time.time()
+        for conjunto in CONJUNTOS:
+            if self._ouvinte_ativo(conjunto) or conjunto in self._excedidos:
+                continue
+            try:
+                self._ouvir(conjunto)
+            except Exception as e:
+                # Sem listener o conjunto segue pela regra da idade máxima.
+                if conjunto not in self._avisados:
+                    self._avisados.add(conjunto)
+                    log.warning("conjunto sem listener", extra={"conjunto": conjunto, "erro": str(e)})
+
+    def gravar(self):
+        """Publica uma versão nova se algo mudou (ou se está na hora de
+        renovar a confirmação dos conjuntos com listener ativo)."""
+        if not self._publicador:
+            return
+        agora = time.time()
+        with self._lock:
+            ao_vivo = [c for c in self._ao_vivo if self._ouvinte_ativo(c)]
+            if not self._sujo and not (ao_vivo and agora - self._gravado_em >= INTERVALO_CONFIRMACAO):
+                return
+            sincronizado_em = dict(self._sincronizado_em)
+            for conjunto in ao_vivo:
+                sincronizado_em[conjunto] = agora
+            self._versao += 1
+            dados, versao = dict(self._dados), self._versao
+            self._sujo = False
+            self._gravado_em = agora
+        try:
+            gravar_arquivo(self._caminho, dados, sincronizado_em, versao)
+        except Exception:
+            log.error("erro ao gravar o instantâneo", extra={"caminho": self._caminho}, exc_info=True)
+            return
+        self._remapear()
@@ -0,0 +1,231 @@
+"""Log do bot: JSON, por nível, fora do thread da requisição.
+
+O bot escrevia tudo com print: a pontuação de cada busca aproximada, o
+payload inteiro do /salvar_token, a mensagem do cliente no 'DEBUG APP' — e
+o Procfile subia o gunicorn com --log-level debug. Era E/S síncrona no
+meio do turno, sem nível pra filtrar e sem como juntar as linhas de um
+mesmo turno (com vários workers e threads as linhas se misturam).
+
+Agora cada módulo pega um logger (obter("app"), obter("busca")...) e:
+
+- cada linha é um JSON: ts, nivel, logger, msg, turno (id da requisição —
+  todas as linhas de um turno têm o mesmo), loja e os campos passados em
+  extra={...};
+- o thread da requisição só põe o registro numa fila (QueueHandler): juntar
+  os argumentos na mensagem, montar o JSON e escrever no stdout ficam pro
+  thread do QueueListener. Registro abaixo do nível nem chega na fila;
+- nível geral em LOG_NIVEL (padrão INFO) e por logger em LOG_NIVEIS
+  ("bot.busca=DEBUG,bot.disparos=WARNING");
+- DEBUG é amostrado: no máximo LOG_DEBUG_POR_SEGUNDO linhas por segundo de
+  cada evento (logger + texto da mensagem); a próxima que passa diz quantas
+  foram descartadas (suprimidas) — ligar o DEBUG no pico não derruba o bot;
+- telefone vira ***1234 e os campos com texto do cliente (CAMPOS_TEXTO)
+  viram só o tamanho. LOG_SEM_REDACAO=1 desliga (só pra depurar local).
+
+configurar() é chamado no import do app.py (com o --preload do gunicorn,
+no processo mestre); o thread do listener é refeito em cada worker depois
+do fork.
+"""
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import re
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+import lojas
+
+RAIZ = "bot"
+CAMPOS_TEXTO = {"texto", "mensagem", "corpo", "payload", "resposta", "termo", "detalhes"}
+_TELEFONE = re.compile(r"(?<!\d)\d{6,9}(\d{4})(?!\d)")
+# Atributos que todo LogRecord tem — o resto veio do extra={...}.
+_ATRIBUTOS_PADRAO = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "turno", "loja"}
+
+_turno = contextvars.ContextVar("turno_log", default=None)
+_lock = threading.Lock()
+_estado = {"handler": None, "listener": None, "saidas": ()}
+
+
+def obter(nome):
+    return logging.getLogger(f"{RAIZ}.{nome}")
+
+
+# --- turno ---
+
+def iniciar_turno(turno_id=None):
+    """Id do turno pras linhas deste contexto (requisição). Devolve o token
+    pro encerrar_turno."""
+    return _turno.set(str(turno_id or uuid.uuid4().hex[:12]))
+
+
+def encerrar_turno(token):
+    _turno.reset(token)
+
+
+def turno_atual():
+    return _turno.get()
+
+
+# --- redação ---
+
+def mascarar_telefone(texto):
+    return _TELEFONE.sub(r"***\1", texto)
+
+
+def _redigir(chave, valor):
+    if chave in CAMPOS_TEXTO and valor is not None:
+        return f"<{len(str(valor))} caracteres>"
+    if isinstance(valor, str):
+        return mascarar_telefone(valor)
+    if isinstance(valor, (int, float)) and not isinstance(valor, bool) and len(str(valor)) >= 10:
+        return mascarar_telefone(str(valor))
+    return valor
+
+
+# --- handlers ---
+
+class _Contexto(logging.Filter):
+    """No thread da requisição: turno e loja (contextvars) vão junto com o
+    registro — o listener roda em outro thread, sem esse contexto."""
+
+    def filter(self, record):
+        record.turno = _turno.get()
+        try:
+            record.loja = lojas.rotulo_atual()
+        except Exception:
+            record.loja = None
+        return True
+
+
+class _AmostraDebug(logging.Filter):
+    """Até 'por_segundo' registros DEBUG por segundo de cada evento."""
+
+    def __init__(self, por_segundo):
+        super().__init__()
+        self._por_segundo = por_segundo
+        self._janelas = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG or self._por_segundo <= 0:
+            return True
+        chave = (record.name, record.msg)
+        segundo = int(time.monotonic())
+        with self._lock:
+            inicio, passaram, suprimidos = self._janelas.get(chave, (segundo, 0, 0))
+            if inicio != segundo:
+                inicio, passaram = segundo, 0
+            if passaram >= self._por_segundo:
+                self._janelas[chave] = (inicio, passaram, suprimidos + 1)
+                return False
+            self._janelas[chave] = (inicio, passaram + 1, 0)
+        if suprimidos:
+            record.suprimidos = suprimidos
+        return True
+
+
+class _Fila(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        # O QueueHandler padrão formata aqui, no thread da requisição; quem
+        # formata é o listener.
+        return record
+
+
+class FormatoJson(logging.Formatter):
+    def __init__(self, redigir=True):
+        super().__init__()
+        self._redigir = redigir
+
+    def format(self, record):
+        mensagem = record.getMessage()
+        linha = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "nivel": record.levelname,
+            "logger": record.name,
+            "msg": mascarar_telefone(mensagem) if self._redigir else mensagem,
+        }
+        for chave in ("turno", "loja"):
+            if getattr(record, chave, None):
+                linha[chave] = getattr(record, chave)
+        for chave, valor in vars(record).items():
+            if chave not in _ATRIBUTOS_PADRAO and not chave.startswith("_"):
+                linha[chave] = _redigir(chave, valor) if self._redigir else valor
+        if record.exc_info:
+            linha["exc"] = self.formatException(record.exc_info)
+        return json.dumps(linha, ensure_ascii=False, default=str)
+
+
+class _SaidaPadrao(logging.StreamHandler):
+    """Sempre o sys.stdout da hora (o bench troca por os.devnull)."""
+
+    @property
+    def stream(self):
+        return sys.stdout
+
+    @stream.setter
+    def stream(self, valor):
+        pass
+
+
+def _niveis(texto):
+    for parte in filter(None, (p.strip() for p in str(texto or "").split(","))):
+        nome, _, nivel = parte.partition("=")
+        if nivel:
+            yield nome.strip(), nivel.strip().upper()
+
+
+def _iniciar_listener():
+    fila = queue.SimpleQueue()
+    _estado["handler"].queue = fila
+    listener = logging.handlers.QueueListener(fila, *_estado["saidas"], respect_handler_level=True)
+    listener.start()
+    _estado["listener"] = listener
+
+
+def _depois_do_fork():
+    if _estado["handler"] is not None:
+        _iniciar_listener()
+
+
+def _parar():
+    listener = _estado["listener"]
+    if listener is not None:
+        _estado["listener"] = None
+        listener.stop()
+
+
+def configurar(nivel=None, niveis=None, debug_por_segundo=None, redigir=None):
+    """Liga o log do bot (uma vez por processo; chamadas seguintes não
+    fazem nada). Sem argumentos, tudo vem do ambiente."""
+    with _lock:
+        if _estado["handler"] is not None:
+            return
+        nivel = nivel or os.environ.get("LOG_NIVEL") or "INFO"
+        niveis = niveis if niveis is not None else os.environ.get("LOG_NIVEIS")
+        if debug_por_segundo is None:
+            debug_por_segundo = float(os.environ.get("LOG_DEBUG_POR_SEGUNDO") or 5)
+        if redigir is None:
+            redigir = os.environ.get("LOG_SEM_REDACAO") != "1"
+
+        saida = _SaidaPadrao()
+        saida.setFormatter(FormatoJson(redigir=redigir))
+        handler = _Fila(queue.SimpleQueue())
+        handler.addFilter(_AmostraDebug(debug_por_segundo))
+        handler.addFilter(_Contexto())
+        raiz = logging.getLogger(RAIZ)
+        raiz.setLevel(str(nivel).upper())
+        raiz.addHandler(handler)
+        raiz.propagate = False
+        for nome, nivel_logger in _niveis(niveis):
+            logging.getLogger(nome if nome.startswith(RAIZ) else f"{RAIZ}.{nome}").setLevel(nivel_logger)
+        _estado.update(handler=handler, saidas=(saida,))
+        _iniciar_listener()
+        os.register_at_fork(after_in_child=_depois_do_fork)
+        atexit.register(_parar)
@@ -0,0 +1,278 @@
+"""Várias lojas no mesmo deploy: qual loja é a do turno e o que é de cada uma.
+
+O bot atendia uma loja só: um PHONE_NUMBER_ID/ACCESS_TOKEN no ambiente, a
+config em configuracoes/bot, o cardápio e os apelidos nas coleções da
+raiz. Outra loja era outro deploy inteiro — outro serviço no Render, outros
+workers, outra cópia de tudo em memória, quase sempre parados.
+
+Agora um deploy atende várias. Cada loja tem:
+
+- número e credencial da Graph API próprios (o webhook da Meta traz, em
+  cada 'value', o metadata.phone_number_id do número que recebeu);
+- dados próprios no Firestore: com 'firebase_credencial' (projeto Firebase
+  da loja, o painel e o app dela continuam como estão) ou, sem, no projeto
+  da loja principal em lojas/<id>/<coleção> — config, cardápio, apelidos,
+  conversas, pedidos, tudo com o mesmo nome embaixo do prefixo;
+- cópias locais (instantaneo.py), fila do histórico (fila_historico.py),
+  varredura (varredor.py), consumo da IA (uso_ia.py) e horário compilado
+  (horario.py) separados: um objeto por loja (PorLoja), criado no primeiro
+  uso da loja no processo — loja sem movimento não ocupa nada;
+- limite de memória das cópias locais ('memoria_max_mb', padrão
+  LOJA_MEMORIA_MAX_MB=64): conjunto que não cabe não fica em memória nem
+  no instantâneo, e as leituras dele vão direto no Firestore.
+
+A loja do turno fica num contextvar: o webhook escolhe pelo
+phone_number_id, as outras rotas pelo parâmetro 'loja' (query ou JSON) ou
+pelo cabeçalho X-Loja (id da loja ou o phone_number_id) e, sem nada, a
+principal. Tudo o que é por loja — db, instantaneo, métricas — lê dali.
+Threads de fundo não herdam o contexto: quem sobe thread por loja passa o
+alvo por fixar().
+
+Lojas em LOJAS (JSON) ou num arquivo em LOJAS_ARQUIVO:
+
+    {"centro": {"phone_number_id": "1234", "access_token": "EAA...",
+                "nome": "Loja Centro", "memoria_max_mb": 32}}
+
+A principal ('principal') é a de sempre: PHONE_NUMBER_ID, ACCESS_TOKEN e
+as credenciais FIREBASE_* do ambiente, coleções na raiz; uma entrada
+"principal" em LOJAS só muda nome/rótulo/limite. Sem LOJAS nada muda:
+qualquer phone_number_id cai na principal. Com outras lojas configuradas,
+número desconhecido é ignorado (bot_erros_total{tipo="loja_desconhecida"}).
+
+Métricas levam o rótulo 'loja' (metricas.py) — este módulo não importa
+metricas, é o contrário.
+"""
+import contextvars
+import json
+import os
+import threading
+from contextlib import contextmanager
+
+PRINCIPAL = "principal"
+MEMORIA_MAX_MB_PADRAO = 64
+
+
+class LojaDesconhecida(KeyError):
+    pass
+
+
+class Loja:
+    def __init__(self, id, phone_number_id=None, access_token=None, nome=None, rotulo=None,
+                 firebase_credencial=None, storage_bucket=None, memoria_max_mb=None):
+        self.id = str(id)
+        self.phone_number_id = str(phone_number_id) if phone_number_id else None
+        self.access_token = access_token
+        self.nome = nome or self.id
+        self.rotulo = rotulo or self.id
+        self.firebase_credencial = firebase_credencial
+        self.storage_bucket = storage_bucket
+        if memoria_max_mb is None:
+            memoria_max_mb = os.environ.get("LOJA_MEMORIA_MAX_MB") or MEMORIA_MAX_MB_PADRAO
+        self.memoria_max_bytes = int(float(memoria_max_mb) * 1024 * 1024)
+
+    @property
+    def principal(self):
+        return self.id == PRINCIPAL
+
+    @property
+    def projeto_proprio(self):
+        return bool(self.firebase_credencial) and not self.principal
+
+    @property
+    def prefixo(self):
+        """Prefixo das coleções no Firestore ('' = raiz do projeto)."""
+        if self.principal or self.projeto_proprio:
+            return ""
+        return f"lojas/{self.id}"
+
+    @property
+    def prefixo_storage(self):
+        return f"{self.prefixo}/" if self.prefixo else ""
+
+    def pasta(self, base):
+        """Subpasta da loja pros arquivos locais (instantâneo, diários)."""
+        return base if self.principal else os.path.join(base, "lojas", self.id)
+
+    def __repr__(self):
+        return f"<Loja {self.id}>"
+
+
+class _Registro:
+    def __init__(self, lojas):
+        self.lojas = lojas
+        self.principal = lojas[PRINCIPAL]
+        self.por_numero = {loja.phone_number_id: loja for loja in lojas.values() if loja.phone_number_id}
+
+
+def _ler_configuracao():
+    texto = os.environ.get("LOJAS")
+    caminho = os.environ.get("LOJAS_ARQUIVO")
+    if not texto and caminho:
+        with open(caminho, encoding="utf-8") as arquivo:
+            texto = arquivo.read()
+    return json.loads(texto) if texto else {}
+
+
+def montar(configuracao):
+    """Registro das lojas a partir do dicionário {id: campos} (o JSON de
+    LOJAS). A principal sai sempre, com o que vier do ambiente."""
+    principal = {
+        "phone_number_id": os.environ.get("PHONE_NUMBER_ID"),
+        "access_token": os.environ.get("ACCESS_TOKEN"),
+        "nome": PRINCIPAL,
+    }
+    extras = dict(configuracao.get(PRINCIPAL) or {})
+    # A principal é sempre a do ambiente: daqui só nome, rótulo e limite.
+    for campo in ("nome", "rotulo", "memoria_max_mb"):
+        if extras.get(campo) is not None:
+            principal[campo] = extras[campo]
+    lojas = {PRINCIPAL: Loja(PRINCIPAL, **principal)}
+    for loja_id, campos in configuracao.items():
+        if loja_id == PRINCIPAL:
+            continue
+        if "/" in loja_id or not loja_id.strip():
+            raise ValueError(f"id de loja inválido: {loja_id!r}")
+        lojas[loja_id] = Loja(loja_id, **campos)
+    return _Registro(lojas)
+
+
+_registro = None
+_lock = threading.Lock()
+
+
+def _obter_registro():
+    # Lido no primeiro uso (depois do load_dotenv do app.py), não no import.
+    global _registro
+    if _registro is None:
+        with _lock:
+            if _registro is None:
+                _registro = montar(_ler_configuracao())
+    return _registro
+
+
+def configurar(configuracao):
+    """Troca as lojas (bench e testes; em produção vêm do ambiente)."""
+    global _registro
+    with _lock:
+        _registro = montar(configuracao)
+    return list(_registro.lojas.values())
+
+
+def todas():
+    return list(_obter_registro().lojas.values())
+
+
+def principal():
+    return _obter_registro().principal
+
+
+def obter(loja_id):
+    try:
+        return _obter_registro().lojas[str(loja_id)]
+    except KeyError:
+        raise LojaDesconhecida(loja_id) from None
+
+
+def por_numero(phone_number_id):
+    """Loja dona do número (metadata.phone_number_id do webhook) ou None.
+    Deploy de uma loja só atende qualquer número, como sempre atendeu."""
+    registro = _obter_registro()
+    loja = registro.por_numero.get(str(phone_number_id or ""))
+    if loja is None and len(registro.lojas) == 1:
+        return registro.principal
+    return loja
+
+
+def da_requisicao(valor):
+    """Loja pedida por uma rota (id ou phone_number_id); vazio = principal,
+    desconhecida = None."""
+    if not valor:
+        return principal()
+    registro = _obter_registro()
+    valor = str(valor)
+    return registro.lojas.get(valor) or registro.por_numero.get(valor)
+
+
+# --- loja do contexto ---
+
+_loja_atual = contextvars.ContextVar("loja_atual", default=None)
+
+
+def atual():
+    return _loja_atual.get() or principal()
+
+
+def rotulo_atual():
+    """Rótulo pras métricas — sem carregar a configuração se ninguém
+    escolheu loja ainda."""
+    loja = _loja_atual.get()
+    return loja.rotulo if loja is not None else PRINCIPAL
+
+
+def entrar(loja):
+    """Versão sem 'with', pros ganchos before/teardown do Flask."""
+    return _loja_atual.set(loja)
+
+
+def sair(token):
+    _loja_atual.reset(token)
+
+
+@contextmanager
+def usar(loja):
+    token = _loja_atual.set(loja)
+    try:
+        yield loja
+    finally:
+        _loja_atual.reset(token)
+
+
+def fixar(funcao, loja=None):
+    """'funcao' rodando sempre na loja de agora (ou na dada) — pra alvo de
+    thread, atexit e callback de listener, que não herdam o contexto."""
+    loja = loja or atual()
+
+    def na_loja(*args, **kwargs):
+        with usar(loja):
+            return funcao(*args, **kwargs)
+    na_loja.__name__ = getattr(funcao, "__name__", "na_loja")
+    return na_loja
+
+
+class PorLoja:
+    """Como o PorProcesso (partida.py), um objeto por loja: a fábrica recebe
+    a Loja e roda dentro dela, no primeiro uso da loja em cada processo."""
+
+    def __init__(self, fabrica):
+        self._fabrica = fabrica
+        self._objetos = {}
+        self._pid = None
+        self._lock = threading.Lock()
+        os.register_at_fork(after_in_child=self._depois_do_fork)
+
+    def _depois_do_fork(self):
+        self._lock = threading.Lock()
+
+    def obter(self, loja=None):
+        loja = loja or atual()
+        pid = os.getpid()
+        objeto = self._objetos.get(loja.id) if self._pid == pid else None
+        if objeto is None:
+            with self._lock:
+                if self._pid != pid:
+                    self._objetos, self._pid = {}, pid
+                objeto = self._objetos.get(loja.id)
+                if objeto is None:
+                    with usar(loja):
+                        objeto = self._fabrica(loja)
+                    self._objetos[loja.id] = objeto
+        return objeto
+
+    def criados(self):
+        """(loja, objeto) já criados neste processo."""
+        if self._pid != os.getpid():
+            return []
+        return [(obter(loja_id), objeto) for loja_id, objeto in list(self._objetos.items())]
+
+    def __getattr__(self, nome):
+        return getattr(self.obter(), nome)
@@ -0,0 +1,216 @@
+"""Métricas do bot no formato do Prometheus (rota /metrics do app.py).
+
+Antes não havia medição de tempo nenhuma, só print — quando o bot ficava
+lento no pico da noite não dava pra saber se o culpado era o Firestore, a
+OpenAI ou a API do WhatsApp. Aqui ficam os histogramas de latência (turno
+inteiro e cada etapa dele) e os contadores de turnos, chamadas de
+ferramenta, erros e respostas de fallback.
+
+Com vários workers do gunicorn cada processo tem seus próprios números; pra
+/metrics devolver o total do servidor (e não só o do worker que atendeu a
+requisição), o prometheus_client roda em modo multiprocesso quando a
+variável PROMETHEUS_MULTIPROC_DIR está definida — o gunicorn.conf.py cuida
+disso. Rodando com 'flask run' (um processo só) funciona sem configurar nada.
+
+Com várias lojas no mesmo deploy (lojas.py), os contadores e o tempo de
+turno levam o rótulo 'loja', preenchido sozinho pela loja do contexto
+(PorLoja abaixo) — quem incrementa não muda nada. Os histogramas por
+etapa, modelo e rota ficam sem ele: cada um já multiplica as séries pelos
+buckets, e a latência da OpenAI/Firestore é do deploy, não da loja.
+"""
+import contextvars
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import lojas
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Histogram, generate_latest, multiprocess, REGISTRY
+)
+
+# Do cache local (milissegundos) até uma resposta da OpenAI com ferramenta
+# (dezenas de segundos) — buckets largos pra cobrir as duas pontas.
+BUCKETS_LATENCIA = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 15, 30, 60, 120)
+
+
+class PorLoja:
+    """Métrica com o rótulo 'loja' (o primeiro) vindo de lojas.rotulo_atual()."""
+
+    def __init__(self, metrica):
+        self._metrica = metrica
+
+    def labels(self, **rotulos):
+        return self._metrica.labels(loja=lojas.rotulo_atual(), **rotulos)
+
+    def inc(self, valor=1):
+        self.labels().inc(valor)
+
+    def observe(self, valor):
+        self.labels().observe(valor)
+
+    def time(self):
+        return self.labels().time()
+
+
+TURNO_SEGUNDOS = PorLoja(Histogram(
+    "bot_turno_segundos",
+    "Tempo entre a mensagem chegar (webhook/chat_app) e a resposta sair pro cliente.",
+    ["loja", "canal"], buckets=BUCKETS_LATENCIA
+))
+ETAPA_SEGUNDOS = Histogram(
+    "bot_etapa_segundos",
+    "Tempo de cada etapa do turno (config, historico, resposta_rapida, usuario, admissao, completion_1, ferramenta:<nome>, completion_2, salvar_historico, send_message).",
+    ["etapa"], buckets=BUCKETS_LATENCIA
+)
+TURNOS = PorLoja(Counter("bot_turnos_total", "Mensagens de cliente processadas.", ["loja", "canal"]))
+CHAMADAS_FERRAMENTA = PorLoja(Counter("bot_chamadas_ferramenta_total", "Ferramentas chamadas pela IA.", ["loja", "ferramenta"]))
+ERROS = PorLoja(Counter("bot_erros_total", "Erros tratados durante o atendimento.", ["loja", "tipo"]))
+FALLBACKS = PorLoja(Counter("bot_fallbacks_total", "Respostas de fallback enviadas no lugar da resposta da IA.", ["loja", "motivo"]))
+# Mensagens que passaram pelo classificador de respostas rápidas
+# (respostas_rapidas.py). resultado: respondida (sem IA), ambigua (regra
+# bateu mas a mensagem tinha mais coisa), sem_dado (faltou o dado na
+# config/cardápio) ou ia (nenhuma regra). Taxa de acerto = respondida /
+# total; a latência fica em bot_etapa_segundos{etapa="resposta_rapida"}.
+RESPOSTAS_RAPIDAS = PorLoja(Counter("bot_respostas_rapidas_total", "Mensagens avaliadas pelas respostas rápidas (sem IA).",
+                                    ["loja", "intencao", "resultado"]))
+OPENAI_TOKENS = PorLoja(Counter("bot_openai_tokens_total", "Tokens consumidos na OpenAI (ver uso_ia.py).", ["loja", "modelo", "tipo"]))
+# Roteamento de modelo por chamada (roteador_modelos.py). motivo: curta,
+# longa, carrinho, pos_ferramenta, fechamento, lento, reserva ou fixo;
+# resultado: ok, timeout, prazo (timeout cortado pelo prazo do turno), erro
+# ou acima_slo (deu certo, mas passou do SLO do modelo — contado junto com
+# o ok).
+ROTEAMENTO_MODELO = Counter("bot_roteamento_modelo_total", "Chamadas à OpenAI por modelo escolhido, motivo e resultado.",
+                            ["etapa", "modelo", "motivo", "resultado"])
+OPENAI_SEGUNDOS = Histogram("bot_openai_segundos", "Latência de cada chamada à OpenAI, por modelo.", ["modelo"],
+                            buckets=BUCKETS_LATENCIA)
+DISJUNTOR_ABERTURAS = Counter("bot_disjuntor_aberturas_total", "Vezes que o disjuntor de um modelo abriu.", ["modelo"])
+
+# Firestore cobra por documento lido/gravado — ver firestore_contagem.py.
+FIRESTORE_OPERACOES = PorLoja(Counter("bot_firestore_operacoes_total", "Operações cobradas do Firestore.", ["loja", "tipo"]))
+FIRESTORE_POR_REQUISICAO = Histogram(
+    "bot_firestore_operacoes_por_requisicao",
+    "Leituras/escritas do Firestore feitas numa requisição (um turno, no caso do webhook e do chat_app).",
+    ["rota", "tipo"], buckets=(0, 1, 2, 4, 8, 16, 32, 64, 128, 256)
+)
+# Config/cardápio/apelidos lidos do instantâneo compartilhado
+# (instantaneo.py): origem instantaneo (dentro da idade máxima) ou
+# firestore (leitura direta, instantâneo velho demais ou ausente).
+# INSTANTANEO_LIMITE: conjuntos tirados da cópia local por passar do
+# limite de memória da loja (lojas.py) — as leituras deles vão direto.
+INSTANTANEO_LEITURAS = PorLoja(Counter("bot_instantaneo_leituras_total", "Leituras da cópia local de config/cardápio/apelidos.",
+                                       ["loja", "conjunto", "origem"]))
+INSTANTANEO_LIMITE = PorLoja(Counter("bot_instantaneo_limite_memoria_total",
+                                     "Conjuntos que passaram do limite de memória da loja e saíram da cópia local.",
+                                     ["loja", "conjunto"]))
+# Histórico gravado por trás da resposta (fila_historico.py): atraso entre
+# o turno e a gravação no Firestore, e quantos turnos cada escrita juntou.
+HISTORICO_ATRASO = Histogram("bot_historico_atraso_segundos", "Atraso entre o turno e o histórico gravado no Firestore.",
+                             buckets=BUCKETS_LATENCIA)
+HISTORICO_TURNOS_POR_GRAVACAO = Histogram("bot_historico_turnos_por_gravacao", "Turnos da mesma conversa juntados numa escrita.",
+                                          buckets=(1, 2, 3, 5, 10, 20))
+# Varredura de fundo (varredor.py): marcações de atenção escaladas ou
+# expiradas, conversas arquivadas no Storage e quanto cada tarefa levou.
+VARREDOR_ATENCAO = PorLoja(Counter("bot_varredor_atencao_total", "Marcações de atenção tratadas pela varredura.", ["loja", "acao"]))
+VARREDOR_ARQUIVADAS = PorLoja(Counter("bot_varredor_arquivadas_total", "Conversas inativas arquivadas no Storage e apagadas do Firestore.",
+                                      ["loja"]))
+VARREDOR_SEGUNDOS = Histogram("bot_varredor_segundos", "Duração de cada tarefa da varredura.", ["tarefa"],
+                              buckets=BUCKETS_LATENCIA)
+# Controle de admissão (admissao.py): mensagens barradas pelo limite por
+# cliente (com ou sem o aviso), turnos pela fila de vagas da IA
+# (imediata/adiada/recusada, checkout ou navegacao) e quanto esperaram.
+# As vagas são da máquina, divididas entre as lojas — sem rótulo de loja.
+ADMISSAO_LIMITE_CLIENTE = PorLoja(Counter("bot_admissao_limite_cliente_total", "Mensagens descartadas pelo limite por cliente.",
+                                          ["loja", "aviso"]))
+ADMISSAO_VAGAS = Counter("bot_admissao_vagas_total", "Turnos com IA pela fila de vagas, por prioridade e resultado.",
+                         ["prioridade", "resultado"])
+ADMISSAO_ESPERA = Histogram("bot_admissao_espera_segundos", "Espera por uma vaga de turno com IA (só de quem não entrou na hora).",
+                            ["prioridade"], buckets=BUCKETS_LATENCIA)
+# Disparos de promoção (disparos.py), por canal (app, whatsapp) e resultado
+# (enviado, falhou, retido — limite do canal, volta pra fila).
+DISPAROS_ENVIOS = PorLoja(Counter("bot_disparos_envios_total", "Envios dos disparos de promoção.",
+                                  ["loja", "canal", "resultado"]))
+# Avisos pro cliente (notificacoes.py, /notificar_pronto): push do app e
+# WhatsApp, por resultado (enviado, falhou, retido, token_invalido) e
+# quanto cada envio levou (o push conta o lote inteiro, uma vez).
+NOTIFICACOES = PorLoja(Counter("bot_notificacoes_total", "Avisos enviados ao cliente, por canal e resultado.",
+                               ["loja", "canal", "resultado"]))
+NOTIFICACAO_SEGUNDOS = Histogram("bot_notificacao_segundos", "Latência de cada envio de aviso (um send_each do FCM ou uma chamada à Graph API).",
+                                 ["canal"], buckets=BUCKETS_LATENCIA)
+NOTIFICACOES_TOKENS_REMOVIDOS = PorLoja(Counter("bot_notificacoes_tokens_removidos_total",
+                                                "Tokens do app recusados pelo FCM e tirados do usuarios_app.", ["loja"]))
+# Turnos que passaram do prazo (prazo.py), pela etapa em que o prazo acabou.
+PRAZO_ESGOTADO = PorLoja(Counter("bot_prazo_esgotado_total", "Turnos que estouraram o prazo, pela etapa que consumiu o orçamento.",
+                                 ["loja", "etapa"]))
+
+
+# Etapa em andamento em cada thread — o profiler por amostragem (perfil.py)
+# lê isso de fora pra marcar cada amostra com a etapa do turno.
+_etapa_por_thread = {}
+
+
+def etapa_da_thread(thread_id):
+    return _etapa_por_thread.get(thread_id)
+
+
+# Etapa em andamento no contexto atual (thread ou corrotina do app_async) e
+# quem mais quer saber de cada etapa medida (prazo.py, pra achar a etapa
+# em que o prazo do turno acabou).
+_etapa_atual = contextvars.ContextVar("etapa_atual", default=None)
+_observadores_etapa = []
+
+
+def etapa_em_andamento():
+    return _etapa_atual.get()
+
+
+def ao_medir_etapa(funcao):
+    """funcao(etapa, inicio, fim) é chamada no fim de cada etapa medida
+    (tempos do time.perf_counter)."""
+    _observadores_etapa.append(funcao)
+
+
+@contextmanager
+def cronometrar_etapa(etapa):
+    """Só o histograma (e os observadores) — serve também pra corrotinas,
+    que dividem a thread (app_async.py)."""
+    token = _etapa_atual.set(etapa)
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        fim = time.perf_counter()
+        _etapa_atual.reset(token)
+        ETAPA_SEGUNDOS.labels(etapa=etapa).observe(fim - inicio)
+        for observador in _observadores_etapa:
+            observador(etapa, inicio, fim)
+
+
+@contextmanager
+def medir_etapa(etapa):
+    """Cronometra o bloco e registra em bot_etapa_segundos{etapa=...},
+    mesmo se o bloco levantar exceção (etapa lenta que termina em erro
+    também precisa aparecer no gráfico)."""
+    thread_id = threading.get_ident()
+    etapa_anterior = _etapa_por_thread.get(thread_id)
+    _etapa_por_thread[thread_id] = etapa
+    try:
+        with cronometrar_etapa(etapa):
+            yield
+    finally:
+        if etapa_anterior is None:
+            _etapa_por_thread.pop(thread_id, None)
+        else:
+            _etapa_por_thread[thread_id] = etapa_anterior
+
+
+def gerar_metricas():
+    """Corpo e content-type da resposta de /metrics. Em modo multiprocesso
+    junta os arquivos de todos os workers (vivos e já encerrados) numa
+    coleta só."""
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registro = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registro)
+    else:
+        registro = REGISTRY
+    return generate_latest(registro), CONTENT_TYPE_LATEST
@@ -0,0 +1,204 @@
+"""Push do app (FCM), em lote, com limpeza dos tokens que morreram.
+
+O /salvar_token guardava o fcm_token em usuarios_app e nada mandava push:
+o /notificar_pronto sempre ia pelo WhatsApp — pago e com limite da Meta —
+até pra quem pediu pelo app. Agora:
+
+- token_do_cliente() acha o token do cliente (usuario_id do pedido ou o
+  telefone do cadastro no app);
+- FilaPush.enviar() põe as notificações numa fila e espera o resultado. Um
+  thread por loja e processo junta o que chegar em JANELA_S (até LOTE_MAX,
+  o limite do FCM por chamada) e manda tudo num send_each só — o KDS
+  marcando dez pedidos prontos de uma vez vira uma chamada, não dez. O
+  disparo de promoção (disparos.py) usa a mesma fila;
+- token que o FCM diz que não existe mais (app desinstalado, token
+  trocado) sai do usuarios_app na hora, só se ainda for o mesmo token —
+  sem isso cada aviso pra esse cliente gastava uma tentativa antes do
+  WhatsApp.
+
+Resultado de cada notificação, como o disparos.py espera: 'enviado',
+'falhou' ou 'retido' (o FCM não respondeu ou ficou na fila além do
+tempo: não saiu, pode tentar de novo ou ir pelo WhatsApp). Métricas:
+bot_notificacoes_total{canal, resultado} e bot_notificacao_segundos{canal}
+— o /notificar_pronto conta o WhatsApp nas mesmas séries.
+"""
+import os
+import queue
+import re
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FuturoEsgotado
+
+import logs
+import lojas
+import metricas
+from partida import importar_quando_usar
+
+firestore = importar_quando_usar("firebase_admin.firestore")
+messaging = importar_quando_usar("firebase_admin.messaging")
+
+log = logs.obter("notificacoes")
+
+COLECAO_USUARIOS = "usuarios_app"
+LOTE_MAX = 500
+JANELA_S = 0.05
+ESPERA_S = 10
+# Respostas do FCM que querem dizer "este token não serve mais".
+ERROS_TOKEN_INVALIDO = ("UnregisteredError", "SenderIdMismatchError")
+_TOKEN_MALFORMADO = re.compile(r"registration token", re.IGNORECASE)
+
+
+def token_invalido(erro):
+    nome = type(erro).__name__
+    if nome in ERROS_TOKEN_INVALIDO:
+        return True
+    # Token malformado (sobra de versão velha do app) vem como argumento
+    # inválido, o mesmo erro de uma mensagem mal montada — só o texto diz.
+    return nome == "InvalidArgumentError" and bool(_TOKEN_MALFORMADO.search(str(erro)))
+
+
+def token_do_cliente(db, usuario_id=None, telefone=None):
+    """(usuario_id, fcm_token) do cliente no app, ou (None, None). Pedido do
+    app traz o usuario_id ('cliente_...', às vezes no lugar do wa_id);
+    pedido do WhatsApp só o telefone, que o cliente pode ter cadastrado no
+    perfil do app."""
+    if usuario_id:
+        snap = db.collection(COLECAO_USUARIOS).document(str(usuario_id)).get()
+        token = (snap.to_dict() or {}).get("fcm_token") if snap.exists else None
+        if token:
+            return snap.id, token
+    telefone = re.sub(r"\D", "", str(telefone or ""))
+    if telefone:
+        for snap in db.collection(COLECAO_USUARIOS).where("telefone", "==", telefone).limit(1).stream():
+            token = (snap.to_dict() or {}).get("fcm_token")
+            if token:
+                return snap.id, token
+    return None, None
+
+
+def limpar_tokens(db, tokens):
+    """Tira de usuarios_app os tokens recusados pelo FCM — só de quem ainda
+    está com o mesmo (o app pode ter mandado um novo no meio)."""
+    lote, n = db.batch(), 0
+    for token in set(tokens):
+        for snap in db.collection(COLECAO_USUARIOS).where("fcm_token", "==", token).stream():
+            lote.update(snap.reference, {"fcm_token": firestore.DELETE_FIELD,
+                                         "fcm_token_invalido_em": firestore.SERVER_TIMESTAMP})
+            n += 1
+    if n:
+        lote.commit()
+        metricas.NOTIFICACOES_TOKENS_REMOVIDOS.inc(n)
+    return n
+
+
+class _Push:
+    __slots__ = ("mensagem", "futuro")
+
+    def __init__(self, mensagem):
+        self.mensagem = mensagem
+        self.futuro = Future()
+
+
+class FilaPush:
+    """obter_app() -> app do firebase_admin da loja (None = o padrão)."""
+
+    def __init__(self, db, obter_app):
+        self._db = db
+        self._obter_app = obter_app
+        self._fila = queue.Queue()
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _iniciar(self):
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._lock:
+            if self._pid == pid:
+                return
+            self._pid = pid
+            threading.Thread(target=lojas.fixar(self._laco), name="fila-push", daemon=True).start()
+
+    def enviar(self, mensagens, espera_s=ESPERA_S):
+        """mensagens: [(token, titulo, corpo, dados)] -> [(resultado, erro)],
+        na mesma ordem."""
+        self._iniciar()
+        pushes = [_Push(m) for m in mensagens]
+        for push in pushes:
+            self._fila.put(push)
+        limite = time.monotonic() + espera_s
+        resultados = []
+        for push in pushes:
+            try:
+                resultados.append(push.futuro.result(timeout=max(0.0, limite - time.monotonic())))
+            except FuturoEsgotado:
+                # Ainda na fila: não sai mais. Já no send_each: espera o fim.
+                if push.futuro.cancel():
+                    metricas.NOTIFICACOES.labels(canal="app", resultado="retido").inc()
+                    resultados.append(("retido", "fila do push sem resposta"))
+                else:
+                    resultados.append(push.futuro.result())
+        return resultados
+
+    # --- thread da loja ---
+
+    def _juntar(self):
+        lote = [self._fila.get()]
+        fim = time.monotonic() + JANELA_S
+        while len(lote) < LOTE_MAX:
+            resta = fim - time.monotonic()
+            if resta <= 0:
+                break
+            try:
+                lote.append(self._fila.get(timeout=resta))
+            except queue.Empty:
+                break
+        return [push for push in lote if push.futuro.set_running_or_notify_cancel()]
+
+    def _laco(self):
+        while True:
+            lote = self._juntar()
+            if not lote:
+                continue
+            try:
+                self._enviar_lote(lote)
+            except Exception as e:
+                metricas.ERROS.labels(tipo="push").inc()
+                log.error("erro no lote de push", extra={"tamanho": len(lote)}, exc_info=True)
+                for push in lote:
+                    if not push.futuro.done():
+                        push.futuro.set_result(("retido", str(e)))
+
+    def _enviar_lote(self, lote):
+        mensagens = [messaging.Message(token=token, notification=messaging.Notification(title=titulo, body=corpo),
+                                       data={chave: str(valor) for chave, valor in (dados or {}).items()})
+                     for token, titulo, corpo, dados in (push.mensagem for push in lote)]
+        inicio = time.perf_counter()
+        try:
+            resposta = messaging.send_each(mensagens, app=self._obter_app())
+        except Exception as e:
+            # Nada saiu (rede, credencial): quem chamou decide o plano B.
+            for push in lote:
+                push.futuro.set_result(("retido", str(e)))
+            metricas.NOTIFICACOES.labels(canal="app", resultado="retido").inc(len(lote))
+            log.warning("send_each falhou", extra={"tamanho": len(lote), "erro": str(e)})
+            return
+        metricas.NOTIFICACAO_SEGUNDOS.labels(canal="app").observe(time.perf_counter() - inicio)
+        invalidos = []
+        for push, r in zip(lote, resposta.responses):
+            if r.success:
+                push.futuro.set_result(("enviado", None))
+                metricas.NOTIFICACOES.labels(canal="app", resultado="enviado").inc()
+            elif token_invalido(r.exception):
+                invalidos.append(push.mensagem[0])
+                push.futuro.set_result(("falhou", f"token inválido: {r.exception}"))
+                metricas.NOTIFICACOES.labels(canal="app", resultado="token_invalido").inc()
+            else:
+                push.futuro.set_result(("falhou", str(r.exception)))
+                metricas.NOTIFICACOES.labels(canal="app", resultado="falhou").inc()
+        if invalidos:
+            try:
+                limpar_tokens(self._db, invalidos)
+            except Exception:
+                metricas.ERROS.labels(tipo="push").inc()
+                log.error("erro ao limpar tokens inválidos", extra={"tokens": len(invalidos)}, exc_info=True)
@@ -0,0 +1,207 @@
+"""Histórico da conversa em páginas, pro GET /chat_app do app.
+
+O GET /chat_app devolvia o histórico inteiro a cada consulta do app (que
+fica perguntando de tempos em tempos), e a conversa inteira morava no
+array 'mensagens' do documento, cortado em max_historico_salvar — o app
+baixava tudo de novo toda vez e o que passava do corte sumia pra sempre.
+
+Agora cada mensagem também vira um documento em
+historico_conversas/{wa_id}/mensagens/{chave}, gravado pela fila do
+histórico (fila_historico.py) no mesmo lote do documento da conversa e
+nunca apagado. A chave é o instante da mensagem em microssegundos (com
+zeros à esquerda) mais o id dela: ordena no tempo e serve de cursor. O
+array 'mensagens' do documento continua sendo só a cauda que vai pro
+contexto da IA.
+
+GET /chat_app?usuario_id=...:
+- sem cursor: as últimas 'limite' mensagens (padrão LIMITE_PADRAO, no
+  máximo LIMITE_MAXIMO);
+- desde=<chave> (ou since=): só as mais novas que a chave — é o que o app
+  manda ao consultar de novo, com o 'cursor' da resposta anterior;
+- antes=<chave>: a página anterior, pra rolar pra cima ('anteriores' da
+  resposta; null quando não tem mais nada antes).
+
+A resposta leva ETag. O app devolve no If-None-Match e, se nada mudou,
+recebe 304 sem corpo — a versão vem do resumo da conversa
+(caixa_entrada.py, gravado no mesmo lote das mensagens) e do que ainda
+está na fila deste processo, então o 304 custa uma leitura pequena e
+nenhuma consulta. Corpo acima de GZIP_MINIMO sai comprimido se o cliente
+aceita gzip.
+
+Mensagens de antes da subcoleção existir só estão no array do documento:
+a primeira página (e a última página pra trás) junta as de lá que forem
+mais antigas que a subcoleção. Entre máquinas com relógio diferente a
+ordem pela chave pode trocar duas mensagens muito próximas; o turno grava
+pergunta e resposta juntas, com instantes crescentes, na mesma máquina.
+"""
+import gzip
+import hashlib
+import json
+from datetime import datetime, timezone
+
+SUBCOLECAO = "mensagens"
+LIMITE_PADRAO = 50
+LIMITE_MAXIMO = 200
+GZIP_MINIMO = 1024
+
+_EPOCA = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def _micros(instante):
+    if not isinstance(instante, datetime):
+        return 0
+    if instante.tzinfo is None:
+        instante = instante.replace(tzinfo=timezone.utc)
+    delta = instante - _EPOCA
+    return (delta.days * 86400 + delta.seconds) * 1_000_000 + delta.microseconds
+
+
+def chave(mensagem):
+    """Chave ordenável da mensagem: instante em microssegundos + id (as
+    mensagens antigas, sem id, usam um hash do conteúdo)."""
+    sufixo = mensagem.get("id") or hashlib.sha1(
+        f'{mensagem.get("role")}|{mensagem.get("content")}'.encode("utf-8")).hexdigest()[:16]
+    return f'{_micros(mensagem.get("timestamp")):016d}-{sufixo}'
+
+
+def documento(mensagem):
+    """Documento da mensagem na subcoleção."""
+    return {
+        "chave": chave(mensagem),
+        "id": mensagem.get("id"),
+        "role": mensagem["role"],
+        "content": mensagem["content"],
+        "timestamp": mensagem.get("timestamp"),
+    }
+
+
+def referencia(doc_ref, mensagem):
+    """Onde a mensagem fica, dado o documento da conversa."""
+    return doc_ref.collection(SUBCOLECAO).document(chave(mensagem))
+
+
+def ler_parametros(args):
+    """(desde, antes, limite) a partir da query string."""
+    try:
+        limite = int(args.get("limite") or LIMITE_PADRAO)
+    except (TypeError, ValueError):
+        limite = LIMITE_PADRAO
+    limite = max(1, min(LIMITE_MAXIMO, limite))
+    desde = args.get("desde") or args.get("since") or None
+    antes = None if desde else (args.get("antes") or None)
+    return desde, antes, limite
+
+
+def consulta(doc_ref, desde, antes, limite):
+    """Consulta da subcoleção pra página pedida (um a mais que o limite,
+    pra saber se ficou coisa de fora)."""
+    colecao = doc_ref.collection(SUBCOLECAO)
+    if desde:
+        return colecao.where("chave", ">", desde).order_by("chave").limit(limite + 1)
+    if antes:
+        colecao = colecao.where("chave", "<", antes)
+    return colecao.order_by("chave", direction="DESCENDING").limit(limite + 1)
+
+
+def precisa_legado(desde, gravadas, limite):
+    """A página chegou ao começo da subcoleção: pode haver mensagens antigas
+    só no array do documento."""
+    return not desde and len(gravadas) <= limite
+
+
+def montar_pagina(gravadas, legado, pendentes, desde, antes, limite):
+    """Junta as mensagens da subcoleção, as do array do documento (legado,
+    só as mais antigas que a subcoleção) e as que ainda estão na fila.
+    Devolve o corpo da resposta."""
+    por_chave = {}
+    for m in legado:
+        por_chave.setdefault(chave(m), m)
+    if gravadas:
+        # O legado só preenche o que vem antes da subcoleção.
+        mais_antiga = min(d["chave"] for d in gravadas)
+        por_chave = {c: m for c, m in por_chave.items() if c < mais_antiga}
+    for d in gravadas:
+        por_chave[d["chave"]] = d
+    for m in pendentes:
+        por_chave.setdefault(chave(m), m)
+
+    chaves = sorted(c for c in por_chave if (not desde or c > desde) and (not antes or c < antes))
+    mais_novas = False
+    if desde:
+        mais_novas = len(chaves) > limite
+        chaves = chaves[:limite]
+        anteriores = None
+    else:
+        tem_antes = len(chaves) > limite
+        chaves = chaves[-limite:]
+        anteriores = chaves[0] if tem_antes and chaves else None
+
+    historico = []
+    for c in chaves:
+        m = por_chave[c]
+        instante = m.get("timestamp")
+        historico.append({
+            "id": c,
+            "role": m["role"],
+            "content": m["content"],
+            "timestamp": instante.isoformat() if isinstance(instante, datetime) else None,
+        })
+    return {
+        "historico": historico,
+        "cursor": chaves[-1] if chaves else desde,
+        "anteriores": anteriores,
+        "mais_novas": mais_novas,
+    }
+
+
+def etag(wa_id, versao, desde, antes, limite):
+    """ETag da página a partir da versão da conversa (None = sem versão
+    conhecida: o ETag sai do corpo)."""
+    if versao is None:
+        return None
+    base = f"{wa_id}|{versao}|{desde}|{antes}|{limite}"
+    return 'W/"' + hashlib.sha1(base.encode("utf-8")).hexdigest()[:20] + '"'
+
+
+def versao(resumo, pendentes):
+    """Versão da conversa: última mensagem gravada (resumo da caixa_entrada)
+    mais a última na fila deste processo. None se não há resumo."""
+    if not resumo or not resumo.get("ultima_interacao"):
+        return None
+    ultima_pendente = chave(pendentes[-1]) if pendentes else ""
+    return f'{_micros(resumo["ultima_interacao"])}:{ultima_pendente}'
+
+
+def nao_mudou(if_none_match, etag_atual):
+    if not if_none_match or not etag_atual:
+        return False
+    candidatas = {e.strip() for e in if_none_match.split(",")}
+    return "*" in candidatas or etag_atual in candidatas or etag_atual[2:] in candidatas
+
+
+def _cabecalhos(etag_atual):
+    return {"ETag": etag_atual, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+
+
+def sem_mudanca(etag_atual, if_none_match):
+    """(304, b"", cabeçalhos) se o cliente já tem essa versão, senão None —
+    pra responder antes de consultar as mensagens."""
+    if nao_mudou(if_none_match, etag_atual):
+        return 304, b"", _cabecalhos(etag_atual)
+    return None
+
+
+def resposta(corpo, etag_atual, if_none_match, accept_encoding):
+    """(status, bytes, cabeçalhos) da resposta — 304 se o corpo é o que o
+    cliente já tem, gzip se compensa."""
+    dados = json.dumps(corpo, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    if etag_atual is None:
+        etag_atual = 'W/"' + hashlib.sha1(dados).hexdigest()[:20] + '"'
+    cabecalhos = _cabecalhos(etag_atual)
+    if nao_mudou(if_none_match, etag_atual):
+        return 304, b"", cabecalhos
+    cabecalhos["Content-Type"] = "application/json"
+    if len(dados) >= GZIP_MINIMO and "gzip" in (accept_encoding or ""):
+        dados = gzip.compress(dados, compresslevel=6)
+        cabecalhos["Content-Encoding"] = "gzip"
+    return 200, dados, cabecalhos
@@ -0,0 +1,76 @@
+"""Partida rápida: import pesado só quando for usado e cliente criado
+depois do fork.
+
+A cada deploy/scale-up o Render pagava o import de openai, firebase_admin
+(Firestore e Storage), thefuzz e requests, mais o initialize_app e o
+firestore.client() rodando no import do app.py — antes do '/' conseguir
+responder o health check. E com o cliente do Firestore (gRPC) criado no
+import, o 'gunicorn --preload' não era seguro: o canal criado no processo
+mestre não sobrevive ao fork dos workers.
+
+- importar_quando_usar("openai") devolve um módulo que só é importado de
+  verdade no primeiro atributo acessado (openai.chat..., firestore.Increment...);
+- PorProcesso(fabrica) cria o objeto no primeiro uso DENTRO de cada
+  processo — se o pid mudou (fork), cria de novo em vez de herdar.
+
+Nada no processo mestre deve tocar nesses objetos: aí com --preload o
+código do app fica nas páginas compartilhadas (copy-on-write) e cada
+worker abre as próprias conexões. bench/bench_partida.py mede o efeito.
+"""
+import importlib
+import os
+import threading
+
+
+class ModuloPreguicoso:
+    def __init__(self, nome):
+        object.__setattr__(self, "_nome", nome)
+        object.__setattr__(self, "_modulo", None)
+
+    def _carregar(self):
+        modulo = self._modulo
+        if modulo is None:
+            modulo = importlib.import_module(self._nome)
+            object.__setattr__(self, "_modulo", modulo)
+        return modulo
+
+    def __getattr__(self, atributo):
+        return getattr(self._carregar(), atributo)
+
+    def __setattr__(self, atributo, valor):
+        setattr(self._carregar(), atributo, valor)
+
+    def __repr__(self):
+        estado = "carregado" if self._modulo is not None else "não carregado"
+        return f"<módulo preguiçoso {self._nome!r} ({estado})>"
+
+
+def importar_quando_usar(nome):
+    return ModuloPreguicoso(nome)
+
+
+class PorProcesso:
+    """Embrulho com a mesma interface do objeto que a fábrica devolve."""
+
+    def __init__(self, fabrica):
+        self._fabrica = fabrica
+        self._objeto = None
+        self._pid = None
+        self._lock = threading.Lock()
+        # O lock herdado pode ter sido copiado travado no fork.
+        os.register_at_fork(after_in_child=self._depois_do_fork)
+
+    def _depois_do_fork(self):
+        self._lock = threading.Lock()
+
+    def obter(self):
+        pid = os.getpid()
+        if self._pid != pid:
+            with self._lock:
+                if self._pid != pid:
+                    self._objeto = self._fabrica()
+                    self._pid = pid
+        return self._objeto
+
+    def __getattr__(self, nome):
+        return getattr(self.obter(), nome)
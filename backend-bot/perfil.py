@@ -0,0 +1,182 @@
+"""Profiler por amostragem, sob demanda, pros workers em produção.
+
+Quando um worker esquenta não havia como ver onde vai o tempo de Python
+(montagem do prompt, json, thefuzz, decodificação do protobuf do
+Firestore...). Ligado, ele sorteia uma fração dos turnos e, enquanto o
+turno roda, um thread separado fotografa a pilha do thread do turno a cada
+PERFIL_INTERVALO_MS (sys._current_frames — não instrumenta chamada por
+chamada, então o custo no turno é quase nenhum). Cada amostra é marcada com
+a etapa do turno em andamento (metricas.medir_etapa) e, no fim do turno,
+tudo vai pra um arquivo .collapsed ("etapa=...;arquivo:função;... N", o
+formato do flamegraph.pl/speedscope) em PERFIL_DIR.
+
+Como ligar:
+- variável de ambiente PERFIL_FRACAO=0.05 (5% dos turnos), ou
+- POST /admin/perfil {"fracao": 0.05, "minutos": 15} com o cabeçalho
+  "Authorization: Bearer <ADMIN_TOKEN>" — vale pra todos os workers da
+  máquina (o estado fica num arquivo em PERFIL_DIR) e desliga sozinho
+  depois de 'minutos'. DELETE /admin/perfil desliga na hora.
+
+Desligado (o normal), o custo por turno é um if sobre um valor em memória —
+o arquivo de estado só é relido a cada poucos segundos.
+"""
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+import logs
+import metricas
+
+log = logs.obter("perfil")
+
+PERFIL_DIR = os.environ.get("PERFIL_DIR") or os.path.join(tempfile.gettempdir(), "bot_perfis")
+INTERVALO = max(1, int(os.environ.get("PERFIL_INTERVALO_MS") or 5)) / 1000
+_ARQUIVO_ESTADO = os.path.join(PERFIL_DIR, "estado.json")
+_RELER_ESTADO_A_CADA = 5
+
+try:
+    _FRACAO_AMBIENTE = min(1.0, max(0.0, float(os.environ.get("PERFIL_FRACAO") or 0)))
+except ValueError:
+    _FRACAO_AMBIENTE = 0.0
+
+_lock = threading.Lock()
+_estado = {"fracao": 0.0, "lido_em": 0.0}
+_turnos = {}
+_amostrador = None
+_acordar = threading.Event()
+
+
+def fracao_atual():
+    """Fração de turnos amostrados agora: a maior entre a do ambiente e a
+    ligada pelo endpoint admin (se ainda não venceu)."""
+    agora = time.monotonic()
+    if agora - _estado["lido_em"] > _RELER_ESTADO_A_CADA:
+        _estado["lido_em"] = agora
+        fracao = 0.0
+        try:
+            with open(_ARQUIVO_ESTADO) as f:
+                dados = json.load(f)
+            if dados.get("ate", 0) > time.time():
+                fracao = float(dados.get("fracao") or 0)
+        except (OSError, ValueError):
+            pass
+        _estado["fracao"] = fracao
+    return max(_FRACAO_AMBIENTE, _estado["fracao"])
+
+
+def ligar(fracao, minutos):
+    fracao = min(1.0, max(0.0, float(fracao)))
+    os.makedirs(PERFIL_DIR, exist_ok=True)
+    estado = {"fracao": fracao, "ate": time.time() + float(minutos) * 60}
+    temporario = _ARQUIVO_ESTADO + f".{os.getpid()}"
+    with open(temporario, "w") as f:
+        json.dump(estado, f)
+    os.replace(temporario, _ARQUIVO_ESTADO)
+    _estado["lido_em"] = 0.0
+    return estado
+
+
+def desligar():
+    try:
+        os.remove(_ARQUIVO_ESTADO)
+    except FileNotFoundError:
+        pass
+    _estado["lido_em"] = 0.0
+
+
+def status():
+    return {
+        "fracao": fracao_atual(),
+        "fracao_ambiente": _FRACAO_AMBIENTE,
+        "intervalo_ms": INTERVALO * 1000,
+        "pasta": PERFIL_DIR,
+        "turnos_em_andamento": len(_turnos),
+    }
+
+
+class _Turno:
+    def __init__(self, rotulo):
+        self.rotulo = rotulo
+        self.pilhas = Counter()
+        self.amostras = 0
+
+    def amostrar(self, frame, etapa):
+        pilha = []
+        while frame is not None:
+            codigo = frame.f_code
+            pilha.append(f"{os.path.basename(codigo.co_filename)}:{codigo.co_name}")
+            frame = frame.f_back
+        pilha.append(f"etapa={etapa or 'outra'}")
+        pilha.reverse()
+        self.pilhas[";".join(pilha)] += 1
+        self.amostras += 1
+
+
+def _laco_amostrador():
+    while True:
+        with _lock:
+            alvos = dict(_turnos)
+        if not alvos:
+            _acordar.wait()
+            _acordar.clear()
+            continue
+        frames = sys._current_frames()
+        for thread_id, turno in alvos.items():
+            frame = frames.get(thread_id)
+            if frame is not None:
+                turno.amostrar(frame, metricas.etapa_da_thread(thread_id))
+        del frames
+        time.sleep(INTERVALO)
+
+
+def _garantir_amostrador():
+    global _amostrador
+    if _amostrador is not None and _amostrador.is_alive():
+        return
+    with _lock:
+        if _amostrador is None or not _amostrador.is_alive():
+            _amostrador = threading.Thread(target=_laco_amostrador, name="perfil-amostrador", daemon=True)
+            _amostrador.start()
+
+
+@contextmanager
+def perfilar_turno(rotulo):
+    """Envolve um turno. Se o sorteio cair dentro da fração ligada, amostra a
+    pilha deste thread até o fim do bloco e grava o .collapsed."""
+    fracao = fracao_atual()
+    if not fracao or random.random() >= fracao:
+        yield
+        return
+
+    _garantir_amostrador()
+    thread_id = threading.get_ident()
+    turno = _Turno(rotulo)
+    inicio = time.perf_counter()
+    with _lock:
+        _turnos[thread_id] = turno
+    _acordar.set()
+    try:
+        yield
+    finally:
+        with _lock:
+            _turnos.pop(thread_id, None)
+        _gravar(turno, time.perf_counter() - inicio)
+
+
+def _gravar(turno, duracao):
+    if not turno.amostras:
+        return
+    try:
+        os.makedirs(PERFIL_DIR, exist_ok=True)
+        nome = f"{time.strftime('%Y%m%d-%H%M%S')}_{os.getpid()}_{turno.rotulo}_{int(duracao * 1000)}ms.collapsed"
+        with open(os.path.join(PERFIL_DIR, nome), "w") as f:
+            for pilha, total in turno.pilhas.most_common():
+                f.write(f"{pilha} {total}\n")
+    except OSError:
+        log.error("erro ao gravar o perfil do turno", exc_info=True)
@@ -0,0 +1,166 @@
+"""Prazo do turno: quanto tempo uma mensagem do cliente pode levar até a
+resposta sair.
+
+Nenhuma chamada de um turno tinha limite próprio — OpenAI sem timeout,
+download de mídia da Graph sem timeout, Firestore com o padrão do cliente
+— e um turno travado passava dos 120 s do gunicorn ('--timeout 120' no
+Procfile), que mata o worker no meio de uma gravação. Agora o prazo é
+marcado quando a mensagem chega (webhook/chat_app) e cada chamada pra
+fora pega o timeout do que sobrou dele:
+
+- Firestore: o ClienteContado (firestore_contagem.py) passa 'timeout=' em
+  get/set/update/stream/commit, nunca menos que MINIMO_FIRESTORE;
+- OpenAI: o roteador (roteador_modelos.py) usa o menor entre o timeout do
+  modelo e o que resta — e não tenta o modelo reserva sem prazo;
+- ferramentas: o turno confere o prazo antes de cada uma (as leituras
+  dentro delas já saem com timeout pelo Firestore);
+- send_message e Graph: o que resta mais RESERVA_ENVIO — o envio é o que
+  leva a resposta (ou o aviso de demora) ao cliente, tem sempre essa folga.
+
+Esgotado, o turno desiste (PrazoEsgotado) e o cliente recebe a
+'mensagem_prazo' da config. O prazo é 'prazo_turno_s' em
+configuracoes/bot (PRAZO_TURNO_S no ambiente enquanto a config não foi
+lida), sempre contado da chegada da mensagem — precisa ficar abaixo do
+timeout do gunicorn com folga pro envio.
+
+Cada turno que estoura conta uma vez em bot_prazo_esgotado_total{etapa}:
+a etapa (metricas.medir_etapa) que estava rodando quando o prazo acabou —
+é ela que comeu o orçamento, não a que veio depois e desistiu.
+
+Fora de um turno (threads de fundo, rotas do painel) não há prazo e nada
+muda: timeout() devolve o máximo pedido, ou None.
+"""
+import contextvars
+import os
+import time
+from contextlib import contextmanager
+
+import metricas
+
+PRAZO_PADRAO = float(os.environ.get("PRAZO_TURNO_S") or 40)
+RESERVA_ENVIO = 5.0
+MINIMO_FIRESTORE = 1.0
+
+_prazo_atual = contextvars.ContextVar("prazo_turno", default=None)
+
+
+class PrazoEsgotado(Exception):
+    """O turno passou do prazo; quem chamou responde com a mensagem_prazo."""
+
+
+class Prazo:
+    def __init__(self, segundos):
+        self.inicio = time.perf_counter()
+        self.limite = self.inicio + segundos
+        self.etapas = []
+        self.etapa_esgotada = None
+
+    def ajustar(self, segundos):
+        """Troca o tamanho do prazo (o da config da loja), ainda contado da
+        chegada da mensagem."""
+        self.limite = self.inicio + segundos
+
+    def restante(self):
+        return self.limite - time.perf_counter()
+
+    def _registrar_etapa(self, etapa, inicio, fim):
+        self.etapas.append((etapa, inicio, fim))
+
+    def marcar_esgotado(self):
+        """Conta o estouro uma vez por turno, na etapa em que o prazo acabou."""
+        if self.etapa_esgotada is not None:
+            return
+        self.etapa_esgotada = "entre_etapas"
+        # A mais interna que cobre o instante do estouro: 'ferramenta:x'
+        # ganha de um bloco maior em volta dela.
+        cobrindo = [(fim - inicio, etapa) for etapa, inicio, fim in self.etapas if inicio <= self.limite <= fim]
+        if cobrindo:
+            self.etapa_esgotada = min(cobrindo)[1]
+        else:
+            etapa_em_andamento = metricas.etapa_em_andamento()
+            if etapa_em_andamento:
+                self.etapa_esgotada = etapa_em_andamento
+        metricas.PRAZO_ESGOTADO.labels(etapa=self.etapa_esgotada).inc()
+
+
+def _ao_medir_etapa(etapa, inicio, fim):
+    prazo = _prazo_atual.get()
+    if prazo is not None:
+        prazo._registrar_etapa(etapa, inicio, fim)
+
+
+metricas.ao_medir_etapa(_ao_medir_etapa)
+
+
+def iniciar_prazo(segundos=None):
+    """Versão sem 'with' (mesmo formato do iniciar_contagem): devolve
+    (prazo, token) — o token vai pra 'encerrar_prazo' no fim do turno."""
+    prazo = Prazo(PRAZO_PADRAO if segundos is None else segundos)
+    return prazo, _prazo_atual.set(prazo)
+
+
+def encerrar_prazo(token):
+    prazo = _prazo_atual.get()
+    _prazo_atual.reset(token)
+    # Turno que terminou depois do prazo sem ninguém ter desistido (a última
+    # etapa passou do limite e acabou) também conta.
+    if prazo is not None and prazo.restante() <= 0:
+        prazo.marcar_esgotado()
+
+
+@contextmanager
+def prazo_turno(segundos=None):
+    prazo, token = iniciar_prazo(segundos)
+    try:
+        yield prazo
+    finally:
+        encerrar_prazo(token)
+
+
+def ajustar(segundos):
+    prazo = _prazo_atual.get()
+    if prazo is not None and segundos:
+        try:
+            prazo.ajustar(float(segundos))
+        except (TypeError, ValueError):
+            pass
+
+
+def esgotado():
+    prazo = _prazo_atual.get()
+    return prazo is not None and prazo.restante() <= 0
+
+
+def verificar():
+    """Levanta PrazoEsgotado se o prazo do turno já acabou."""
+    prazo = _prazo_atual.get()
+    if prazo is not None and prazo.restante() <= 0:
+        prazo.marcar_esgotado()
+        raise PrazoEsgotado()
+
+
+def timeout(maximo=None, minimo=None):
+    """Timeout pra uma chamada: o que resta do prazo, limitado a 'maximo'.
+    Sem 'minimo', prazo acabado levanta PrazoEsgotado; com ele, devolve pelo
+    menos 'minimo' (pra chamada que precisa acontecer mesmo assim). Fora de
+    um turno devolve 'maximo'."""
+    prazo = _prazo_atual.get()
+    if prazo is None:
+        return maximo
+    restante = prazo.restante()
+    if restante <= 0:
+        prazo.marcar_esgotado()
+        if minimo is None:
+            raise PrazoEsgotado()
+    if maximo is not None:
+        restante = min(restante, maximo)
+    return max(restante, minimo or 0)
+
+
+def timeout_envio(maximo):
+    """Timeout de quem entrega a resposta ao cliente: o que resta mais
+    RESERVA_ENVIO, nunca mais que 'maximo'. Nunca levanta."""
+    prazo = _prazo_atual.get()
+    if prazo is None:
+        return maximo
+    return min(maximo, max(prazo.restante(), 0) + RESERVA_ENVIO)
@@ -0,0 +1,105 @@
+"""Respostas rápidas: perguntas que o servidor responde sozinho, sem IA.
+
+"Qual o horário?", "entrega no bairro X?", "manda o cardápio", "qual a
+chave pix?" passavam pelas duas chamadas ao gpt-4o com o prompt de sistema
+inteiro, só pra devolver um dado que já está na config ou no cardápio.
+Aqui fica o classificador (regras de palavra-chave/regex, sem modelo
+nenhum) e os textos prontos; quem busca o dado e responde é o
+'resposta_rapida' do app.py, antes do get_openai_response chamar a OpenAI.
+
+Só responde quando tem certeza: a mensagem inteira tem que ser a pergunta
+— fora a frase-chave, só cumprimento e palavra de ligação (PALAVRAS_NEUTRAS).
+"Qual o horário?" responde; "quero 2 calabresas, qual o pix?" vai pra IA,
+que entende o pedido junto. Na dúvida, vai pra IA.
+
+Desliga por loja com 'respostas_rapidas: false' em configuracoes/bot. Os
+textos podem ser trocados em 'textos_respostas_rapidas' (mesmas chaves de
+TEXTOS_PADRAO, mesmos {campos}).
+"""
+import re
+import unicodedata
+
+TEXTOS_PADRAO = {
+    "horario": "Nosso horário de funcionamento: {horario}. Estamos abertos agora, é só mandar o seu pedido!",
+    "pix": "Nossa chave PIX é: {chave_pix}",
+    "cardapio": "Nosso cardápio:\n\n{cardapio}\n\nÉ só me dizer o que vai querer!",
+    "bairro_atende": "Entregamos sim em {bairro}! A taxa de entrega é R$ {taxa}.",
+    "bairro_atende_sem_taxa": "Entregamos sim em {bairro}!",
+    "bairro_nao_atende": "Infelizmente não entregamos em {bairro}. Se quiser, você pode retirar o pedido aqui com a gente!",
+}
+
+# Pode sobrar na mensagem além da frase-chave sem tirar a certeza.
+PALAVRAS_NEUTRAS = set("""
+    oi ola opa eai e ai bom boa dia tarde noite tudo bem blz beleza por favor pf pfv porfavor obrigado obrigada
+    me manda mandar envia enviar mostra mostrar passa passar ver qual quais como o a os as de do da dos das
+    voces vcs voce vc ai hoje ainda agora pode poderia podia consegue gostaria queria saber seria so
+    tem ta esta eh e um uma seu sua teu tua pra pro para sim ok certo
+    abre abrem fecha fecham funciona funcionam atende atendem
+""".split())
+# Cauda que não faz parte do nome do bairro ("entrega no centro ai?").
+_FIM_DO_BAIRRO = {"ai", "hoje", "por", "favor", "pf", "pfv", "tambem", "tb", "sim", "ok"}
+# Palavra que nome de bairro não tem: dois bairros ("no centro ou no jardim
+# america?") ou outra pergunta ("entrega em quanto tempo?") — vai pra IA.
+_NAO_E_BAIRRO = {"ou", "e", "no", "na", "quanto", "quanta", "quantos", "qual", "quais", "que", "quando",
+                 "como", "onde", "tempo", "horas", "minutos", "demora", "custa", "fica", "valor", "taxa"}
+
+# Sinais de que a mensagem é mais que a pergunta (pedido em andamento,
+# pagamento, reclamação) — nunca responde sem a IA.
+_FORA_DO_ATALHO = re.compile(
+    r"\b(quero|vou querer|pedir|pedido|fechar|finalizar|adiciona\w*|acrescenta\w*|tira|troca\w*|cancela\w*|"
+    r"endereco|comprovante|paguei|pago|pagar|pagamento|reclama\w*|errad\w*|atrasad\w*|demor\w*)\b"
+)
+
+# (intenção, regex da frase-chave). Bairro captura o nome.
+_REGRAS = [
+    ("horario", re.compile(
+        r"\b(horarios?( de funcionamento| de atendimento)?|que horas (abre|abrem|fecha|fecham|comeca|funciona)|"
+        r"ate que horas|(estao|esta|ta|tao) (abertos?|funcionando|atendendo)|"
+        r"(abre|abrem|funciona|funcionam) (hoje|amanha|que horas|ate que horas))\b")),
+    ("pix", re.compile(r"\b(chave( do| de)? pix|pix)\b")),
+    ("cardapio", re.compile(r"\b(cardapio|menu)\b")),
+    ("bairro", re.compile(
+        r"\b(entrega|entregam|faz entrega|fazem entrega|tem entrega|atende|atendem|chega|chegam)"
+        r"( ai| ate)? (no|na|em|pro|pra|para o|para a|para|ate o|ate a)( bairro)? (?P<bairro>[a-z0-9 ]+)$")),
+]
+
+
+def normalizar(texto):
+    """Minúsculo, sem acento, sem pontuação, espaços simples."""
+    sem_acento = "".join(ch for ch in unicodedata.normalize("NFD", str(texto or ""))
+                         if not unicodedata.combining(ch))
+    return " ".join(re.sub(r"[^\w\s]", " ", sem_acento.lower()).split())
+
+
+def classificar(texto):
+    """(intenção, argumento, confiante). intenção None = nenhuma regra
+    bateu; confiante False = bateu, mas a mensagem tem mais coisa (vai pra
+    IA). O argumento só existe pra 'bairro' (o nome citado)."""
+    normalizado = normalizar(texto)
+    if not normalizado:
+        return None, None, False
+    encontradas = [(intencao, m) for intencao, regra in _REGRAS if (m := regra.search(normalizado))]
+    if not encontradas:
+        return None, None, False
+    intencao, m = encontradas[0]
+    if len(encontradas) > 1 or _FORA_DO_ATALHO.search(normalizado):
+        return intencao, None, False
+    argumento = None
+    if intencao == "bairro":
+        palavras = m.group("bairro").split()
+        while palavras and palavras[-1] in _FIM_DO_BAIRRO:
+            palavras.pop()
+        argumento = " ".join(palavras)
+    sobra = (normalizado[:m.start()] + " " + normalizado[m.end():]).split()
+    if intencao == "bairro" and (not argumento or len(argumento.split()) > 5
+                                 or _NAO_E_BAIRRO.intersection(argumento.split())):
+        return intencao, None, False
+    return intencao, argumento, all(palavra in PALAVRAS_NEUTRAS for palavra in sobra)
+
+
+def montar_texto(bot_cfg, chave, **campos):
+    textos = {**TEXTOS_PADRAO, **(bot_cfg.get("textos_respostas_rapidas") or {})}
+    texto = textos.get(chave) or TEXTOS_PADRAO[chave]
+    for nome, valor in campos.items():
+        texto = texto.replace("{" + nome + "}", str(valor))
+    return texto
@@ -0,0 +1,218 @@
+"""Escolha do modelo da OpenAI por chamada, com SLO de latência, disjuntor
+e modelo reserva.
+
+Antes o 'modelo' da config (gpt-4o) atendia todas as chamadas do turno, e
+com a OpenAI lenta ou com erro cada cliente esperava o timeout inteiro
+(com as retentativas da biblioteca) pra no fim receber a mensagem_erro.
+
+Política (RoteadorModelos.escolher):
+- 1ª chamada do turno: modelo forte ('modelo') se a conversa tem carrinho
+  (ultimo_calculo gravado pelo calcular_pedido), se a mensagem fala de
+  pedido/pagamento/endereço ou se é longa; senão o rápido ('modelo_rapido').
+- 2ª chamada (depois das ferramentas): rápida — só reescreve o resultado
+  da ferramenta —, a não ser que a ferramenta tenha sido de fechamento
+  (calcular_pedido/registrar_pedido): aí o forte, que erra menos o resumo.
+- Ciente da latência: se a média recente (EWMA) do modelo escolhido está
+  acima do SLO dele e a do outro não, turno sem carrinho vai pro outro.
+
+Cada modelo tem um SLO em segundos (slo_modelos na config, SLO_PADRAO
+aqui); o timeout da chamada é FATOR_TIMEOUT x SLO, sem retentativa da
+biblioteca. Deu timeout ou erro de servidor/conexão LIMITE_FALHAS vezes
+seguidas, o disjuntor do modelo abre por TEMPO_ABERTO segundos e as
+chamadas vão direto pro outro modelo; passado esse tempo, a próxima
+chamada testa o modelo de novo (uma falha reabre na hora). Qualquer falha
+numa chamada tenta o outro modelo antes de desistir.
+
+O estado (médias e disjuntores) é por processo. Cada decisão e resultado
+vai pras métricas (bot_roteamento_modelo_total, bot_openai_segundos,
+bot_disjuntor_aberturas_total) e pro log, e o custo por modelo segue pro
+uso_ia.py — é com isso que a política é ajustada.
+
+Desligar ('roteamento_modelos: false' em configuracoes/bot) volta a usar
+só o 'modelo' — o reserva e o disjuntor continuam valendo.
+
+Dentro do prazo do turno (prazo.py): o timeout nunca passa do que resta,
+timeout cortado pelo prazo não conta pro disjuntor (o modelo não teve a
+chance inteira) e, com o prazo esgotado, o reserva nem é tentado — levanta
+PrazoEsgotado.
+"""
+import logging
+import re
+import threading
+import time
+
+import logs
+import metricas
+import prazo
+from partida import importar_quando_usar
+
+openai = importar_quando_usar("openai")
+
+log = logs.obter("roteador")
+
+MODELO_RAPIDO_PADRAO = "gpt-4o-mini"
+SLO_PADRAO = {"gpt-4o": 8.0, "gpt-4o-mini": 4.0}
+SLO_DESCONHECIDO = 8.0
+FATOR_TIMEOUT = 2.5
+LIMITE_FALHAS = 3
+TEMPO_ABERTO = 30
+PESO_EWMA = 0.2
+TEXTO_LONGO = 160
+
+FERRAMENTAS_FECHAMENTO = {"calcular_pedido", "registrar_pedido"}
+
+_CARRINHO = re.compile(
+    r"\b(quero|queria|vou querer|pedido|pedir|fechar|finalizar|confirm\w*|carrinho|total|endere[cç]o|"
+    r"entrega|retirada|retirar|pagamento|pagar|pix|cart[aã]o|dinheiro|troco)\b",
+    re.IGNORECASE,
+)
+
+
+def _falha_de_disponibilidade(erro):
+    """Timeout, conexão, 5xx e 429 contam pro disjuntor; erro de requisição
+    (400, 401...) não é culpa do modelo estar fora."""
+    return isinstance(erro, (openai.APIConnectionError, openai.InternalServerError, openai.RateLimitError))
+
+
+class _EstadoModelo:
+    def __init__(self):
+        self.falhas_seguidas = 0
+        self.aberto_ate = 0.0
+        self.ewma = None
+
+
+class RoteadorModelos:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._estados = {}
+
+    def _estado(self, modelo):
+        with self._lock:
+            return self._estados.setdefault(modelo, _EstadoModelo())
+
+    @staticmethod
+    def modelos(bot_cfg):
+        forte = bot_cfg.get("modelo") or "gpt-4o"
+        rapido = bot_cfg.get("modelo_rapido") or MODELO_RAPIDO_PADRAO
+        return forte, rapido
+
+    @staticmethod
+    def slo(bot_cfg, modelo):
+        tabela = {**SLO_PADRAO, **(bot_cfg.get("slo_modelos") or {})}
+        try:
+            return float(tabela.get(modelo) or SLO_DESCONHECIDO)
+        except (TypeError, ValueError):
+            return SLO_DESCONHECIDO
+
+    def aberto(self, modelo):
+        return time.monotonic() < self._estado(modelo).aberto_ate
+
+    def escolher(self, bot_cfg, etapa, texto="", tem_carrinho=False, ferramentas=()):
+        """(modelo, motivo) pra uma chamada. etapa: completion_1 ou completion_2."""
+        forte, rapido = self.modelos(bot_cfg)
+        if bot_cfg.get("roteamento_modelos") is False:
+            return forte, "fixo"
+        if etapa == "completion_2":
+            if FERRAMENTAS_FECHAMENTO.intersection(ferramentas):
+                return forte, "fechamento"
+            modelo, motivo = rapido, "pos_ferramenta"
+        elif tem_carrinho or _CARRINHO.search(texto or ""):
+            return forte, "carrinho"
+        elif len(texto or "") > TEXTO_LONGO:
+            return forte, "longa"
+        else:
+            modelo, motivo = rapido, "curta"
+
+        outro = forte if modelo == rapido else rapido
+        if self._acima_do_slo(bot_cfg, modelo) and not self._acima_do_slo(bot_cfg, outro):
+            return outro, "lento:" + modelo
+        return modelo, motivo
+
+    def _acima_do_slo(self, bot_cfg, modelo):
+        ewma = self._estado(modelo).ewma
+        return ewma is not None and ewma > self.slo(bot_cfg, modelo)
+
+    def plano(self, bot_cfg, modelo):
+        """Ordem de tentativa: o escolhido e o reserva, sem os de disjuntor
+        aberto (se os dois estiverem abertos, tenta o escolhido assim mesmo)."""
+        forte, rapido = self.modelos(bot_cfg)
+        reserva = rapido if modelo == forte else forte
+        candidatos = [m for m in dict.fromkeys([modelo, reserva]) if not self.aberto(m)]
+        return candidatos or [modelo]
+
+    def _registrar(self, bot_cfg, etapa, modelo, motivo, resultado, segundos, erro=None):
+        estado = self._estado(modelo)
+        with self._lock:
+            if resultado == "ok":
+                estado.falhas_seguidas = 0
+                estado.ewma = segundos if estado.ewma is None else (1 - PESO_EWMA) * estado.ewma + PESO_EWMA * segundos
+            elif resultado != "prazo" and _falha_de_disponibilidade(erro):
+                estado.falhas_seguidas += 1
+                if resultado == "timeout":
+                    # Timeout também entra na média: é o sinal mais claro de lentidão.
+                    estado.ewma = segundos if estado.ewma is None else (1 - PESO_EWMA) * estado.ewma + PESO_EWMA * segundos
+                if estado.falhas_seguidas >= LIMITE_FALHAS:
+                    estado.aberto_ate = time.monotonic() + TEMPO_ABERTO
+                    metricas.DISJUNTOR_ABERTURAS.labels(modelo=modelo).inc()
+                    log.warning("disjuntor aberto", extra={"modelo": modelo, "segundos": TEMPO_ABERTO,
+                                                           "falhas_seguidas": estado.falhas_seguidas})
+        metricas.ROTEAMENTO_MODELO.labels(etapa=etapa, modelo=modelo, motivo=motivo.split(":")[0], resultado=resultado).inc()
+        metricas.OPENAI_SEGUNDOS.labels(modelo=modelo).observe(segundos)
+        if resultado == "ok" and segundos > self.slo(bot_cfg, modelo):
+            metricas.ROTEAMENTO_MODELO.labels(etapa=etapa, modelo=modelo, motivo=motivo.split(":")[0], resultado="acima_slo").inc()
+        # Uma linha por chamada à OpenAI: DEBUG (amostrado) quando deu certo.
+        log.log(logging.DEBUG if resultado == "ok" else logging.WARNING, "chamada à OpenAI", extra={
+            "etapa": etapa, "modelo": modelo, "motivo": motivo, "resultado": resultado, "segundos": round(segundos, 2),
+            "erro": type(erro).__name__ if erro is not None else None})
+
+    def _timeout(self, bot_cfg, modelo):
+        """(timeout da chamada, se foi cortado pelo prazo do turno)."""
+        do_modelo = FATOR_TIMEOUT * self.slo(bot_cfg, modelo)
+        timeout = prazo.timeout(do_modelo)
+        return timeout, timeout < do_modelo
+
+    @staticmethod
+    def _resultado_do_erro(erro, cortado_pelo_prazo):
+        if isinstance(erro, openai.APITimeoutError):
+            return "prazo" if cortado_pelo_prazo else "timeout"
+        return "erro"
+
+    def executar(self, bot_cfg, etapa, modelo, motivo, chamar):
+        """chamar(modelo, timeout) faz a chamada. Devolve (modelo usado,
+        resposta); se todos os modelos do plano falharem, levanta o último
+        erro."""
+        ultimo_erro = None
+        for candidato in self.plano(bot_cfg, modelo):
+            motivo_tentativa = motivo if candidato == modelo else f"reserva:{modelo}"
+            timeout, cortado = self._timeout(bot_cfg, candidato)
+            inicio = time.perf_counter()
+            try:
+                resposta = chamar(candidato, timeout)
+            except Exception as e:
+                self._registrar(bot_cfg, etapa, candidato, motivo_tentativa, self._resultado_do_erro(e, cortado),
+                                time.perf_counter() - inicio, e)
+                ultimo_erro = e
+                continue
+            self._registrar(bot_cfg, etapa, candidato, motivo_tentativa, "ok", time.perf_counter() - inicio)
+            return candidato, resposta
+        prazo.verificar()
+        raise ultimo_erro
+
+    async def executar_async(self, bot_cfg, etapa, modelo, motivo, chamar):
+        """Mesmo que executar(), com chamar(modelo, timeout) assíncrono."""
+        ultimo_erro = None
+        for candidato in self.plano(bot_cfg, modelo):
+            motivo_tentativa = motivo if candidato == modelo else f"reserva:{modelo}"
+            timeout, cortado = self._timeout(bot_cfg, candidato)
+            inicio = time.perf_counter()
+            try:
+                resposta = await chamar(candidato, timeout)
+            except Exception as e:
+                self._registrar(bot_cfg, etapa, candidato, motivo_tentativa, self._resultado_do_erro(e, cortado),
+                                time.perf_counter() - inicio, e)
+                ultimo_erro = e
+                continue
+            self._registrar(bot_cfg, etapa, candidato, motivo_tentativa, "ok", time.perf_counter() - inicio)
+            return candidato, resposta
+        prazo.verificar()
+        raise ultimo_erro
@@ -0,0 +1,255 @@
+"""Registro de consumo da OpenAI (tokens e custo estimado) por conversa e
+por dia.
+
+O 'response.usage' das duas chamadas de cada turno era jogado fora — com
+gpt-4o e um prompt de sistema enorme não dava pra saber quais conversas ou
+quais mudanças de prompt/modelo estavam puxando o gasto. Cada turno agora
+soma aqui: tokens de prompt (e quantos vieram do cache da OpenAI), de
+resposta, total, número de rodadas (1 sem ferramenta, 2 com) e o tempo
+gasto esperando a OpenAI.
+
+Nada é gravado por turno: os números se acumulam em memória e um thread
+de fundo grava tudo a cada INTERVALO_GRAVACAO segundos (ou antes, acordado
+pelo turno que juntar MAX_PENDENTES conversas), em batches de até
+LOTE_MAX documentos e sempre com firestore.Increment — vários workers
+somando no mesmo documento não se atropelam. Se o worker
+morrer, perde-se no máximo esse intervalo de números (é relatório, não
+cobrança).
+
+Documentos (lidos pelo painel em Configurações do Bot):
+- uso_ia_diario/{AAAA-MM-DD}: totais do dia + 'por_variante', um mapa por
+  "modelo|versão do prompt" — é o que permite comparar prompt/modelo novo
+  contra o anterior no tráfego real.
+- uso_ia_conversas/{id_usuario}: totais acumulados da conversa.
+"""
+import atexit
+import hashlib
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import logs
+import lojas
+import metricas
+from partida import importar_quando_usar
+
+firestore = importar_quando_usar("firebase_admin.firestore")
+
+log = logs.obter("uso_ia")
+
+INTERVALO_GRAVACAO = 30
+MAX_PENDENTES = 50
+# Limite de escritas de um batch do Firestore.
+LOTE_MAX = 500
+
+# Preço em US$ por 1 milhão de tokens (entrada, entrada em cache, saída) —
+# tabela pública da OpenAI. Pode ser sobrescrita por loja em
+# configuracoes/bot -> precos_modelos, no mesmo formato.
+PRECOS_MODELOS = {
+    "gpt-4o": {"entrada": 2.50, "cache": 1.25, "saida": 10.00},
+    "gpt-4o-mini": {"entrada": 0.15, "cache": 0.075, "saida": 0.60},
+}
+
+CAMPOS_SOMADOS = ("turnos", "rodadas", "prompt_tokens", "cached_tokens", "completion_tokens",
+                  "total_tokens", "custo_usd", "segundos_openai")
+
+
+def versao_prompt(base, instrucoes_extras):
+    """Identifica a variante do prompt de sistema: 'base' é a versão do
+    texto fixo (PROMPT_VERSAO no app.py, trocada à mão quando as regras
+    mudam) e o hash curto das instruções extras cobre o que a loja muda
+    pelo painel."""
+    extras = hashlib.sha1((instrucoes_extras or "").encode("utf-8")).hexdigest()[:6]
+    return f"{base}-{extras}"
+
+
+def _chave_campo(texto):
+    # Nome de campo do Firestore não pode ter ponto ("gpt-4.1") nem barra.
+    return str(texto).replace(".", "_").replace("/", "_")
+
+
+def custo_estimado(modelo, prompt_tokens, cached_tokens, completion_tokens, precos=None):
+    tabela = {**PRECOS_MODELOS, **(precos or {})}
+    preco = tabela.get(modelo)
+    if not preco:
+        return 0.0
+    nao_cacheados = max(0, prompt_tokens - cached_tokens)
+    return (nao_cacheados * float(preco.get("entrada", 0))
+            + cached_tokens * float(preco.get("cache", preco.get("entrada", 0)))
+            + completion_tokens * float(preco.get("saida", 0))) / 1_000_000
+
+
+def resumir_usos(respostas):
+    """Soma o 'usage' de todas as respostas do turno (objetos devolvidos por
+    chat.completions.create). Resposta sem 'usage' conta como zero."""
+    total = {"prompt_tokens": 0, "cached_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+    for resposta in respostas:
+        uso = getattr(resposta, "usage", None)
+        if uso is None:
+            continue
+        total["prompt_tokens"] += getattr(uso, "prompt_tokens", 0) or 0
+        total["completion_tokens"] += getattr(uso, "completion_tokens", 0) or 0
+        total["total_tokens"] += getattr(uso, "total_tokens", 0) or 0
+        detalhes = getattr(uso, "prompt_tokens_details", None)
+        total["cached_tokens"] += (getattr(detalhes, "cached_tokens", 0) or 0) if detalhes else 0
+    return total
+
+
+class RegistroUsoIA:
+    def __init__(self, db):
+        self._db = db
+        self._lock = threading.Lock()
+        self._por_conversa = {}
+        self._por_dia = {}
+        self._thread = None
+        self._acordar = None
+        self._saida_pid = None
+        self._falhou_em = None
+
+    def registrar_turno(self, id_conversa, modelo, respostas, versao, segundos_openai=0.0, precos=None,
+                        chamadas=None):
+        """Acumula o consumo de um turno. Não grava nada na hora.
+
+        'chamadas' é o (modelo, segundos) de cada resposta, na mesma ordem —
+        com o roteador (roteador_modelos.py) as chamadas de um turno podem
+        ser de modelos diferentes, e cada uma entra no preço e na variante
+        do próprio modelo. Sem ele, todas contam como 'modelo'."""
+        if not respostas:
+            return
+        if not chamadas:
+            chamadas = [(modelo, 0.0)] * len(respostas)
+            chamadas[0] = (modelo, segundos_openai)
+        por_modelo = {}
+        for (modelo_chamada, segundos), resposta in zip(chamadas, respostas):
+            por_modelo.setdefault(modelo_chamada, ([], []))
+            por_modelo[modelo_chamada][0].append(resposta)
+            por_modelo[modelo_chamada][1].append(segundos)
+
+        total = {"turnos": 1}
+        por_variante = {}
+        for modelo_chamada, (respostas_modelo, segundos) in por_modelo.items():
+            uso = resumir_usos(respostas_modelo)
+            valores = {
+                "turnos": 1,
+                "rodadas": len(respostas_modelo),
+                **uso,
+                "custo_usd": custo_estimado(modelo_chamada, uso["prompt_tokens"], uso["cached_tokens"],
+                                            uso["completion_tokens"], precos),
+                "segundos_openai": round(sum(segundos), 3),
+            }
+            for tipo in ("prompt_tokens", "cached_tokens", "completion_tokens"):
+                metricas.OPENAI_TOKENS.labels(modelo=modelo_chamada, tipo=tipo).inc(uso[tipo])
+            por_variante[_chave_campo(f"{modelo_chamada}|{versao}")] = valores
+            _somar_em(total, {campo: v for campo, v in valores.items() if campo != "turnos"})
+        ultimo_modelo = chamadas[-1][0]
+
+        fuso_br = timezone(timedelta(hours=-3))
+        dia = datetime.now(fuso_br).strftime("%Y-%m-%d")
+        with self._lock:
+            conversa = self._por_conversa.setdefault(id_conversa, {})
+            _somar_em(conversa, total)
+            conversa["_modelo"] = ultimo_modelo
+            diario = self._por_dia.setdefault(dia, {"": {}})
+            _somar_em(diario[""], total)
+            for variante, valores in por_variante.items():
+                _somar_em(diario.setdefault(variante, {}), valores)
+            pendentes = len(self._por_conversa)
+        self._garantir_thread()
+        # Quem grava é sempre o thread: o turno só acorda, não espera o
+        # commit. Depois de uma falha nem acorda — o thread tenta de novo
+        # no próprio intervalo.
+        falhou_em = self._falhou_em
+        if pendentes >= MAX_PENDENTES and (falhou_em is None or time.monotonic() - falhou_em >= INTERVALO_GRAVACAO):
+            self._acordar.set()
+
+    def gravar(self):
+        """Grava tudo o que está acumulado (Increment), em batches de até
+        LOTE_MAX documentos."""
+        with self._lock:
+            por_conversa, self._por_conversa = self._por_conversa, {}
+            por_dia, self._por_dia = self._por_dia, {}
+        if not por_conversa and not por_dia:
+            return
+        agora = datetime.now(timezone.utc)
+        escritas = [("conversa", chave, valores) for chave, valores in por_conversa.items()]
+        escritas += [("dia", chave, valores) for chave, valores in por_dia.items()]
+        for inicio in range(0, len(escritas), LOTE_MAX):
+            try:
+                batch = self._db.batch()
+                for tipo, chave, valores in escritas[inicio:inicio + LOTE_MAX]:
+                    if tipo == "conversa":
+                        batch.set(self._db.collection("uso_ia_conversas").document(chave),
+                                  _dados_conversa(valores, agora), merge=True)
+                    else:
+                        batch.set(self._db.collection("uso_ia_diario").document(chave),
+                                  _dados_dia(valores, agora), merge=True)
+                batch.commit()
+            except Exception:
+                log.error("erro ao gravar o uso da IA", exc_info=True)
+                # Os batches anteriores já foram; volta só deste em diante.
+                restantes = escritas[inicio:]
+                self._devolver({chave: v for tipo, chave, v in restantes if tipo == "conversa"},
+                               {chave: v for tipo, chave, v in restantes if tipo == "dia"})
+                return
+        self._falhou_em = None
+
+    def _devolver(self, por_conversa, por_dia):
+        """Commit falhou: nada desse batch foi gravado (é atômico). Soma de
+        volta no que acumulou enquanto isso, pra próxima gravação levar junto."""
+        with self._lock:
+            self._falhou_em = time.monotonic()
+            for id_conversa, valores in por_conversa.items():
+                conversa = self._por_conversa.setdefault(id_conversa, {})
+                _somar_em(conversa, valores)
+                # O modelo de um turno mais novo, se houver, fica.
+                conversa.setdefault("_modelo", valores.get("_modelo"))
+            for dia, variantes in por_dia.items():
+                diario = self._por_dia.setdefault(dia, {"": {}})
+                for variante, valores in variantes.items():
+                    _somar_em(diario.setdefault(variante, {}), valores)
+
+    def _garantir_thread(self):
+        # Criado no primeiro turno (e não no import) pra nascer DENTRO do
+        # worker do gunicorn — thread criado antes do fork não sobrevive nele.
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._acordar = threading.Event()
+            # Um registro por loja (lojas.py): grava no db da loja.
+            self._thread = threading.Thread(target=lojas.fixar(self._laco), name="uso-ia", daemon=True)
+            self._thread.start()
+            # O thread pode ser recriado; o gravar da saída é um por processo.
+            if self._saida_pid != os.getpid():
+                self._saida_pid = os.getpid()
+                atexit.register(lojas.fixar(self.gravar))
+
+    def _laco(self):
+        while True:
+            self._acordar.wait(INTERVALO_GRAVACAO)
+            self._acordar.clear()
+            self.gravar()
+
+
+def _dados_conversa(valores, agora):
+    dados = {campo: firestore.Increment(v) for campo, v in valores.items() if not campo.startswith("_")}
+    dados["ultimo_modelo"] = valores.get("_modelo")
+    dados["atualizado_em"] = agora
+    return dados
+
+
+def _dados_dia(variantes, agora):
+    dados = {campo: firestore.Increment(v) for campo, v in variantes.get("", {}).items()}
+    dados["por_variante"] = {
+        variante: {campo: firestore.Increment(v) for campo, v in valores.items()}
+        for variante, valores in variantes.items() if variante
+    }
+    dados["atualizado_em"] = agora
+    return dados
+
+
+def _somar_em(destino, valores):
+    for campo in CAMPOS_SOMADOS:
+        destino[campo] = destino.get(campo, 0) + valores.get(campo, 0)
@@ -0,0 +1,308 @@
+"""Varredura de fundo: atenção esquecida e conversas paradas.
+
+Duas coisas só aconteciam se o cliente mandasse outra mensagem, ou nunca:
+
+- Atenção: texto_atencao_pendente_antiga lia o documento da conversa a
+  cada turno pra descobrir se havia uma dúvida marcada pra equipe havia
+  mais de 10 minutos — e a equipe nunca era lembrada de nada, a não ser
+  que abrisse o painel.
+- Retenção: historico_conversas crescia pra sempre; 'ultima_interacao'
+  era gravado "pra limpeza automática", mas ninguém limpava.
+
+Cada worker roda um thread (Varredor.iniciar, chamado no post_fork do
+gunicorn ou no primeiro uso) que a cada INTERVALO_ATENCAO segundos relê
+as conversas com precisa_atencao na caixa_entrada (resumos pequenos, só
+as marcadas) e guarda em memória. O turno consulta esse índice
+(atencao_pendente) em vez de ler o documento. O índice pode estar até um
+intervalo atrás do Firestore — não importa pro aviso, que só vale depois
+de 'atencao_escalar_min' minutos —, e o que este worker marca entra na
+hora (registrar_atencao).
+
+Um único processo entre todas as máquinas — o que segura o mandato em
+tarefas_bot/varredor, renovado a cada volta e tomado de quem passou de
+MANDATO_S sem renovar — também:
+
+- escala as marcações mais velhas que 'atencao_escalar_min' (padrão 10):
+  grava atencao_escalada_em na conversa e no resumo (o painel destaca) e,
+  com 'telefone_alerta_equipe' na config, manda um WhatsApp pra equipe
+  com a lista;
+- limpa as mais velhas que 'atencao_expirar_h' horas (padrão 12):
+  precisa_atencao vira false e fica atencao_expirada_em — o cliente já
+  foi embora, a marcação só atrapalha a lista;
+- uma vez por INTERVALO_RETENCAO, arquiva as conversas sem interação há
+  mais de 'retencao_conversas_dias' dias (padrão 180; 0 desliga):
+  documento da conversa e todas as mensagens da subcoleção viram uma
+  linha de JSONL comprimido (gzip) em
+  arquivo_conversas/AAAA/MM/DD/<hora>-<n>.jsonl.gz no Storage, e só
+  depois do upload os documentos são apagados — a conversa (com
+  precondição: se o cliente voltou no meio, fica) e o resumo num batch, as
+  mensagens com o BulkWriter.
+- junto com o arquivamento, e só depois das 4h (HORA_REPROCESSAR), refaz
+  os totais de vendas dos dias que terminaram (vendas_agregadas.py);
+- a cada volta, retoma os disparos de promoção pendentes ou sem dono
+  (disparos.py, via retomar_disparos).
+
+Tudo em lotes: as alterações de atenção vão num BulkWriter só por volta, e
+cada arquivo junta até LOTE_ARQUIVO conversas. Métricas:
+bot_varredor_atencao_total{acao}, bot_varredor_arquivadas_total e
+bot_varredor_segundos{tarefa}.
+"""
+import gzip
+import json
+import os
+import socket
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import caixa_entrada
+import logs
+import lojas
+import metricas
+import paginas_historico
+import vendas_agregadas
+from partida import importar_quando_usar
+
+google_exceptions = importar_quando_usar("google.api_core.exceptions")
+
+log = logs.obter("varredor")
+
+INTERVALO_ATENCAO = 60
+INTERVALO_RETENCAO = 3600
+MANDATO_S = 3 * INTERVALO_ATENCAO
+LOTE_ARQUIVO = 200
+MAX_LOTES_POR_VOLTA = 5
+MAX_LISTA_ALERTA = 5
+COLECAO_TAREFAS = "tarefas_bot"
+PASTA_ARQUIVO = "arquivo_conversas"
+
+ESCALAR_MIN_PADRAO = 10
+EXPIRAR_H_PADRAO = 12
+RETENCAO_DIAS_PADRAO = 180
+
+
+def _numero(valor, padrao):
+    try:
+        return float(valor) if valor is not None else padrao
+    except (TypeError, ValueError):
+        return padrao
+
+
+def _para_json(valor):
+    if isinstance(valor, datetime):
+        return valor.isoformat()
+    return str(valor)
+
+
+class Varredor:
+    def __init__(self, db, obter_config, obter_bucket, enviar_alerta, pasta_arquivo=PASTA_ARQUIVO,
+                 retomar_disparos=None):
+        self._db = db
+        self._retomar_disparos = retomar_disparos
+        self._pasta_arquivo = pasta_arquivo
+        self._obter_config = obter_config
+        self._obter_bucket = obter_bucket
+        self._enviar_alerta = enviar_alerta
+        self._pid = None
+        self._lock = threading.Lock()
+        # wa_id -> (atencao_marcada_em, motivo_atencao)
+        self._atencao = {}
+        self._ultima_retencao = None
+        os.register_at_fork(after_in_child=self._depois_do_fork)
+
+    def _depois_do_fork(self):
+        self._lock = threading.Lock()
+        self._pid = None
+        self._ultima_retencao = None
+
+    def iniciar(self):
+        """Sobe o thread deste processo (uma vez por pid)."""
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._lock:
+            if self._pid == pid:
+                return
+            self._pid = pid
+            self._dono = f"{socket.gethostname()}:{pid}"
+            # Um varredor por loja (lojas.py): o thread varre o db da loja.
+            threading.Thread(target=lojas.fixar(self._laco), name="varredor", daemon=True).start()
+
+    # --- índice de atenção (todos os workers) ---
+
+    def atencao_pendente(self, wa_id):
+        """(marcada_em, motivo) da dúvida pra equipe ainda aberta, ou None."""
+        self.iniciar()
+        return self._atencao.get(wa_id)
+
+    def registrar_atencao(self, wa_id, motivo, marcada_em):
+        with self._lock:
+            self._atencao[wa_id] = (marcada_em, motivo)
+
+    def _marcadas(self):
+        consulta = self._db.collection(caixa_entrada.COLECAO).where("precisa_atencao", "==", True)
+        return [(doc.id, doc.to_dict() or {}) for doc in consulta.stream()]
+
+    def _atualizar_indice(self, marcadas):
+        indice = {wa_id: (d["atencao_marcada_em"], d.get("motivo_atencao", ""))
+                  for wa_id, d in marcadas if d.get("atencao_marcada_em")}
+        with self._lock:
+            self._atencao = indice
+
+    # --- laço ---
+
+    def _laco(self):
+        while True:
+            try:
+                self.varrer()
+            except Exception:
+                metricas.ERROS.labels(tipo="varredor").inc()
+                log.error("erro na varredura", exc_info=True)
+            time.sleep(INTERVALO_ATENCAO)
+
+    def varrer(self):
+        """Uma volta: índice sempre; escalar/limpar e arquivar só no líder."""
+        with metricas.VARREDOR_SEGUNDOS.labels(tarefa="atencao").time():
+            marcadas = self._marcadas()
+        self._atualizar_indice(marcadas)
+        if not self._ser_lider():
+            return
+        bot_cfg = self._obter_config()
+        with metricas.VARREDOR_SEGUNDOS.labels(tarefa="escalar").time():
+            self.varrer_atencao(bot_cfg, marcadas)
+        if self._retomar_disparos is not None:
+            with metricas.VARREDOR_SEGUNDOS.labels(tarefa="disparos").time():
+                self._retomar_disparos()
+        if self._ultima_retencao is None or time.monotonic() - self._ultima_retencao >= INTERVALO_RETENCAO:
+            self._ultima_retencao = time.monotonic()
+            with metricas.VARREDOR_SEGUNDOS.labels(tarefa="arquivar").time():
+                self.arquivar_inativas(bot_cfg)
+            with metricas.VARREDOR_SEGUNDOS.labels(tarefa="vendas").time():
+                vendas_agregadas.reprocessar_dias_passados(self._db)
+
+    def _ser_lider(self):
+        """Pega ou renova o mandato em tarefas_bot/varredor (otimista, como a
+        fila do histórico)."""
+        ref = self._db.collection(COLECAO_TAREFAS).document("varredor")
+        agora = datetime.now(timezone.utc)
+        mandato = {"dono": self._dono, "expira_em": agora + timedelta(seconds=MANDATO_S)}
+        doc = ref.get()
+        try:
+            if not doc.exists:
+                ref.create(mandato)
+                return True
+            atual = doc.to_dict() or {}
+            expira_em = atual.get("expira_em")
+            if atual.get("dono") != self._dono and expira_em is not None and expira_em > agora:
+                return False
+            ref.update(mandato, option=self._db.write_option(last_update_time=doc.update_time))
+            return True
+        except (google_exceptions.AlreadyExists, google_exceptions.FailedPrecondition, google_exceptions.NotFound):
+            return False
+
+    # --- atenção (líder) ---
+
+    def varrer_atencao(self, bot_cfg, marcadas):
+        agora = datetime.now(timezone.utc)
+        escalar_min = _numero(bot_cfg.get("atencao_escalar_min"), ESCALAR_MIN_PADRAO)
+        expirar_h = _numero(bot_cfg.get("atencao_expirar_h"), EXPIRAR_H_PADRAO)
+        escalar, expirar = [], []
+        for wa_id, dados in marcadas:
+            marcada_em = dados.get("atencao_marcada_em")
+            if not marcada_em:
+                continue
+            if expirar_h and agora - marcada_em > timedelta(hours=expirar_h):
+                expirar.append(wa_id)
+            elif agora - marcada_em > timedelta(minutes=escalar_min) and not dados.get("atencao_escalada_em"):
+                escalar.append((wa_id, dados))
+        if not escalar and not expirar:
+            return
+
+        lote = self._db.bulk_writer()
+        for wa_id in expirar:
+            campos = {"precisa_atencao": False, "atencao_expirada_em": agora}
+            lote.set(self._db.collection("historico_conversas").document(wa_id), campos, merge=True)
+            lote.set(caixa_entrada.referencia(self._db, wa_id), campos, merge=True)
+        for wa_id, _dados in escalar:
+            campos = {"atencao_escalada_em": agora}
+            lote.set(self._db.collection("historico_conversas").document(wa_id), campos, merge=True)
+            lote.set(caixa_entrada.referencia(self._db, wa_id), campos, merge=True)
+        lote.close()
+
+        with self._lock:
+            for wa_id in expirar:
+                self._atencao.pop(wa_id, None)
+        metricas.VARREDOR_ATENCAO.labels(acao="expirada").inc(len(expirar))
+        metricas.VARREDOR_ATENCAO.labels(acao="escalada").inc(len(escalar))
+        log.info("atenção varrida", extra={"escaladas": len(escalar), "expiradas": len(expirar)})
+
+        telefone = str(bot_cfg.get("telefone_alerta_equipe") or "").strip()
+        if escalar and telefone:
+            linhas = [f"- {wa_id}: {dados.get('motivo_atencao') or 'sem motivo'}"
+                      for wa_id, dados in escalar[:MAX_LISTA_ALERTA]]
+            if len(escalar) > MAX_LISTA_ALERTA:
+                linhas.append(f"- e mais {len(escalar) - MAX_LISTA_ALERTA}")
+            self._enviar_alerta(telefone, (
+                f"⚠️ {len(escalar)} conversa(s) esperando a equipe há mais de {int(escalar_min)} min "
+                f"no painel de Atendimento:\n" + "\n".join(linhas)
+            ))
+
+    # --- retenção (líder) ---
+
+    def arquivar_inativas(self, bot_cfg):
+        dias = _numero(bot_cfg.get("retencao_conversas_dias"), RETENCAO_DIAS_PADRAO)
+        if not dias or dias <= 0:
+            return 0
+        corte = datetime.now(timezone.utc) - timedelta(days=dias)
+        total = 0
+        for n in range(MAX_LOTES_POR_VOLTA):
+            consulta = (self._db.collection("historico_conversas")
+                        .where("ultima_interacao", "<", corte).limit(LOTE_ARQUIVO))
+            docs = list(consulta.stream())
+            if not docs:
+                break
+            total += self._arquivar_lote(docs, n)
+            if len(docs) < LOTE_ARQUIVO:
+                break
+        return total
+
+    def _arquivar_lote(self, docs, n):
+        linhas, mensagens_por_conversa = [], {}
+        for doc in docs:
+            conversa = doc.to_dict() or {}
+            legado = conversa.pop("mensagens", [])
+            refs = list(doc.reference.collection(paginas_historico.SUBCOLECAO).stream())
+            gravadas = {snap.id: snap.to_dict() or {} for snap in refs}
+            for mensagem in legado:
+                gravadas.setdefault(paginas_historico.chave(mensagem), paginas_historico.documento(mensagem))
+            mensagens_por_conversa[doc.id] = [snap.reference for snap in refs]
+            linhas.append(json.dumps({
+                "wa_id": doc.id,
+                "conversa": conversa,
+                "mensagens": [gravadas[c] for c in sorted(gravadas)],
+            }, ensure_ascii=False, default=_para_json))
+
+        agora = datetime.now(timezone.utc)
+        caminho = f"{self._pasta_arquivo}/{agora:%Y/%m/%d}/{agora:%H%M%S}-{n}.jsonl.gz"
+        dados = gzip.compress(("\n".join(linhas) + "\n").encode("utf-8"))
+        self._obter_bucket().blob(caminho).upload_from_string(dados, content_type="application/gzip", timeout=120)
+
+        # Só depois do arquivo salvo. A conversa sai com precondição: se o
+        # cliente mandou mensagem depois da leitura, ela fica (e volta a
+        # ser arquivada quando parar de novo — a linha do arquivo sobra).
+        arquivadas, mensagens = 0, self._db.bulk_writer()
+        for doc in docs:
+            lote = self._db.batch()
+            lote.delete(doc.reference, option=self._db.write_option(last_update_time=doc.update_time))
+            lote.delete(caixa_entrada.referencia(self._db, doc.id))
+            try:
+                lote.commit()
+            except (google_exceptions.FailedPrecondition, google_exceptions.NotFound):
+                continue
+            for ref in mensagens_por_conversa[doc.id]:
+                mensagens.delete(ref)
+            arquivadas += 1
+        mensagens.close()
+        metricas.VARREDOR_ARQUIVADAS.inc(arquivadas)
+        log.info("conversas arquivadas", extra={"arquivadas": arquivadas, "caminho": caminho})
+        return arquivadas
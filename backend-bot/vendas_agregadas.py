@@ -0,0 +1,273 @@
+"""Totais de vendas já somados, pro BI (dashboard/public/bi.js).
+
+O bi.js lia todos os pedidos do período (e do período anterior, pra
+comparar) e somava no navegador: um mês são milhares de leituras a cada
+vez que alguém abre a página, e cresce com a loja. Agora cada dia tem os
+totais prontos em vendas_agregadas/{AAAA-MM-DD}_{n}:
+
+- pedidos, receita, itens e cancelados do dia;
+- por_hora (00–23), por_canal (BALCAO, MESA, WHATSAPP, APP, APP_BOT),
+  por_pagamento, por_item e por_cliente — pedidos/receita (qtd/receita
+  nos itens), só dos pedidos não cancelados, como o BI sempre contou.
+
+Dia e hora no horário de Brasília. Os números são só somas: o dia é a
+soma de todos os documentos dele, e cada pedido soma num fragmento
+(n de 0 a FRAGMENTOS-1) sorteado — num sábado à noite os pedidos não
+disputam o mesmo documento (o Firestore aguenta ~1 escrita/s em cada um).
+
+Quem soma:
+
+- registrar_pedido (app.py), no mesmo batch do pedido — o pedido e a
+  soma entram juntos ou nenhum entra; o pedido fica com agregado=true;
+- a Cloud Function agregarVendas (app-mobile/functions/index.js), pros
+  pedidos do app, do PDV e da mesa, e pra toda mudança que mexe na soma
+  (cancelamento, pedido apagado ou alterado) — inclusive nos do bot;
+- reprocessar(): recalcula dias inteiros a partir dos pedidos e deixa
+  cada um num documento só ({dia}_0, com reprocessado_em). O líder da
+  varredura (varredor.py) reprocessa os dias que passaram, uma vez por
+  dia depois de HORA_REPROCESSAR — corrige o que escapou (função fora do
+  ar, entrega dupla) e junta os fragmentos, então um mês no BI custa uns
+  30 documentos. POST /admin/vendas_agregadas faz o mesmo pra trás (o
+  histórico de antes disto existir).
+
+O BI só usa os totais de um dia depois que ele foi reprocessado ({dia}_0
+com reprocessado_em); nos outros (hoje, ontem antes da varredura, dias
+de antes disto existir) lê os pedidos direto. Num dia que nunca foi
+reprocessado os fragmentos são só diferenças — um pedido antigo
+cancelado deixa lá pedidos -1, cancelados +1 — e não o total do dia.
+"""
+import random
+import re
+from datetime import datetime, timedelta, timezone
+
+import logs
+from partida import importar_quando_usar
+
+firestore = importar_quando_usar("firebase_admin.firestore")
+
+log = logs.obter("vendas")
+
+COLECAO = "vendas_agregadas"
+COLECAO_PEDIDOS = "pedidos"
+FRAGMENTOS = 8
+FUSO_BR = timezone(timedelta(hours=-3))
+HORA_REPROCESSAR = 4
+MAX_DIAS_ATRASADOS = 7
+TAMANHO_CHAVE = 80
+LOTE_DIAS = 40
+
+_QUANTIDADE_NO_NOME = re.compile(r"^\d+x\s")
+
+
+def _chave(texto, padrao):
+    """Nome usado como chave de mapa: curto, sem vazio e sem __x__ (que o
+    Firestore reserva)."""
+    texto = str(texto or "").strip()[:TAMANHO_CHAVE]
+    if texto.startswith("__") and texto.endswith("__"):
+        texto = texto.strip("_")
+    return texto or padrao
+
+
+def _numero(valor):
+    try:
+        return float(valor or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def canal(pedido):
+    """Mesma regra do canalDe do bi.js, em código (o BI põe o rótulo)."""
+    origem = str(pedido.get("origem") or "").upper()
+    if origem in ("BALCAO", "MESA", "APP"):
+        return origem
+    if origem in ("BOT", "WHATSAPP"):
+        return "WHATSAPP"
+    # Pedidos antigos do app não tinham origem; o usuario_id é "cliente_...".
+    if str(pedido.get("usuario_id") or "").startswith("cliente_"):
+        return "APP"
+    return "APP_BOT"
+
+
+def _item(item):
+    """(nome, quantidade, valor) de um item do pedido — string solta nos
+    pedidos antigos, dict nos novos."""
+    if not isinstance(item, dict):
+        return _QUANTIDADE_NO_NOME.sub("", str(item)).strip(), 1, 0.0
+    nome = _QUANTIDADE_NO_NOME.sub("", str(item.get("nome_exibicao") or item.get("nome") or "")).strip()
+    quantidade = _numero(item.get("quantidade")) or 1
+    if quantidade.is_integer():
+        quantidade = int(quantidade)
+    return nome, quantidade, _numero(item.get("preco")) * quantidade
+
+
+def dia_e_hora(pedido):
+    hora = pedido.get("hora_pedido")
+    if not isinstance(hora, datetime):
+        return None, None
+    if hora.tzinfo is None:
+        hora = hora.replace(tzinfo=timezone.utc)
+    local = hora.astimezone(FUSO_BR)
+    return local.strftime("%Y-%m-%d"), local.hour
+
+
+def parcela(pedido):
+    """(dia, números que o pedido soma no dia), ou (None, None) sem
+    hora_pedido."""
+    dia, hora = dia_e_hora(pedido)
+    if dia is None:
+        return None, None
+    if pedido.get("status") == "CANCELADO":
+        return dia, {"cancelados": 1}
+    valor = _numero(pedido.get("valor_total"))
+    por_item, itens = {}, 0
+    for item in pedido.get("itens") or []:
+        nome, quantidade, valor_item = _item(item)
+        itens += quantidade
+        if nome:
+            soma = por_item.setdefault(_chave(nome, "Item"), {"qtd": 0, "receita": 0.0})
+            soma["qtd"] += quantidade
+            soma["receita"] += valor_item
+    venda = {"pedidos": 1, "receita": valor}
+    return dia, {
+        "pedidos": 1,
+        "receita": valor,
+        "itens": itens,
+        "por_hora": {f"{hora:02d}": dict(venda)},
+        "por_canal": {canal(pedido): dict(venda)},
+        "por_pagamento": {_chave(pedido.get("forma_pagamento"), "N/I"): dict(venda)},
+        "por_item": por_item,
+        "por_cliente": {_chave(pedido.get("nome_cliente"), "Cliente"): dict(venda)},
+    }
+
+
+def _somar(alvo, numeros):
+    for chave, valor in numeros.items():
+        if isinstance(valor, dict):
+            _somar(alvo.setdefault(chave, {}), valor)
+        else:
+            alvo[chave] = alvo.get(chave, 0) + valor
+    return alvo
+
+
+def _incrementos(numeros):
+    return {chave: _incrementos(valor) if isinstance(valor, dict) else firestore.Increment(valor)
+            for chave, valor in numeros.items()}
+
+
+def _arredondar(numeros):
+    return {chave: _arredondar(valor) if isinstance(valor, dict) else round(valor, 2)
+            for chave, valor in numeros.items()}
+
+
+def referencia(db, dia, fragmento):
+    return db.collection(COLECAO).document(f"{dia}_{fragmento}")
+
+
+def somar_no_lote(lote, db, pedido):
+    """Põe no lote (batch do pedido) a soma do pedido num fragmento
+    sorteado do dia dele. Devolve False se o pedido não tem hora_pedido."""
+    dia, numeros = parcela(pedido)
+    if dia is None:
+        return False
+    lote.set(referencia(db, dia, random.randrange(FRAGMENTOS)), {"dia": dia, **_incrementos(numeros)}, merge=True)
+    return True
+
+
+def _limites_do_dia(dia):
+    inicio = datetime.strptime(dia, "%Y-%m-%d").replace(tzinfo=FUSO_BR)
+    return inicio, inicio + timedelta(days=1)
+
+
+def dias_entre(de, ate):
+    atual = datetime.strptime(de, "%Y-%m-%d")
+    fim = datetime.strptime(ate, "%Y-%m-%d")
+    while atual <= fim:
+        yield atual.strftime("%Y-%m-%d")
+        atual += timedelta(days=1)
+
+
+def ontem():
+    return (datetime.now(FUSO_BR) - timedelta(days=1)).strftime("%Y-%m-%d")
+
+
+def reprocessar(db, de, ate, ao_terminar_dia=None):
+    """Recalcula os dias de 'de' a 'ate' (AAAA-MM-DD, inclusive) a partir
+    dos pedidos: cada dia vira um documento só ({dia}_0) e os outros
+    fragmentos são apagados. Dia sem pedido também ganha o documento
+    (zerado), pro BI saber que não precisa ler os pedidos. Pedido somado
+    entre a leitura e o commit do dia se perde até o próximo reprocessamento
+    — por isso o dia corrente não entra na varredura noturna.
+    ao_terminar_dia(dia) é chamada depois de cada lote gravado. Devolve
+    (dias, pedidos)."""
+    total_dias, total_pedidos = 0, 0
+    lote, pendentes = db.batch(), []
+    for dia in dias_entre(de, ate):
+        inicio, fim = _limites_do_dia(dia)
+        consulta = (db.collection(COLECAO_PEDIDOS)
+                    .where("hora_pedido", ">=", inicio).where("hora_pedido", "<", fim))
+        soma = {"pedidos": 0, "receita": 0.0, "itens": 0, "cancelados": 0}
+        for doc in consulta.stream():
+            _dia, numeros = parcela(doc.to_dict() or {})
+            if numeros:
+                _somar(soma, numeros)
+                total_pedidos += 1
+        lote.set(referencia(db, dia, 0), {"dia": dia, "reprocessado_em": datetime.now(timezone.utc),
+                                          **_arredondar(soma)})
+        for fragmento in range(1, FRAGMENTOS):
+            lote.delete(referencia(db, dia, fragmento))
+        pendentes.append(dia)
+        total_dias += 1
+        if len(pendentes) == LOTE_DIAS:
+            lote.commit()
+            if ao_terminar_dia:
+                ao_terminar_dia(pendentes[-1])
+            lote, pendentes = db.batch(), []
+    if pendentes:
+        lote.commit()
+        if ao_terminar_dia:
+            ao_terminar_dia(pendentes[-1])
+    return total_dias, total_pedidos
+
+
+def tarefa(db):
+    """Andamento em tarefas_bot/vendas_agregadas: reprocessado_ate (da
+    varredura noturna) e backfill (do POST /admin/vendas_agregadas)."""
+    return db.collection("tarefas_bot").document(COLECAO)
+
+
+def reprocessar_dias_passados(db, agora=None):
+    """Varredura noturna (líder do varredor.py): reprocessa os dias que
+    terminaram desde a última vez — no máximo MAX_DIAS_ATRASADOS, se o bot
+    ficou parado — depois de HORA_REPROCESSAR. Devolve quantos dias."""
+    agora = agora or datetime.now(FUSO_BR)
+    if agora.hour < HORA_REPROCESSAR:
+        return 0
+    ate = (agora - timedelta(days=1)).strftime("%Y-%m-%d")
+    ref = tarefa(db)
+    feito = (ref.get().to_dict() or {}).get("reprocessado_ate")
+    if feito and feito >= ate:
+        return 0
+    mais_antigo = (agora - timedelta(days=MAX_DIAS_ATRASADOS)).strftime("%Y-%m-%d")
+    de = ate if not feito else max(mais_antigo, (datetime.strptime(feito, "%Y-%m-%d") + timedelta(days=1)).strftime("%Y-%m-%d"))
+    dias, pedidos = reprocessar(db, de, ate)
+    ref.set({"reprocessado_ate": ate}, merge=True)
+    log.info("dias reprocessados", extra={"dias": dias, "de": de, "ate": ate, "pedidos": pedidos})
+    return dias
+
+
+def reprocessar_periodo(db, de, ate):
+    """Backfill em segundo plano (POST /admin/vendas_agregadas), com o
+    andamento em tarefas_bot/vendas_agregadas.backfill — se o worker for
+    reciclado no meio, feito_ate diz de onde recomeçar."""
+    ref = tarefa(db)
+    ref.set({"backfill": {"de": de, "ate": ate, "feito_ate": None, "iniciado_em": datetime.now(timezone.utc),
+                          "terminado_em": None, "erro": None}}, merge=True)
+    try:
+        dias, pedidos = reprocessar(db, de, ate,
+                                    ao_terminar_dia=lambda dia: ref.set({"backfill": {"feito_ate": dia}}, merge=True))
+    except Exception as e:
+        ref.set({"backfill": {"erro": str(e)}}, merge=True)
+        log.error("erro no backfill", extra={"de": de, "ate": ate}, exc_info=True)
+        return
+    ref.set({"backfill": {"terminado_em": datetime.now(timezone.utc), "dias": dias, "pedidos": pedidos}}, merge=True)
+    log.info("backfill terminado", extra={"dias": dias, "de": de, "ate": ate, "pedidos": pedidos})
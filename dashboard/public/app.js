@@ -1326,6 +1326,8 @@ document.addEventListener('DOMContentLoaded', () => {
                         headers: { 'Content-Type': 'application/json' },
                         body: JSON.stringify({
                             wa_id: pedido.telefone_cliente || pedido.wa_id || pedido.telefone,
+                            usuario_id: pedido.usuario_id || null,
+                            pedido_id: id,
                             nome: pedido.nome_cliente || pedido.nome,
                             tipo_servico: pedido.tipo_entrega
                                 ? pedido.tipo_entrega
@@ -1,5 +1,5 @@
 // ============================================================
-//  BI / VENDAS — dashboard analítico (Chart.js) sobre `pedidos`
+//  BI / VENDAS — dashboard analítico (Chart.js) sobre `vendas_agregadas`
 // ============================================================
 document.addEventListener('DOMContentLoaded', () => {
     const firebaseConfig = window.__FIREBASE_CONFIG__;
@@ -16,7 +16,7 @@ document.addEventListener('DOMContentLoaded', () => {
     const charts = {};
     let categoriasMap = {};
 
-    function ymd(d) { return d.toISOString().slice(0, 10); }
+    function ymd(d) { return `${d.getFullYear()}-${String(d.getMonth() + 1).padStart(2, '0')}-${String(d.getDate()).padStart(2, '0')}`; }
     (function init() {
         const hoje = new Date();
         $('data-ini').value = ymd(new Date(hoje.getFullYear(), hoje.getMonth(), 1));
@@ -47,16 +47,125 @@ document.addEventListener('DOMContentLoaded', () => {
         return { ini, fim };
     }
 
-    async function buscarPedidos(ini, fim) {
+    // ---------- totais ----------
+    // Cada dia tem os totais prontos em vendas_agregadas/{AAAA-MM-DD}_{n}
+    // (backend-bot/vendas_agregadas.py): um mês são ~30 documentos em vez de
+    // todos os pedidos. Os dias sem nenhum documento ali (antes do backfill,
+    // ou hoje antes do primeiro pedido) são somados aqui a partir dos
+    // pedidos, com as mesmas regras (parcelaPedido). Dia e hora em Brasília.
+    const CANAIS = { BALCAO: 'Balcão (PDV)', MESA: 'Mesa', WHATSAPP: 'WhatsApp', APP: 'App', APP_BOT: 'App/Bot' };
+    const FUSO_BR_MS = -3 * 3600 * 1000;
+
+    const nomeItem = (i) => ((typeof i === 'object') ? (i.nome_exibicao || i.nome || '') : String(i)).replace(/^\d+x\s/, '').trim();
+    const qtdItem = (i) => (typeof i === 'object' && i.quantidade) ? Number(i.quantidade) : 1;
+    const chave = (t, padrao) => String(t == null ? '' : t).trim().slice(0, 80) || padrao;
+
+    function resumoVazio() {
+        return { pedidos: 0, receita: 0, itens: 0, cancelados: 0, por_dia: {}, por_hora: {}, por_canal: {}, por_pagamento: {}, por_item: {}, por_cliente: {} };
+    }
+
+    function somar(alvo, numeros) {
+        Object.entries(numeros).forEach(([k, v]) => {
+            if (v && typeof v === 'object') somar(alvo[k] = alvo[k] || {}, v);
+            else if (typeof v === 'number') alvo[k] = (alvo[k] || 0) + v;
+        });
+        return alvo;
+    }
+
+    function canalDe(p) {
+        const o = (p.origem || '').toUpperCase();
+        if (o === 'BALCAO' || o === 'MESA' || o === 'APP') return o;
+        if (o === 'BOT' || o === 'WHATSAPP') return 'WHATSAPP';
+        // inferência: pedidos do app usam usuario_id "cliente_..."
+        if (p.usuario_id && String(p.usuario_id).startsWith('cliente_')) return 'APP';
+        return 'APP_BOT';
+    }
+
+    function parcelaPedido(p) {
+        if (!p.hora_pedido?.toDate) return null;
+        const local = new Date(p.hora_pedido.toDate().getTime() + FUSO_BR_MS);
+        const dia = local.toISOString().slice(0, 10);
+        if (p.status === 'CANCELADO') return { dia, numeros: { cancelados: 1 } };
+        const valor = Number(p.valor_total) || 0;
+        const venda = () => ({ pedidos: 1, receita: valor });
+        const porItem = {};
+        let itens = 0;
+        (p.itens || []).forEach(i => {
+            const nome = nomeItem(i);
+            itens += qtdItem(i);
+            if (!nome) return;
+            const k = chave(nome, 'Item');
+            porItem[k] = porItem[k] || { qtd: 0, receita: 0 };
+            porItem[k].qtd += qtdItem(i);
+            porItem[k].receita += (typeof i === 'object' && i.preco) ? Number(i.preco) * qtdItem(i) : 0;
+        });
+        return {
+            dia,
+            numeros: {
+                pedidos: 1, receita: valor, itens,
+                por_hora: { [String(local.getUTCHours()).padStart(2, '0')]: venda() },
+                por_canal: { [canalDe(p)]: venda() },
+                por_pagamento: { [chave(p.forma_pagamento, 'N/I')]: venda() },
+                por_item: porItem,
+                por_cliente: { [chave(p.nome_cliente, 'Cliente')]: venda() },
+            }
+        };
+    }
+
+    function somarDia(resumo, dia, numeros) {
+        somar(resumo, numeros);
+        somar(resumo.por_dia, { [dia]: { receita: numeros.receita || 0, pedidos: numeros.pedidos || 0 } });
+    }
+
+    async function buscarPedidos(diaIni, diaFim) {
         const snap = await db.collection('pedidos')
-            .where('hora_pedido', '>=', Timestamp.fromDate(ini))
-            .where('hora_pedido', '<=', Timestamp.fromDate(fim))
+            .where('hora_pedido', '>=', Timestamp.fromDate(new Date(diaIni + 'T00:00:00-03:00')))
+            .where('hora_pedido', '<=', Timestamp.fromDate(new Date(diaFim + 'T23:59:59.999-03:00')))
             .get();
         const arr = [];
         snap.forEach(d => arr.push({ id: d.id, ...d.data() }));
         return arr;
     }
 
+    async function buscarResumo(ini, fim) {
+        const diaIni = ymd(ini), diaFim = ymd(fim);
+        const resumo = resumoVazio();
+        const cobertos = new Set();
+        const fragmentos = [];
+        const snap = await db.collection('vendas_agregadas')
+            .where('dia', '>=', diaIni)
+            .where('dia', '<=', diaFim)
+            .get();
+        // Só dia já reprocessado ({dia}_0 com reprocessado_em) tem o total
+        // certo: antes disso os fragmentos são só as diferenças (pedido
+        // editado/cancelado num dia de antes dos totais existirem).
+        snap.forEach(d => {
+            const { dia, reprocessado_em, ...numeros } = d.data();
+            if (reprocessado_em) cobertos.add(dia);
+            fragmentos.push([dia, numeros]);
+        });
+        fragmentos.forEach(([dia, numeros]) => {
+            if (cobertos.has(dia)) somarDia(resumo, dia, numeros);
+        });
+
+        // Dias sem totais, em faixas contínuas (uma consulta por faixa).
+        const faixas = [];
+        for (let d = new Date(ini); ymd(d) <= diaFim; d.setDate(d.getDate() + 1)) {
+            const k = ymd(d);
+            if (cobertos.has(k)) continue;
+            const ultima = faixas[faixas.length - 1];
+            const anterior = new Date(d); anterior.setDate(anterior.getDate() - 1);
+            if (ultima && ultima[1] === ymd(anterior)) ultima[1] = k;
+            else faixas.push([k, k]);
+        }
+        const pedidos = await Promise.all(faixas.map(([a, b]) => buscarPedidos(a, b)));
+        pedidos.flat().forEach(p => {
+            const parcela = parcelaPedido(p);
+            if (parcela) somarDia(resumo, parcela.dia, parcela.numeros);
+        });
+        return resumo;
+    }
+
     async function carregar() {
         const { ini, fim } = intervalo();
         if (ini > fim) { alert('Período inválido.'); return; }
@@ -65,8 +174,8 @@ document.addEventListener('DOMContentLoaded', () => {
         const fimAnt = new Date(ini.getTime() - 1000);
         try {
             const [atual, anterior] = await Promise.all([
-                buscarPedidos(ini, fim),
-                buscarPedidos(iniAnt, fimAnt)
+                buscarResumo(ini, fim),
+                buscarResumo(iniAnt, fimAnt)
             ]);
             render(atual, anterior, ini, fim);
         } catch (e) {
@@ -75,42 +184,30 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     }
 
-    const nomeItem = (i) => ((typeof i === 'object') ? (i.nome_exibicao || i.nome || '') : String(i)).replace(/^\d+x\s/, '').trim();
-    const qtdItem = (i) => (typeof i === 'object' && i.quantidade) ? Number(i.quantidade) : 1;
-
-    function somaValidos(pedidos) {
-        return pedidos.filter(p => p.status !== 'CANCELADO').reduce((s, p) => s + (Number(p.valor_total) || 0), 0);
-    }
-
-    function render(pedidos, anteriores, ini, fim) {
-        const validos = pedidos.filter(p => p.status !== 'CANCELADO');
-        const cancelados = pedidos.filter(p => p.status === 'CANCELADO');
-        const fat = validos.reduce((s, p) => s + (Number(p.valor_total) || 0), 0);
-        const qtd = validos.length;
+    function render(resumo, anterior, ini, fim) {
+        const fat = resumo.receita;
+        const qtd = resumo.pedidos;
         const tkt = qtd ? fat / qtd : 0;
-        let itensVendidos = 0;
-        validos.forEach(p => (p.itens || []).forEach(i => itensVendidos += qtdItem(i)));
-        const taxaCanc = pedidos.length ? (cancelados.length / pedidos.length) * 100 : 0;
+        const total = qtd + resumo.cancelados;
+        const taxaCanc = total ? (resumo.cancelados / total) * 100 : 0;
 
         // comparativo
-        const fatAnt = somaValidos(anteriores);
-        const qtdAnt = anteriores.filter(p => p.status !== 'CANCELADO').length;
-        delta('k-fat-d', fat, fatAnt);
-        delta('k-ped-d', qtd, qtdAnt);
+        delta('k-fat-d', fat, anterior.receita);
+        delta('k-ped-d', qtd, anterior.pedidos);
 
         $('k-fat').textContent = money(fat);
         $('k-ped').textContent = qtd;
         $('k-tkt').textContent = money(tkt);
-        $('k-itens').textContent = itensVendidos;
+        $('k-itens').textContent = resumo.itens;
         $('k-canc').textContent = taxaCanc.toFixed(1).replace('.', ',') + '%';
 
-        renderPorDia(validos, ini, fim);
-        renderPorHora(validos);
-        renderCanal(validos);
-        renderPagamento(validos);
-        renderCategoria(validos);
-        renderProdutos(validos);
-        renderClientes(validos);
+        renderPorDia(resumo, ini, fim);
+        renderPorHora(resumo);
+        renderCanal(resumo);
+        renderPagamento(resumo);
+        renderCategoria(resumo);
+        renderProdutos(resumo);
+        renderClientes(resumo);
     }
 
     function delta(id, atual, anterior) {
@@ -126,15 +223,12 @@ document.addEventListener('DOMContentLoaded', () => {
         charts[id] = new Chart($(id), config);
     }
 
-    function renderPorDia(pedidos, ini, fim) {
+    function renderPorDia(resumo, ini, fim) {
         const dias = {};
-        for (let d = new Date(ini); d <= fim; d.setDate(d.getDate() + 1)) dias[ymd(new Date(d))] = 0;
-        pedidos.forEach(p => {
-            if (p.hora_pedido?.toDate) {
-                const k = ymd(p.hora_pedido.toDate());
-                if (k in dias) dias[k] += Number(p.valor_total) || 0;
-            }
-        });
+        for (let d = new Date(ini); d <= fim; d.setDate(d.getDate() + 1)) {
+            const k = ymd(d);
+            dias[k] = resumo.por_dia[k]?.receita || 0;
+        }
         const labels = Object.keys(dias).map(k => k.slice(8) + '/' + k.slice(5, 7));
         desenhar('c-dia', {
             type: 'line',
@@ -143,9 +237,8 @@ document.addEventListener('DOMContentLoaded', () => {
         });
     }
 
-    function renderPorHora(pedidos) {
-        const horas = Array(24).fill(0);
-        pedidos.forEach(p => { if (p.hora_pedido?.toDate) horas[p.hora_pedido.toDate().getHours()]++; });
+    function renderPorHora(resumo) {
+        const horas = Array.from({ length: 24 }, (_, h) => resumo.por_hora[String(h).padStart(2, '0')]?.pedidos || 0);
         desenhar('c-hora', {
             type: 'bar',
             data: { labels: horas.map((_, h) => h + 'h'), datasets: [{ data: horas, backgroundColor: '#2f6fed' }] },
@@ -153,17 +246,6 @@ document.addEventListener('DOMContentLoaded', () => {
         });
     }
 
-    function canalDe(p) {
-        const o = (p.origem || '').toUpperCase();
-        if (o === 'BALCAO') return 'Balcão (PDV)';
-        if (o === 'MESA') return 'Mesa';
-        if (o === 'BOT' || o === 'WHATSAPP') return 'WhatsApp';
-        if (o === 'APP') return 'App';
-        // inferência: pedidos do app usam usuario_id "cliente_..."
-        if (p.usuario_id && String(p.usuario_id).startsWith('cliente_')) return 'App';
-        return 'App/Bot';
-    }
-
     function renderPie(id, contagem) {
         const labels = Object.keys(contagem);
         desenhar(id, {
@@ -173,29 +255,33 @@ document.addEventListener('DOMContentLoaded', () => {
         });
     }
 
-    function renderCanal(pedidos) {
+    // Soma a receita por rótulo, sem as fatias zeradas (pedido cancelado
+    // depois de somado deixa a chave com 0).
+    function receitaPor(mapa, rotulo) {
         const c = {};
-        pedidos.forEach(p => { const k = canalDe(p); c[k] = (c[k] || 0) + (Number(p.valor_total) || 0); });
-        renderPie('c-canal', c);
+        Object.entries(mapa).forEach(([k, v]) => {
+            if (!v.pedidos) return;
+            const r = rotulo(k);
+            c[r] = (c[r] || 0) + (v.receita || 0);
+        });
+        return c;
     }
 
-    function renderPagamento(pedidos) {
-        const c = {};
-        pedidos.forEach(p => {
-            const k = (p.forma_pagamento || 'N/I').replace(/_/g, ' ');
-            c[k] = (c[k] || 0) + (Number(p.valor_total) || 0);
-        });
-        renderPie('c-pag', c);
+    function renderCanal(resumo) {
+        renderPie('c-canal', receitaPor(resumo.por_canal, k => CANAIS[k] || k));
     }
 
-    function renderCategoria(pedidos) {
+    function renderPagamento(resumo) {
+        renderPie('c-pag', receitaPor(resumo.por_pagamento, k => k.replace(/_/g, ' ')));
+    }
+
+    function renderCategoria(resumo) {
         const c = {};
-        pedidos.forEach(p => (p.itens || []).forEach(i => {
-            const nome = nomeItem(i).toLowerCase();
-            const cat = categoriasMap[nome] || 'Outros';
-            const preco = (typeof i === 'object' && i.preco) ? Number(i.preco) * qtdItem(i) : 0;
-            c[cat] = (c[cat] || 0) + (preco || qtdItem(i));
-        }));
+        Object.entries(resumo.por_item).forEach(([nome, v]) => {
+            if (!v.qtd) return;
+            const cat = categoriasMap[nome.toLowerCase()] || 'Outros';
+            c[cat] = (c[cat] || 0) + (v.receita || v.qtd);
+        });
         const labels = Object.keys(c).sort((a, b) => c[b] - c[a]);
         desenhar('c-cat', {
             type: 'bar',
@@ -204,13 +290,9 @@ document.addEventListener('DOMContentLoaded', () => {
         });
     }
 
-    function renderProdutos(pedidos) {
-        const c = {};
-        pedidos.forEach(p => (p.itens || []).forEach(i => {
-            const nome = nomeItem(i);
-            if (nome) c[nome] = (c[nome] || 0) + qtdItem(i);
-        }));
-        const top = Object.entries(c).sort((a, b) => b[1] - a[1]).slice(0, 10);
+    function renderProdutos(resumo) {
+        const top = Object.entries(resumo.por_item).map(([nome, v]) => [nome, v.qtd || 0])
+            .filter(t => t[1] > 0).sort((a, b) => b[1] - a[1]).slice(0, 10);
         desenhar('c-prod', {
             type: 'bar',
             data: { labels: top.map(t => t[0]), datasets: [{ label: 'Qtd vendida', data: top.map(t => t[1]), backgroundColor: '#ff5200' }] },
@@ -218,17 +300,12 @@ document.addEventListener('DOMContentLoaded', () => {
         });
     }
 
-    function renderClientes(pedidos) {
-        const c = {};
-        pedidos.forEach(p => {
-            const nome = p.nome_cliente || 'Cliente';
-            if (!c[nome]) c[nome] = { qtd: 0, total: 0 };
-            c[nome].qtd++; c[nome].total += Number(p.valor_total) || 0;
-        });
-        const top = Object.entries(c).sort((a, b) => b[1].total - a[1].total).slice(0, 10);
+    function renderClientes(resumo) {
+        const top = Object.entries(resumo.por_cliente).filter(([, v]) => v.pedidos > 0)
+            .sort((a, b) => (b[1].receita || 0) - (a[1].receita || 0)).slice(0, 10);
         const tb = $('t-clientes');
         tb.innerHTML = top.length ? top.map(([nome, v]) =>
-            `<tr><td>${esc(nome)}</td><td class="num">${v.qtd}</td><td class="num">${money(v.total)}</td></tr>`
+            `<tr><td>${esc(nome)}</td><td class="num">${v.pedidos}</td><td class="num">${money(v.receita)}</td></tr>`
         ).join('') : '<tr><td colspan="3" class="vazio">Sem dados.</td></tr>';
     }
 });
@@ -3,6 +3,10 @@
 //  Lê/escreve a coleção "historico_conversas" (mesma que o bot
 //  usa) direto pelo client SDK; só o envio real da mensagem pro
 //  WhatsApp passa pelo backend (precisa do token de acesso).
+//  A lista da esquerda vem de "caixa_entrada" (um resumo pequeno
+//  por conversa, gravado pelo bot junto com o histórico — ver
+//  backend-bot/caixa_entrada.py); a conversa inteira só é lida
+//  ao abrir.
 // ============================================================
 
 document.addEventListener('DOMContentLoaded', () => {
@@ -16,14 +20,17 @@ document.addEventListener('DOMContentLoaded', () => {
     // Base do backend do bot (mesmo endereço usado em kds.js / entrega.js).
     const BOT_BASE_URL = "https://whatsapp-bot-agendamento.onrender.com";
     const COL = db.collection('historico_conversas');
+    const COL_CAIXA = db.collection('caixa_entrada');
     const COL_BAIRROS_APRENDIZADO = db.collection('bairros_aprendizado');
     const COL_ITENS_APRENDIZADO = db.collection('itens_aprendizado');
     const COL_CARDAPIO = db.collection('cardapio');
 
     let conversas = [];
     let conversaAtualId = null;
-    let pollConversas = null;
-    let pollMensagens = null;
+    let pararCaixa = null;
+    // Última versão do resumo da conversa aberta que já foi desenhada — o
+    // snapshot da caixa_entrada só relê a conversa inteira quando ela muda.
+    let versaoConversaAberta = null;
     let cardapioCache = [];
     // Trava simples contra duplo-clique: o clique não dá feedback imediato
     // (precisa gravar no Firestore + mandar WhatsApp antes de sumir da
@@ -48,15 +55,14 @@ document.addEventListener('DOMContentLoaded', () => {
 
     auth.onAuthStateChanged(user => {
         if (!user) { window.location.href = '/login.html'; return; }
-        carregarConversas();
+        assinarConversas();
         carregarCardapioCache();
-        $('btn-refresh-conversas').addEventListener('click', carregarConversas);
+        $('btn-refresh-conversas').addEventListener('click', assinarConversas);
         $('toggle-manual').addEventListener('change', onToggleManual);
         $('btn-send').addEventListener('click', enviarMensagem);
         $('reply-text').addEventListener('keydown', e => {
             if (e.key === 'Enter' && !e.shiftKey) { e.preventDefault(); enviarMensagem(); }
         });
-        pollConversas = setInterval(carregarConversas, 20000);
     });
 
     function formatarHora(ts) {
@@ -71,18 +77,39 @@ document.addEventListener('DOMContentLoaded', () => {
         return String(s ?? '').replace(/[&<>"]/g, c => ({ '&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;' }[c]));
     }
 
-    async function carregarConversas() {
-        const lista = $('conv-list');
-        try {
-            const snap = await COL.orderBy('ultima_interacao', 'desc').limit(50).get();
+    function assinarConversas() {
+        if (pararCaixa) pararCaixa();
+        pararCaixa = COL_CAIXA.orderBy('ultima_interacao', 'desc').limit(50).onSnapshot(snap => {
             conversas = [];
             snap.forEach(doc => conversas.push({ id: doc.id, ...doc.data() }));
             // Conversas que precisam de atenção sempre no topo, senão a mais recente primeiro.
             conversas.sort((a, b) => (b.precisa_atencao ? 1 : 0) - (a.precisa_atencao ? 1 : 0));
             renderConversas();
-        } catch (err) {
-            lista.innerHTML = `<div class="empty">Erro ao carregar conversas: ${escapeHtml(err.message)}</div>`;
-        }
+            const aberta = conversas.find(c => c.id === conversaAtualId);
+            if (aberta && versaoResumo(aberta) !== versaoConversaAberta) carregarMensagens();
+            if (aberta && aberta.nao_lidas) marcarLida(aberta.id);
+        }, err => {
+            $('conv-list').innerHTML = `<div class="empty">Erro ao carregar conversas: ${escapeHtml(err.message)}</div>`;
+        });
+    }
+
+    function versaoResumo(c) {
+        const ts = c.ultima_interacao;
+        return [ts && ts.toMillis ? ts.toMillis() : String(ts), !!c.precisa_atencao, !!c.modo_manual].join('|');
+    }
+
+    function marcarLida(id) {
+        COL_CAIXA.doc(id).set({ nao_lidas: 0 }, { merge: true })
+            .catch(err => console.warn('Erro ao marcar conversa como lida:', err.message));
+    }
+
+    // Atenção e modo manual ficam no documento da conversa e no resumo da
+    // caixa_entrada — grava nos dois num lote só (como o backend faz).
+    function atualizarConversa(id, campos) {
+        const lote = db.batch();
+        lote.set(COL.doc(id), campos, { merge: true });
+        lote.set(COL_CAIXA.doc(id), campos, { merge: true });
+        return lote.commit();
     }
 
     function renderConversas() {
@@ -92,14 +119,17 @@ document.addEventListener('DOMContentLoaded', () => {
             return;
         }
         lista.innerHTML = conversas.map(c => {
-            const msgs = c.mensagens || [];
-            const ultima = msgs[msgs.length - 1];
-            const preview = ultima ? escapeHtml(ultima.content).slice(0, 80) : 'Sem mensagens';
+            const preview = c.previa ? escapeHtml(c.previa.slice(0, 80)) : 'Sem mensagens';
             const ativo = c.id === conversaAtualId ? ' active' : '';
             const classeAtencao = c.precisa_atencao ? ' precisa-atencao' : '';
             const badgeManual = c.modo_manual ? '<span class="badge-manual">Manual</span>' : '';
+            const badgeNaoLidas = c.nao_lidas && c.id !== conversaAtualId
+                ? `<span class="badge-nao-lidas">${Number(c.nao_lidas)}</span>`
+                : '';
+            // atencao_escalada_em: a varredura do bot (varredor.py) já viu a
+            // dúvida passar do tempo sem resposta e avisou a equipe.
             const badgeAtencao = c.precisa_atencao
-                ? `<span class="badge-atencao" title="${escapeHtml(c.motivo_atencao || '')}">⚠️ Precisa de atenção</span>`
+                ? `<span class="badge-atencao" title="${escapeHtml(c.motivo_atencao || '')}">⚠️ ${c.atencao_escalada_em ? 'Sem resposta da equipe' : 'Precisa de atenção'}</span>`
                 : '';
             return `<div class="conv-item${ativo}${classeAtencao}" data-id="${escapeHtml(c.id)}">
                 <div class="conv-id">${escapeHtml(c.id)}</div>
@@ -108,6 +138,7 @@ document.addEventListener('DOMContentLoaded', () => {
                 <div class="conv-meta">
                     <span class="conv-time">${formatarHora(c.ultima_interacao)}</span>
                     ${badgeManual}
+                    ${badgeNaoLidas}
                 </div>
             </div>`;
         }).join('');
@@ -124,13 +155,16 @@ document.addEventListener('DOMContentLoaded', () => {
         $('reply-text').disabled = false;
         $('btn-send').disabled = false;
         $('toggle-manual').disabled = false;
-        if (pollMensagens) clearInterval(pollMensagens);
+        versaoConversaAberta = null;
+        const conversa = conversas.find(c => c.id === id);
+        if (conversa && conversa.nao_lidas) marcarLida(id);
         await carregarMensagens();
-        pollMensagens = setInterval(carregarMensagens, 10000);
     }
 
     async function carregarMensagens() {
         if (!conversaAtualId) return;
+        const resumo = conversas.find(c => c.id === conversaAtualId);
+        if (resumo) versaoConversaAberta = versaoResumo(resumo);
         try {
             const doc = await COL.doc(conversaAtualId).get();
             const dados = doc.exists ? doc.data() : {};
@@ -153,9 +187,10 @@ document.addEventListener('DOMContentLoaded', () => {
     }
 
     function renderAtencaoBox(dados) {
-        // Não redesenha por cima de uma ação em andamento (o poll de 10s
-        // recarrega a conversa mesmo enquanto o clique anterior ainda está
-        // sendo processado) — isso re-habilitaria os botões antes da hora.
+        // Não redesenha por cima de uma ação em andamento (o snapshot da
+        // caixa_entrada recarrega a conversa mesmo enquanto o clique anterior
+        // ainda está sendo processado) — isso re-habilitaria os botões antes
+        // da hora.
         if (acaoAtencaoEmAndamento) return;
         const box = $('atencao-box');
         if (!dados.precisa_atencao || !dados.tipo_atencao) {
@@ -202,7 +237,7 @@ document.addEventListener('DOMContentLoaded', () => {
     }
 
     async function limparAtencao(id) {
-        await COL.doc(id).set({ precisa_atencao: false }, { merge: true });
+        await atualizarConversa(id, { precisa_atencao: false });
         const conversa = conversas.find(c => c.id === id);
         if (conversa) conversa.precisa_atencao = false;
         renderConversas();
@@ -316,7 +351,7 @@ document.addEventListener('DOMContentLoaded', () => {
         if (!conversaAtualId) return;
         const ativo = $('toggle-manual').checked;
         try {
-            await COL.doc(conversaAtualId).set({ modo_manual: ativo }, { merge: true });
+            await atualizarConversa(conversaAtualId, { modo_manual: ativo });
             $('chat-status').textContent = ativo
                 ? 'Controle manual ativado: o bot não vai responder até você desligar.'
                 : 'Controle manual desativado: o bot volta a responder automaticamente.';
@@ -10,6 +10,8 @@ document.addEventListener('DOMContentLoaded', () => {
     const DOC_BOT = db.collection('configuracoes').doc('bot');
     const BOT_DEFAULTS = {
         ativo: true,
+        respostas_rapidas: true,
+        roteamento_modelos: true,
         nome_atendente: 'Sofia',
         nome_empresa: 'Lileamar Salgados',
         chave_pix: 'abc1231234567',
@@ -19,12 +21,26 @@ document.addEventListener('DOMContentLoaded', () => {
         mensagem_pronto: 'Oi {nome_cliente}! Seu pedido esta pronto!',
         mensagem_retirada: 'Boa noticia, {nome_cliente}! Seu pedido ja pode ser retirado!',
         mensagem_erro: 'Desculpe, tive um probleminha aqui. Pode repetir?',
-        instrucoes_extras: ''
+        prazo_turno_s: 40,
+        mensagem_prazo: 'Desculpe a demora, estou com uma lentidão aqui agora. Pode mandar sua mensagem de novo?',
+        instrucoes_extras: '',
+        atencao_escalar_min: 10,
+        atencao_expirar_h: 12,
+        telefone_alerta_equipe: '',
+        retencao_conversas_dias: 180,
+        admissao_por_minuto: 8,
+        admissao_rajada: 6,
+        admissao_concorrencia: 16,
+        admissao_reserva_checkout: 4,
+        mensagem_limite_cliente: 'Recebi várias mensagens seguidas suas! Me dá um minutinho e manda de novo, que eu já te respondo.',
+        mensagem_espera: 'Só um instante, já te respondo!',
+        mensagem_sobrecarga: 'Estamos com muito movimento agora. Pode mandar sua mensagem de novo daqui a pouquinho?'
     };
 
     auth.onAuthStateChanged(user => {
         if (!user) { window.location.href = '/login.html'; return; }
         carregarBot();
+        carregarUsoIA();
         $('salvar-bot').addEventListener('click', salvarBot);
         $('salvar-bairros').addEventListener('click', salvarBairros);
         $('bot-bairros-entrega').addEventListener('input', atualizarContagemBairros);
@@ -48,6 +64,8 @@ document.addEventListener('DOMContentLoaded', () => {
             const snap = await DOC_BOT.get();
             const d = { ...BOT_DEFAULTS, ...(snap.exists ? (snap.data() || {}) : {}) };
             $('bot-ativo').checked = d.ativo !== false;
+            $('bot-respostas-rapidas').checked = d.respostas_rapidas !== false;
+            $('bot-roteamento-modelos').checked = d.roteamento_modelos !== false;
             $('bot-nome-atendente').value = d.nome_atendente || '';
             $('bot-nome-empresa').value = d.nome_empresa || '';
             $('bot-chave-pix').value = d.chave_pix || '';
@@ -57,7 +75,19 @@ document.addEventListener('DOMContentLoaded', () => {
             $('bot-mensagem-pronto').value = d.mensagem_pronto || '';
             $('bot-mensagem-retirada').value = d.mensagem_retirada || '';
             $('bot-mensagem-erro').value = d.mensagem_erro || '';
+            $('bot-prazo-turno').value = d.prazo_turno_s || BOT_DEFAULTS.prazo_turno_s;
+            $('bot-mensagem-prazo').value = d.mensagem_prazo || '';
             $('bot-instrucoes-extras').value = d.instrucoes_extras || '';
+            $('bot-atencao-escalar').value = d.atencao_escalar_min || BOT_DEFAULTS.atencao_escalar_min;
+            $('bot-atencao-expirar').value = d.atencao_expirar_h || BOT_DEFAULTS.atencao_expirar_h;
+            $('bot-telefone-alerta').value = d.telefone_alerta_equipe || '';
+            $('bot-retencao-dias').value = d.retencao_conversas_dias != null ? d.retencao_conversas_dias : BOT_DEFAULTS.retencao_conversas_dias;
+            ['admissao_por_minuto', 'admissao_rajada', 'admissao_concorrencia', 'admissao_reserva_checkout'].forEach(chave => {
+                $('bot-' + chave.replace(/_/g, '-')).value = d[chave] != null ? d[chave] : BOT_DEFAULTS[chave];
+            });
+            $('bot-mensagem-limite-cliente').value = d.mensagem_limite_cliente || '';
+            $('bot-mensagem-espera').value = d.mensagem_espera != null ? d.mensagem_espera : BOT_DEFAULTS.mensagem_espera;
+            $('bot-mensagem-sobrecarga').value = d.mensagem_sobrecarga || '';
             $('bot-bairros-entrega').value = Array.isArray(d.bairros_entrega) ? d.bairros_entrega.join('\n') : '';
             $('bot-taxa-entrega').value = d.taxa_entrega != null ? d.taxa_entrega : 0;
             $('bot-cidade-atendida').value = d.cidade_atendida || '';
@@ -85,6 +115,8 @@ document.addEventListener('DOMContentLoaded', () => {
     async function salvarBot() {
         const payload = {
             ativo: $('bot-ativo').checked,
+            respostas_rapidas: $('bot-respostas-rapidas').checked,
+            roteamento_modelos: $('bot-roteamento-modelos').checked,
             nome_atendente: $('bot-nome-atendente').value.trim() || BOT_DEFAULTS.nome_atendente,
             nome_empresa: $('bot-nome-empresa').value.trim() || BOT_DEFAULTS.nome_empresa,
             chave_pix: $('bot-chave-pix').value.trim(),
@@ -94,7 +126,25 @@ document.addEventListener('DOMContentLoaded', () => {
             mensagem_pronto: $('bot-mensagem-pronto').value.trim() || BOT_DEFAULTS.mensagem_pronto,
             mensagem_retirada: $('bot-mensagem-retirada').value.trim() || BOT_DEFAULTS.mensagem_retirada,
             mensagem_erro: $('bot-mensagem-erro').value.trim() || BOT_DEFAULTS.mensagem_erro,
+            // Abaixo do timeout do gunicorn (120s), com folga pro envio.
+            prazo_turno_s: Math.min(100, Math.max(10, parseInt($('bot-prazo-turno').value, 10) || BOT_DEFAULTS.prazo_turno_s)),
+            mensagem_prazo: $('bot-mensagem-prazo').value.trim() || BOT_DEFAULTS.mensagem_prazo,
             instrucoes_extras: $('bot-instrucoes-extras').value.trim(),
+            atencao_escalar_min: Math.max(1, parseInt($('bot-atencao-escalar').value, 10) || BOT_DEFAULTS.atencao_escalar_min),
+            atencao_expirar_h: Math.max(1, parseInt($('bot-atencao-expirar').value, 10) || BOT_DEFAULTS.atencao_expirar_h),
+            telefone_alerta_equipe: $('bot-telefone-alerta').value.replace(/\D/g, ''),
+            // 0 desliga o arquivamento de conversas paradas.
+            retencao_conversas_dias: Math.max(0, parseInt($('bot-retencao-dias').value, 10) || 0),
+            // Controle de admissão (backend-bot/admissao.py): 0 desliga o
+            // limite por cliente / o limite de turnos simultâneos.
+            admissao_por_minuto: Math.max(0, parseInt($('bot-admissao-por-minuto').value, 10) || 0),
+            admissao_rajada: Math.max(1, parseInt($('bot-admissao-rajada').value, 10) || BOT_DEFAULTS.admissao_rajada),
+            admissao_concorrencia: Math.max(0, parseInt($('bot-admissao-concorrencia').value, 10) || 0),
+            admissao_reserva_checkout: Math.max(0, parseInt($('bot-admissao-reserva-checkout').value, 10) || 0),
+            mensagem_limite_cliente: $('bot-mensagem-limite-cliente').value.trim() || BOT_DEFAULTS.mensagem_limite_cliente,
+            // Vazia = não avisa quem entrou na fila.
+            mensagem_espera: $('bot-mensagem-espera').value.trim(),
+            mensagem_sobrecarga: $('bot-mensagem-sobrecarga').value.trim() || BOT_DEFAULTS.mensagem_sobrecarga,
             atualizado_em: firebase.firestore.FieldValue.serverTimestamp()
         };
         try {
@@ -105,6 +155,38 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     }
 
+    // Consumo da OpenAI gravado pelo bot (backend-bot/uso_ia.py): um doc por
+    // dia em 'uso_ia_diario', com os totais e um mapa 'por_variante'
+    // ("modelo|versão do prompt").
+    async function carregarUsoIA() {
+        const corpo = $('uso-ia-corpo');
+        try {
+            const snap = await db.collection('uso_ia_diario')
+                .orderBy(firebase.firestore.FieldPath.documentId(), 'desc').limit(7).get();
+            if (snap.empty) {
+                corpo.innerHTML = '<tr><td colspan="6">Nenhum consumo registrado ainda.</td></tr>';
+                return;
+            }
+            const linha = (rotulo, d, classe) => {
+                const turnos = d.turnos || 0;
+                const porTurno = (v) => turnos ? (v / turnos) : 0;
+                const cache = d.prompt_tokens ? (100 * (d.cached_tokens || 0) / d.prompt_tokens) : 0;
+                return `<tr class="${classe || ''}"><td>${rotulo}</td><td>${turnos}</td>`
+                    + `<td>${Math.round(porTurno(d.total_tokens || 0))}</td><td>${cache.toFixed(0)}%</td>`
+                    + `<td>${porTurno(d.segundos_openai || 0).toFixed(1)}</td><td>${(d.custo_usd || 0).toFixed(2)}</td></tr>`;
+            };
+            corpo.innerHTML = snap.docs.map(doc => {
+                const d = doc.data() || {};
+                const variantes = Object.entries(d.por_variante || {})
+                    .map(([nome, v]) => linha('&nbsp;&nbsp;' + nome.replace('|', ' · '), v, 'variante'));
+                return linha(doc.id.split('-').reverse().join('/'), d) + variantes.join('');
+            }).join('');
+        } catch (err) {
+            console.warn('uso ia:', err.message);
+            corpo.innerHTML = '<tr><td colspan="6">Não foi possível carregar o consumo.</td></tr>';
+        }
+    }
+
     function flash(t) {
         const d = document.createElement('div');
         d.textContent = t;
@@ -77,8 +77,46 @@ document.addEventListener('DOMContentLoaded', () => {
                 <td style="padding:6px 4px;"><input type="checkbox" id="horario-${d.chave}-aberto" style="width:18px;height:18px;"></td>
                 <td style="padding:6px 4px;"><input type="time" id="horario-${d.chave}-abre" style="padding:6px;"></td>
                 <td style="padding:6px 4px;"><input type="time" id="horario-${d.chave}-fecha" style="padding:6px;"></td>
+                <td style="padding:6px 4px;"><input type="time" id="horario-${d.chave}-abre2" style="padding:6px;"></td>
+                <td style="padding:6px 4px;"><input type="time" id="horario-${d.chave}-fecha2" style="padding:6px;"></td>
             </tr>
         `).join('');
+        $('horario-nova-excecao').addEventListener('click', () => adicionarExcecao({ aberto: false }));
+    }
+
+    // Datas especiais (horario_funcionamento.excecoes): mesmo formato de um
+    // dia da semana mais 'data' (AAAA-MM-DD) e 'descricao' — ver
+    // backend-bot/horario.py.
+    function adicionarExcecao(excecao) {
+        const tr = document.createElement('tr');
+        tr.className = 'horario-excecao';
+        tr.innerHTML = `
+            <td style="padding:6px 4px;"><input type="date" data-campo="data" style="padding:6px;"></td>
+            <td style="padding:6px 4px;"><input type="text" data-campo="descricao" placeholder="Natal" style="padding:6px;"></td>
+            <td style="padding:6px 4px;"><input type="checkbox" data-campo="aberto" style="width:18px;height:18px;"></td>
+            <td style="padding:6px 4px;"><input type="time" data-campo="abre" style="padding:6px;"></td>
+            <td style="padding:6px 4px;"><input type="time" data-campo="fecha" style="padding:6px;"></td>
+            <td style="padding:6px 4px;"><input type="time" data-campo="abre2" style="padding:6px;"></td>
+            <td style="padding:6px 4px;"><input type="time" data-campo="fecha2" style="padding:6px;"></td>
+            <td style="padding:6px 4px;"><button class="btn btn-cinza" type="button">Remover</button></td>
+        `;
+        tr.querySelectorAll('input').forEach(input => {
+            const valor = excecao[input.dataset.campo];
+            if (input.type === 'checkbox') input.checked = valor === true;
+            else input.value = valor || '';
+        });
+        tr.querySelector('button').addEventListener('click', () => tr.remove());
+        $('horario-excecoes-body').appendChild(tr);
+    }
+
+    function lerExcecoes() {
+        return Array.from(document.querySelectorAll('#horario-excecoes-body tr.horario-excecao')).map(tr => {
+            const excecao = {};
+            tr.querySelectorAll('input').forEach(input => {
+                excecao[input.dataset.campo] = input.type === 'checkbox' ? input.checked : input.value.trim();
+            });
+            return excecao;
+        }).filter(e => e.data).sort((a, b) => a.data.localeCompare(b.data));
     }
 
     async function carregarHorario() {
@@ -93,7 +131,11 @@ document.addEventListener('DOMContentLoaded', () => {
                 $(`horario-${dd.chave}-aberto`).checked = cfgDia.aberto === true;
                 $(`horario-${dd.chave}-abre`).value = cfgDia.abre || '';
                 $(`horario-${dd.chave}-fecha`).value = cfgDia.fecha || '';
+                $(`horario-${dd.chave}-abre2`).value = cfgDia.abre2 || '';
+                $(`horario-${dd.chave}-fecha2`).value = cfgDia.fecha2 || '';
             });
+            $('horario-excecoes-body').innerHTML = '';
+            (horario.excecoes || []).forEach(adicionarExcecao);
         } catch (err) {
             console.warn('horario:', err.message);
         }
@@ -105,7 +147,9 @@ document.addEventListener('DOMContentLoaded', () => {
             dias[d.chave] = {
                 aberto: $(`horario-${d.chave}-aberto`).checked,
                 abre: $(`horario-${d.chave}-abre`).value || '',
-                fecha: $(`horario-${d.chave}-fecha`).value || ''
+                fecha: $(`horario-${d.chave}-fecha`).value || '',
+                abre2: $(`horario-${d.chave}-abre2`).value || '',
+                fecha2: $(`horario-${d.chave}-fecha2`).value || ''
             };
         });
         try {
@@ -113,7 +157,8 @@ document.addEventListener('DOMContentLoaded', () => {
                 horario_funcionamento: {
                     ativo: $('horario-ativo').checked,
                     mensagem_fechado: $('horario-mensagem-fechado').value.trim() || HORARIO_MENSAGEM_PADRAO,
-                    dias
+                    dias,
+                    excecoes: lerExcecoes()
                 },
                 atualizado_em: firebase.firestore.FieldValue.serverTimestamp()
             }, { merge: true });
@@ -230,7 +230,7 @@ document.addEventListener('DOMContentLoaded', () => {
             if (novoStatus === "PRONTO_PARA_ENTREGA") {
                 const doc = await db.collection(COLECAO_PEDIDOS).doc(id).get();
                 const pedido = doc.data() || {};
-                notificarBot(pedido);
+                notificarBot(id, pedido);
             }
         } catch (err) {
             alert("Erro ao atualizar o pedido: " + err.message);
@@ -238,13 +238,15 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     }
 
-    function notificarBot(pedido) {
+    function notificarBot(id, pedido) {
         if (!BOT_BASE_URL) return;
         fetch(`${BOT_BASE_URL}/notificar_pronto`, {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
             body: JSON.stringify({
                 wa_id: pedido.telefone_cliente || pedido.wa_id || pedido.telefone,
+                usuario_id: pedido.usuario_id || null,
+                pedido_id: id,
                 nome: pedido.nome_cliente || pedido.nome,
                 tipo_servico: pedido.endereco === "Retirada no Balcão" ? "RETIRADA" : "ENTREGA"
             })
@@ -10,6 +10,9 @@
 //    app_config/destaques { grupos: [{ chave, titulo, cor, limite, produtosIds }] }
 //    cupons     { codigo, tipo, valor, minimo, validade, ativo }
 //    promocoes  { titulo, descricao, ativo, criado_em }
+//    disparos   { mensagem, titulo, template, canais, publico, por_segundo,
+//                 status, contagem, taxa_por_minuto } — o bot envia
+//                 (backend-bot/disparos.py); o painel cria, pausa e acompanha
 // ============================================================
 document.addEventListener('DOMContentLoaded', () => {
     const firebaseConfig = window.__FIREBASE_CONFIG__;
@@ -45,12 +48,14 @@ document.addEventListener('DOMContentLoaded', () => {
         carregarDestaques();
         ouvirCupons();
         ouvirPromocoes();
+        ouvirDisparos();
         $('a-salvar').addEventListener('click', salvarAparencia);
         $('b-salvar').addEventListener('click', salvarBanner);
         $('f-salvar').addEventListener('click', salvarFidelidade);
         $('d-salvar').addEventListener('click', salvarDestaques);
         $('c-add').addEventListener('click', addCupom);
         $('p-add').addEventListener('click', addPromocao);
+        $('d-criar').addEventListener('click', criarDisparo);
         $('a-cor').addEventListener('input', () => { $('a-corhex').value = $('a-cor').value; previewApp(); });
         $('a-corhex').addEventListener('input', () => { if (/^#[0-9a-fA-F]{6}$/.test($('a-corhex').value)) $('a-cor').value = $('a-corhex').value; previewApp(); });
         $('a-cor2').addEventListener('input', () => { $('a-corhex2').value = $('a-cor2').value; });
@@ -544,6 +549,66 @@ document.addEventListener('DOMContentLoaded', () => {
         } catch (e) { alert('Erro: ' + e.message); }
     }
 
+    // ---------- Disparos ----------
+    const DISPARO_STATUS = {
+        pendente: ['aguardando', 'b-off'], rodando: ['enviando', 'b-on'], pausado: ['pausado', 'b-off'],
+        concluido: ['concluído', 'b-on'], cancelado: ['cancelado', 'b-off'], erro: ['erro', 'b-off']
+    };
+
+    function ouvirDisparos() {
+        db.collection('disparos').orderBy('criado_em', 'desc').limit(20).onSnapshot(snap => {
+            const arr = []; snap.forEach(d => arr.push({ id: d.id, ...d.data() }));
+            const tb = $('d-lista');
+            if (!arr.length) { tb.innerHTML = '<tr><td colspan="4" style="color:#7f8c8d">Nenhum disparo.</td></tr>'; return; }
+            tb.innerHTML = arr.map(d => {
+                const c = d.contagem || {};
+                const feitos = (c.enviados || 0) + (c.falhas || 0) + (c.incertos || 0);
+                const [rotulo, cls] = DISPARO_STATUS[d.status] || [d.status, 'b-off'];
+                const andamento = `${feitos}/${c.total || 0}${d.expansao_concluida ? '' : '+'} · ${c.falhas || 0} falhas`
+                    + (d.status === 'rodando' && d.taxa_por_minuto ? ` · ${d.taxa_por_minuto}/min` : '');
+                const acoes = [];
+                if (d.status === 'pendente' || d.status === 'rodando') acoes.push(['pausado', 'Pausar']);
+                if (d.status === 'pausado') acoes.push(['pendente', 'Retomar']);
+                if (['pendente', 'rodando', 'pausado'].includes(d.status)) acoes.push(['cancelado', 'Cancelar']);
+                return `<tr>
+                    <td>${esc((d.mensagem || d.template?.nome || '').slice(0, 80))}${d.erro ? `<br><span style="color:#c0392b;font-size:.8rem">${esc(d.erro)}</span>` : ''}</td>
+                    <td><span class="badge ${cls}">${esc(rotulo)}</span></td>
+                    <td>${andamento}</td>
+                    <td style="text-align:right">${acoes.map(([status, txt]) =>
+                        `<button class="btn ${status === 'cancelado' ? 'btn-rm' : 'btn-add'}" data-disparo="${d.id}" data-status="${status}">${txt}</button>`).join(' ')}</td></tr>`;
+            }).join('');
+            tb.querySelectorAll('[data-disparo]').forEach(b => b.onclick = () => {
+                if (b.dataset.status === 'cancelado' && !confirm('Cancelar o disparo? Quem ainda não recebeu não vai receber.')) return;
+                // Retomar: sem mandato, o bot pega de novo na próxima volta.
+                const campos = b.dataset.status === 'pendente' ? { status: 'pendente', mandato_expira_em: null } : { status: b.dataset.status };
+                db.collection('disparos').doc(b.dataset.disparo).update(campos);
+            });
+        });
+    }
+
+    async function criarDisparo() {
+        const mensagem = ($('d-mensagem').value || '').trim();
+        const template = ($('d-template').value || '').trim();
+        if (!mensagem && !template) { alert('Escreva a mensagem (ou informe o template).'); return; }
+        const canais = $('d-canais').value.split(',');
+        const publico = { tipo: $('d-publico').value, somente_optin: $('d-optin').checked };
+        if (publico.tipo === 'pedido_recente') publico.dias = parseInt($('d-dias').value) || 30;
+        if (!confirm('Disparar agora pros clientes selecionados?')) return;
+        try {
+            await db.collection('disparos').add({
+                mensagem, titulo: ($('d-titulo').value || '').trim(),
+                template: template ? { nome: template, idioma: 'pt_BR', parametros: [] } : null,
+                canais, publico,
+                por_segundo: Math.min(60, Math.max(0.1, parseFloat($('d-porsegundo').value) || 10)),
+                status: 'pendente', criado_em: FieldValue.serverTimestamp(),
+                expansao_concluida: false, cursor_publico: null,
+                contagem: { total: 0, enviados: 0, falhas: 0, incertos: 0, fora_do_publico: 0 }
+            });
+            $('d-mensagem').value = ''; $('d-titulo').value = ''; $('d-template').value = '';
+            flash('Disparo criado — o bot começa em até 1 minuto.');
+        } catch (e) { alert('Erro: ' + e.message); }
+    }
+
     function flash(t) {
         const d = document.createElement('div');
         d.textContent = t;